@@ -0,0 +1,54 @@
+"""
+Script para agregar los índices de deudas pendientes
+Ejecutar: python add_debt_page_indexes.py
+
+`db.create_all()` solo crea los índices de tablas nuevas. Las bases existentes
+necesitan este script para que las páginas de "pagar deudas" y "quién me
+debe" (consultas keyset, ver app.debt_pages) y el barrido de recordatorios
+(ver app.reminders) usen un índice en lugar de recorrer todas las deudas.
+"""
+import sys
+from app import create_app, db
+from app.models import Expense
+from sqlalchemy import inspect
+
+
+def existing_indexes() -> set:
+    """Nombres de los índices de la tabla expenses (PostgreSQL y SQLite)"""
+    inspector = inspect(db.engine)
+    return {index['name'] for index in inspector.get_indexes('expenses')}
+
+
+print("🔄 Iniciando script de migración...")
+print("📋 Verificando conexión a la base de datos...")
+
+try:
+    app = create_app()
+
+    with app.app_context():
+        print("✅ Conexión establecida")
+
+        present = existing_indexes()
+        for index in Expense.__table__.indexes:
+            if not index.name.endswith('_pending'):
+                continue
+            if index.name in present:
+                print(f"✅ El índice '{index.name}' ya existe en la tabla 'expenses'")
+                continue
+            print(f"🔄 Creando el índice '{index.name}'...")
+            index.create(db.engine)
+            print(f"✅ Índice '{index.name}' creado exitosamente")
+
+except Exception as e:
+    print(f"\n❌ Error al ejecutar el script: {e}")
+    print(f"   Tipo de error: {type(e).__name__}")
+    import traceback
+    print("\n📋 Detalles del error:")
+    traceback.print_exc()
+    print("\n💡 Alternativa: Puedes ejecutar este SQL manualmente en tu base de datos:")
+    print("   CREATE INDEX ix_expenses_debtor_pending ON expenses (debtor_id, is_settled, due_date, created_at, id);")
+    print("   CREATE INDEX ix_expenses_payer_pending ON expenses (payer_id, is_settled, due_date, created_at, id);")
+    print("   CREATE INDEX ix_expenses_reminder_pending ON expenses (is_settled, debtor_id, due_date, id);")
+    sys.exit(1)
+
+print("\n✅ Script completado exitosamente")
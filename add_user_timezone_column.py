@@ -0,0 +1,59 @@
+"""
+Script para agregar la columna timezone a la tabla users
+Ejecutar: python add_user_timezone_column.py
+
+La columna guarda la zona horaria IANA de cada usuario (ej: America/Bogota)
+para resolver "mañana", "el próximo lunes"... con su fecha local. Los usuarios
+existentes quedan en NULL y usan DEFAULT_TIMEZONE.
+"""
+import sys
+from app import create_app, db
+from sqlalchemy import inspect, text
+
+
+def has_timezone_column() -> bool:
+    """Verifica la columna con el inspector de SQLAlchemy (PostgreSQL y SQLite)"""
+    inspector = inspect(db.engine)
+    return any(column['name'] == 'timezone' for column in inspector.get_columns('users'))
+
+
+print("🔄 Iniciando script de migración...")
+print("📋 Verificando conexión a la base de datos...")
+
+try:
+    app = create_app()
+
+    with app.app_context():
+        print("✅ Conexión establecida")
+
+        # Verificar si la columna ya existe
+        print("🔍 Verificando si la columna 'timezone' existe...")
+        if has_timezone_column():
+            print("✅ La columna 'timezone' ya existe en la tabla 'users'")
+            print("📋 No es necesario agregarla nuevamente")
+        else:
+            print("🔄 La columna 'timezone' NO existe. Agregándola...")
+            db.session.execute(text("""
+                ALTER TABLE users
+                ADD COLUMN timezone VARCHAR(64) NULL
+            """))
+            db.session.commit()
+            print("✅ Columna 'timezone' agregada exitosamente a la tabla 'users'")
+
+            # Verificar que se agregó correctamente
+            if has_timezone_column():
+                print("✅ Verificación: La columna 'timezone' está presente en la base de datos")
+            else:
+                print("⚠️ Advertencia: No se pudo verificar la columna después de agregarla")
+
+except Exception as e:
+    print(f"\n❌ Error al ejecutar el script: {e}")
+    print(f"   Tipo de error: {type(e).__name__}")
+    import traceback
+    print("\n📋 Detalles del error:")
+    traceback.print_exc()
+    print("\n💡 Alternativa: Puedes ejecutar este SQL manualmente en tu base de datos:")
+    print("   ALTER TABLE users ADD COLUMN timezone VARCHAR(64) NULL;")
+    sys.exit(1)
+
+print("\n✅ Script completado exitosamente")
@@ -22,6 +22,17 @@ def create_app(config_name="development"):
         Flask app instance
     """
     import os
+    import time
+
+    # Duración de cada fase del arranque (ms), para benchmarks/startup_profile.py
+    timings = {}
+    phase_started = time.perf_counter()
+
+    def mark(phase):
+        nonlocal phase_started
+        now = time.perf_counter()
+        timings[phase] = (now - phase_started) * 1000
+        phase_started = now
 
     # En Vercel, usar /tmp para instance path porque es el único directorio escribible
     if os.environ.get("VERCEL"):
@@ -32,40 +43,53 @@ def create_app(config_name="development"):
             pass
     else:
         app = Flask(__name__)
+    mark("flask")
 
     # Configurar logging mejorado
     from app.logger_config import setup_logging
-    import os
 
     log_file = os.getenv("LOG_FILE", "app.log")
     setup_logging(log_level=os.getenv("LOG_LEVEL", "INFO"), log_file=log_file)
+    mark("logging")
 
-    # Cargar configuración
-    app.config.from_object(config.get(config_name, config["default"]))
+    # Cargar y validar configuración
+    config_class = config.get(config_name, config["default"])
+    config_class.validate()
+    app.config.from_object(config_class)
+    app.config["CONFIG_NAME"] = config_name
+    mark("config")
 
     # Inicializar extensiones
     db.init_app(app)
+    mark("extensions")
 
     # Importar modelos para que SQLAlchemy los registre (import diferido para evitar circular)
     with app.app_context():
         from app import models  # noqa: F401
+    mark("models")
 
     # Registrar blueprints
     from app.routes import bp
 
     app.register_blueprint(bp)
+    mark("blueprints")
 
-    # Crear tablas en la base de datos (solo si la conexión está disponible)
-    try:
-        with app.app_context():
-            db.create_all()
-    except Exception as e:
-        # Si hay un error de conexión, no fallar - las tablas se crearán cuando se conecte
-        import logging
+    # Crear tablas en la base de datos (solo si la conexión está disponible).
+    # Con SCHEMA_INIT=deploy se omite: es un round trip a la base de datos en
+    # cada arranque en frío y init_db.py ya lo hace una vez por despliegue
+    if app.config.get("SCHEMA_INIT") != "deploy":
+        try:
+            with app.app_context():
+                db.create_all()
+        except Exception as e:
+            # Si hay un error de conexión, no fallar - las tablas se crearán cuando se conecte
+            import logging
 
-        logger = logging.getLogger(__name__)
-        logger.warning(f"No se pudo crear las tablas al inicializar: {e}")
+            logger = logging.getLogger(__name__)
+            logger.warning(f"No se pudo crear las tablas al inicializar: {e}")
+    mark("schema")
 
+    app.extensions["startup_timings"] = timings
     return app
 
 
@@ -106,23 +130,59 @@ def get_app():
     return _app_instance
 
 
-# Crear el objeto app para compatibilidad con servidores WSGI/ASGI
-# Esto permite usar: uvicorn app:app o gunicorn app:app
-_flask_app = get_app()
-
-# Crear wrapper ASGI para uvicorn
-try:
-    from asgiref.wsgi import WsgiToAsgi
-
-    # Envolver la aplicación Flask en un wrapper ASGI
-    app = WsgiToAsgi(_flask_app)
-except ImportError:
-    # Si asgiref no está disponible, usar la app Flask directamente
-    # (funcionará con gunicorn pero no con uvicorn)
-    import logging
-
-    logger = logging.getLogger(__name__)
-    logger.warning(
-        "asgiref no está instalado. Para usar uvicorn, instala: pip install asgiref"
-    )
-    app = _flask_app
+_asgi_app = None
+
+
+def get_asgi_app():
+    """
+    Obtiene o crea la aplicación ASGI para uvicorn (patrón singleton)
+
+    Por defecto (ASGI_MODE=wsgi) se envuelve Flask en WsgiToAsgi; con
+    ASGI_MODE=native se usa app.asgi, con handlers asyncio para los updates
+    frecuentes. Si faltan sus dependencias (httpx, asyncpg/aiosqlite) se
+    vuelve a WsgiToAsgi
+    """
+    global _asgi_app
+    if _asgi_app is not None:
+        return _asgi_app
+
+    flask_app = get_app()
+    if flask_app.config.get("ASGI_MODE") == "native":
+        try:
+            from app.asgi import AsyncBotApp
+
+            _asgi_app = AsyncBotApp(flask_app)
+            return _asgi_app
+        except ImportError as e:
+            import logging
+
+            logger = logging.getLogger(__name__)
+            logger.warning(
+                f"No se pudo crear la aplicación ASGI nativa ({e}). Usando WsgiToAsgi."
+            )
+
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+
+        # Envolver la aplicación Flask en un wrapper ASGI
+        _asgi_app = WsgiToAsgi(flask_app)
+    except ImportError:
+        # Si asgiref no está disponible, usar la app Flask directamente
+        # (funcionará con gunicorn pero no con uvicorn)
+        import logging
+
+        logger = logging.getLogger(__name__)
+        logger.warning(
+            "asgiref no está instalado. Para usar uvicorn, instala: pip install asgiref"
+        )
+        _asgi_app = flask_app
+    return _asgi_app
+
+
+def __getattr__(name):
+    # `uvicorn app:app` / `gunicorn app:app` piden el atributo `app`: se crea
+    # al pedirlo y no al importar el paquete, así importar app.models o
+    # create_app (main.py, init_db.py, workers) no construye una app de más
+    if name == "app":
+        return get_asgi_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,35 +3,94 @@ Servicios de IA para integración con Google Gemini
 """
 import json
 import logging
-from typing import Dict, Optional
+import random
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
 import requests
+from flask import current_app, has_app_context
 from app.config import Config
 from app.logger_config import log_operation, log_error, ErrorCodes
+from app.metrics import stage_timer, STAGE_GEMINI
+from app.deadline import Deadline, DeadlineExceeded, current_deadline, MIN_CALL_TIMEOUT
+from app.extraction_cache import get_extraction_cache
+from app.extraction_batcher import get_extraction_batcher
+from app.date_resolver import resolve_due_dates, today_in
+from app.http_clients import http_session, CLIENT_GEMINI
+from app.circuit_breaker import CircuitBreaker, CircuitOpen, get_gemini_breaker
+from app.gemini_usage import ExtractionUsage, GeminiCall, OUTCOME_CACHE
+from app.model_router import ModelRouter, get_model_router
+from app.rate_limiter import RateLimited, get_rate_limiter
+from app.extraction_result import (
+    ExtractionError, ExtractionResult, RESPONSE_SCHEMA, BATCH_RESPONSE_SCHEMA,
+    REASON_MISSING_FIELD, REASON_NOT_OBJECT, REASON_INVALID_FIELD,
+    decode_json, output_tokens, parse_stats, response_text,
+)
 
 logger = logging.getLogger(__name__)
 
+
+def gemini_models_url(url: str) -> str:
+    """
+    Prefijo `.../models/` de la API de Gemini
+
+    Acepta la URL base o la URL completa de generateContent de un modelo
+    (`.../models/gemini-2.5-flash:generateContent`), que es lo que traían
+    las configuraciones anteriores de GEMINI_API_URL.
+    """
+    url = url.split('?', 1)[0]
+    if url.endswith(':generateContent'):
+        url = url.rsplit('/', 1)[0]
+    return url.rstrip('/') + '/'
+
+
+def model_id(model: str) -> str:
+    """Nombre del modelo sin el prefijo `models/` ("models/gemini-2.5-flash" -> "gemini-2.5-flash")"""
+    return model[len('models/'):] if model.startswith('models/') else model
+
+
 # Configuración de Gemini desde archivo de configuración
-GEMINI_API_URL = Config.GEMINI_API_URL
+GEMINI_API_URL = gemini_models_url(Config.GEMINI_API_URL)
 GEMINI_API_KEY = Config.GOOGLE_API_KEY
-GEMINI_MODEL = Config.GEMINI_MODEL
+GEMINI_MODEL = model_id(Config.GEMINI_MODEL)
 
+# Timeout máximo de la llamada a Gemini (segundos)
+GEMINI_TIMEOUT = 30
 
-def extract_expense_data(text: str) -> Optional[Dict]:
-    """
-    Extrae datos estructurados de un mensaje de texto usando Gemini
-    
-    Args:
-        text: Texto del mensaje del usuario
-        
-    Returns:
-        Diccionario con los datos extraídos o None si hay error
-        
-    Raises:
-        Exception: Si hay error en la comunicación con Gemini
-    """
-    try:
-        # System prompt para extracción de entidades financieras
-        system_prompt = """Actúa como un extractor de entidades financieras. 
+# Salida JSON restringida por responseSchema (ver app.extraction_result)
+GEMINI_STRUCTURED_OUTPUT = Config.GEMINI_STRUCTURED_OUTPUT
+GEMINI_STRUCTURED_MAX_OUTPUT_TOKENS = Config.GEMINI_STRUCTURED_MAX_OUTPUT_TOKENS
+GEMINI_THINKING_BUDGET = Config.GEMINI_THINKING_BUDGET
+GEMINI_THINKING_BUDGET_MODELS = Config.GEMINI_THINKING_BUDGET_MODELS
+# Tokens de salida por carácter del mensaje: un gasto en JSON compacto son
+# ~45 tokens y en el mensaje ocupa desde ~15 caracteres ("y 5000 en pan")
+STRUCTURED_TOKENS_PER_CHAR = 3
+# Margen para el razonamiento dinámico de los modelos 2.5 cuando no se envía
+# thinkingConfig: esos tokens también cuentan dentro de maxOutputTokens
+DYNAMIC_THINKING_ALLOWANCE = 1024
+
+# Reintentos ante 429/5xx con backoff exponencial y jitter
+GEMINI_RETRY_ATTEMPTS = Config.GEMINI_RETRY_ATTEMPTS
+GEMINI_RETRY_BACKOFF = Config.GEMINI_RETRY_BACKOFF
+GEMINI_RETRY_MAX_BACKOFF = Config.GEMINI_RETRY_MAX_BACKOFF
+# Tiempo mínimo que debe quedar tras la espera para que valga la pena reintentar
+MIN_RETRY_WINDOW = 1.0
+# Un timeout cuenta como fallo de Gemini para el breaker solo si la llamada
+# tuvo al menos este margen (los timeouts cortos los pone el deadline del update)
+BREAKER_TIMEOUT_FLOOR = 5.0
+
+
+class GeminiUnavailable(Exception):
+    """Gemini no está disponible: circuito abierto o fallo de disponibilidad tras los reintentos"""
+
+    def __init__(self, reason: str, retry_after: float = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# System prompt para extracción de entidades financieras
+SYSTEM_PROMPT = """Actúa como un extractor de entidades financieras. 
 Analiza el texto del usuario para identificar:
 - El monto del gasto (amount)
 - La moneda (currency) - por defecto COP si no se especifica
@@ -39,17 +98,18 @@ Analiza el texto del usuario para identificar:
 - La categoría del gasto (category) - ej: transporte, comida, servicios, etc.
 - La acción (action) - puede ser "debt" (deuda) o "expense" (gasto compartido)
 - El nombre de la persona mencionada (debtor_name) - Si el usuario menciona explícitamente a otra persona, extrae el nombre. Si no se menciona, usa null.
-- La fecha de vencimiento (due_date) - Si el usuario menciona fechas relativas como "mañana", "ayer", "el próximo lunes", "en 3 días", calcula la fecha en formato YYYY-MM-DD. Si no se menciona, usa null.
+- La expresión de fecha (due_date_text) - Si el usuario menciona una fecha o plazo como "mañana", "ayer", "el próximo lunes", "en 3 días", "fin de mes", copia la expresión tal como aparece en el mensaje, sin calcular la fecha. Si no se menciona, usa null.
 
 IMPORTANTE: 
 - Si el usuario dice "gasté", "gastamos", "pagué", "pagamos", "compré", "compramos", la acción debe ser "expense" (gasto compartido)
 - Si el usuario dice "debo", "debo pagar", "tengo que pagar", "le debo", "debo dinero", la acción debe ser "debt" (deuda)
 - Para "expense" (gasté): el usuario que envía el mensaje es quien pagó, y la persona mencionada es quien debe
 - Para "debt" (debo): el usuario que envía el mensaje es quien debe, y la persona mencionada es quien va a recibir el pago
-- Para fechas relativas, calcula la fecha basándote en la fecha actual (hoy)
+- No calcules fechas: devuelve solo el texto de la expresión de fecha
+- Un mensaje puede describir varios gastos o deudas (por ejemplo "gasté 50000 en cine con Julieth y 20000 en taxi con Carlos"): extrae cada uno por separado, en el orden del mensaje. Si un gasto no repite el verbo, usa la acción del anterior
 - Debes devolver SOLO un JSON válido, sin texto adicional, sin markdown, sin explicaciones.
 
-El JSON debe tener exactamente esta estructura:
+El JSON debe ser un arreglo con un objeto por gasto, y cada objeto debe tener exactamente esta estructura:
 {
     "amount": <número>,
     "currency": "<código de moneda>",
@@ -57,164 +117,782 @@ El JSON debe tener exactamente esta estructura:
     "category": "<categoría>",
     "action": "<debt|expense>",
     "debtor_name": "<nombre de la persona mencionada o null si no se especifica>",
-    "due_date": "<fecha en formato YYYY-MM-DD o null si no se especifica>"
+    "due_date_text": "<expresión de fecha tal como aparece en el mensaje o null si no se especifica>"
 }
 
 Ejemplos:
-- "Gasté 50000 con María en el supermercado" -> action: "expense", currency: "COP", debtor_name: "María", due_date: null
-- "Gastamos 30000 en el taxi" -> action: "expense", currency: "COP", debtor_name: null, due_date: null
-- "Le debo 30000 a María por el taxi" -> action: "debt", currency: "COP", debtor_name: "María", due_date: null
-- "Debo 100000 pesos a Juan mañana" -> action: "debt", currency: "COP", debtor_name: "Juan", due_date: "2024-01-16" (si hoy es 2024-01-15)
-- "Tengo que pagar 50 USD el próximo lunes" -> action: "debt", currency: "USD", debtor_name: null, due_date: "2024-01-22" (calcula el próximo lunes)
-- "Debo 20 dólares ayer" -> action: "debt", currency: "USD", debtor_name: null, due_date: "2024-01-14" (si hoy es 2024-01-15)
+- "Gasté 50000 con María en el supermercado" -> action: "expense", currency: "COP", debtor_name: "María", due_date_text: null
+- "Gastamos 30000 en el taxi" -> action: "expense", currency: "COP", debtor_name: null, due_date_text: null
+- "Le debo 30000 a María por el taxi" -> action: "debt", currency: "COP", debtor_name: "María", due_date_text: null
+- "Debo 100000 pesos a Juan mañana" -> action: "debt", currency: "COP", debtor_name: "Juan", due_date_text: "mañana"
+- "Tengo que pagar 50 USD el próximo lunes" -> action: "debt", currency: "USD", debtor_name: null, due_date_text: "el próximo lunes"
+- "Debo 20 dólares ayer" -> action: "debt", currency: "USD", debtor_name: null, due_date_text: "ayer"
+- "Gasté 50000 en cine con Julieth y 20000 en taxi con Carlos" -> dos objetos: amount: 50000, action: "expense", debtor_name: "Julieth"; amount: 20000, action: "expense", debtor_name: "Carlos"
 """
 
-        # Prompt completo
-        full_prompt = f"{system_prompt}\n\nTexto del usuario: {text}\n\nJSON:"
-        
-        # Preparar payload para la API de Gemini
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": full_prompt
-                }]
-            }],
-            "generationConfig": {
-                "temperature": 0.1,
-                "topK": 1,
-                "topP": 1,
-                "maxOutputTokens": 1024
-            }
-        }
-        
-        # Headers con la API key
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # Construir URL completa con API key como parámetro
-        url_with_key = f"{GEMINI_API_URL}{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
-        
-        # Hacer la llamada HTTP a Gemini
-        log_operation(logger, "GEMINI_API_CALL",
-                     f"Llamando a Gemini API: {GEMINI_API_URL}, modelo={GEMINI_MODEL}, texto_length={len(text)}",
-                     error_code=ErrorCodes.OP_SUCCESS)
-        
-        response = requests.post(
-            url_with_key,
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
-        
-        # Verificar que la respuesta sea exitosa
-        response.raise_for_status()
-        
-        log_operation(logger, "GEMINI_API_RESPONSE",
-                     f"Respuesta recibida de Gemini API: status={response.status_code}",
-                     error_code=ErrorCodes.OP_SUCCESS)
-        
-        # Parsear respuesta JSON
-        response_data = response.json()
+# Instrucciones adicionales para extraer varios mensajes en una sola llamada
+BATCH_INSTRUCTIONS = """Vas a recibir {count} mensajes numerados, cada uno de un usuario distinto. Analiza cada mensaje por separado con las reglas anteriores.
+Devuelve SOLO un arreglo JSON con {count} objetos, uno por mensaje y en el mismo orden. Cada objeto tiene el campo "index" con el número del mensaje y el campo "expenses" con el arreglo de gastos de ese mensaje (objetos con la estructura anterior).
+Si un mensaje no describe un gasto ni una deuda, usa un arreglo "expenses" vacío."""
+
+
+def thinking_budget(model: Optional[str] = None) -> Optional[int]:
+    """
+    thinkingBudget que se envía al modelo, o None para no enviar thinkingConfig
+
+    Solo los modelos de GEMINI_THINKING_BUDGET_MODELS (prefijos) lo reciben:
+    `gemini-2.5-pro` rechaza un presupuesto de 0 con HTTP 400 y los modelos
+    sin razonamiento no aceptan thinkingConfig.
+
+    Args:
+        model: Modelo de la llamada (por defecto GEMINI_MODEL)
+
+    Returns:
+        GEMINI_THINKING_BUDGET o None
+    """
+    if GEMINI_THINKING_BUDGET is None:
+        return None
+    model = model_id(model or GEMINI_MODEL)
+    if any(model.startswith(prefix) for prefix in GEMINI_THINKING_BUDGET_MODELS):
+        return GEMINI_THINKING_BUDGET
+    return None
+
+
+def structured_max_output_tokens(texts: List[str], budget: Optional[int]) -> int:
+    """
+    maxOutputTokens de una extracción estructurada
+
+    Cada mensaje tiene al menos GEMINI_STRUCTURED_MAX_OUTPUT_TOKENS y más si
+    es largo (STRUCTURED_TOKENS_PER_CHAR), para que un mensaje con varios
+    gastos no se corte. Se suma el razonamiento, que en los modelos 2.5
+    cuenta dentro del tope: el presupuesto enviado o, si no se envía
+    thinkingConfig, DYNAMIC_THINKING_ALLOWANCE.
+
+    Args:
+        texts: Textos de los mensajes de la llamada
+        budget: thinkingBudget enviado o None
+
+    Returns:
+        Tope de tokens de salida de la llamada
+    """
+    tokens = sum(max(GEMINI_STRUCTURED_MAX_OUTPUT_TOKENS, STRUCTURED_TOKENS_PER_CHAR * len(text))
+                 for text in texts)
+    return tokens + (DYNAMIC_THINKING_ALLOWANCE if budget is None else max(budget, 0))
+
+
+def generation_config(texts: List[str], schema: Dict, model: Optional[str] = None) -> Dict:
+    """
+    generationConfig común a las extracciones
+
+    Con GEMINI_STRUCTURED_OUTPUT pide JSON restringido a `schema` con un tope
+    de salida según el largo de los mensajes; GEMINI_THINKING_BUDGET (si está
+    definido y el modelo lo admite) limita los tokens de razonamiento.
+
+    Args:
+        texts: Textos de los mensajes que se extraen en la llamada
+        schema: responseSchema para el modo estructurado
+        model: Modelo de la llamada (por defecto GEMINI_MODEL)
+
+    Returns:
+        generationConfig para la API de Gemini
+    """
+    config = {
+        "temperature": 0.1,
+        "topK": 1,
+        "topP": 1,
+        "maxOutputTokens": 1024 * len(texts)
+    }
+    if GEMINI_STRUCTURED_OUTPUT:
+        budget = thinking_budget(model)
+        config["maxOutputTokens"] = structured_max_output_tokens(texts, budget)
+        config["responseMimeType"] = "application/json"
+        config["responseSchema"] = schema
+        if budget is not None:
+            config["thinkingConfig"] = {"thinkingBudget": budget}
+    return config
+
+
+def build_extraction_payload(text: str, model: Optional[str] = None) -> Dict:
+    """
+    Construye el payload de generateContent para extraer un gasto
+
+    Args:
+        text: Texto del mensaje del usuario
+        model: Opcional, modelo a llamar (por defecto GEMINI_MODEL)
+
+    Returns:
+        Payload JSON para la API de Gemini
+    """
+    # Prompt completo
+    full_prompt = f"{SYSTEM_PROMPT}\n\nTexto del usuario: {text}\n\nJSON:"
+
+    return {
+        "contents": [{
+            "parts": [{
+                "text": full_prompt
+            }]
+        }],
+        "generationConfig": generation_config([text], RESPONSE_SCHEMA, model)
+    }
+
+
+def gemini_request_url(model: Optional[str] = None) -> str:
+    """URL completa de generateContent del modelo (por defecto GEMINI_MODEL) con la API key como parámetro"""
+    return f"{GEMINI_API_URL}{model_id(model or GEMINI_MODEL)}:generateContent?key={GEMINI_API_KEY}"
+
+
+def _log_parse_error(error: ExtractionError, data_dict: Dict):
+    """Registra un fallo de parseo con el código de error de su motivo"""
+    parse_stats.record_failure(error.reason)
+    error_code = {
+        REASON_MISSING_FIELD: ErrorCodes.ERR_MISSING_REQUIRED_FIELD,
+        REASON_NOT_OBJECT: ErrorCodes.ERR_INVALID_DATA,
+        REASON_INVALID_FIELD: ErrorCodes.ERR_INVALID_DATA,
+    }.get(error.reason, ErrorCodes.ERR_GEMINI_API)
+    log_error(logger, error_code, str(error), data_dict=dict(data_dict, reason=error.reason))
+
+
+def decode_response(response_data: Dict) -> Any:
+    """
+    Lee el JSON generado de una respuesta de generateContent
+
+    Args:
+        response_data: JSON de respuesta de Gemini
+
+    Returns:
+        Objeto JSON decodificado
+
+    Raises:
+        ExtractionError: Si la respuesta no trae texto o no es JSON válido
+    """
+    parse_stats.record_response(output_tokens(response_data))
+    return decode_json(response_text(response_data))
+
+
+def parse_extraction_results(response_data: Dict) -> Optional[List[ExtractionResult]]:
+    """
+    Convierte una respuesta de generateContent en los ExtractionResult del mensaje
+
+    Args:
+        response_data: JSON de respuesta de Gemini
+
+    Returns:
+        Lista de ExtractionResult (uno por gasto) o None si la respuesta no es válida
+    """
+    try:
+        data = decode_response(response_data)
+    except ExtractionError as e:
+        _log_parse_error(e, {"response_data": response_data})
+        return None
+    return validate_extractions(data)
+
+
+def parse_extraction_response(response_data: Dict) -> Optional[List[Dict]]:
+    """
+    Extrae y valida los gastos de una respuesta de generateContent
+
+    Args:
+        response_data: JSON de respuesta de Gemini
+
+    Returns:
+        Lista con los datos de cada gasto o None si la respuesta no es válida
+    """
+    results = parse_extraction_results(response_data)
+    return [result.to_dict() for result in results] if results is not None else None
+
+
+def build_batch_extraction_payload(texts: List[str], model: Optional[str] = None) -> Dict:
+    """
+    Construye un payload de generateContent que extrae varios mensajes a la vez
+
+    El system prompt va una sola vez; los mensajes se numeran desde 1 y se
+    pide un arreglo JSON con un objeto por mensaje, su número en "index" y
+    sus gastos en "expenses".
+
+    Args:
+        texts: Textos de los mensajes
+        model: Opcional, modelo a llamar (por defecto GEMINI_MODEL)
+
+    Returns:
+        Payload JSON para la API de Gemini
+    """
+    numbered = "\n".join(
+        f"{index}. {json.dumps(text, ensure_ascii=False)}" for index, text in enumerate(texts, start=1)
+    )
+    full_prompt = (
+        f"{SYSTEM_PROMPT}\n\n"
+        f"{BATCH_INSTRUCTIONS.format(count=len(texts))}\n\n"
+        f"Mensajes:\n{numbered}\n\nJSON:"
+    )
+
+    return {
+        "contents": [{
+            "parts": [{
+                "text": full_prompt
+            }]
+        }],
+        "generationConfig": generation_config(texts, BATCH_RESPONSE_SCHEMA, model)
+    }
+
+
+def parse_batch_extraction_response(response_data: Dict, count: int) -> Dict[int, Optional[List[Dict]]]:
+    """
+    Reparte la respuesta de una extracción en lote entre sus mensajes
+
+    Cada elemento se valida por separado: un objeto inválido solo anula su
+    mensaje. Los mensajes que no aparecen en la respuesta quedan fuera del
+    resultado para que se extraigan individualmente.
+
+    Args:
+        response_data: JSON de respuesta de Gemini
+        count: Número de mensajes enviados
+
+    Returns:
+        Diccionario {posición (desde 0): gastos extraídos o None}
+    """
+    try:
+        items = decode_response(response_data)
+        if not isinstance(items, list):
+            raise ExtractionError(REASON_NOT_OBJECT, "La respuesta en lote de Gemini no es un arreglo JSON")
+    except ExtractionError as e:
+        _log_parse_error(e, {"response_data": response_data})
+        return {}
+
+    # Sin "index" en todos los objetos solo se confía en el orden si el largo coincide
+    indexed = all(isinstance(item, dict) and isinstance(item.get('index'), int) for item in items)
+    if not indexed and len(items) != count:
+        log_error(logger, ErrorCodes.ERR_GEMINI_API,
+                 f"La respuesta en lote trae {len(items)} elementos para {count} mensajes",
+                 data_dict={"items": items})
+        return {}
+
+    results = {}
+    for position, item in enumerate(items):
+        if indexed:
+            position = item['index'] - 1
+        if not 0 <= position < count or position in results:
+            continue
+        # null o "expenses" vacío: el mensaje no es un gasto (no cuenta como fallo)
+        not_expense = item is None or (isinstance(item, dict) and item.get('expenses') == [])
+        results[position] = validate_expense_items(item) if not not_expense else None
+    return results
+
+
+def validate_extractions(expense_data: Any) -> Optional[List[ExtractionResult]]:
+    """
+    Valida los gastos JSON de un mensaje y los convierte en ExtractionResult
+
+    `due_date` no se acepta de Gemini: se resuelve localmente a partir de
+    `due_date_text` con la fecha del usuario (ver app.date_resolver).
+
+    Args:
+        expense_data: Arreglo JSON con los gastos crudos (o un único objeto)
+
+    Returns:
+        Lista de ExtractionResult o None si algún gasto tiene un campo faltante o inválido
+    """
+    try:
+        results = ExtractionResult.list_from_json(expense_data)
+    except ExtractionError as e:
+        _log_parse_error(e, {"expense_data": expense_data})
+        return None
+    parse_stats.record_parsed(len(results))
+    log_operation(logger, "GEMINI_EXTRACTION_SUCCESS",
+                 f"Datos extraídos exitosamente: gastos={len(results)}, "
+                 + ", ".join(f"amount={result.amount} {result.currency} ({result.action})" for result in results),
+                 error_code=ErrorCodes.OP_SUCCESS)
+    return results
+
+
+def validate_expense_items(expense_data: Any) -> Optional[List[Dict]]:
+    """
+    Valida y normaliza los gastos extraídos de un mensaje
+
+    Args:
+        expense_data: Arreglo JSON con los gastos crudos (o un único objeto)
+
+    Returns:
+        Lista de diccionarios normalizados o None si algún gasto es inválido
+    """
+    results = validate_extractions(expense_data)
+    return [result.to_dict() for result in results] if results is not None else None
+
+
+def is_retryable_status(status_code: int) -> bool:
+    """429 (cuota) y 5xx se reintentan; el resto de 4xx no cambia al repetir"""
+    return status_code == 429 or status_code >= 500
+
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Espera antes del reintento `attempt` (desde 0)
+
+    Backoff exponencial con jitter completo: uniforme entre 0 y
+    min(GEMINI_RETRY_MAX_BACKOFF, GEMINI_RETRY_BACKOFF * 2^attempt). Si Gemini
+    envía Retry-After en segundos, se respeta como mínimo.
+
+    Args:
+        attempt: Número de reintento
+        retry_after: Valor del encabezado Retry-After (opcional)
+
+    Returns:
+        Segundos de espera
+    """
+    delay = random.uniform(0, min(GEMINI_RETRY_MAX_BACKOFF, GEMINI_RETRY_BACKOFF * (2 ** attempt)))
+    try:
+        return max(delay, float(retry_after)) if retry_after else delay
+    except ValueError:
+        return delay
+
+
+def next_retry_delay(response_headers, attempt: int, expires_at: float) -> Optional[float]:
+    """
+    Espera antes de repetir una respuesta 429/5xx, o None si ya no se reintenta
+
+    La comparten `post_gemini` y el cliente async (`app.async_clients`).
+
+    Args:
+        response_headers: Encabezados de la respuesta (para Retry-After)
+        attempt: Número de reintento (desde 0)
+        expires_at: time.monotonic() en que vence el tiempo de la llamada
+
+    Returns:
+        Segundos de espera o None si se agotaron los reintentos o el tiempo
+    """
+    delay = retry_delay(attempt, response_headers.get("Retry-After"))
+    if attempt >= GEMINI_RETRY_ATTEMPTS or expires_at - time.monotonic() - delay < MIN_RETRY_WINDOW:
+        return None
+    return delay
+
+
+def post_gemini(payload: Dict, timeout: float, session: Optional[requests.Session] = None,
+                breaker: Optional[CircuitBreaker] = None, model: Optional[str] = None) -> requests.Response:
+    """
+    POST a generateContent con reintentos y circuit breaker
+
+    Reintenta 429/5xx mientras quede tiempo dentro de `timeout`. Los errores de
+    conexión, los timeouts largos y los 429/5xx que agotan los reintentos
+    cuentan como fallo para el breaker; con el circuito abierto no se llama.
+
+    Args:
+        payload: Payload JSON de generateContent
+        timeout: Segundos totales disponibles para la llamada y sus reintentos
+        session: Opcional, sesión HTTP (por defecto la compartida de Gemini)
+        breaker: Opcional, breaker de Gemini (por defecto el de la aplicación)
+        model: Opcional, modelo a llamar (por defecto GEMINI_MODEL)
+
+    Returns:
+        Respuesta exitosa de Gemini
+
+    Raises:
+        GeminiUnavailable: Circuito abierto, error de conexión o 429/5xx tras los reintentos
+        requests.exceptions.Timeout: Si la llamada agotó `timeout`
+        requests.exceptions.HTTPError: Si Gemini responde otro 4xx
+    """
+    if breaker is None and has_app_context():
+        breaker = get_gemini_breaker(current_app._get_current_object())
+    if breaker is not None:
+        try:
+            breaker.before_call()
+        except CircuitOpen as e:
+            raise GeminiUnavailable(str(e), retry_after=e.retry_after) from e
+
+    session = session or http_session(CLIENT_GEMINI)
+    url = gemini_request_url(model)
+    expires_at = time.monotonic() + timeout
+    attempt = 0
+    try:
+        while True:
+            attempt_timeout = expires_at - time.monotonic()
+            try:
+                response = session.post(
+                    url,
+                    json=payload,
+                    headers={"Content-Type": "application/json"},
+                    timeout=attempt_timeout
+                )
+            except requests.exceptions.Timeout:
+                if breaker is not None and attempt_timeout >= BREAKER_TIMEOUT_FLOOR:
+                    breaker.record_failure(f"timeout de {attempt_timeout:.1f}s")
+                    breaker = None
+                raise
+            except requests.exceptions.ConnectionError as e:
+                if breaker is not None:
+                    breaker.record_failure(f"error de conexión: {e}")
+                    breaker = None
+                raise GeminiUnavailable(f"Error de conexión con Gemini: {e}") from e
+
+            if not is_retryable_status(response.status_code):
+                if breaker is not None:
+                    breaker.record_success()
+                    breaker = None
+                # 4xx distinto de 429: error de la petición, no de disponibilidad
+                response.raise_for_status()
+                return response
+
+            delay = next_retry_delay(response.headers, attempt, expires_at)
+            if delay is None:
+                if breaker is not None:
+                    breaker.record_failure(f"HTTP {response.status_code}")
+                    breaker = None
+                raise GeminiUnavailable(f"Gemini respondió HTTP {response.status_code} tras {attempt + 1} intentos")
+
+            log_operation(logger, "GEMINI_RETRY",
+                         f"Gemini respondió HTTP {response.status_code}; reintento {attempt + 1} en {delay:.2f}s",
+                         error_code=ErrorCodes.OP_FAILED)
+            time.sleep(delay)
+            attempt += 1
+    finally:
+        # Una llamada de prueba que terminó sin veredicto (p. ej. timeout corto) libera su turno
+        if breaker is not None:
+            breaker.release()
+
+
+def request_extraction(text: str, timeout: float,
+                       session: Optional[requests.Session] = None,
+                       breaker: Optional[CircuitBreaker] = None,
+                       usage: Optional[ExtractionUsage] = None,
+                       model: Optional[str] = None,
+                       router: Optional[ModelRouter] = None) -> Optional[List[Dict]]:
+    """
+    Llama a generateContent con un mensaje y valida sus gastos
+
+    Args:
+        text: Texto del mensaje del usuario
+        timeout: Timeout de la llamada en segundos
+        session: Opcional, sesión HTTP (por defecto la compartida de Gemini)
+        breaker: Opcional, breaker de Gemini (por defecto el de la aplicación)
+        usage: Opcional, consumo del mensaje donde anotar tokens y latencia
+        model: Opcional, modelo a llamar (por defecto GEMINI_MODEL)
+        router: Opcional, router de modelos donde registrar la latencia de la llamada
+
+    Returns:
+        Lista con los datos de cada gasto o None si la respuesta no es válida
+
+    Raises:
+        GeminiUnavailable: Si Gemini no está disponible (ver `post_gemini`)
+        requests.exceptions.RequestException: Si la llamada falla
+    """
+    # Hacer la llamada HTTP a Gemini
+    model = model or GEMINI_MODEL
+    log_extraction_call(text, model)
+
+    started = time.perf_counter()
+    response = post_gemini(build_extraction_payload(text, model), timeout, session, breaker, model)
+    return extraction_call_result(response.json(), response.status_code, started, model, usage, router)
+
+
+def log_extraction_call(text: str, model: str):
+    """Registra en el log una llamada de extracción de un mensaje"""
+    log_operation(logger, "GEMINI_API_CALL",
+                 f"Llamando a Gemini API: {GEMINI_API_URL}, modelo={model}, texto_length={len(text)}",
+                 error_code=ErrorCodes.OP_SUCCESS)
+
+
+def extraction_call_result(response_data: Dict, status_code: int, started: float, model: str,
+                           usage: Optional[ExtractionUsage] = None,
+                           router: Optional[ModelRouter] = None) -> Optional[List[Dict]]:
+    """
+    Contabiliza una respuesta de extracción de un mensaje y valida sus gastos
+
+    La comparten `request_extraction` y el cliente async (`app.async_clients`).
+
+    Args:
+        response_data: JSON de la respuesta de generateContent
+        status_code: Status HTTP de la respuesta (para el log)
+        started: time.perf_counter() al iniciar la llamada
+        model: Modelo llamado
+        usage: Opcional, consumo del mensaje donde anotar tokens y latencia
+        router: Opcional, router de modelos donde registrar la latencia
+
+    Returns:
+        Lista con los datos de cada gasto o None si la respuesta no es válida
+    """
+    call = GeminiCall.from_response(response_data, time.perf_counter() - started, model)
+    if router is not None:
+        router.record_latency(model, call.latency)
+
+    log_operation(logger, "GEMINI_API_RESPONSE",
+                 f"Respuesta recibida de Gemini API: status={status_code}, modelo={call.model}, "
+                 f"tokens={call.prompt_tokens}+{call.candidate_tokens}/{call.total_tokens}, "
+                 f"latencia={call.latency * 1000:.0f}ms",
+                 error_code=ErrorCodes.OP_SUCCESS)
+    if usage is not None:
+        usage.add_call(call)
+
+    # Validar los datos extraídos
+    return parse_extraction_response(response_data)
+
+
+def request_batch_extraction(texts: List[str], timeout: float,
+                             session: Optional[requests.Session] = None,
+                             breaker: Optional[CircuitBreaker] = None,
+                             model: Optional[str] = None,
+                             router: Optional[ModelRouter] = None) -> Tuple[Dict[int, Optional[List[Dict]]], GeminiCall]:
+    """
+    Llama a generateContent con varios mensajes en un solo prompt
+
+    Args:
+        texts: Textos de los mensajes
+        timeout: Timeout de la llamada en segundos
+        session: Opcional, sesión HTTP (por defecto la compartida de Gemini)
+        breaker: Opcional, breaker de Gemini (por defecto el de la aplicación)
+        model: Opcional, modelo a llamar (por defecto GEMINI_MODEL)
+        router: Opcional, router de modelos donde registrar la latencia de la llamada
+
+    Returns:
+        Tupla ({posición: gastos extraídos o None}, llamada con los tokens y la latencia)
+
+    Raises:
+        GeminiUnavailable: Si Gemini no está disponible (ver `post_gemini`)
+        requests.exceptions.RequestException: Si la llamada falla
+    """
+    model = model or GEMINI_MODEL
+    log_operation(logger, "GEMINI_API_CALL",
+                 f"Llamando a Gemini API en lote: {GEMINI_API_URL}, modelo={model}, mensajes={len(texts)}",
+                 error_code=ErrorCodes.OP_SUCCESS)
+
+    started = time.perf_counter()
+    response = post_gemini(build_batch_extraction_payload(texts, model), timeout, session, breaker, model)
+    response_data = response.json()
+    call = GeminiCall.from_response(response_data, time.perf_counter() - started, model)
+    if router is not None:
+        router.record_latency(model, call.latency)
+
+    log_operation(logger, "GEMINI_API_RESPONSE",
+                 f"Respuesta recibida de Gemini API en lote: status={response.status_code}, mensajes={len(texts)}, "
+                 f"modelo={call.model}, tokens={call.prompt_tokens}+{call.candidate_tokens}/{call.total_tokens}, "
+                 f"latencia={call.latency * 1000:.0f}ms",
+                 error_code=ErrorCodes.OP_SUCCESS)
+
+    return parse_batch_extraction_response(response_data, len(texts)), call
+
+
+def extract_expense_items(text: str, deadline: Optional[Deadline] = None,
+                          today: Optional[date] = None,
+                          usage: Optional[ExtractionUsage] = None,
+                          telegram_id: Optional[int] = None) -> Optional[List[Dict]]:
+    """
+    Extrae los gastos de un mensaje de texto usando Gemini
+
+    Un mensaje puede traer varios gastos ("gasté 50000 en cine con Julieth y
+    20000 en taxi con Carlos"); se devuelven en el orden del mensaje.
+
+    Los resultados válidos se guardan en la caché de extracción; un mensaje
+    repetido el mismo día no vuelve a llamar a Gemini. Con un deadline activo,
+    el timeout de la llamada es lo que queda del presupuesto menos la reserva
+    para responder al usuario. Con EXTRACTION_BATCH_ENABLED el mensaje viaja
+    junto con los que lleguen en la misma ventana (ver `app.extraction_batcher`).
+
+    Gemini devuelve la expresión de fecha sin resolver, así que lo que se
+    cachea no depende del día; `due_date` se calcula después con `today`.
+
+    Con `usage` se anotan el acierto de caché o los tokens y la latencia de
+    la llamada (ver `app.gemini_usage`).
+
+    Con `telegram_id`, un mensaje que no está en caché consume un token del
+    limitador (`app.rate_limiter`) justo antes de llamar a Gemini.
+
+    Con GEMINI_ROUTER_ENABLED el modelo depende de la complejidad del mensaje
+    (ver `app.model_router`): los simples van al modelo rápido (y son los
+    únicos que viajan en micro-lotes) y, si su respuesta no pasa la
+    validación, se repiten con el modelo fuerte mientras quede presupuesto.
+    
+    Args:
+        text: Texto del mensaje del usuario
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+        today: Opcional, fecha de hoy del usuario (por defecto en DEFAULT_TIMEZONE)
+        usage: Opcional, consumo del mensaje
+        telegram_id: Opcional, usuario al que se le cobra el token del limitador
         
-        # Extraer el texto de la respuesta
-        response_text = None
-        if 'candidates' in response_data and len(response_data['candidates']) > 0:
-            if 'content' in response_data['candidates'][0]:
-                if 'parts' in response_data['candidates'][0]['content']:
-                    response_text = response_data['candidates'][0]['content']['parts'][0].get('text', '').strip()
-                else:
-                    log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                             "No se encontró 'parts' en la respuesta de Gemini",
-                             data_dict={"response_structure": list(response_data.get('candidates', [{}])[0].keys()) if response_data.get('candidates') else None})
-                    return None
+    Returns:
+        Lista con los datos de cada gasto o None si hay error
+
+    Raises:
+        RateLimited: Si el usuario o el bucket global no tienen token
+        DeadlineExceeded: Si no queda presupuesto para llamar a Gemini o la
+            llamada agotó el tiempo que quedaba
+        GeminiUnavailable: Si el circuito de Gemini está abierto o Gemini no
+            respondió tras los reintentos (el llamador decide el respaldo)
+    """
+    cache = get_extraction_cache(current_app) if has_app_context() else None
+    cached = cached_extraction(cache, text, today, usage)
+    if cached is not None:
+        return cached
+
+    # Control de admisión solo para los mensajes que sí van a llamar a Gemini
+    limiter = get_rate_limiter(current_app) if has_app_context() and telegram_id is not None else None
+    admit_extraction(limiter, telegram_id)
+
+    batcher = get_extraction_batcher(current_app) if has_app_context() else None
+    router = get_model_router(current_app) if has_app_context() else None
+    deadline = deadline or current_deadline()
+    timeout = extraction_timeout(deadline)
+    try:
+        decision = router.route(text, today) if router is not None else None
+        with stage_timer(STAGE_GEMINI):
+            # Con router, el batcher llama al modelo rápido
+            if batcher is not None and (decision is None or decision.model == router.fast_model):
+                items = batcher.extract(text, timeout, usage)
             else:
-                log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                         "No se encontró 'content' en la respuesta de Gemini",
-                         data_dict={"response_structure": list(response_data.get('candidates', [{}])[0].keys()) if response_data.get('candidates') else None})
-                return None
-        else:
-            log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                     "No se encontró 'candidates' en la respuesta de Gemini",
-                     data_dict={"response_data": response_data})
-            return None
-        
-        if not response_text:
-            log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                     "La respuesta de Gemini está vacía",
-                     data_dict={"response_data": response_data})
-            return None
-        
-        # Limpiar el texto si viene con markdown
-        if response_text.startswith('```json'):
-            response_text = response_text.replace('```json', '').replace('```', '').strip()
-        elif response_text.startswith('```'):
-            response_text = response_text.replace('```', '').strip()
-        
-        # Parsear JSON
-        expense_data = json.loads(response_text)
-        
-        # Validar campos requeridos
-        required_fields = ['amount', 'currency', 'description', 'action']
-        for field in required_fields:
-            if field not in expense_data:
-                log_error(logger, ErrorCodes.ERR_MISSING_REQUIRED_FIELD,
-                         f"Campo requerido '{field}' no encontrado en la respuesta de Gemini",
-                         data_dict={"expense_data": expense_data, "missing_field": field})
-                return None
-        
-        # Asegurar que debtor_name exista (puede ser null)
-        if 'debtor_name' not in expense_data:
-            expense_data['debtor_name'] = None
-        
-        # Asegurar que due_date exista (puede ser null)
-        if 'due_date' not in expense_data:
-            expense_data['due_date'] = None
-        
-        # Validar valores
-        if not isinstance(expense_data['amount'], (int, float)) or expense_data['amount'] <= 0:
-            log_error(logger, ErrorCodes.ERR_INVALID_DATA,
-                     f"Monto inválido: {expense_data['amount']}",
-                     data_dict={"expense_data": expense_data})
-            return None
-        
-        if expense_data['action'] not in ['debt', 'expense']:
-            log_error(logger, ErrorCodes.ERR_INVALID_DATA,
-                     f"Acción desconocida '{expense_data['action']}', usando 'debt' por defecto",
-                     data_dict={"expense_data": expense_data})
-            expense_data['action'] = 'debt'
-        
-        # Asegurar que currency tenga un valor por defecto (COP)
-        if not expense_data.get('currency'):
-            expense_data['currency'] = 'COP'
-        
-        log_operation(logger, "GEMINI_EXTRACTION_SUCCESS",
-                     f"Datos extraídos exitosamente: amount={expense_data['amount']}, currency={expense_data['currency']}, action={expense_data['action']}",
-                     error_code=ErrorCodes.OP_SUCCESS)
-        return expense_data
-        
-    except requests.exceptions.HTTPError as e:
-        error_response_text = e.response.text if hasattr(e.response, 'text') else 'N/A'
-        log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                 f"Error HTTP al comunicarse con Gemini: {str(e)}",
-                 data_dict={"status_code": e.response.status_code if hasattr(e.response, 'status_code') else None,
-                           "response_text": error_response_text},
-                 exception=e)
+                items = request_extraction(text, timeout, usage=usage,
+                                           model=decision.model if decision is not None else None, router=router)
+
+            if items is None and decision is not None and router.should_escalate(decision):
+                # La respuesta del modelo rápido no pasó la validación: se repite con el fuerte
+                escalation = escalation_timeout(deadline, decision, router)
+                if escalation is not None:
+                    items = request_extraction(text, escalation, usage=usage, model=router.strong_model,
+                                               router=router)
+                    router.record_escalation(items is not None)
+
+        return store_extraction(cache, text, items, today)
+
+    except Exception as e:
+        return extraction_failure(e, deadline, timeout)
+
+
+def cached_extraction(cache, text: str, today: Optional[date] = None,
+                      usage: Optional[ExtractionUsage] = None) -> Optional[List[Dict]]:
+    """
+    Gastos del mensaje si ya están en la caché de extracción
+
+    Args:
+        cache: ExtractionCache o None
+        text: Texto del mensaje del usuario
+        today: Opcional, fecha de hoy del usuario (para resolver las fechas)
+        usage: Opcional, consumo del mensaje (se marca el acierto de caché)
+
+    Returns:
+        Lista con los datos de cada gasto o None si no está en caché
+    """
+    if cache is None:
         return None
-    except requests.exceptions.RequestException as e:
-        log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                 f"Error de conexión con Gemini: {str(e)}",
-                 exception=e)
+    cached = cache.get(text)
+    if cached is None:
         return None
-    except json.JSONDecodeError as e:
+    log_operation(logger, "GEMINI_CACHE_HIT",
+                 f"Resultado de extracción reutilizado: gastos={len(cached)}",
+                 error_code=ErrorCodes.OP_SUCCESS)
+    if usage is not None:
+        usage.outcome = OUTCOME_CACHE
+    return resolve_due_dates(cached, text, today or today_in())
+
+
+def admit_extraction(limiter, telegram_id: Optional[int]):
+    """
+    Consume el token del limitador de un mensaje que va a llamar a Gemini
+
+    Args:
+        limiter: RateLimiter o None
+        telegram_id: Usuario al que se le cobra el token
+
+    Raises:
+        RateLimited: Si el usuario o el bucket global no tienen token
+    """
+    if limiter is None or telegram_id is None:
+        return
+    decision = limiter.check(telegram_id)
+    if not decision.allowed:
+        raise RateLimited(telegram_id, decision)
+
+
+def extraction_timeout(deadline: Optional[Deadline]) -> float:
+    """Timeout de la extracción: lo que queda del presupuesto menos la reserva para responder"""
+    if deadline is None:
+        return GEMINI_TIMEOUT
+    return deadline.timeout(STAGE_GEMINI, GEMINI_TIMEOUT, reserve=deadline.reply_reserve)
+
+
+def escalation_timeout(deadline: Optional[Deadline], decision, router: ModelRouter) -> Optional[float]:
+    """
+    Timeout para repetir con el modelo fuerte una extracción inválida del rápido
+
+    Args:
+        deadline: Deadline del update o None
+        decision: Decisión del router para el mensaje
+        router: Router de modelos
+
+    Returns:
+        Segundos para la llamada o None si ya no alcanza el presupuesto
+    """
+    remaining = GEMINI_TIMEOUT if deadline is None else deadline.remaining() - deadline.reply_reserve
+    if remaining < MIN_CALL_TIMEOUT:
+        return None
+    log_operation(logger, "GEMINI_ESCALATION",
+                 f"Extracción con {decision.model} inválida (complejidad={decision.score}); "
+                 f"reintentando con {router.strong_model}",
+                 error_code=ErrorCodes.OP_FAILED)
+    return min(GEMINI_TIMEOUT, remaining)
+
+
+def store_extraction(cache, text: str, items: Optional[List[Dict]],
+                     today: Optional[date] = None) -> Optional[List[Dict]]:
+    """
+    Guarda en caché una extracción válida y resuelve sus fechas
+
+    Gemini devuelve la expresión de fecha sin resolver, así que lo que se
+    cachea no depende del día; `due_date` se calcula con `today`.
+
+    Args:
+        cache: ExtractionCache o None
+        text: Texto del mensaje del usuario
+        items: Gastos extraídos o None si la respuesta no fue válida
+        today: Opcional, fecha de hoy del usuario
+
+    Returns:
+        Gastos con `due_date` resuelta o None
+    """
+    if items is None:
+        return None
+    if cache is not None:
+        cache.put(text, items)
+    return resolve_due_dates(items, text, today or today_in())
+
+
+def extraction_failure(error: Exception, deadline: Optional[Deadline], timeout: float) -> None:
+    """
+    Trato de un error de la extracción (mismo para la ruta síncrona y la async)
+
+    Args:
+        error: Excepción de la llamada; el cliente async traduce las de httpx a
+            las de requests para compartir este trato
+        deadline: Deadline del update o None
+        timeout: Timeout con el que se llamó a Gemini
+
+    Returns:
+        None (extracción fallida) para los errores HTTP y los inesperados
+
+    Raises:
+        DeadlineExceeded: Si el timeout lo puso el presupuesto del update
+        GeminiUnavailable: Si Gemini no está disponible o no respondió en el
+            tiempo completo
+    """
+    if isinstance(error, (DeadlineExceeded, GeminiUnavailable)):
+        raise error
+    if isinstance(error, requests.exceptions.Timeout):
+        if deadline is not None and timeout < GEMINI_TIMEOUT:
+            # El timeout lo puso el presupuesto del update, no el límite de Gemini
+            raise deadline.exceeded(STAGE_GEMINI) from error
         log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                 f"Error al parsear JSON de Gemini: {str(e)}",
-                 data_dict={"response_text": response_text if 'response_text' in locals() else 'N/A'},
-                 exception=e)
+                 f"Timeout al comunicarse con Gemini: {str(error)}",
+                 exception=error)
+        # Gemini no respondió en el tiempo completo: mismo trato que una caída
+        raise GeminiUnavailable(f"Timeout al comunicarse con Gemini: {error}") from error
+    if isinstance(error, requests.exceptions.HTTPError):
+        error_response_text = error.response.text if hasattr(error.response, 'text') else 'N/A'
+        log_error(logger, ErrorCodes.ERR_GEMINI_API,
+                 f"Error HTTP al comunicarse con Gemini: {str(error)}",
+                 data_dict={"status_code": error.response.status_code if hasattr(error.response, 'status_code') else None,
+                           "response_text": error_response_text},
+                 exception=error)
         return None
-    except Exception as e:
+    if isinstance(error, requests.exceptions.RequestException):
         log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                 f"Error inesperado al comunicarse con Gemini: {str(e)}",
-                 exception=e)
+                 f"Error de conexión con Gemini: {str(error)}",
+                 exception=error)
         return None
-
+    log_error(logger, ErrorCodes.ERR_GEMINI_API,
+             f"Error inesperado al comunicarse con Gemini: {str(error)}",
+             exception=error)
+    return None
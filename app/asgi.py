@@ -0,0 +1,323 @@
+"""
+Aplicación ASGI nativa (asyncio) del bot
+
+Atiende /webhook y /health en el event loop. La lectura del request, la
+deduplicación, el tope de updates en vuelo y el orden por chat no ocupan un
+thread. Los mensajes de gasto y los botones de pagar deuda y de página se
+procesan en el event loop (`app.async_handlers`: Telegram y Gemini con
+httpx, la DB con SQLAlchemy async) con los mismos helpers de respuesta,
+validación y formato que el webhook de Flask. El resto de updates (/start,
+/admin, consultas) corre `routes.process_inline_update` en uno de los
+ASGI_WORKERS workers. Cualquier otra ruta se delega a la aplicación Flask
+envuelta en WsgiToAsgi.
+
+Uso: `uvicorn app:app` con ASGI_MODE=native.
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import db
+from app.async_clients import create_http_client
+from app.async_db import create_engine_and_sessionmaker
+from app.async_handlers import AsyncUpdateHandler, is_hot_update
+from app.deadline import Deadline
+from app.dedup import get_update_deduplicator
+from app.dispatcher import update_chat_key
+from app.update_queue import get_update_pool
+from app.routes import health_payload, process_inline_update
+from app.logger_config import log_request, log_response, log_error, log_operation, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBotApp:
+    """
+    Aplicación ASGI con handlers async para los updates frecuentes del webhook
+
+    Attributes:
+        flask_app: Aplicación Flask (config, extensiones y rutas no nativas)
+        handler: AsyncUpdateHandler de los updates frecuentes
+        executor: Workers que ejecutan el flujo síncrono del resto de updates
+        max_inflight: Máximo de updates aceptados a la vez (procesándose o esperando turno)
+    """
+
+    def __init__(self, flask_app):
+        config = flask_app.config
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self.workers = max(1, config.get("ASGI_WORKERS", 16))
+        self.max_inflight = max(1, config.get("ASGI_MAX_INFLIGHT", 2000))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="asgi-update")
+
+        self.http = create_http_client(config.get("ASGI_HTTP_MAX_CONNECTIONS", 200))
+        with flask_app.app_context():
+            # La URL del engine síncrono ya trae resuelta la ruta de SQLite relativa a instance/
+            database_url = db.engine.url.render_as_string(hide_password=False)
+        self.engine, sessionmaker = create_engine_and_sessionmaker(
+            database_url,
+            pool_size=config.get("ASGI_DB_POOL_SIZE", 20),
+            max_overflow=config.get("ASGI_DB_MAX_OVERFLOW", 20),
+        )
+        self.handler = AsyncUpdateHandler(self.http, sessionmaker)
+
+        # Candado FIFO por chat: los updates de un mismo chat se procesan en orden
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._chat_waiters: Dict[int, int] = {}
+
+        self._inflight = 0
+        self._peak_inflight = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._native = 0
+        self._fallback = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        if scope["type"] == "http":
+            method, path = scope["method"], scope["path"]
+            if path == "/webhook" and method == "POST":
+                await self._webhook(receive, send)
+                return
+            if path == "/health" and method == "GET":
+                await self._send_json(send, 200, self.health())
+                return
+
+        await self.wsgi_app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        """Protocolo lifespan: espera a los workers y cierra los pools de HTTP y DB al apagar"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def aclose(self):
+        """Espera a los updates en proceso, vuelca el consumo de Gemini pendiente y cierra el cliente HTTP y el engine"""
+        await asyncio.to_thread(self.executor.shutdown, True)
+        gemini_usage = self.flask_app.extensions.get('gemini_usage')
+        if gemini_usage is not None:
+            await asyncio.to_thread(gemini_usage.flush, self.flask_app)
+        await self.http.aclose()
+        await self.engine.dispose()
+
+    async def run_sync(self, func, *args):
+        """
+        Ejecuta una función síncrona en un worker dentro del contexto de Flask
+
+        Args:
+            func: Función a ejecutar
+            *args: Argumentos de la función
+
+        Returns:
+            Resultado de la función
+        """
+        def call():
+            with self.flask_app.app_context():
+                return func(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    @asynccontextmanager
+    async def _chat_turn(self, key: Optional[int]):
+        """Espera el turno del chat (los chats distintos no se bloquean entre sí)"""
+        if key is None:
+            yield
+            return
+
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = self._chat_locks[key] = asyncio.Lock()
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._chat_waiters[key] -= 1
+            if not self._chat_waiters[key]:
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        """Lee el cuerpo completo del request"""
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _send_json(send, status: int, body: dict):
+        """Envía una respuesta JSON"""
+        data = json.dumps(body).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(data)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": data})
+
+    @staticmethod
+    def _json_response(response) -> Tuple[dict, int]:
+        """Tupla (cuerpo_json, status_code) de una respuesta Flask"""
+        response, status = response if isinstance(response, tuple) else (response, response.status_code)
+        return response.get_json(), status
+
+    @staticmethod
+    def _process(update: dict, deadline: Optional[Deadline]) -> Tuple[dict, int]:
+        """Procesa el update con el flujo del webhook de Flask (corre en un worker)"""
+        return AsyncBotApp._json_response(process_inline_update(update, deadline))
+
+    async def _process_native(self, update: dict, deadline: Optional[Deadline]) -> Tuple[dict, int]:
+        """Procesa un update frecuente en el event loop (contexto de Flask propio de la tarea)"""
+        with self.flask_app.app_context():
+            return self._json_response(await self.handler.process(update, deadline))
+
+    async def _webhook(self, receive, send):
+        """
+        Endpoint /webhook nativo
+
+        Mismo contrato que `routes.webhook`: 400 si el update es inválido, 200
+        para reenvíos duplicados, WEBHOOK_ASYNC_MODE encola en el pool de
+        updates y, si no, el resultado de procesar el update. Además responde
+        503 (Telegram reintenta) si se supera ASGI_MAX_INFLIGHT. Con cualquier
+        respuesta 5xx se olvida el update_id para que el reintento se procese.
+        """
+        try:
+            update = json.loads(await self._read_body(receive) or b"null")
+            log_request(logger, "IN", "/webhook", data_dict={"has_update": update is not None})
+            if not update or not isinstance(update, dict):
+                log_error(logger, ErrorCodes.ERR_INVALID_DATA, "Update vacío recibido")
+                log_response(logger, "OUT", "/webhook", 400, error_code=ErrorCodes.RESP_ERROR)
+                await self._send_json(send, 400, {'status': 'error', 'message': 'Empty update'})
+                return
+        except ValueError as e:
+            log_error(logger, ErrorCodes.ERR_INVALID_DATA,
+                      f"Error al leer el update: {str(e)}", exception=e)
+            log_response(logger, "OUT", "/webhook", 400, error_code=ErrorCodes.RESP_ERROR)
+            await self._send_json(send, 400, {'status': 'error', 'message': 'Invalid update'})
+            return
+
+        update_id = update.get('update_id')
+
+        # El presupuesto corre desde que llega el update: la espera por el
+        # turno del chat o por un worker también lo consume
+        budget = self.flask_app.config.get('UPDATE_DEADLINE_SECONDS', 0)
+        deadline = Deadline(budget, self.flask_app.config.get('UPDATE_DEADLINE_REPLY_RESERVE', 0)) \
+            if budget > 0 else None
+
+        dedup = get_update_deduplicator(self.flask_app)
+        if dedup is not None:
+            if dedup.backend == "db":
+                duplicate = await self.run_sync(dedup.is_duplicate, update_id)
+            else:
+                duplicate = dedup.is_duplicate(update_id)
+            if duplicate:
+                log_operation(logger, "UPDATE_DUPLICATE_DROPPED",
+                              f"Update duplicado descartado: update_id={update_id}",
+                              error_code=ErrorCodes.UPDATE_DUPLICATE)
+                log_response(logger, "OUT", "/webhook", 200,
+                             message="Update duplicado", error_code=ErrorCodes.RESP_OK)
+                await self._send_json(send, 200, {'status': 'ok'})
+                return
+
+        pool = get_update_pool(self.flask_app)
+        if pool is not None:
+            if not pool.submit(update):
+                # Pool lleno: responder 503 para que Telegram reintente más tarde
+                self._rejected += 1
+                await self._forget(dedup, update_id)
+                log_error(logger, ErrorCodes.ERR_QUEUE_FULL,
+                          "Cola de updates llena, update rechazado",
+                          data_dict={"update_id": update_id, **pool.stats()})
+                log_response(logger, "OUT", "/webhook", 503, error_code=ErrorCodes.RESP_ERROR)
+                await self._send_json(send, 503, {'status': 'error', 'message': 'Queue full'})
+                return
+            log_response(logger, "OUT", "/webhook", 200,
+                         message=f"Update encolado: update_id={update_id}",
+                         error_code=ErrorCodes.RESP_OK)
+            await self._send_json(send, 200, {'status': 'ok'})
+            return
+
+        if self._inflight >= self.max_inflight:
+            self._rejected += 1
+            await self._forget(dedup, update_id)
+            log_error(logger, ErrorCodes.ERR_QUEUE_FULL,
+                      "Máximo de updates en vuelo alcanzado, update rechazado",
+                      data_dict={"update_id": update_id, "inflight": self._inflight})
+            log_response(logger, "OUT", "/webhook", 503, error_code=ErrorCodes.RESP_ERROR)
+            await self._send_json(send, 503, {'status': 'error', 'message': 'Too many in-flight updates'})
+            return
+
+        self._inflight += 1
+        self._peak_inflight = max(self._peak_inflight, self._inflight)
+        try:
+            async with self._chat_turn(update_chat_key(update)):
+                if is_hot_update(update):
+                    self._native += 1
+                    body, status = await self._process_native(update, deadline)
+                else:
+                    self._fallback += 1
+                    body, status = await self.run_sync(self._process, update, deadline)
+        except Exception as e:
+            log_error(logger, ErrorCodes.ERR_EXPENSE_CREATION,
+                      f"Error procesando update: {str(e)}",
+                      data_dict={"update_id": update_id}, exception=e)
+            log_response(logger, "OUT", "/webhook", 500, error_code=ErrorCodes.RESP_ERROR)
+            body, status = {'status': 'error', 'message': str(e)}, 500
+        finally:
+            self._inflight -= 1
+
+        if status >= 500:
+            # Telegram reintenta los 5xx: el reintento no debe descartarse como duplicado
+            self._failed += 1
+            await self._forget(dedup, update_id)
+        else:
+            self._processed += 1
+        await self._send_json(send, status, body)
+
+    async def _forget(self, dedup, update_id):
+        """Olvida el update_id para que el reintento de Telegram no se descarte como duplicado"""
+        if dedup is None:
+            return
+        if dedup.backend == "db":
+            await self.run_sync(dedup.forget, update_id)
+        else:
+            dedup.forget(update_id)
+
+    def health(self) -> dict:
+        """Payload de /health (`routes.health_payload` más la sección `asgi`)"""
+        payload = health_payload(self.flask_app)
+        payload['asgi'] = {
+            "mode": "native",
+            "workers": self.workers,
+            "native_updates": self._native,
+            "worker_updates": self._fallback,
+            "inflight": self._inflight,
+            "peak_inflight": self._peak_inflight,
+            "max_inflight": self.max_inflight,
+            "active_chats": len(self._chat_locks),
+            "processed": self._processed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+        }
+        return payload
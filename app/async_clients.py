@@ -0,0 +1,379 @@
+"""
+Clientes asyncio de las APIs de Telegram y Gemini
+
+Versiones no bloqueantes de `bot_services.send_message` / `answer_callback_query` /
+`edit_message_text` y de `ai_services.extract_expense_items`, sobre un único
+`httpx.AsyncClient` con pool de conexiones compartido. Los payloads, el
+parseo de respuestas, los reintentos y el trato de errores son los helpers
+de los clientes síncronos; los errores de httpx se traducen a los de
+`requests` para compartir ese trato. Requieren un contexto de aplicación
+(task-local en asyncio).
+"""
+import asyncio
+import logging
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+import httpx
+import requests
+from flask import current_app
+
+from app.ai_services import (
+    BREAKER_TIMEOUT_FLOOR,
+    GEMINI_MODEL,
+    GeminiUnavailable,
+    admit_extraction,
+    build_extraction_payload,
+    cached_extraction,
+    escalation_timeout,
+    extraction_call_result,
+    extraction_failure,
+    extraction_timeout,
+    gemini_request_url,
+    is_retryable_status,
+    log_extraction_call,
+    next_retry_delay,
+    store_extraction,
+)
+from app.bot_services import (
+    TELEGRAM_API_URL,
+    answer_callback_payload,
+    edit_message_payload,
+    send_message_payload,
+    telegram_scheduler,
+    telegram_timeout,
+)
+from app.circuit_breaker import CircuitOpen, get_gemini_breaker
+from app.deadline import Deadline, DeadlineExceeded, current_deadline
+from app.extraction_batcher import get_extraction_batcher
+from app.extraction_cache import get_extraction_cache
+from app.gemini_usage import ExtractionUsage
+from app.model_router import get_model_router
+from app.rate_limiter import SQLiteBucketStore, get_rate_limiter
+from app.telegram_scheduler import OutboundExpired, PRIORITY_CALLBACK, PRIORITY_INTERACTIVE
+from app.webhook_reply import HeldCall, current_outbox, current_webhook_reply
+from app.logger_config import log_operation, log_error, ErrorCodes
+from app.metrics import stage_timer, STAGE_GEMINI, STAGE_TELEGRAM
+
+logger = logging.getLogger(__name__)
+
+
+def create_http_client(max_connections: int = 200) -> httpx.AsyncClient:
+    """
+    Crea el cliente HTTP async compartido por los clientes de Telegram y Gemini
+
+    Args:
+        max_connections: Máximo de conexiones simultáneas del pool
+
+    Returns:
+        httpx.AsyncClient
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0))
+
+
+def raise_for_status(response: httpx.Response):
+    """`raise_for_status` con la excepción de requests (el trato de errores es el de la ruta síncrona)"""
+    if response.is_error:
+        raise requests.exceptions.HTTPError(f"HTTP {response.status_code} de {response.url}",
+                                            response=response)
+
+
+async def run_blocking(blocking: bool, func, *args):
+    """
+    Ejecuta `func` en un thread si hace I/O bloqueante (stores SQLite)
+
+    `asyncio.to_thread` copia el contexto, así que el thread ve el contexto de
+    aplicación del handler.
+    """
+    if blocking:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+class AsyncTelegramClient:
+    """
+    Cliente async de la Bot API de Telegram
+
+    Mismo contrato que `bot_services.post_telegram`: respuesta en línea del
+    webhook, cola de salida compartida (se espera su future sin ocupar un
+    thread) o POST directo con el timeout del deadline.
+
+    Attributes:
+        http: Cliente httpx compartido
+    """
+
+    def __init__(self, http: httpx.AsyncClient):
+        self.http = http
+
+    async def post(self, method: str, payload: dict, deadline: Optional[Deadline] = None,
+                   chat_id: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE):
+        """
+        Llama a un método de la Bot API
+
+        Args:
+            method: Método de la Bot API (sendMessage, editMessageText, ...)
+            payload: Cuerpo JSON
+            deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+            chat_id: Opcional, chat destino (buckets y orden por chat de la cola)
+            priority: Opcional, prioridad en la cola (PRIORITY_*)
+
+        Raises:
+            DeadlineExceeded: Si ya no queda presupuesto para la llamada
+            requests.exceptions.RequestException: Igual que `post_telegram`
+        """
+        outbox = current_outbox()
+        if outbox is not None and outbox.hold(method, payload, chat_id, priority):
+            return
+
+        inline = current_webhook_reply()
+        if inline is not None:
+            if inline.hold(method, payload, chat_id, priority):
+                log_operation(logger, "TELEGRAM_INLINE_REPLY",
+                              f"{method} retenido para la respuesta del webhook",
+                              telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
+                return
+            held = inline.release()
+            if held is not None:
+                await self.send_held(held, deadline)
+
+        timeout = telegram_timeout(deadline)
+        scheduler = telegram_scheduler()
+        with stage_timer(STAGE_TELEGRAM):
+            if scheduler is None:
+                try:
+                    response = await self.http.post(f"{TELEGRAM_API_URL}/{method}", json=payload,
+                                                    timeout=timeout)
+                except httpx.TimeoutException as e:
+                    raise requests.exceptions.Timeout(f"{method} sin respuesta en {timeout:.1f}s") from e
+                except httpx.HTTPError as e:
+                    raise requests.exceptions.ConnectionError(str(e)) from e
+                raise_for_status(response)
+                return
+
+            future = scheduler.submit(method, payload, chat_id, priority)
+            try:
+                # shield: si se acaba el tiempo la llamada sigue en cola y se envía después
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except asyncio.TimeoutError:
+                raise requests.exceptions.Timeout(f"{method} sigue en la cola de salida tras {timeout:.1f}s")
+            except OutboundExpired as e:
+                raise requests.exceptions.Timeout(str(e))
+
+    async def call(self, method: str, payload: dict, deadline: Optional[Deadline] = None,
+                   chat_id: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE) -> bool:
+        """
+        `post` que registra el resultado en lugar de lanzar
+
+        Returns:
+            True si la llamada se envió (o quedó retenida), False en caso contrario
+        """
+        try:
+            await self.post(method, payload, deadline, chat_id, priority)
+            log_operation(logger, "TELEGRAM_CALL_SENT",
+                          f"{method} enviado a chat_id={chat_id}",
+                          telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
+            return True
+        except DeadlineExceeded as e:
+            log_error(logger, ErrorCodes.ERR_DEADLINE_EXCEEDED,
+                      f"{method} no enviado: {str(e)}",
+                      telegram_id=chat_id)
+            return False
+        except requests.exceptions.RequestException as e:
+            log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
+                      f"Error al llamar a {method} en Telegram: {str(e)}",
+                      telegram_id=chat_id, exception=e)
+            return False
+        except Exception as e:
+            log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
+                      f"Error inesperado al llamar a {method}: {str(e)}",
+                      telegram_id=chat_id, exception=e)
+            return False
+
+    async def send_held(self, held: HeldCall, deadline: Optional[Deadline] = None) -> bool:
+        """Envía por HTTP una llamada que estaba retenida para la respuesta del webhook"""
+        return await self.call(held.method, held.payload, deadline, held.chat_id, held.priority)
+
+    async def flush_webhook_reply(self, deadline: Optional[Deadline] = None):
+        """Igual que `bot_services.flush_webhook_reply`"""
+        inline = current_webhook_reply()
+        held = inline.release() if inline is not None else None
+        if held is not None:
+            await self.send_held(held, deadline)
+
+    async def send_message(self, chat_id: int, text: str, reply_markup: Optional[dict] = None,
+                           deadline: Optional[Deadline] = None) -> bool:
+        """Igual que `bot_services.send_message`"""
+        log_operation(logger, "TELEGRAM_SEND_MESSAGE",
+                      f"Enviando mensaje a chat_id={chat_id}, length={len(text)}",
+                      telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
+        return await self.call("sendMessage", send_message_payload(chat_id, text, reply_markup),
+                               deadline, chat_id)
+
+    async def answer_callback_query(self, callback_query_id: str, text: str = "", show_alert: bool = False,
+                                    deadline: Optional[Deadline] = None,
+                                    chat_id: Optional[int] = None) -> bool:
+        """Igual que `bot_services.answer_callback_query`"""
+        log_operation(logger, "TELEGRAM_ANSWER_CALLBACK",
+                      f"Respondiendo callback_query_id={callback_query_id}, text={text[:50]}",
+                      error_code=ErrorCodes.OP_SUCCESS)
+        return await self.call("answerCallbackQuery",
+                               answer_callback_payload(callback_query_id, text, show_alert),
+                               deadline, chat_id, PRIORITY_CALLBACK)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str,
+                                reply_markup: Optional[dict] = None,
+                                deadline: Optional[Deadline] = None) -> bool:
+        """Igual que `bot_services.edit_message_text`"""
+        log_operation(logger, "TELEGRAM_EDIT_MESSAGE",
+                      f"Editando mensaje chat_id={chat_id}, message_id={message_id}",
+                      telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
+        return await self.call("editMessageText", edit_message_payload(chat_id, message_id, text, reply_markup),
+                               deadline, chat_id)
+
+
+class AsyncGeminiClient:
+    """
+    Cliente async de generateContent
+
+    Comparte con `ai_services` el circuit breaker, el router de modelos, el
+    batcher, la caché y el limitador de la aplicación.
+
+    Attributes:
+        http: Cliente httpx compartido
+    """
+
+    def __init__(self, http: httpx.AsyncClient):
+        self.http = http
+
+    async def post(self, payload: Dict, timeout: float, model: Optional[str] = None) -> httpx.Response:
+        """
+        Igual que `ai_services.post_gemini`: reintentos 429/5xx y circuit breaker
+
+        Raises:
+            GeminiUnavailable: Circuito abierto, error de conexión o 429/5xx tras los reintentos
+            requests.exceptions.Timeout: Si la llamada agotó `timeout`
+            requests.exceptions.HTTPError: Si Gemini responde otro 4xx
+        """
+        breaker = get_gemini_breaker(current_app._get_current_object())
+        if breaker is not None:
+            try:
+                breaker.before_call()
+            except CircuitOpen as e:
+                raise GeminiUnavailable(str(e), retry_after=e.retry_after) from e
+
+        url = gemini_request_url(model)
+        expires_at = time.monotonic() + timeout
+        attempt = 0
+        try:
+            while True:
+                attempt_timeout = expires_at - time.monotonic()
+                try:
+                    response = await self.http.post(url, json=payload,
+                                                    headers={"Content-Type": "application/json"},
+                                                    timeout=attempt_timeout)
+                except httpx.TimeoutException as e:
+                    if breaker is not None and attempt_timeout >= BREAKER_TIMEOUT_FLOOR:
+                        breaker.record_failure(f"timeout de {attempt_timeout:.1f}s")
+                        breaker = None
+                    raise requests.exceptions.Timeout(f"Gemini sin respuesta en {attempt_timeout:.1f}s") from e
+                except httpx.TransportError as e:
+                    if breaker is not None:
+                        breaker.record_failure(f"error de conexión: {e}")
+                        breaker = None
+                    raise GeminiUnavailable(f"Error de conexión con Gemini: {e}") from e
+
+                if not is_retryable_status(response.status_code):
+                    if breaker is not None:
+                        breaker.record_success()
+                        breaker = None
+                    # 4xx distinto de 429: error de la petición, no de disponibilidad
+                    raise_for_status(response)
+                    return response
+
+                delay = next_retry_delay(response.headers, attempt, expires_at)
+                if delay is None:
+                    if breaker is not None:
+                        breaker.record_failure(f"HTTP {response.status_code}")
+                        breaker = None
+                    raise GeminiUnavailable(f"Gemini respondió HTTP {response.status_code} tras {attempt + 1} intentos")
+
+                log_operation(logger, "GEMINI_RETRY",
+                              f"Gemini respondió HTTP {response.status_code}; reintento {attempt + 1} en {delay:.2f}s",
+                              error_code=ErrorCodes.OP_FAILED)
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            # Una llamada de prueba que terminó sin veredicto (p. ej. timeout corto) libera su turno
+            if breaker is not None:
+                breaker.release()
+
+    async def request_extraction(self, text: str, timeout: float, usage: Optional[ExtractionUsage] = None,
+                                 model: Optional[str] = None) -> Optional[List[Dict]]:
+        """Igual que `ai_services.request_extraction`"""
+        model = model or GEMINI_MODEL
+        log_extraction_call(text, model)
+
+        started = time.perf_counter()
+        response = await self.post(build_extraction_payload(text, model), timeout, model)
+        return extraction_call_result(response.json(), response.status_code, started, model, usage,
+                                      get_model_router(current_app._get_current_object()))
+
+    async def extract_expense_items(self, text: str, deadline: Optional[Deadline] = None,
+                                    today: Optional[date] = None, usage: Optional[ExtractionUsage] = None,
+                                    telegram_id: Optional[int] = None) -> Optional[List[Dict]]:
+        """
+        Igual que `ai_services.extract_expense_items`, compuesto con los mismos helpers
+
+        La caché y el limitador con store SQLite corren en un thread.
+
+        Raises:
+            RateLimited, DeadlineExceeded, GeminiUnavailable: Igual que la versión síncrona
+        """
+        app = current_app._get_current_object()
+        cache = get_extraction_cache(app)
+        cached = await run_blocking(cache is not None and cache.store is not None,
+                                    cached_extraction, cache, text, today, usage)
+        if cached is not None:
+            return cached
+
+        # Control de admisión solo para los mensajes que sí van a llamar a Gemini
+        limiter = get_rate_limiter(app) if telegram_id is not None else None
+        await run_blocking(limiter is not None and isinstance(limiter.store, SQLiteBucketStore),
+                           admit_extraction, limiter, telegram_id)
+
+        batcher = get_extraction_batcher(app)
+        router = get_model_router(app)
+        deadline = deadline or current_deadline()
+        timeout = extraction_timeout(deadline)
+        try:
+            decision = router.route(text, today) if router is not None else None
+            with stage_timer(STAGE_GEMINI):
+                # Con router, el batcher llama al modelo rápido
+                if batcher is not None and (decision is None or decision.model == router.fast_model):
+                    fast_model = router.fast_model if router is not None else None
+                    items = await batcher.extract_async(
+                        text, timeout,
+                        lambda one, remaining, one_usage: self.request_extraction(one, remaining, one_usage,
+                                                                                  fast_model),
+                        usage)
+                else:
+                    items = await self.request_extraction(text, timeout, usage,
+                                                          decision.model if decision is not None else None)
+
+                if items is None and decision is not None and router.should_escalate(decision):
+                    # La respuesta del modelo rápido no pasó la validación: se repite con el fuerte
+                    escalation = escalation_timeout(deadline, decision, router)
+                    if escalation is not None:
+                        items = await self.request_extraction(text, escalation, usage, router.strong_model)
+                        router.record_escalation(items is not None)
+
+            return await run_blocking(cache is not None and cache.store is not None,
+                                      store_extraction, cache, text, items, today)
+
+        except Exception as e:
+            return extraction_failure(e, deadline, timeout)
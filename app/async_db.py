@@ -0,0 +1,71 @@
+"""
+Sesión async de SQLAlchemy para la aplicación ASGI nativa
+
+Reutiliza los modelos de `app.models` (las tablas de Flask-SQLAlchemy) con un
+engine async: asyncpg para PostgreSQL y aiosqlite para SQLite.
+"""
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+# Drivers async por dialecto
+_ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "postgres": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+
+def async_database_url(database_url: str) -> str:
+    """
+    Convierte DATABASE_URL al driver async equivalente
+
+    `postgres://` y `postgresql://` pasan a `postgresql+asyncpg://`, y el
+    parámetro `sslmode` de libpq se traduce a `ssl`, que es el que entiende
+    asyncpg (Neon y Supabase entregan URLs con `?sslmode=require`).
+
+    Args:
+        database_url: URL de conexión síncrona
+
+    Returns:
+        URL con driver async
+    """
+    url = make_url(database_url)
+    dialect = url.get_backend_name()
+    if dialect not in _ASYNC_DRIVERS:
+        raise ValueError(f"Dialecto sin driver async configurado: {dialect}")
+
+    url = url.set(drivername=f"{'postgresql' if dialect == 'postgres' else dialect}+{_ASYNC_DRIVERS[dialect]}")
+    if "sslmode" in url.query:
+        query = dict(url.query)
+        query["ssl"] = query.pop("sslmode")
+        url = url.set(query=query)
+    return url.render_as_string(hide_password=False)
+
+
+def create_engine_and_sessionmaker(database_url: str, pool_size: int = 20,
+                                   max_overflow: int = 20):
+    """
+    Crea el engine async y la fábrica de sesiones
+
+    Args:
+        database_url: URL de conexión (síncrona, se convierte al driver async)
+        pool_size: Conexiones permanentes del pool
+        max_overflow: Conexiones extra permitidas en picos
+
+    Returns:
+        Tupla (AsyncEngine, async_sessionmaker)
+    """
+    url = async_database_url(database_url)
+    if url.startswith("sqlite"):
+        # SQLite admite un solo escritor: con varias conexiones los commits
+        # concurrentes caen en el busy handler (esperas con backoff); una sola
+        # conexión los encola en el pool
+        options = {"pool_size": 1, "max_overflow": 0}
+    else:
+        options = {"pool_size": pool_size, "max_overflow": max_overflow, "pool_pre_ping": True}
+
+    engine: AsyncEngine = create_async_engine(url, **options)
+    # expire_on_commit=False: los objetos siguen usables tras el commit sin
+    # recargas implícitas (que en async lanzarían MissingGreenlet)
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+    return engine, sessionmaker
@@ -0,0 +1,341 @@
+"""
+Handlers asyncio de los updates más frecuentes del webhook
+
+Cubren los mensajes de gasto y los botones de pagar deuda y de paginación:
+el usuario, los gastos y las deudas se leen y escriben con la sesión async
+(`app.async_db`) y Telegram y Gemini se llaman con los clientes de
+`app.async_clients`, así que esperar la DB o la API no ocupa un thread.
+
+Las respuestas, la validación, el parseo, las sentencias SQL y el formato son
+los helpers de `app.routes` y `app.bot_services`; aquí solo cambia cómo se
+espera la I/O. El resto de updates (/start, /admin, consultas, updates sin
+texto) sigue en el flujo síncrono (`routes.process_inline_update`).
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from flask import current_app, jsonify
+
+from app.ai_services import GeminiUnavailable
+from app.async_clients import AsyncGeminiClient, AsyncTelegramClient
+from app.bot_services import (
+    authorization, debts_page_size, expense_bulk_insert, expense_rows, expenses_by_id_statement,
+    format_debts_page, format_expenses_confirmation, format_payment_receipt, format_remaining_debts,
+    log_expense_paid, log_expenses_saved, order_expenses, user_by_telegram_id_statement
+)
+from app.date_resolver import user_today
+from app.deadline import Deadline, DeadlineExceeded, update_deadline
+from app.debt_pages import (CALLBACK_PREFIX as DEBTS_PAGE_PREFIX, DebtPage, PageCursor, ROLE_PAY,
+                            build_page, page_statements, summary_statement)
+from app.gemini_usage import ExtractionUsage, record_usage
+from app.intent_router import intent_router
+from app.metrics import stage_timer, STAGE_AUTH, STAGE_DB_COMMIT, STAGE_UPDATE
+from app.rate_limiter import RateLimited
+from app.reminders import schedule_reminders
+from app.routes import (
+    CALLBACK_ERROR_REPLY, DEADLINE_REPLY, PARTIES_ERROR_REPLY, PAY_DEBT_PREFIX, REJECTED_REPLY,
+    assign_parties, callback_auth_reply, callback_fields, callback_response, complete_parties,
+    counterpart_statement, debt_paid_answer, debt_payment_error, deadline_response, deferred_response,
+    enqueue_pending, expense_row, expenses_created_response, get_message_text_from_update,
+    get_sender_id, held_reply_response, local_extraction, local_fallback, log_deadline_exceeded,
+    log_expense_creation, log_expenses_created, needs_user_list, other_users_statement,
+    parse_debt_id, parse_page, parties_error_response, pending_reply, rate_limited_reply,
+    rate_limited_response, rejected_message, rejected_response, response_status, unauthorized_reply,
+    unparsed_reply, update_error_response
+)
+from app.webhook_reply import webhook_reply
+from app.logger_config import log_response
+
+logger = logging.getLogger(__name__)
+
+
+def is_hot_update(update: dict) -> bool:
+    """
+    Indica si el update lo atiende un handler asyncio
+
+    Args:
+        update: Diccionario con el update de Telegram
+
+    Returns:
+        True para mensajes de gasto y botones de pagar deuda o de página
+    """
+    if 'callback_query' in update:
+        callback_query = update['callback_query']
+        callback_data = callback_query.get('data') or ''
+        return bool(callback_query.get('from', {}).get('id')) and (
+            callback_data.startswith(PAY_DEBT_PREFIX) or callback_data.startswith(DEBTS_PAGE_PREFIX))
+
+    text = get_message_text_from_update(update)
+    if not text or not get_sender_id(update):
+        return False
+    return not text.startswith(('/start', '/admin')) and intent_router.resolve(text.lower().strip()) is None
+
+
+class AsyncUpdateHandler:
+    """
+    Procesa los updates frecuentes en el event loop
+
+    Attributes:
+        telegram: Cliente async de la Bot API
+        gemini: Cliente async de Gemini
+        sessionmaker: Fábrica de sesiones async de la DB
+    """
+
+    def __init__(self, http, sessionmaker):
+        self.telegram = AsyncTelegramClient(http)
+        self.gemini = AsyncGeminiClient(http)
+        self.sessionmaker = sessionmaker
+
+    async def process(self, update: dict, deadline: Optional[Deadline] = None):
+        """
+        Equivalente async de `routes.process_inline_update` + `process_update`
+
+        Requiere un contexto de aplicación (task-local).
+
+        Args:
+            update: Diccionario con el update de Telegram ya deduplicado
+            deadline: Deadline creado al recibir el update
+
+        Returns:
+            Respuesta Flask (json, status_code)
+        """
+        flask_app = current_app._get_current_object()
+        schedule_reminders(flask_app)
+        with update_deadline(flask_app.config.get('UPDATE_DEADLINE_SECONDS', 0),
+                             flask_app.config.get('UPDATE_DEADLINE_REPLY_RESERVE', 0),
+                             deadline=deadline, telegram_id=get_sender_id(update)):
+            with webhook_reply(flask_app.config.get('WEBHOOK_INLINE_REPLY', False)) as inline:
+                with stage_timer(STAGE_UPDATE):
+                    try:
+                        response = await self._process_update(update)
+                    except DeadlineExceeded as e:
+                        response = await self._reply_deadline_exceeded(update, e)
+                    except GeminiUnavailable as e:
+                        response = await self._defer_update(update, e)
+
+                held = inline.release() if inline is not None else None
+                if held is None:
+                    return response
+                if response_status(response) != 200:
+                    await self.telegram.send_held(held)
+                    return response
+                return held_reply_response(held)
+
+    async def _reply_deadline_exceeded(self, update: dict, error: DeadlineExceeded):
+        """Igual que `routes.reply_deadline_exceeded`"""
+        telegram_id = log_deadline_exceeded(update, error)
+        if 'callback_query' in update:
+            callback_query_id, _, _, _, chat_id = callback_fields(update)
+            await self.telegram.answer_callback_query(callback_query_id, DEADLINE_REPLY, show_alert=True,
+                                                      chat_id=chat_id)
+        elif telegram_id:
+            await self.telegram.send_message(telegram_id, DEADLINE_REPLY)
+        return deadline_response(telegram_id)
+
+    async def _defer_update(self, update: dict, error: GeminiUnavailable):
+        """Igual que `routes.defer_update` (la cola de pendientes es SQLite: va en un thread)"""
+        telegram_id = get_sender_id(update)
+        pending_id = await asyncio.to_thread(enqueue_pending, update, error)
+        if telegram_id:
+            await self.telegram.send_message(telegram_id, pending_reply(pending_id))
+        return deferred_response(telegram_id, pending_id)
+
+    async def _process_update(self, update: dict):
+        """Despacha el update a su handler"""
+        async with self.sessionmaker() as session:
+            if 'callback_query' in update:
+                return await self._handle_callback_query(session, update)
+            return await self._handle_expense_message(session, update)
+
+    @staticmethod
+    async def _release(session):
+        """
+        Termina la transacción en curso y devuelve la conexión al pool
+
+        Se llama antes de esperar a Telegram o Gemini: con SQLite el pool tiene
+        una sola conexión, y una sesión que la retuviera durante la llamada
+        serializaría todos los updates. Con expire_on_commit=False los objetos
+        cargados siguen usables.
+        """
+        await session.commit()
+
+    async def _authorize(self, session, telegram_id: int):
+        """Igual que `bot_services.is_user_authorized`, con la sesión async"""
+        with stage_timer(STAGE_AUTH):
+            user = (await session.scalars(user_by_telegram_id_statement(telegram_id))).first()
+            await self._release(session)
+        return authorization(user)
+
+    async def _handle_expense_message(self, session, update: dict):
+        """Flujo de gasto de `routes._process_update` (mensaje de texto sin comando ni consulta)"""
+        telegram_id = get_sender_id(update)
+        message_text = get_message_text_from_update(update)
+        user = None
+        try:
+            authorized, user = await self._authorize(session, telegram_id)
+            if not authorized:
+                await self.telegram.send_message(telegram_id, unauthorized_reply(user))
+                return jsonify({'status': 'ok'}), 200
+
+            if rejected_message(telegram_id, user, message_text):
+                await self.telegram.send_message(telegram_id, REJECTED_REPLY)
+                return rejected_response(telegram_id, user)
+
+            today = user_today(user)
+            usage = ExtractionUsage()
+            expense_items = local_extraction(telegram_id, user, message_text, today, usage)
+            if expense_items is None:
+                try:
+                    expense_items = await self.gemini.extract_expense_items(message_text, today=today, usage=usage,
+                                                                            telegram_id=telegram_id)
+                except RateLimited as e:
+                    reply = rate_limited_reply(telegram_id, e)
+                    if reply is not None:
+                        await self.telegram.send_message(telegram_id, reply)
+                    return rate_limited_response(telegram_id, user, e)
+                except GeminiUnavailable as e:
+                    expense_items = local_fallback(telegram_id, user, message_text, today, usage, e)
+                    if expense_items is None:
+                        raise
+            record_usage(current_app._get_current_object(), user.id, message_text, usage, expense_items)
+
+            if not expense_items:
+                await self.telegram.send_message(telegram_id, unparsed_reply(telegram_id, user))
+                log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id)
+                return jsonify({'status': 'ok'}), 200
+
+            rows = []
+            for expense_data in expense_items:
+                parties = await self._resolve_parties(session, telegram_id, user, expense_data)
+                if parties is None:
+                    return jsonify({'status': 'ok'}), 200
+                if not complete_parties(telegram_id, user, *parties):
+                    await self.telegram.send_message(telegram_id, PARTIES_ERROR_REPLY)
+                    return parties_error_response()
+                rows.append(expense_row(expense_data, *parties))
+
+            log_expense_creation(telegram_id, user, rows)
+            expenses = await self._create_expenses(session, rows, message_text)
+            log_expenses_created(telegram_id, user, expenses)
+
+            await self.telegram.send_message(telegram_id, format_expenses_confirmation(expenses))
+            return expenses_created_response(telegram_id, user)
+
+        except (DeadlineExceeded, GeminiUnavailable):
+            raise
+        except Exception as e:
+            return update_error_response(e, telegram_id, user)
+
+    async def _resolve_parties(self, session, telegram_id: int, user, expense_data: dict):
+        """Igual que `routes.resolve_parties`, con la sesión async"""
+        statement = counterpart_statement(user, expense_data)
+        counterpart = (await session.scalars(statement)).first() if statement is not None else None
+        others = []
+        if needs_user_list(expense_data, counterpart):
+            others = (await session.scalars(other_users_statement(user))).all()
+        await self._release(session)
+
+        parties, reply = assign_parties(telegram_id, user, expense_data, counterpart, others)
+        if reply is not None:
+            await self.telegram.send_message(telegram_id, reply)
+        return parties
+
+    @staticmethod
+    async def _create_expenses(session, items: list, raw_text: str):
+        """Igual que `bot_services.create_expenses`, con la sesión async"""
+        rows = expense_rows(items, raw_text)
+        expense_ids = sorted(expense.id for expense in await session.scalars(expense_bulk_insert(), rows))
+        with stage_timer(STAGE_DB_COMMIT):
+            await session.commit()
+
+        expenses = order_expenses(await session.scalars(expenses_by_id_statement(expense_ids)), expense_ids)
+        await AsyncUpdateHandler._release(session)
+        log_expenses_saved(expense_ids)
+        return expenses
+
+    @staticmethod
+    async def _debts_page(session, user_id: int, role: str, cursor: Optional[PageCursor] = None,
+                          backward: bool = False, number: int = 1) -> DebtPage:
+        """Igual que `bot_services.get_debts_page`, con la sesión async"""
+        page_size = debts_page_size()
+        rows = []
+        for statement in page_statements(role, user_id, cursor, backward, page_size + 1):
+            rows.extend((await session.execute(statement)).scalars())
+            if len(rows) > page_size:
+                break
+
+        if not rows and cursor is not None:
+            return await AsyncUpdateHandler._debts_page(session, user_id, role)
+
+        summary_rows = (await session.execute(summary_statement(role, user_id))).all()
+        await AsyncUpdateHandler._release(session)
+        return build_page(role, rows, summary_rows, cursor, backward, number, page_size)
+
+    async def _handle_callback_query(self, session, update: dict):
+        """Botones de pagar deuda y de página de `routes.handle_callback_query`"""
+        callback_query_id, callback_data, telegram_id, message_id, chat_id = callback_fields(update)
+        try:
+            authorized, user = await self._authorize(session, telegram_id)
+            reply = callback_auth_reply(authorized, user)
+            if reply is not None:
+                await self.telegram.answer_callback_query(callback_query_id, reply, show_alert=True,
+                                                          chat_id=chat_id)
+                return jsonify({'status': 'ok'}), 200
+
+            if callback_data.startswith(PAY_DEBT_PREFIX):
+                debt_id = parse_debt_id(telegram_id, user, callback_data)
+                if debt_id is None:
+                    await self.telegram.answer_callback_query(callback_query_id, "❌ ID de deuda inválido.",
+                                                              show_alert=True, chat_id=chat_id)
+                    return jsonify({'status': 'ok'}), 200
+
+                expense = (await session.scalars(expenses_by_id_statement([debt_id]))).first()
+                reply = debt_payment_error(telegram_id, user, debt_id, expense)
+                if reply is not None:
+                    await self._release(session)
+                    await self.telegram.answer_callback_query(callback_query_id, reply, show_alert=True,
+                                                              chat_id=chat_id)
+                    return jsonify({'status': 'ok'}), 200
+
+                expense.is_settled = True
+                with stage_timer(STAGE_DB_COMMIT):
+                    await session.commit()
+                log_expense_paid(debt_id, expense)
+
+                # La respuesta al callback y el comprobante salen mientras se
+                # consultan las deudas restantes; la respuesta no puede esperar
+                # a la del webhook
+                await self.telegram.flush_webhook_reply()
+                answered = asyncio.create_task(self.telegram.answer_callback_query(
+                    callback_query_id, debt_paid_answer(telegram_id, user, expense), chat_id=chat_id))
+                receipt_sent = asyncio.create_task(self.telegram.send_message(
+                    chat_id, format_payment_receipt(expense)))
+                try:
+                    remaining_message, reply_markup = format_remaining_debts(
+                        await self._debts_page(session, user.id, ROLE_PAY))
+                    await self.telegram.edit_message_text(chat_id, message_id, remaining_message,
+                                                          reply_markup or None)
+                finally:
+                    await asyncio.gather(answered, receipt_sent)
+            else:
+                page_request = parse_page(telegram_id, user, callback_data)
+                if page_request is None:
+                    await self.telegram.answer_callback_query(callback_query_id, "❌ Página inválida.",
+                                                              show_alert=True, chat_id=chat_id)
+                    return jsonify({'status': 'ok'}), 200
+
+                page_message, reply_markup = format_debts_page(
+                    await self._debts_page(session, user.id, *page_request))
+                await self.telegram.flush_webhook_reply()
+                await asyncio.gather(
+                    self.telegram.answer_callback_query(callback_query_id, chat_id=chat_id),
+                    self.telegram.edit_message_text(chat_id, message_id, page_message, reply_markup or None),
+                )
+            return callback_response(telegram_id, user)
+
+        except Exception as e:
+            logger.error(f"Error en handle_callback_query: {e}", exc_info=True)
+            await self.telegram.answer_callback_query(callback_query_id, CALLBACK_ERROR_REPLY, show_alert=True,
+                                                      chat_id=chat_id)
+            return jsonify({'status': 'error', 'message': str(e)}), 500
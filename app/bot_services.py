@@ -2,17 +2,50 @@
 Servicios del bot de Telegram
 """
 import logging
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import requests
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from flask import current_app, g, has_app_context
+from sqlalchemy import insert, select
+from sqlalchemy.orm import selectinload
 from app.config import Config
 from app import db
 from app.models import User, Expense
 from app.logger_config import log_operation, log_error, ErrorCodes
+from app.metrics import stage_timer, timed_stage, STAGE_AUTH, STAGE_DB_COMMIT, STAGE_TELEGRAM
+from app.deadline import Deadline, DeadlineExceeded, current_deadline
+from app.http_clients import http_session, CLIENT_TELEGRAM
+from app.webhook_reply import HeldCall, current_outbox, current_webhook_reply
+from app.debt_pages import (DebtPage, PageCursor, ROLE_PAY, build_page, page_statements,
+                            summary_statement)
+from app.telegram_scheduler import (get_telegram_scheduler, OutboundExpired, TelegramScheduler,
+                                    PRIORITY_CALLBACK, PRIORITY_INTERACTIVE, PRIORITY_BULK)
 import re
 
 logger = logging.getLogger(__name__)
 
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{Config.TELEGRAM_BOT_TOKEN}"
+TELEGRAM_API_URL = f"{Config.TELEGRAM_API_BASE_URL}/bot{Config.TELEGRAM_BOT_TOKEN}"
+
+# Timeout máximo de una llamada a la API de Telegram (segundos)
+TELEGRAM_TIMEOUT = 10
+
+# Caracteres de la descripción de cada deuda en las listas paginadas
+DEBT_DESCRIPTION_PREVIEW = 100
+
+
+@timed_stage(STAGE_DB_COMMIT)
+def commit_session():
+    """
+    Confirma la sesión de base de datos
+
+    Dentro de un lote de long polling (`g.defer_commit`) solo hace flush: los
+    cambios quedan visibles para el resto del lote y el commit se hace una sola
+    vez al final del lote.
+    """
+    if g.get('defer_commit'):
+        db.session.flush()
+    else:
+        db.session.commit()
 
 
 def validate_message_content(text: str) -> bool:
@@ -44,8 +77,187 @@ def validate_message_content(text: str) -> bool:
     return bool(re.match(pattern, text))
 
 
+def telegram_timeout(deadline: Optional[Deadline] = None) -> float:
+    """
+    Timeout de una llamada a Telegram según el presupuesto del update
 
-def send_message(chat_id: int, text: str, reply_markup: Optional[dict] = None) -> bool:
+    Args:
+        deadline: Deadline del update (por defecto el activo en `flask.g`)
+
+    Returns:
+        Segundos de timeout (TELEGRAM_TIMEOUT sin deadline)
+
+    Raises:
+        DeadlineExceeded: Si ya no queda presupuesto para la llamada
+    """
+    deadline = deadline or current_deadline()
+    if deadline is None:
+        return TELEGRAM_TIMEOUT
+    return deadline.timeout(STAGE_TELEGRAM, TELEGRAM_TIMEOUT)
+
+
+def telegram_scheduler() -> Optional[TelegramScheduler]:
+    """
+    Cola de salida de la aplicación activa, con sus workers arrancados
+
+    Returns:
+        TelegramScheduler, o None sin contexto de aplicación o con
+        TELEGRAM_SCHEDULER_ENABLED desactivado
+    """
+    if not has_app_context():
+        return None
+    app = current_app._get_current_object()
+    scheduler = get_telegram_scheduler(app)
+    if scheduler is not None:
+        session = http_session(CLIENT_TELEGRAM)
+        scheduler.start(
+            lambda method, payload: session.post(f"{TELEGRAM_API_URL}/{method}", json=payload,
+                                                 timeout=TELEGRAM_TIMEOUT),
+            workers=app.config.get("TELEGRAM_SCHEDULER_WORKERS", 8),
+        )
+    return scheduler
+
+
+def post_telegram(method: str, payload: dict, deadline: Optional[Deadline] = None,
+                  chat_id: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE,
+                  wait: bool = True):
+    """
+    Llama a un método de la Bot API, por la cola de salida si está activa
+
+    Con la cola, la llamada espera su turno (buckets, prioridad, pausas por
+    429) hasta el timeout del update; si no salió en ese tiempo sigue en cola
+    y se envía después. Con WEBHOOK_INLINE_REPLY, la primera llamada del
+    update queda retenida para la respuesta del webhook; si llega otra, la
+    retenida sale antes por HTTP. Dentro de un lote de long polling con
+    commit por lote (`HeldOutbox`) toda llamada queda retenida hasta el commit.
+
+    Args:
+        method: Método de la Bot API (sendMessage, editMessageText, ...)
+        payload: Cuerpo JSON
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+        chat_id: Opcional, chat destino (buckets y orden por chat de la cola)
+        priority: Opcional, prioridad en la cola (PRIORITY_*)
+        wait: Si False, con la cola activa solo encola y no espera el envío
+
+    Raises:
+        DeadlineExceeded: Si ya no queda presupuesto para la llamada
+        requests.exceptions.RequestException: Si Telegram respondió con error, no
+            respondió, o la llamada sigue en cola (Timeout) o se descartó por vieja
+    """
+    outbox = current_outbox()
+    if outbox is not None and outbox.hold(method, payload, chat_id, priority):
+        return
+
+    inline = current_webhook_reply()
+    if inline is not None and wait:
+        if inline.hold(method, payload, chat_id, priority):
+            log_operation(logger, "TELEGRAM_INLINE_REPLY",
+                          f"{method} retenido para la respuesta del webhook",
+                          telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
+            return
+        held = inline.release()
+        if held is not None:
+            send_held(held, deadline)
+
+    timeout = telegram_timeout(deadline)
+    scheduler = telegram_scheduler()
+    with stage_timer(STAGE_TELEGRAM):
+        if scheduler is None:
+            response = http_session(CLIENT_TELEGRAM).post(f"{TELEGRAM_API_URL}/{method}",
+                                                          json=payload, timeout=timeout)
+            response.raise_for_status()
+            return
+
+        future = scheduler.submit(method, payload, chat_id, priority)
+        if not wait:
+            return
+        try:
+            future.result(timeout)
+        except FutureTimeoutError:
+            raise requests.exceptions.Timeout(f"{method} sigue en la cola de salida tras {timeout:.1f}s")
+        except OutboundExpired as e:
+            raise requests.exceptions.Timeout(str(e))
+
+
+def send_held(held: HeldCall, deadline: Optional[Deadline] = None) -> bool:
+    """
+    Envía por HTTP una llamada que estaba retenida para la respuesta del webhook
+
+    Args:
+        held: Llamada retenida
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+
+    Returns:
+        True si se envió correctamente, False en caso contrario
+    """
+    try:
+        post_telegram(held.method, held.payload, deadline, chat_id=held.chat_id, priority=held.priority)
+        return True
+    except DeadlineExceeded as e:
+        log_error(logger, ErrorCodes.ERR_DEADLINE_EXCEEDED,
+                 f"{held.method} retenido no enviado: {str(e)}",
+                 telegram_id=held.chat_id)
+        return False
+    except requests.exceptions.RequestException as e:
+        log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
+                 f"Error al enviar {held.method} retenido: {str(e)}",
+                 telegram_id=held.chat_id, exception=e)
+        return False
+
+
+def flush_webhook_reply(deadline: Optional[Deadline] = None):
+    """
+    Deja de retener llamadas para la respuesta del webhook
+
+    Las llamadas que se lanzan en paralelo (`fanout`) salen por HTTP de
+    inmediato; la retenida, si la hay, se envía antes para conservar el orden.
+
+    Args:
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+    """
+    inline = current_webhook_reply()
+    held = inline.release() if inline is not None else None
+    if held is not None:
+        send_held(held, deadline)
+
+
+def send_message_payload(chat_id: int, text: str, reply_markup: Optional[dict] = None) -> dict:
+    """Cuerpo de sendMessage (compartido con el cliente async de Telegram)"""
+    payload = {
+        'chat_id': chat_id,
+        'text': text,
+        'parse_mode': 'HTML'
+    }
+    if reply_markup:
+        payload['reply_markup'] = reply_markup
+    return payload
+
+
+def answer_callback_payload(callback_query_id: str, text: str = "", show_alert: bool = False) -> dict:
+    """Cuerpo de answerCallbackQuery (compartido con el cliente async de Telegram)"""
+    return {
+        'callback_query_id': callback_query_id,
+        'text': text,
+        'show_alert': show_alert
+    }
+
+
+def edit_message_payload(chat_id: int, message_id: int, text: str,
+                         reply_markup: Optional[dict] = None) -> dict:
+    """Cuerpo de editMessageText (compartido con el cliente async de Telegram)"""
+    payload = {
+        'chat_id': chat_id,
+        'message_id': message_id,
+        'text': text,
+        'parse_mode': 'HTML'
+    }
+    if reply_markup:
+        payload['reply_markup'] = reply_markup
+    return payload
+
+
+def send_message(chat_id: int, text: str, reply_markup: Optional[dict] = None,
+                 deadline: Optional[Deadline] = None, bulk: bool = False) -> bool:
     """
     Envía un mensaje a través de la API de Telegram
     
@@ -53,31 +265,32 @@ def send_message(chat_id: int, text: str, reply_markup: Optional[dict] = None) -
         chat_id: ID del chat de Telegram
         text: Texto del mensaje a enviar
         reply_markup: Opcional, diccionario con botones inline (keyboard)
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+        bulk: Opcional, envío masivo (recordatorios): con la cola de salida
+            activa sale después de los mensajes de los updates y no se espera
         
     Returns:
-        True si el mensaje se envió correctamente, False en caso contrario
+        True si el mensaje se envió (o se encoló, con `bulk`), False en caso contrario
     """
     try:
-        url = f"{TELEGRAM_API_URL}/sendMessage"
-        payload = {
-            'chat_id': chat_id,
-            'text': text,
-            'parse_mode': 'HTML'
-        }
-        if reply_markup:
-            payload['reply_markup'] = reply_markup
+        payload = send_message_payload(chat_id, text, reply_markup)
         
         log_operation(logger, "TELEGRAM_SEND_MESSAGE", 
                      f"Enviando mensaje a chat_id={chat_id}, length={len(text)}",
                      telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
         
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
+        post_telegram("sendMessage", payload, deadline, chat_id=chat_id,
+                      priority=PRIORITY_BULK if bulk else PRIORITY_INTERACTIVE, wait=not bulk)
         
         log_operation(logger, "TELEGRAM_MESSAGE_SENT",
                      f"Mensaje enviado exitosamente a chat_id={chat_id}",
                      telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
         return True
+    except DeadlineExceeded as e:
+        log_error(logger, ErrorCodes.ERR_DEADLINE_EXCEEDED,
+                 f"Mensaje no enviado: {str(e)}",
+                 telegram_id=chat_id)
+        return False
     except requests.exceptions.RequestException as e:
         log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
                  f"Error al enviar mensaje a Telegram: {str(e)}",
@@ -90,7 +303,8 @@ def send_message(chat_id: int, text: str, reply_markup: Optional[dict] = None) -
         return False
 
 
-def answer_callback_query(callback_query_id: str, text: str = "", show_alert: bool = False) -> bool:
+def answer_callback_query(callback_query_id: str, text: str = "", show_alert: bool = False,
+                          deadline: Optional[Deadline] = None, chat_id: Optional[int] = None) -> bool:
     """
     Responde a un callback query de Telegram
     
@@ -98,29 +312,29 @@ def answer_callback_query(callback_query_id: str, text: str = "", show_alert: bo
         callback_query_id: ID del callback query
         text: Texto de respuesta (opcional)
         show_alert: Si True, muestra una alerta en lugar de notificación
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+        chat_id: Opcional, chat del mensaje del botón (clave en la cola de salida)
         
     Returns:
         True si se respondió correctamente, False en caso contrario
     """
     try:
-        url = f"{TELEGRAM_API_URL}/answerCallbackQuery"
-        payload = {
-            'callback_query_id': callback_query_id,
-            'text': text,
-            'show_alert': show_alert
-        }
+        payload = answer_callback_payload(callback_query_id, text, show_alert)
         
         log_operation(logger, "TELEGRAM_ANSWER_CALLBACK",
                      f"Respondiendo callback_query_id={callback_query_id}, text={text[:50]}",
                      error_code=ErrorCodes.OP_SUCCESS)
         
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
+        post_telegram("answerCallbackQuery", payload, deadline, chat_id=chat_id, priority=PRIORITY_CALLBACK)
         
         log_operation(logger, "TELEGRAM_CALLBACK_ANSWERED",
                      f"Callback query respondido exitosamente: {callback_query_id}",
                      error_code=ErrorCodes.OP_SUCCESS)
         return True
+    except DeadlineExceeded as e:
+        log_error(logger, ErrorCodes.ERR_DEADLINE_EXCEEDED,
+                 f"Callback query no respondido: {str(e)}")
+        return False
     except requests.exceptions.RequestException as e:
         log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
                  f"Error al responder callback query: {str(e)}",
@@ -133,7 +347,8 @@ def answer_callback_query(callback_query_id: str, text: str = "", show_alert: bo
         return False
 
 
-def edit_message_text(chat_id: int, message_id: int, text: str, reply_markup: Optional[dict] = None) -> bool:
+def edit_message_text(chat_id: int, message_id: int, text: str, reply_markup: Optional[dict] = None,
+                      deadline: Optional[Deadline] = None) -> bool:
     """
     Edita un mensaje existente en Telegram
     
@@ -142,32 +357,29 @@ def edit_message_text(chat_id: int, message_id: int, text: str, reply_markup: Op
         message_id: ID del mensaje a editar
         text: Nuevo texto del mensaje
         reply_markup: Opcional, diccionario con botones inline
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
         
     Returns:
         True si se editó correctamente, False en caso contrario
     """
     try:
-        url = f"{TELEGRAM_API_URL}/editMessageText"
-        payload = {
-            'chat_id': chat_id,
-            'message_id': message_id,
-            'text': text,
-            'parse_mode': 'HTML'
-        }
-        if reply_markup:
-            payload['reply_markup'] = reply_markup
+        payload = edit_message_payload(chat_id, message_id, text, reply_markup)
         
         log_operation(logger, "TELEGRAM_EDIT_MESSAGE",
                      f"Editando mensaje chat_id={chat_id}, message_id={message_id}",
                      telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
         
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
+        post_telegram("editMessageText", payload, deadline, chat_id=chat_id)
         
         log_operation(logger, "TELEGRAM_MESSAGE_EDITED",
                      f"Mensaje editado exitosamente: chat_id={chat_id}, message_id={message_id}",
                      telegram_id=chat_id, error_code=ErrorCodes.OP_SUCCESS)
         return True
+    except DeadlineExceeded as e:
+        log_error(logger, ErrorCodes.ERR_DEADLINE_EXCEEDED,
+                 f"Mensaje no editado: {str(e)}",
+                 telegram_id=chat_id)
+        return False
     except requests.exceptions.RequestException as e:
         log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
                  f"Error al editar mensaje: {str(e)}",
@@ -190,21 +402,24 @@ def get_user_by_telegram_id(telegram_id: int) -> Optional[User]:
     Returns:
         Objeto User si existe, None en caso contrario
     """
-    return User.query.filter_by(telegram_id=telegram_id).first()
+    return db.session.scalars(user_by_telegram_id_statement(telegram_id)).first()
 
 
-def is_user_authorized(telegram_id: int) -> Tuple[bool, Optional[User]]:
+def user_by_telegram_id_statement(telegram_id: int):
+    """SELECT del usuario por telegram_id (compartido con la ruta async de la DB)"""
+    return select(User).filter_by(telegram_id=telegram_id).limit(1)
+
+
+def authorization(user: Optional[User]) -> Tuple[bool, Optional[User]]:
     """
-    Verifica si un usuario está autorizado para usar el bot
-    
+    Tupla (is_authorized, user_object) de un usuario ya consultado
+
     Args:
-        telegram_id: ID de Telegram del usuario
-        
+        user: Usuario o None si no está registrado
+
     Returns:
         Tupla (is_authorized, user_object)
     """
-    user = get_user_by_telegram_id(telegram_id)
-    
     if not user:
         return False, None
     
@@ -214,6 +429,20 @@ def is_user_authorized(telegram_id: int) -> Tuple[bool, Optional[User]]:
     return True, user
 
 
+@timed_stage(STAGE_AUTH)
+def is_user_authorized(telegram_id: int) -> Tuple[bool, Optional[User]]:
+    """
+    Verifica si un usuario está autorizado para usar el bot
+    
+    Args:
+        telegram_id: ID de Telegram del usuario
+        
+    Returns:
+        Tupla (is_authorized, user_object)
+    """
+    return authorization(get_user_by_telegram_id(telegram_id))
+
+
 def create_user(telegram_id: int, name: str, is_authorized: bool = True) -> User:
     """
     Crea un nuevo usuario en la base de datos
@@ -236,7 +465,7 @@ def create_user(telegram_id: int, name: str, is_authorized: bool = True) -> User
         is_authorized=is_authorized
     )
     db.session.add(user)
-    db.session.commit()
+    commit_session()
     
     log_operation(logger, "USER_CREATED",
                  f"Usuario creado exitosamente: user_id={user.id}, name={user.name}",
@@ -244,6 +473,33 @@ def create_user(telegram_id: int, name: str, is_authorized: bool = True) -> User
     return user
 
 
+def parse_due_date(due_date: Optional[str]):
+    """
+    Convierte la fecha de vencimiento extraída (YYYY-MM-DD) a date
+    
+    Args:
+        due_date: Fecha en formato YYYY-MM-DD o None
+        
+    Returns:
+        Objeto date o None si no hay fecha o el formato es inválido
+    """
+    from datetime import datetime
+    
+    if not due_date:
+        return None
+    try:
+        due_date_obj = datetime.strptime(due_date, '%Y-%m-%d').date()
+        log_operation(logger, "DATE_PARSED",
+                     f"Fecha parseada correctamente: {due_date} -> {due_date_obj}",
+                     error_code=ErrorCodes.OP_SUCCESS)
+        return due_date_obj
+    except ValueError:
+        log_error(logger, ErrorCodes.ERR_INVALID_DATA,
+                 f"Formato de fecha inválido: {due_date}",
+                 exception=None)
+        return None
+
+
 def create_expense(
     payer_id: int,
     debtor_id: int,
@@ -252,7 +508,8 @@ def create_expense(
     description: str,
     raw_text: Optional[str] = None,
     category: Optional[str] = None,
-    due_date: Optional[str] = None
+    due_date: Optional[str] = None,
+    deadline: Optional[Deadline] = None
 ) -> Expense:
     """
     Crea un nuevo gasto en la base de datos
@@ -266,30 +523,23 @@ def create_expense(
         raw_text: Texto original del mensaje
         category: Categoría del gasto
         due_date: Fecha de vencimiento en formato YYYY-MM-DD o None
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
         
     Returns:
         Objeto Expense creado
+
+    Raises:
+        DeadlineExceeded: Si no queda presupuesto para guardar el gasto y aun
+            confirmarlo al usuario (no se escribe nada)
     """
-    from datetime import datetime
-    
+    deadline = deadline or current_deadline()
+    if deadline is not None:
+        deadline.check(STAGE_DB_COMMIT, reserve=deadline.reply_reserve)
+
     log_operation(logger, "EXPENSE_CREATION_DB",
                  f"Creando gasto en DB: payer_id={payer_id}, debtor_id={debtor_id}, amount={amount}, currency={currency}, due_date={due_date}",
                  error_code=ErrorCodes.OP_SUCCESS)
     
-    # Convertir due_date de string a date si se proporciona
-    due_date_obj = None
-    if due_date:
-        try:
-            due_date_obj = datetime.strptime(due_date, '%Y-%m-%d').date()
-            log_operation(logger, "DATE_PARSED",
-                         f"Fecha parseada correctamente: {due_date} -> {due_date_obj}",
-                         error_code=ErrorCodes.OP_SUCCESS)
-        except ValueError:
-            log_error(logger, ErrorCodes.ERR_INVALID_DATA,
-                     f"Formato de fecha inválido: {due_date}",
-                     exception=None)
-            due_date_obj = None
-    
     expense = Expense(
         payer_id=payer_id,
         debtor_id=debtor_id,
@@ -298,10 +548,10 @@ def create_expense(
         description=description,
         raw_text=raw_text,
         category=category,
-        due_date=due_date_obj
+        due_date=parse_due_date(due_date)
     )
     db.session.add(expense)
-    db.session.commit()
+    commit_session()
     
     log_operation(logger, "EXPENSE_CREATED_DB",
                  f"Gasto creado en DB exitosamente: expense_id={expense.id}, amount={expense.amount} {expense.currency}",
@@ -309,6 +559,123 @@ def create_expense(
     return expense
 
 
+def expense_bulk_insert():
+    """
+    INSERT en bloque de gastos que devuelve los Expense creados
+
+    `render_nulls` manda los None como NULL: así todas las filas tienen las
+    mismas columnas y SQLAlchemy las envía en una sola sentencia (con
+    columnas distintas, por ejemplo un gasto con fecha y otro sin ella, las
+    separaría en un INSERT por grupo). No se pide `sort_by_parameter_order`:
+    en SQLite obliga a un INSERT por fila; los ids autoincrementales ya
+    siguen el orden de las filas.
+
+    Returns:
+        Sentencia para `session.scalars(stmt, filas)`
+    """
+    return insert(Expense).returning(Expense).execution_options(render_nulls=True)
+
+
+def create_expenses(
+    items: List[Dict],
+    raw_text: Optional[str] = None,
+    deadline: Optional[Deadline] = None
+) -> List[Expense]:
+    """
+    Crea todos los gastos de un mensaje en una sola transacción
+
+    Los gastos se insertan con un único INSERT (ver `expense_bulk_insert`) y
+    se confirman con un solo commit: o quedan todos o ninguno. Después se
+    recargan en una consulta con pagador y deudor para armar la confirmación
+    sin una consulta por gasto.
+
+    Args:
+        items: Gastos con payer_id, debtor_id, amount, currency, description,
+            category y due_date (YYYY-MM-DD o None)
+        raw_text: Texto original del mensaje (se guarda en cada gasto)
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+
+    Returns:
+        Lista de Expense creados, en el orden de `items`
+
+    Raises:
+        DeadlineExceeded: Si no queda presupuesto para guardar los gastos y aun
+            confirmarlos al usuario (no se escribe nada)
+    """
+    rows = expense_rows(items, raw_text, deadline)
+    expense_ids = sorted(expense.id for expense in db.session.scalars(expense_bulk_insert(), rows))
+    commit_session()
+
+    expenses = order_expenses(db.session.scalars(expenses_by_id_statement(expense_ids)), expense_ids)
+    log_expenses_saved(expense_ids)
+    return expenses
+
+
+def log_expenses_saved(expense_ids: List[int]):
+    """Registra los gastos guardados por `create_expenses` (o su versión async)"""
+    log_operation(logger, "EXPENSE_CREATED_DB",
+                 f"Gastos creados en DB exitosamente: expense_ids={expense_ids}",
+                 error_code=ErrorCodes.OP_SUCCESS)
+
+
+def expense_rows(items: List[Dict], raw_text: Optional[str] = None,
+                 deadline: Optional[Deadline] = None) -> List[Dict]:
+    """
+    Filas para `expense_bulk_insert` de los gastos de un mensaje
+
+    La comparten `create_expenses` y la ruta async de la DB.
+
+    Args:
+        items: Gastos con payer_id, debtor_id, amount, currency, description,
+            category y due_date (YYYY-MM-DD o None)
+        raw_text: Texto original del mensaje
+        deadline: Opcional, deadline del update (por defecto el activo en `flask.g`)
+
+    Returns:
+        Lista de filas con las columnas de Expense
+
+    Raises:
+        DeadlineExceeded: Si no queda presupuesto para guardar los gastos y aun
+            confirmarlos al usuario
+    """
+    deadline = deadline or current_deadline()
+    if deadline is not None:
+        deadline.check(STAGE_DB_COMMIT, reserve=deadline.reply_reserve)
+
+    log_operation(logger, "EXPENSE_CREATION_DB",
+                 f"Creando {len(items)} gastos en DB: "
+                 + ", ".join(f"payer_id={item['payer_id']}, debtor_id={item['debtor_id']}, "
+                             f"amount={item['amount']} {item['currency']}" for item in items),
+                 error_code=ErrorCodes.OP_SUCCESS)
+
+    return [
+        {
+            'payer_id': item['payer_id'],
+            'debtor_id': item['debtor_id'],
+            'amount': item['amount'],
+            'currency': item['currency'],
+            'description': item['description'],
+            'raw_text': raw_text,
+            'category': item.get('category'),
+            'due_date': parse_due_date(item.get('due_date')),
+        }
+        for item in items
+    ]
+
+
+def expenses_by_id_statement(expense_ids: List[int]):
+    """SELECT de gastos con pagador y deudor precargados (para formatearlos sin más consultas)"""
+    return (select(Expense)
+            .options(selectinload(Expense.payer), selectinload(Expense.debtor))
+            .where(Expense.id.in_(expense_ids)))
+
+
+def order_expenses(expenses, expense_ids: List[int]) -> List[Expense]:
+    """Ordena los gastos recargados según `expense_ids`"""
+    loaded = {expense.id: expense for expense in expenses}
+    return [loaded[expense_id] for expense_id in expense_ids]
+
+
 def format_payment_receipt(expense: Expense) -> str:
     """
     Formatea un comprobante de pago detallado
@@ -360,8 +727,6 @@ def format_expense_confirmation(expense: Expense) -> str:
     Returns:
         Mensaje formateado
     """
-    from datetime import date
-    
     payer_name = expense.payer.name if expense.payer else "Usuario"
     debtor_name = expense.debtor.name if expense.debtor else "Usuario"
     
@@ -378,17 +743,67 @@ def format_expense_confirmation(expense: Expense) -> str:
     
     # Agregar fecha de vencimiento si existe
     if expense.due_date:
-        today = date.today()
-        if expense.due_date < today:
-            message += f"📅 Fecha: {expense.due_date.strftime('%d/%m/%Y')} ⚠️ Vencida\n"
-        elif expense.due_date == today:
-            message += f"📅 Fecha: {expense.due_date.strftime('%d/%m/%Y')} 🔴 Vence hoy\n"
-        else:
-            message += f"📅 Fecha: {expense.due_date.strftime('%d/%m/%Y')}\n"
+        message += f"📅 Fecha: {format_due_date_status(expense.due_date)}\n"
     
     return message
 
 
+def format_due_date_status(due_date) -> str:
+    """
+    Fecha de vencimiento con su estado (vencida / vence hoy)
+
+    Args:
+        due_date: Objeto date
+
+    Returns:
+        Fecha en formato DD/MM/YYYY con el aviso correspondiente
+    """
+    from datetime import date
+
+    today = date.today()
+    label = due_date.strftime('%d/%m/%Y')
+    if due_date < today:
+        return f"{label} ⚠️ Vencida"
+    if due_date == today:
+        return f"{label} 🔴 Vence hoy"
+    return label
+
+
+def format_expenses_confirmation(expenses: List[Expense]) -> str:
+    """
+    Formatea una sola confirmación para los gastos registrados de un mensaje
+
+    Con un gasto es igual a `format_expense_confirmation`; con varios los
+    lista numerados y suma el total por moneda.
+
+    Args:
+        expenses: Lista de Expense creados
+
+    Returns:
+        Mensaje formateado
+    """
+    if len(expenses) == 1:
+        return format_expense_confirmation(expenses[0])
+
+    message = f"✅ <b>{len(expenses)} gastos registrados</b>\n\n"
+    totals = {}
+    for number, expense in enumerate(expenses, start=1):
+        payer_name = expense.payer.name if expense.payer else "Usuario"
+        debtor_name = expense.debtor.name if expense.debtor else "Usuario"
+        message += (
+            f"{number}. 💰 {expense.amount} {expense.currency} · {expense.description}\n"
+            f"    👤 Pagó: {payer_name} · 💳 Debe: {debtor_name}\n"
+        )
+        if expense.category:
+            message += f"    🏷️ Categoría: {expense.category}\n"
+        if expense.due_date:
+            message += f"    📅 Fecha: {format_due_date_status(expense.due_date)}\n"
+        totals[expense.currency] = totals.get(expense.currency, 0) + expense.amount
+
+    message += "\n💵 Total: " + " + ".join(f"{amount} {currency}" for currency, amount in totals.items())
+    return message
+
+
 def get_user_expenses(user_id: int):
     """
     Obtiene todos los gastos relacionados con un usuario
@@ -416,6 +831,32 @@ def get_user_expenses(user_id: int):
     return expenses_to_pay, expenses_to_collect
 
 
+def sort_debts_by_due_date(debts: list) -> list:
+    """
+    Ordena deudas para mostrarlas al usuario
+    
+    Primero las que tienen due_date (por fecha ascendente), luego las que no
+    tienen (por created_at descendente).
+    
+    Args:
+        debts: Lista de objetos Expense
+        
+    Returns:
+        Nueva lista ordenada
+    """
+    debts_with_date = sorted(
+        [d for d in debts if d.due_date is not None],
+        key=lambda x: (x.due_date, x.created_at)
+    )
+    debts_without_date = sorted(
+        [d for d in debts if d.due_date is None],
+        key=lambda x: x.created_at,
+        reverse=True
+    )
+    
+    return debts_with_date + debts_without_date
+
+
 def get_user_debts_to_pay(user_id: int):
     """
     Obtiene solo las deudas que el usuario debe pagar
@@ -426,29 +867,13 @@ def get_user_debts_to_pay(user_id: int):
     Returns:
         Lista de gastos donde el usuario es deudor (debe pagar)
     """
-    # Ordenar por fecha de vencimiento (las que tienen fecha primero, luego las que no tienen)
-    # Usar una consulta más simple: primero las que tienen fecha, luego las que no
-    from sqlalchemy import desc
-    
     # Obtener todas las deudas
     all_debts = Expense.query.filter(
         Expense.debtor_id == user_id,
         Expense.is_settled == False
     ).all()
     
-    # Ordenar manualmente: primero las que tienen due_date, ordenadas por fecha ascendente
-    # luego las que no tienen due_date, ordenadas por created_at descendente
-    debts_with_date = sorted(
-        [d for d in all_debts if d.due_date is not None],
-        key=lambda x: (x.due_date, x.created_at)
-    )
-    debts_without_date = sorted(
-        [d for d in all_debts if d.due_date is None],
-        key=lambda x: x.created_at,
-        reverse=True
-    )
-    
-    return debts_with_date + debts_without_date
+    return sort_debts_by_due_date(all_debts)
 
 
 def get_user_debts_to_collect(user_id: int):
@@ -461,35 +886,59 @@ def get_user_debts_to_collect(user_id: int):
     Returns:
         Lista de gastos donde el usuario es pagador (debe cobrar)
     """
-    from sqlalchemy import desc
-    
     # Obtener todas las deudas a cobrar
     all_debts = Expense.query.filter(
         Expense.payer_id == user_id,
         Expense.is_settled == False
     ).all()
     
-    # Ordenar manualmente: primero las que tienen due_date, ordenadas por fecha ascendente
-    # luego las que no tienen due_date, ordenadas por created_at descendente
-    debts_with_date = sorted(
-        [d for d in all_debts if d.due_date is not None],
-        key=lambda x: (x.due_date, x.created_at)
-    )
-    debts_without_date = sorted(
-        [d for d in all_debts if d.due_date is None],
-        key=lambda x: x.created_at,
-        reverse=True
-    )
-    
-    return debts_with_date + debts_without_date
+    return sort_debts_by_due_date(all_debts)
+
+
+def get_debts_page(user_id: int, role: str, cursor: Optional[PageCursor] = None,
+                   backward: bool = False, number: int = 1) -> DebtPage:
+    """
+    Obtiene una página de deudas pendientes con keyset (ver app.debt_pages)
+
+    Si la página pedida quedó vacía (se pagaron sus deudas) se devuelve la primera.
+
+    Args:
+        user_id: ID del usuario
+        role: ROLE_PAY (deudas por pagar) o ROLE_COLLECT (deudas por cobrar)
+        cursor: Opcional, deuda límite de la página actual (None = primera página)
+        backward: True para la página anterior al cursor
+        number: Número de la página pedida
+
+    Returns:
+        DebtPage con las deudas de la página, el conteo y los totales por moneda
+    """
+    page_size = debts_page_size()
+    rows = []
+    for statement in page_statements(role, user_id, cursor, backward, page_size + 1):
+        rows.extend(db.session.execute(statement).scalars())
+        if len(rows) > page_size:
+            break
+
+    if not rows and cursor is not None:
+        return get_debts_page(user_id, role)
+
+    summary_rows = db.session.execute(summary_statement(role, user_id)).all()
+    return build_page(role, rows, summary_rows, cursor, backward, number, page_size)
+
+
+def debts_page_size() -> int:
+    """Deudas por página de las listas paginadas (DEBTS_PAGE_SIZE)"""
+    return max(1, current_app.config.get('DEBTS_PAGE_SIZE', 10))
 
 
-def format_debts_to_collect(debts: list) -> str:
+def format_debts_to_collect(debts: list, start: int = 1, totals: Optional[dict] = None) -> str:
     """
     Formatea una lista de deudas que el usuario debe cobrar
     
     Args:
         debts: Lista de objetos Expense (deudas a cobrar)
+        start: Opcional, número de la primera deuda (en una página, su posición en la lista completa)
+        totals: Opcional, totales por moneda a mostrar (por defecto, la suma de `debts`)
         
     Returns:
         Mensaje formateado con la lista
@@ -505,7 +954,7 @@ def format_debts_to_collect(debts: list) -> str:
     from collections import defaultdict
     totals_by_currency = defaultdict(float)
     
-    for idx, debt in enumerate(debts, 1):
+    for idx, debt in enumerate(debts, start):
         debtor_name = debt.debtor.name if debt.debtor else "Usuario"
         due_date_str = ""
         
@@ -521,11 +970,14 @@ def format_debts_to_collect(debts: list) -> str:
         message += (
             f"<b>{idx}.</b> {debtor_name} te debe\n"
             f"   💰 {debt.amount} {debt.currency}\n"
-            f"   📝 {debt.description}{due_date_str}\n\n"
+            f"   📝 {preview_description(debt.description)}{due_date_str}\n\n"
         )
         
         totals_by_currency[debt.currency] += float(debt.amount)
     
+    if totals is not None:
+        totals_by_currency = {currency: float(total) for currency, total in totals.items()}
+    
     # Agregar totales
     if totals_by_currency:
         message += "\n<b>💰 Total a cobrar:</b>\n"
@@ -552,17 +1004,21 @@ def mark_expense_as_paid(expense_id: int) -> Optional[Expense]:
     expense = Expense.query.get(expense_id)
     if expense:
         expense.is_settled = True
-        db.session.commit()
-        
+        commit_session()
+    log_expense_paid(expense_id, expense)
+    return expense
+
+
+def log_expense_paid(expense_id: int, expense: Optional[Expense]):
+    """Registra el resultado de marcar un gasto como pagado (ruta síncrona y async)"""
+    if expense:
         log_operation(logger, "EXPENSE_MARKED_PAID",
                      f"Gasto marcado como pagado exitosamente: expense_id={expense.id}, amount={expense.amount} {expense.currency}",
                      error_code=ErrorCodes.OP_SUCCESS)
-        return expense
     else:
         log_error(logger, ErrorCodes.ERR_EXPENSE_NOT_FOUND,
                  f"Gasto no encontrado: expense_id={expense_id}",
                  exception=None)
-    return None
 
 
 def delete_expense(expense_id: int) -> Optional[Expense]:
@@ -611,7 +1067,7 @@ def delete_expense(expense_id: int) -> Optional[Expense]:
         
         # Eliminar de la base de datos
         db.session.delete(expense)
-        db.session.commit()
+        commit_session()
         
         log_operation(logger, "EXPENSE_DELETED",
                      f"Gasto eliminado exitosamente: expense_id={expense_id}, amount={amount_val} {currency_val}",
@@ -624,12 +1080,13 @@ def delete_expense(expense_id: int) -> Optional[Expense]:
     return None
 
 
-def format_debts_list_for_payment(debts: list) -> tuple[str, dict]:
+def format_debts_list_for_payment(debts: list, start: int = 1) -> tuple[str, dict]:
     """
     Formatea una lista de deudas para mostrar con botones inline
     
     Args:
         debts: Lista de objetos Expense (deudas)
+        start: Opcional, número de la primera deuda (en una página, su posición en la lista completa)
         
     Returns:
         Tupla (mensaje_texto, reply_markup) con el mensaje y los botones
@@ -644,7 +1101,7 @@ def format_debts_list_for_payment(debts: list) -> tuple[str, dict]:
     # Crear botones inline
     inline_keyboard = []
     
-    for idx, debt in enumerate(debts, 1):
+    for idx, debt in enumerate(debts, start):
         payer_name = debt.payer.name if debt.payer else "Usuario"
         due_date_str = ""
         if debt.due_date:
@@ -657,7 +1114,7 @@ def format_debts_list_for_payment(debts: list) -> tuple[str, dict]:
                 due_date_str = f" 📅 {debt.due_date.strftime('%d/%m/%Y')}"
         
         message += (
-            f"<b>{idx}.</b> {debt.amount} {debt.currency} - {debt.description}\n"
+            f"<b>{idx}.</b> {debt.amount} {debt.currency} - {preview_description(debt.description)}\n"
             f"   👤 A: {payer_name}{due_date_str}\n\n"
         )
         
@@ -678,6 +1135,114 @@ def format_debts_list_for_payment(debts: list) -> tuple[str, dict]:
     return message, reply_markup
 
 
+def preview_description(description: str) -> str:
+    """
+    Recorta la descripción de una deuda para las listas
+
+    Una página de DEBTS_PAGE_SIZE deudas con descripciones largas (hasta 500
+    caracteres) pasaría el límite de 4096 caracteres de un mensaje de Telegram.
+
+    Args:
+        description: Descripción completa
+
+    Returns:
+        Descripción de hasta DEBT_DESCRIPTION_PREVIEW caracteres
+    """
+    if len(description) <= DEBT_DESCRIPTION_PREVIEW:
+        return description
+    return description[:DEBT_DESCRIPTION_PREVIEW].rstrip() + "..."
+
+
+def page_navigation(page: DebtPage) -> list:
+    """
+    Fila de botones "Anterior"/"Siguiente" de una página de deudas
+
+    Args:
+        page: Página mostrada
+
+    Returns:
+        Lista de botones (vacía si la lista cabe en una página)
+    """
+    buttons = []
+    if page.prev_callback():
+        buttons.append({'text': '◀️ Anterior', 'callback_data': page.prev_callback()})
+    if page.next_callback():
+        buttons.append({'text': 'Siguiente ▶️', 'callback_data': page.next_callback()})
+    return buttons
+
+
+def page_header(page: DebtPage) -> str:
+    """Línea "Página k de n" (vacía si la lista cabe en una página)"""
+    if page.pages <= 1:
+        return ""
+    return f"📄 Página {min(page.number, page.pages)} de {page.pages} · {page.count} deudas\n\n"
+
+
+def format_debts_page(page: DebtPage) -> tuple[str, dict]:
+    """
+    Formatea una página de deudas por pagar (con botones de pago) o por cobrar
+
+    Args:
+        page: Página de `get_debts_page`
+
+    Returns:
+        Tupla (mensaje_texto, reply_markup); reply_markup vacío si no hay botones
+    """
+    if page.role == ROLE_PAY:
+        message, reply_markup = format_debts_list_for_payment(page.items, page.start)
+    else:
+        message, reply_markup = format_debts_to_collect(page.items, page.start, page.totals), {}
+
+    if page.items:
+        # "Página k de n" bajo el título
+        title, items = message.split("\n\n", 1)
+        message = f"{title}\n\n{page_header(page)}{items}"
+
+    navigation = page_navigation(page)
+    if navigation:
+        reply_markup = {'inline_keyboard': reply_markup.get('inline_keyboard', []) + [navigation]}
+    return message, reply_markup
+
+
+def format_remaining_debts(page: DebtPage) -> tuple[str, dict]:
+    """
+    Formatea el mensaje que reemplaza la lista de deudas tras un pago
+    
+    Args:
+        page: Primera página de las deudas que siguen pendientes
+        
+    Returns:
+        Tupla (mensaje_texto, reply_markup); reply_markup vacío si no quedan deudas
+    """
+    if not page.items:
+        # No quedan deudas pendientes
+        final_message = (
+            "✅ <b>¡Felicidades!</b>\n\n"
+            "🎉 No tienes más deudas pendientes.\n"
+            "Todas tus deudas han sido saldadas."
+        )
+        return final_message, {}
+    
+    # Crear mensaje con resumen y lista de deudas restantes
+    remaining_message = (
+        f"💳 <b>Deudas Pendientes Restantes</b>\n\n"
+        f"📊 Total de deudas: {page.count}\n\n"
+    )
+    
+    # Agregar totales por moneda
+    if page.totals:
+        remaining_message += "<b>💰 Total a pagar:</b>\n"
+        for currency, total in page.totals.items():
+            remaining_message += f"• {float(total):,.2f} {currency}\n"
+        remaining_message += "\n"
+    
+    # Agregar la página de deudas con botones (sin el encabezado duplicado)
+    debts_list, reply_markup = format_debts_page(page)
+    remaining_message += debts_list.split("\n\n", 1)[1]
+    
+    return remaining_message, reply_markup
+
+
 def format_expenses_summary(user: User, expenses_to_pay: list, expenses_to_collect: list) -> str:
     """
     Formatea un resumen de gastos del usuario
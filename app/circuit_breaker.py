@@ -0,0 +1,212 @@
+"""
+Circuit breaker para las llamadas a Gemini
+
+Con Gemini caído, cada mensaje esperaba el timeout completo antes de fallar.
+El breaker cuenta los fallos consecutivos de disponibilidad (errores de
+conexión, timeouts, 429 y 5xx ya reintentados); al llegar al umbral se abre y
+las llamadas se rechazan al instante durante `reset_timeout` segundos, para que
+el bot use la ruta de respaldo (extractor local o cola de pendientes). Después
+deja pasar una llamada de prueba (half-open): si funciona se cierra, si no se
+vuelve a abrir.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_breaker_lock = threading.Lock()
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """El breaker rechazó la llamada sin intentarla"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito '{name}' abierto (reintento en {retry_after:.1f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Breaker thread-safe de tres estados (closed, open, half_open)
+
+    Attributes:
+        name: Nombre del servicio protegido (para logs y /health)
+        failure_threshold: Fallos consecutivos que abren el circuito
+        reset_timeout: Segundos que el circuito queda abierto antes de probar
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = max(0.0, reset_timeout)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._transitions: Dict[str, int] = {STATE_CLOSED: 0, STATE_OPEN: 0, STATE_HALF_OPEN: 0}
+        self._successes = 0
+        self._failures = 0
+        self._rejected = 0
+        self._success_listeners: List[Callable[[], None]] = []
+
+    @property
+    def state(self) -> str:
+        """Estado actual (pasa a half_open si ya venció el tiempo abierto)"""
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        """Abierto y vencido -> half_open (requiere _lock)"""
+        if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._transition(STATE_HALF_OPEN)
+
+    def _transition(self, state: str):
+        """Cambia de estado y cuenta la transición (requiere _lock)"""
+        self._state = state
+        self._transitions[state] += 1
+        if state == STATE_OPEN:
+            self._opened_at = self._clock()
+        if state != STATE_HALF_OPEN:
+            self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        """Segundos hasta que el circuito abierto acepte una llamada de prueba"""
+        with self._lock:
+            if self._state != STATE_OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def before_call(self):
+        """
+        Reserva permiso para una llamada
+
+        Raises:
+            CircuitOpen: Si el circuito está abierto o ya hay una llamada de prueba en curso
+        """
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == STATE_CLOSED:
+                return
+            if self._state == STATE_HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self._rejected += 1
+            retry_after = (max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+                           if self._state == STATE_OPEN else self.reset_timeout)
+        raise CircuitOpen(self.name, retry_after)
+
+    def record_success(self):
+        """Registra una llamada exitosa (cierra el circuito si era la de prueba)"""
+        with self._lock:
+            self._successes += 1
+            self._consecutive_failures = 0
+            recovered = self._state != STATE_CLOSED
+            if recovered:
+                self._transition(STATE_CLOSED)
+            listeners = list(self._success_listeners)
+        if recovered:
+            log_operation(logger, "CIRCUIT_CLOSED",
+                          f"Circuito '{self.name}' cerrado: el servicio respondió",
+                          error_code=ErrorCodes.OP_SUCCESS)
+        for listener in listeners:
+            listener()
+
+    def record_failure(self, reason: str = ""):
+        """
+        Registra un fallo de disponibilidad
+
+        Args:
+            reason: Descripción del fallo para el log
+        """
+        with self._lock:
+            self._failures += 1
+            self._consecutive_failures += 1
+            opened = (self._state == STATE_HALF_OPEN
+                      or (self._state == STATE_CLOSED
+                          and self._consecutive_failures >= self.failure_threshold))
+            if opened:
+                self._transition(STATE_OPEN)
+            consecutive = self._consecutive_failures
+        if opened:
+            log_error(logger, ErrorCodes.ERR_CIRCUIT_OPEN,
+                      f"Circuito '{self.name}' abierto tras {consecutive} fallos consecutivos: {reason}",
+                      data_dict={"reset_timeout": self.reset_timeout})
+
+    def release(self):
+        """Libera la reserva de prueba de una llamada que no llegó a concluir (ni éxito ni fallo)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def add_success_listener(self, listener: Callable[[], None]):
+        """Registra una función que se llama tras cada llamada exitosa"""
+        with self._lock:
+            self._success_listeners.append(listener)
+
+    def stats(self) -> dict:
+        """
+        Estado y contadores del breaker
+
+        Returns:
+            Diccionario con estado, transiciones por estado destino y contadores
+        """
+        with self._lock:
+            self._maybe_half_open()
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "transitions": dict(self._transitions),
+                "successes": self._successes,
+                "failures": self._failures,
+                "rejected": self._rejected,
+            }
+
+
+def get_gemini_breaker(app) -> Optional[CircuitBreaker]:
+    """
+    Obtiene (o crea de forma lazy) el breaker de Gemini de la aplicación
+
+    Al crearlo abre también la cola de pendientes, que se suscribe a las
+    llamadas exitosas para vaciar lo que haya quedado de ejecuciones anteriores.
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        CircuitBreaker o None si GEMINI_BREAKER_ENABLED está desactivado
+    """
+    if not app.config.get("GEMINI_BREAKER_ENABLED"):
+        return None
+
+    breaker = app.extensions.get("gemini_breaker")
+    if breaker is None:
+        created = False
+        with _breaker_lock:
+            breaker = app.extensions.get("gemini_breaker")
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    "gemini",
+                    failure_threshold=app.config.get("GEMINI_BREAKER_FAILURE_THRESHOLD", 5),
+                    reset_timeout=app.config.get("GEMINI_BREAKER_RESET_SECONDS", 30.0),
+                )
+                app.extensions["gemini_breaker"] = breaker
+                created = True
+        if created:
+            # Import diferido: pending_extractions usa este módulo
+            from app.pending_extractions import get_pending_queue
+            get_pending_queue(app)
+    return breaker
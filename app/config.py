@@ -9,34 +9,228 @@ load_dotenv()
 
 class Config:
     """Configuración base"""
+    # Variables obligatorias: se validan en create_app (validate), no al importar
+    REQUIRED_SETTINGS = ('TELEGRAM_BOT_TOKEN', 'GOOGLE_API_KEY', 'DATABASE_URL')
+
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
     # Telegram
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    if not TELEGRAM_BOT_TOKEN:
-        raise ValueError("TELEGRAM_BOT_TOKEN no está configurada")
+    # URL base de la API de Telegram (permite apuntar a un servidor local de pruebas)
+    TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org').rstrip('/')
     
     # Google Gemini
     GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-    if not GOOGLE_API_KEY:
-        raise ValueError("GOOGLE_API_KEY no está configurada")
     
     GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
-    # Construir URL base de Gemini API
-    _gemini_base_url = os.getenv(
-        'GEMINI_API_URL',
-        f'https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent'
-    )
-    GEMINI_API_URL = _gemini_base_url
+    # URL base de los modelos de Gemini API; el cliente agrega `{modelo}:generateContent`.
+    # También se acepta la URL completa de generateContent de un modelo
+    GEMINI_API_URL = os.getenv('GEMINI_API_URL', 'https://generativelanguage.googleapis.com/v1beta/models/')
     
     # Database
     DATABASE_URL = os.getenv('DATABASE_URL')
-    if not DATABASE_URL:
-        raise ValueError("DATABASE_URL no está configurada")
     
     SQLALCHEMY_DATABASE_URI = DATABASE_URL
 
+    # Procesamiento asíncrono del webhook (responde 200 y encola el update)
+    WEBHOOK_ASYNC_MODE = os.getenv('WEBHOOK_ASYNC_MODE', 'false').lower() == 'true'
+    # Tipo de pool de workers: "thread" o "process"
+    WEBHOOK_WORKER_KIND = os.getenv('WEBHOOK_WORKER_KIND', 'thread').lower()
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+    # Respuesta en línea: la primera llamada a Telegram de un update procesado
+    # en el request va en el cuerpo de la respuesta del webhook (sin sendMessage
+    # aparte). No aplica con WEBHOOK_ASYNC_MODE, que responde antes de procesar
+    WEBHOOK_INLINE_REPLY = os.getenv('WEBHOOK_INLINE_REPLY', 'false').lower() == 'true'
+
+    # Deduplicación de updates reenviados por Telegram (por update_id)
+    UPDATE_DEDUP_ENABLED = os.getenv('UPDATE_DEDUP_ENABLED', 'true').lower() == 'true'
+    # Backend: "memory" (por proceso) o "db" (compartido entre workers)
+    UPDATE_DEDUP_BACKEND = os.getenv('UPDATE_DEDUP_BACKEND', 'memory').lower()
+    UPDATE_DEDUP_TTL_SECONDS = int(os.getenv('UPDATE_DEDUP_TTL_SECONDS', '3600'))
+    UPDATE_DEDUP_MAX_SIZE = int(os.getenv('UPDATE_DEDUP_MAX_SIZE', '10000'))
+
+    # Ingesta por long polling (getUpdates) en lugar de webhook
+    POLLING_LIMIT = int(os.getenv('POLLING_LIMIT', '100'))
+    POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', '30'))
+    # Si es true, se hace un solo commit de DB por lote de updates
+    POLLING_BATCH_COMMIT = os.getenv('POLLING_BATCH_COMMIT', 'true').lower() == 'true'
+
+    # Límite de mensajes que requieren extracción con Gemini (token bucket)
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    # Por usuario: tokens por segundo y capacidad (ráfaga)
+    RATE_LIMIT_USER_RATE = float(os.getenv('RATE_LIMIT_USER_RATE', '0.2'))
+    RATE_LIMIT_USER_BURST = float(os.getenv('RATE_LIMIT_USER_BURST', '5'))
+    # Global (0 desactiva el bucket global)
+    RATE_LIMIT_GLOBAL_RATE = float(os.getenv('RATE_LIMIT_GLOBAL_RATE', '2'))
+    RATE_LIMIT_GLOBAL_BURST = float(os.getenv('RATE_LIMIT_GLOBAL_BURST', '20'))
+    # Store: "memory" (por proceso) o "sqlite" (archivo compartido entre workers)
+    RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'memory').lower()
+    RATE_LIMIT_SQLITE_PATH = os.getenv('RATE_LIMIT_SQLITE_PATH', '/tmp/we_owe_bot_rate_limit.db')
+
+    # Aplicación ASGI: "wsgi" (Flask envuelto en WsgiToAsgi) o "native"
+    # (handlers asyncio para los updates frecuentes, pool de workers para el resto)
+    ASGI_MODE = os.getenv('ASGI_MODE', 'wsgi').lower()
+    # Workers de la app nativa para los updates sin handler asyncio (/start,
+    # /admin, consultas). Cada uno usa una conexión del pool de SQLAlchemy
+    ASGI_WORKERS = int(os.getenv('ASGI_WORKERS', '16'))
+    # Máximo de updates aceptados en la app nativa, procesándose o esperando
+    # turno (responde 503 al superarlo y Telegram reintenta)
+    ASGI_MAX_INFLIGHT = int(os.getenv('ASGI_MAX_INFLIGHT', '2000'))
+    # Pool de conexiones async a la base de datos y a las APIs HTTP
+    ASGI_DB_POOL_SIZE = int(os.getenv('ASGI_DB_POOL_SIZE', '20'))
+    ASGI_DB_MAX_OVERFLOW = int(os.getenv('ASGI_DB_MAX_OVERFLOW', '20'))
+    ASGI_HTTP_MAX_CONNECTIONS = int(os.getenv('ASGI_HTTP_MAX_CONNECTIONS', '200'))
+
+    # Creación de tablas: "startup" (db.create_all en cada create_app) o
+    # "deploy" (no se toca el esquema al arrancar; correr `python init_db.py`
+    # una vez por despliegue)
+    SCHEMA_INIT = os.getenv('SCHEMA_INIT', 'startup').lower()
+
+    # Latencias por etapa (update, auth, gemini, telegram, db_commit) en /health
+    STAGE_METRICS_ENABLED = os.getenv('STAGE_METRICS_ENABLED', 'false').lower() == 'true'
+    STAGE_METRICS_MAX_SAMPLES = int(os.getenv('STAGE_METRICS_MAX_SAMPLES', '10000'))
+
+    # Presupuesto de tiempo por update: cada llamada a Gemini/Telegram usa como
+    # timeout lo que queda (0 desactiva). La reserva queda libre para responder
+    # al usuario cuando Gemini no alcanza a contestar
+    UPDATE_DEADLINE_SECONDS = float(os.getenv('UPDATE_DEADLINE_SECONDS', '25'))
+    UPDATE_DEADLINE_REPLY_RESERVE = float(os.getenv('UPDATE_DEADLINE_REPLY_RESERVE', '2'))
+
+    # Extractor local: los mensajes con la forma de los ejemplos del prompt
+    # ("Gasté 50000 con María en el supermercado") se interpretan sin Gemini
+    # cuando la confianza del resultado llega al mínimo
+    LOCAL_PARSER_ENABLED = os.getenv('LOCAL_PARSER_ENABLED', 'true').lower() == 'true'
+    LOCAL_PARSER_MIN_CONFIDENCE = float(os.getenv('LOCAL_PARSER_MIN_CONFIDENCE', '0.9'))
+
+    # Caché de resultados de Gemini por texto normalizado + fecha de referencia.
+    # Backend: "memory" (por proceso) o "sqlite" (compartido entre workers del host)
+    EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'true').lower() == 'true'
+    EXTRACTION_CACHE_BACKEND = os.getenv('EXTRACTION_CACHE_BACKEND', 'memory').lower()
+    EXTRACTION_CACHE_TTL_SECONDS = int(os.getenv('EXTRACTION_CACHE_TTL_SECONDS', '86400'))
+    EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '5000'))
+    EXTRACTION_CACHE_MAX_BYTES = int(os.getenv('EXTRACTION_CACHE_MAX_BYTES', str(5 * 1024 * 1024)))
+    EXTRACTION_CACHE_SQLITE_PATH = os.getenv('EXTRACTION_CACHE_SQLITE_PATH', '/tmp/we_owe_bot_extraction_cache.db')
+
+    # Zona horaria para "hoy", "mañana"... de los usuarios sin zona propia
+    DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'America/Bogota')
+
+    # Micro-lotes de extracción: los mensajes que llegan dentro de la ventana
+    # (o hasta MAX_SIZE) comparten una sola llamada a Gemini
+    EXTRACTION_BATCH_ENABLED = os.getenv('EXTRACTION_BATCH_ENABLED', 'false').lower() == 'true'
+    EXTRACTION_BATCH_MAX_SIZE = int(os.getenv('EXTRACTION_BATCH_MAX_SIZE', '8'))
+    EXTRACTION_BATCH_WINDOW_MS = float(os.getenv('EXTRACTION_BATCH_WINDOW_MS', '20'))
+    EXTRACTION_BATCH_MAX_INFLIGHT = int(os.getenv('EXTRACTION_BATCH_MAX_INFLIGHT', '4'))
+
+    # Salida estructurada de Gemini: JSON restringido por responseSchema y
+    # tope mínimo de tokens de salida por mensaje (crece con el largo del
+    # mensaje). THINKING_BUDGET vacío = no se envía thinkingConfig; si se
+    # define, solo lo reciben los modelos con los prefijos de
+    # THINKING_BUDGET_MODELS (gemini-2.5-pro rechaza un presupuesto de 0)
+    GEMINI_STRUCTURED_OUTPUT = os.getenv('GEMINI_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+    GEMINI_STRUCTURED_MAX_OUTPUT_TOKENS = int(os.getenv('GEMINI_STRUCTURED_MAX_OUTPUT_TOKENS', '256'))
+    _thinking_budget = os.getenv('GEMINI_THINKING_BUDGET', '').strip()
+    GEMINI_THINKING_BUDGET = int(_thinking_budget) if _thinking_budget else None
+    GEMINI_THINKING_BUDGET_MODELS = tuple(
+        prefix.strip()
+        for prefix in os.getenv('GEMINI_THINKING_BUDGET_MODELS', 'gemini-2.5-flash').split(',')
+        if prefix.strip()
+    )
+
+    # Circuit breaker de Gemini: tras N fallos consecutivos las llamadas se
+    # rechazan al instante durante RESET_SECONDS. Los 429/5xx se reintentan
+    # con backoff exponencial y jitter
+    GEMINI_BREAKER_ENABLED = os.getenv('GEMINI_BREAKER_ENABLED', 'true').lower() == 'true'
+    GEMINI_BREAKER_FAILURE_THRESHOLD = int(os.getenv('GEMINI_BREAKER_FAILURE_THRESHOLD', '5'))
+    GEMINI_BREAKER_RESET_SECONDS = float(os.getenv('GEMINI_BREAKER_RESET_SECONDS', '30'))
+    GEMINI_RETRY_ATTEMPTS = int(os.getenv('GEMINI_RETRY_ATTEMPTS', '2'))
+    GEMINI_RETRY_BACKOFF = float(os.getenv('GEMINI_RETRY_BACKOFF', '0.5'))
+    GEMINI_RETRY_MAX_BACKOFF = float(os.getenv('GEMINI_RETRY_MAX_BACKOFF', '4'))
+
+    # Respaldo con Gemini caído: extractor local con confianza mínima relajada
+    # y, si no alcanza, cola durable de pendientes que se vacía al recuperarse
+    GEMINI_FALLBACK_MIN_CONFIDENCE = float(os.getenv('GEMINI_FALLBACK_MIN_CONFIDENCE', '0.6'))
+    PENDING_EXTRACTION_ENABLED = os.getenv('PENDING_EXTRACTION_ENABLED', 'true').lower() == 'true'
+    PENDING_EXTRACTION_PATH = os.getenv('PENDING_EXTRACTION_PATH', '/tmp/we_owe_bot_pending.db')
+    PENDING_EXTRACTION_MAX_AGE_SECONDS = int(os.getenv('PENDING_EXTRACTION_MAX_AGE_SECONDS', '86400'))
+
+    # Consumo de Gemini por llamada (tokens de usageMetadata, latencia, modelo
+    # y ruta: local, caché, lote...) agregado en memoria por usuario y global,
+    # y volcado a la tabla gemini_usage cada FLUSH_SECONDS (0 no vuelca).
+    # Precios en USD por millón de tokens (por defecto los de gemini-2.5-flash;
+    # los tokens de razonamiento se cobran como salida)
+    GEMINI_USAGE_ENABLED = os.getenv('GEMINI_USAGE_ENABLED', 'true').lower() == 'true'
+    GEMINI_USAGE_FLUSH_SECONDS = float(os.getenv('GEMINI_USAGE_FLUSH_SECONDS', '60'))
+    GEMINI_INPUT_PRICE_PER_MTOK = float(os.getenv('GEMINI_INPUT_PRICE_PER_MTOK', '0.30'))
+    GEMINI_OUTPUT_PRICE_PER_MTOK = float(os.getenv('GEMINI_OUTPUT_PRICE_PER_MTOK', '2.50'))
+
+    # Router de modelos: los mensajes simples van a FAST_MODEL y los que llegan
+    # a THRESHOLD de complejidad (o cuya extracción con el rápido falla) a
+    # STRONG_MODEL (por defecto GEMINI_MODEL). El p95 observado por modelo
+    # ajusta la decisión (STRONG_P95_BUDGET_MS 0 = sin límite)
+    GEMINI_ROUTER_ENABLED = os.getenv('GEMINI_ROUTER_ENABLED', 'false').lower() == 'true'
+    GEMINI_FAST_MODEL = os.getenv('GEMINI_FAST_MODEL', 'gemini-2.5-flash-lite')
+    GEMINI_STRONG_MODEL = os.getenv('GEMINI_STRONG_MODEL', GEMINI_MODEL)
+    GEMINI_ROUTER_THRESHOLD = int(os.getenv('GEMINI_ROUTER_THRESHOLD', '3'))
+    GEMINI_ROUTER_STRONG_P95_BUDGET_MS = float(os.getenv('GEMINI_ROUTER_STRONG_P95_BUDGET_MS', '0'))
+    GEMINI_ROUTER_MIN_SAMPLES = int(os.getenv('GEMINI_ROUTER_MIN_SAMPLES', '20'))
+
+    # Cola de salida hacia Telegram: token bucket global (~30 msg/s) y por chat
+    # (~1 msg/s, GROUP_PER_MINUTE en grupos), respeta el retry_after de los 429,
+    # las respuestas a callbacks pasan primero y las ediciones seguidas del mismo
+    # mensaje se fusionan. Lo que lleva más de MAX_AGE_SECONDS en cola se descarta
+    TELEGRAM_SCHEDULER_ENABLED = os.getenv('TELEGRAM_SCHEDULER_ENABLED', 'false').lower() == 'true'
+    TELEGRAM_SCHEDULER_WORKERS = int(os.getenv('TELEGRAM_SCHEDULER_WORKERS', '8'))
+    TELEGRAM_GLOBAL_PER_SECOND = float(os.getenv('TELEGRAM_GLOBAL_PER_SECOND', '30'))
+    TELEGRAM_GLOBAL_BURST = int(os.getenv('TELEGRAM_GLOBAL_BURST', '30'))
+    TELEGRAM_CHAT_PER_SECOND = float(os.getenv('TELEGRAM_CHAT_PER_SECOND', '1'))
+    TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+    TELEGRAM_GROUP_PER_MINUTE = float(os.getenv('TELEGRAM_GROUP_PER_MINUTE', '20'))
+    TELEGRAM_SCHEDULER_MAX_AGE_SECONDS = float(os.getenv('TELEGRAM_SCHEDULER_MAX_AGE_SECONDS', '60'))
+
+    # Llamadas a Telegram en paralelo dentro de un update (pago por botón:
+    # respuesta al callback, comprobante y edición del teclado a la vez)
+    TELEGRAM_FANOUT_ENABLED = os.getenv('TELEGRAM_FANOUT_ENABLED', 'true').lower() == 'true'
+    TELEGRAM_FANOUT_WORKERS = int(os.getenv('TELEGRAM_FANOUT_WORKERS', '8'))
+
+    # Listas de deudas ("pagar deudas", "quién me debe") por páginas con
+    # botones Anterior/Siguiente; cada página es una consulta keyset
+    DEBTS_PAGE_SIZE = int(os.getenv('DEBTS_PAGE_SIZE', '10'))
+
+    # Recordatorios diarios de deudas vencidas o que vencen hoy: un mensaje por
+    # deudor, por la cola de salida con prioridad masiva. `python remind.py` los
+    # envía; con SCHEDULE_ENABLED también se disparan en proceso a partir de
+    # DAILY_AT (hora de DEFAULT_TIMEZONE). BATCH_SIZE deudores por bloque (el
+    # avance se guarda por bloque), STREAM_ROWS filas por lote de la consulta
+    REMINDERS_SCHEDULE_ENABLED = os.getenv('REMINDERS_SCHEDULE_ENABLED', 'false').lower() == 'true'
+    REMINDERS_DAILY_AT = os.getenv('REMINDERS_DAILY_AT', '09:00')
+    REMINDERS_BATCH_SIZE = int(os.getenv('REMINDERS_BATCH_SIZE', '200'))
+    REMINDERS_STREAM_ROWS = int(os.getenv('REMINDERS_STREAM_ROWS', '1000'))
+    REMINDERS_MAX_ITEMS = int(os.getenv('REMINDERS_MAX_ITEMS', '10'))
+    REMINDERS_LEASE_SECONDS = float(os.getenv('REMINDERS_LEASE_SECONDS', '300'))
+
+    # Sesiones HTTP keep-alive para Telegram y Gemini: conexiones por host,
+    # hosts por sesión, bloqueo al llenar el pool y reintentos de conexión
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '20'))
+    HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '10'))
+    HTTP_POOL_BLOCK = os.getenv('HTTP_POOL_BLOCK', 'false').lower() == 'true'
+    HTTP_CONNECT_RETRIES = int(os.getenv('HTTP_CONNECT_RETRIES', '2'))
+    HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.1'))
+
+    @classmethod
+    def validate(cls):
+        """
+        Verifica que las variables obligatorias estén configuradas
+
+        Raises:
+            ValueError: Si falta alguna variable de REQUIRED_SETTINGS
+        """
+        for name in cls.REQUIRED_SETTINGS:
+            if not getattr(cls, name):
+                raise ValueError(f"{name} no está configurada")
+
 
 class DevelopmentConfig(Config):
     """Configuración de desarrollo"""
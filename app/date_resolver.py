@@ -0,0 +1,333 @@
+"""
+Resolución local de fechas relativas en español
+
+El prompt pedía a Gemini calcular `due_date` "basándose en la fecha de hoy"
+sin enviarle la fecha, así que el resultado dependía de lo que el modelo
+supusiera y no se podía cachear. Ahora Gemini solo devuelve la expresión tal
+como aparece en el mensaje (`due_date_text`) y aquí se convierte en fecha con
+el "hoy" de la zona horaria del usuario: la salida del modelo ya no depende
+del día y la caché de extracción puede reutilizarla.
+
+Expresiones soportadas (sin importar tildes ni mayúsculas):
+
+- hoy, mañana, pasado mañana, ayer, anoche, anteayer / antier
+- en / dentro de N (o "dos", "tres"...) días, semanas o meses
+- el lunes, el próximo lunes, el lunes que viene, el lunes pasado
+- la próxima semana / la semana que viene (lunes siguiente)
+- el próximo mes / el mes que viene (día 1 del mes siguiente)
+- fin de mes / finales de mes, fin de semana, la quincena (15 o último día)
+- el día 20, el 20 de marzo (de 2025), 20/03, 20/03/2025, 2025-03-20
+"""
+import logging
+import re
+import unicodedata
+from calendar import monthrange
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app.config import Config
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = {
+    "lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3,
+    "viernes": 4, "sabado": 5, "domingo": 6,
+}
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12,
+}
+NUMBER_WORDS = {
+    "un": 1, "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "quince": 15,
+    "veinte": 20, "treinta": 30,
+}
+
+_WEEKDAY = "(?P<weekday>" + "|".join(WEEKDAYS) + ")"
+_MONTH = "(?P<month>" + "|".join(MONTHS) + ")"
+_COUNT = r"(?P<count>\d{1,3}|" + "|".join(NUMBER_WORDS) + ")"
+
+
+@dataclass(frozen=True)
+class DateMatch:
+    """
+    Expresión de fecha encontrada en un texto
+
+    Attributes:
+        phrase: Expresión tal como quedó tras normalizar el texto
+        start: Posición de inicio en el texto normalizado
+        value: Fecha resuelta
+    """
+    phrase: str
+    start: int
+    value: date
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes ni ñ, con los espacios colapsados"""
+    decomposed = unicodedata.normalize("NFD", text.lower())
+    return " ".join("".join(char for char in decomposed if unicodedata.category(char) != "Mn").split())
+
+
+def add_months(value: date, months: int) -> date:
+    """Suma meses ajustando al último día del mes si hace falta (31 ene + 1 = 29 feb)"""
+    month_index = value.month - 1 + months
+    year, month = value.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(value.day, monthrange(year, month)[1]))
+
+
+def end_of_month(value: date) -> date:
+    """Último día del mes de `value`"""
+    return value.replace(day=monthrange(value.year, value.month)[1])
+
+
+def next_weekday(today: date, weekday: int) -> date:
+    """Próximo `weekday` estrictamente después de hoy ("el lunes" dicho un lunes = en 7 días)"""
+    return today + timedelta(days=(weekday - today.weekday() - 1) % 7 + 1)
+
+
+def previous_weekday(today: date, weekday: int) -> date:
+    """Último `weekday` estrictamente antes de hoy"""
+    return today - timedelta(days=(today.weekday() - weekday - 1) % 7 + 1)
+
+
+def _count(match: re.Match) -> int:
+    raw = match.group("count")
+    return int(raw) if raw.isdigit() else NUMBER_WORDS[raw]
+
+
+def _in_period(match: re.Match, today: date) -> Optional[date]:
+    count, unit = _count(match), match.group("unit")
+    if unit.startswith("dia"):
+        return today + timedelta(days=count)
+    if unit.startswith("semana"):
+        return today + timedelta(weeks=count)
+    return add_months(today, count)
+
+
+def _weekday(match: re.Match, today: date) -> date:
+    weekday = WEEKDAYS[match.group("weekday")]
+    if match.group("past"):
+        return previous_weekday(today, weekday)
+    return next_weekday(today, weekday)
+
+
+def _weekend(match: re.Match, today: date) -> date:
+    # Sábado o domingo: el fin de semana es hoy
+    return today if today.weekday() >= 5 else next_weekday(today, 5)
+
+
+def _fortnight(match: re.Match, today: date) -> date:
+    # Días de pago: 15 y último día del mes
+    if today.day <= 15:
+        return today.replace(day=15)
+    return end_of_month(today)
+
+
+def _day_of_month(match: re.Match, today: date) -> Optional[date]:
+    day = int(match.group("day"))
+    if not 1 <= day <= 31:
+        return None
+    candidate = today if day >= today.day else add_months(today.replace(day=1), 1)
+    return candidate.replace(day=min(day, monthrange(candidate.year, candidate.month)[1]))
+
+
+def _closest_year(day: int, month: int, today: date) -> Optional[date]:
+    """Fecha sin año: la ocurrencia (año pasado, este o el próximo) más cercana a hoy"""
+    candidates = []
+    for year in (today.year - 1, today.year, today.year + 1):
+        try:
+            candidates.append(date(year, month, day))
+        except ValueError:
+            continue
+    return min(candidates, key=lambda value: abs((value - today).days)) if candidates else None
+
+
+def _explicit(day: int, month: int, year: Optional[int], today: date) -> Optional[date]:
+    if year is None:
+        return _closest_year(day, month, today)
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _day_month_name(match: re.Match, today: date) -> Optional[date]:
+    year = match.group("year")
+    return _explicit(int(match.group("day")), MONTHS[match.group("month")],
+                     int(year) if year else None, today)
+
+
+def _numeric(match: re.Match, today: date) -> Optional[date]:
+    year = match.group("year")
+    return _explicit(int(match.group("day")), int(match.group("month")), int(year) if year else None, today)
+
+
+def _iso(match: re.Match, today: date) -> Optional[date]:
+    try:
+        return date.fromisoformat(match.group(0))
+    except ValueError:
+        return None
+
+
+def _rule(pattern: str, resolver: Callable[[re.Match, date], Optional[date]]):
+    return re.compile(r"(?<!\w)(?:" + pattern + r")(?!\w)"), resolver
+
+
+# (expresión, resolutor); todas se buscan y gana la que empieza antes (y la más larga)
+_RULES: List[Tuple[re.Pattern, Callable[[re.Match, date], Optional[date]]]] = [
+    _rule(r"pasado manana", lambda m, today: today + timedelta(days=2)),
+    # "esta mañana" / "por la mañana" hablan de la mañana de hoy, no de mañana
+    _rule(r"(?:esta|la) manana", lambda m, today: today),
+    _rule(r"manana", lambda m, today: today + timedelta(days=1)),
+    _rule(r"hoy", lambda m, today: today),
+    _rule(r"anteayer|antier|antes de ayer", lambda m, today: today - timedelta(days=2)),
+    _rule(r"ayer|anoche", lambda m, today: today - timedelta(days=1)),
+    _rule(r"(?:en|dentro de) " + _COUNT + r" (?P<unit>dias?|semanas?|mes|meses)", _in_period),
+    _rule(r"(?:(?:el|este|esta) )?(?:proximo |siguiente )?" + _WEEKDAY
+          + r"(?: (?:que viene|proximo|siguiente)|(?P<past> pasado))?", _weekday),
+    _rule(r"(?:la )?(?:proxima semana|semana (?:que viene|entrante|siguiente))",
+          lambda m, today: next_weekday(today, 0)),
+    _rule(r"(?:el )?(?:proximo mes|mes (?:que viene|entrante|siguiente))",
+          lambda m, today: add_months(today.replace(day=1), 1)),
+    _rule(r"(?:a )?(?:fin|final|finales) de(?:l)? mes", lambda m, today: end_of_month(today)),
+    _rule(r"(?:este |el )?fin de semana", _weekend),
+    _rule(r"(?:la |esta |proxima )?quincena", _fortnight),
+    _rule(r"el (?:dia )?(?P<day>\d{1,2}) de " + _MONTH + r"(?: (?:de|del) (?P<year>\d{4}))?", _day_month_name),
+    _rule(r"el dia (?P<day>\d{1,2})", _day_of_month),
+    _rule(r"\d{4}-\d{2}-\d{2}", _iso),
+    _rule(r"(?P<day>\d{1,2})/(?P<month>\d{1,2})(?:/(?P<year>\d{2}|\d{4}))?", _numeric),
+]
+
+
+def find_date(text: str, today: date) -> Optional[DateMatch]:
+    """
+    Busca la primera expresión de fecha de un texto y la resuelve
+
+    Args:
+        text: Texto del mensaje o expresión de fecha
+        today: Fecha de referencia ("hoy" en la zona horaria del usuario)
+
+    Returns:
+        DateMatch o None si no hay una expresión reconocible
+    """
+    folded = fold(text)
+    best = None
+    for pattern, resolver in _RULES:
+        for match in pattern.finditer(folded):
+            if best is not None and (match.start(), -len(match.group(0))) >= (best[0].start(), -len(best[0].group(0))):
+                break
+            value = resolver(match, today)
+            if value is not None:
+                best = (match, value)
+                break
+    if best is None:
+        return None
+    match, value = best
+    return DateMatch(phrase=match.group(0), start=match.start(), value=value)
+
+
+def resolve_due_date(expense_data: dict, text: Optional[str], today: date) -> dict:
+    """
+    Calcula `due_date` de una extracción con la fecha de referencia del usuario
+
+    Usa la expresión que devolvió Gemini en `due_date_text` y, si no la
+    reconoce, busca una en el mensaje completo. Reemplaza cualquier `due_date`
+    previo y quita `due_date_text`.
+
+    Args:
+        expense_data: Resultado de la extracción (se modifica)
+        text: Texto original del mensaje (None: no buscar en el mensaje)
+        today: Fecha de referencia del usuario
+
+    Returns:
+        El mismo diccionario con `due_date` en formato YYYY-MM-DD o None
+    """
+    phrase = expense_data.pop('due_date_text', None)
+    match = find_date(phrase, today) if isinstance(phrase, str) and phrase.strip() else None
+    if match is None:
+        match = find_date(text, today) if text else None
+        if match is None and phrase:
+            log_operation(logger, "DATE_UNRESOLVED",
+                          f"Expresión de fecha no reconocida: '{phrase}'",
+                          error_code=ErrorCodes.OP_FAILED)
+    expense_data['due_date'] = match.value.isoformat() if match else None
+    return expense_data
+
+
+def resolve_due_dates(items: List[dict], text: str, today: date) -> List[dict]:
+    """
+    Calcula `due_date` de cada gasto extraído de un mensaje
+
+    Con varios gastos, una fecha del mensaje no se reparte entre todos: cada
+    gasto usa solo la expresión que Gemini le asignó.
+
+    Args:
+        items: Gastos extraídos del mensaje (se modifican)
+        text: Texto original del mensaje
+        today: Fecha de referencia del usuario
+
+    Returns:
+        La misma lista con `due_date` resuelto en cada gasto
+    """
+    message_text = text if len(items) == 1 else None
+    for item in items:
+        resolve_due_date(item, message_text, today)
+    return items
+
+
+@lru_cache(maxsize=256)
+def get_timezone(name: Optional[str] = None) -> tzinfo:
+    """
+    Zona horaria por nombre IANA, con DEFAULT_TIMEZONE como respaldo
+
+    Args:
+        name: Nombre IANA ("America/Bogota"); None usa DEFAULT_TIMEZONE
+
+    Returns:
+        tzinfo; UTC si ni el nombre ni DEFAULT_TIMEZONE existen en el sistema
+    """
+    for candidate in (name, Config.DEFAULT_TIMEZONE):
+        if not candidate:
+            continue
+        try:
+            return ZoneInfo(candidate)
+        except (ZoneInfoNotFoundError, ValueError):
+            log_error(logger, ErrorCodes.ERR_INVALID_DATA,
+                      f"Zona horaria desconocida '{candidate}', se usa la siguiente disponible")
+    return timezone.utc
+
+
+def is_valid_timezone(name: str) -> bool:
+    """Indica si `name` es una zona horaria IANA disponible"""
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def today_in(timezone_name: Optional[str] = None, now: Optional[datetime] = None) -> date:
+    """
+    Fecha de hoy en una zona horaria
+
+    Args:
+        timezone_name: Nombre IANA (None = DEFAULT_TIMEZONE)
+        now: Opcional, instante de referencia con zona (por defecto ahora)
+
+    Returns:
+        Fecha local
+    """
+    return (now or datetime.now(timezone.utc)).astimezone(get_timezone(timezone_name)).date()
+
+
+def user_today(user, now: Optional[datetime] = None) -> date:
+    """Fecha de hoy (o de `now`) en la zona horaria del usuario (o DEFAULT_TIMEZONE si no tiene)"""
+    return today_in(getattr(user, 'timezone', None), now)
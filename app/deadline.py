@@ -0,0 +1,179 @@
+"""
+Presupuesto de tiempo por update
+
+Un update puede encadenar la extracción con Gemini (hasta 30 s) y varias
+llamadas a Telegram (hasta 10 s cada una) y pasarse del límite de la función
+serverless. `Deadline` lleva el tiempo restante del update: cada llamada
+saliente usa como timeout lo que queda (con su tope habitual) y, si ya no
+alcanza, falla de inmediato con `DeadlineExceeded` en lugar de esperar.
+
+El deadline activo vive en `flask.g` durante el update (lo crea `webhook()`,
+la app ASGI nativa al recibir el update o, fuera de un request,
+`process_update`) y `current_deadline()` lo recupera en `ai_services` y
+`bot_services`.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from flask import g, has_app_context
+
+from app.logger_config import log_operation, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+# Por debajo de este timeout una llamada HTTP no tiene sentido
+MIN_CALL_TIMEOUT = 0.1
+
+
+class DeadlineExceeded(Exception):
+    """No queda presupuesto para una llamada"""
+
+    def __init__(self, stage: str, remaining: float):
+        super().__init__(f"Sin presupuesto para {stage}: quedan {remaining * 1000:.0f} ms")
+        self.stage = stage
+        self.remaining = remaining
+
+
+class Deadline:
+    """
+    Presupuesto de tiempo de un update
+
+    Attributes:
+        budget: Segundos totales del update
+        reply_reserve: Segundos que se reservan para la respuesta al usuario
+        stages: Segundos acumulados por etapa (gemini, telegram, db_commit, ...)
+        exceeded_stage: Primera etapa que se quedó sin presupuesto (o None)
+    """
+
+    def __init__(self, budget: float, reply_reserve: float = 0.0, clock=time.monotonic):
+        self.budget = budget
+        self.reply_reserve = reply_reserve
+        self.stages: Dict[str, float] = {}
+        self.exceeded_stage: Optional[str] = None
+        self._clock = clock
+        self._started = clock()
+        self._expires_at = self._started + budget
+
+    def remaining(self) -> float:
+        """Segundos que quedan (negativo si ya venció)"""
+        return self._expires_at - self._clock()
+
+    def elapsed(self) -> float:
+        """Segundos desde que empezó el update"""
+        return self._clock() - self._started
+
+    def timeout(self, stage: str, cap: float, reserve: float = 0.0) -> float:
+        """
+        Timeout para una llamada saliente
+
+        Args:
+            stage: Etapa de la llamada (para el error)
+            cap: Timeout máximo habitual de la llamada
+            reserve: Segundos que deben quedar libres después de la llamada
+
+        Returns:
+            min(cap, restante - reserve)
+
+        Raises:
+            DeadlineExceeded: Si lo disponible es menor que MIN_CALL_TIMEOUT
+        """
+        available = self.remaining() - reserve
+        if available < MIN_CALL_TIMEOUT:
+            raise self.exceeded(stage)
+        return min(cap, available)
+
+    def exceeded(self, stage: str) -> DeadlineExceeded:
+        """
+        Marca la etapa como sin presupuesto
+
+        Args:
+            stage: Etapa que no alcanzó a completarse
+
+        Returns:
+            DeadlineExceeded listo para lanzar
+        """
+        self.exceeded_stage = self.exceeded_stage or stage
+        return DeadlineExceeded(stage, self.remaining())
+
+    def check(self, stage: str, reserve: float = 0.0):
+        """
+        Falla rápido antes de trabajo que no admite timeout (consultas de DB)
+
+        Args:
+            stage: Etapa que se va a ejecutar
+            reserve: Segundos que deben quedar libres después
+
+        Raises:
+            DeadlineExceeded: Si ya no queda presupuesto
+        """
+        self.timeout(stage, 0.0, reserve)
+
+    def record(self, stage: str, seconds: float):
+        """Acumula el tiempo de una etapa"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Deadline del update en curso, o None fuera de un update"""
+    if not has_app_context():
+        return None
+    return g.get('deadline')
+
+
+@contextmanager
+def update_deadline(budget: float, reply_reserve: float = 0.0,
+                    deadline: Optional[Deadline] = None, **log_context):
+    """
+    Activa un Deadline en `flask.g` mientras se procesa un update
+
+    Si ya hay uno activo (creado por `webhook()`) lo reutiliza. Al terminar
+    registra en el log el tiempo por etapa y retira el deadline que activó,
+    para que el siguiente update de un lote de long polling empiece con el suyo.
+
+    Args:
+        budget: Segundos del update (0 o negativo desactiva el deadline)
+        reply_reserve: Segundos reservados para responder al usuario
+        deadline: Deadline creado al recibir el update fuera del contexto de
+            Flask (app ASGI nativa); se activa en lugar de crear uno nuevo
+        **log_context: telegram_id / user_id para el log
+
+    Yields:
+        Deadline activo o None si está desactivado
+    """
+    if g.get('deadline') is not None:
+        yield g.deadline
+        return
+    if deadline is None:
+        if budget <= 0:
+            yield None
+            return
+        deadline = Deadline(budget, reply_reserve)
+
+    g.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        g.pop('deadline', None)
+        log_deadline(deadline, **log_context)
+
+
+def log_deadline(deadline: Deadline, **log_context):
+    """
+    Registra en el log el tiempo del update por etapa
+
+    Args:
+        deadline: Deadline del update
+        **log_context: telegram_id / user_id para el log
+    """
+    stages = ", ".join(f"{stage}={seconds * 1000:.0f}ms"
+                       for stage, seconds in sorted(deadline.stages.items()))
+    details = (f"Update procesado en {deadline.elapsed() * 1000:.0f}ms de "
+               f"{deadline.budget * 1000:.0f}ms ({stages or 'sin llamadas salientes'})")
+    if deadline.exceeded_stage or deadline.remaining() <= 0:
+        details += f"; presupuesto agotado en {deadline.exceeded_stage or 'el update'}"
+        error_code = ErrorCodes.ERR_DEADLINE_EXCEEDED
+    else:
+        error_code = ErrorCodes.OP_SUCCESS
+    log_operation(logger, "UPDATE_TIMING", details, error_code=error_code, **log_context)
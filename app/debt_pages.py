@@ -0,0 +1,281 @@
+"""
+Listas de deudas paginadas con keyset
+
+"Pagar deudas" y "quién me debe" cargaban todas las deudas pendientes del
+usuario y las mostraban en un solo mensaje (con un botón por deuda): con
+muchas deudas el mensaje pasaba el límite de 4096 caracteres de Telegram y
+la consulta crecía con el historial. Ahora cada vista muestra una página de
+DEBTS_PAGE_SIZE deudas con botones "Anterior"/"Siguiente".
+
+El orden es el de siempre (`bot_services.sort_debts_by_due_date`): primero
+las deudas con fecha límite, por (due_date, created_at) ascendente, y luego
+las que no tienen fecha, por created_at descendente; `id` desempata. Cada
+página se pide con keyset (`WHERE clave > cursor ORDER BY clave LIMIT n+1`)
+sobre el índice (deudor o pagador, is_settled, due_date, created_at, id), sin
+OFFSET: el costo no depende de en qué página se esté. Como el orden mezcla
+direcciones, la consulta se parte en dos tramos (con fecha / sin fecha) y el
+segundo solo se ejecuta si el primero no llenó la página.
+
+El cursor (clave de la primera o última deuda de la página) viaja en el
+`callback_data` del botón, así que pagar o agregar deudas entre páginas no
+desplaza la lista: la siguiente página empieza justo después de la última
+deuda vista.
+"""
+import math
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select, tuple_
+from sqlalchemy.orm import configure_mappers, selectinload
+
+from app.models import Expense
+
+ROLE_PAY = "p"
+ROLE_COLLECT = "c"
+ROLES = (ROLE_PAY, ROLE_COLLECT)
+
+CALLBACK_PREFIX = "debts:"
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def role_column(role: str):
+    """Columna que filtra las deudas del usuario según la vista (deudor o pagador)"""
+    return Expense.debtor_id if role == ROLE_PAY else Expense.payer_id
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    """
+    Clave de orden de una deuda (límite de una página)
+
+    Attributes:
+        due_date: Fecha límite (None si la deuda no tiene)
+        created_at: Fecha de creación
+        id: ID de la deuda (desempate)
+    """
+    due_date: Optional[date]
+    created_at: datetime
+    id: int
+
+    @classmethod
+    def of(cls, expense: Expense) -> "PageCursor":
+        """Cursor de una deuda"""
+        return cls(expense.due_date, expense.created_at, expense.id)
+
+    def encode(self) -> str:
+        """
+        Codifica el cursor para `callback_data` (máximo 64 bytes en Telegram)
+
+        Returns:
+            "<ordinal de due_date o vacío>.<created_at en µs desde epoch>.<id>"
+        """
+        due = str(self.due_date.toordinal()) if self.due_date else ""
+        created = self.created_at.replace(tzinfo=None) - _EPOCH
+        return f"{due}.{created // _MICROSECOND}.{self.id}"
+
+    @classmethod
+    def decode(cls, raw: str) -> "PageCursor":
+        """
+        Decodifica un cursor de `encode`
+
+        Raises:
+            ValueError: Si el cursor no tiene el formato esperado
+        """
+        due, created, expense_id = raw.split(".")
+        try:
+            return cls(
+                date.fromordinal(int(due)) if due else None,
+                _EPOCH + timedelta(microseconds=int(created)),
+                int(expense_id),
+            )
+        except OverflowError as e:
+            raise ValueError(f"Cursor fuera de rango: {raw}") from e
+
+
+@dataclass
+class DebtPage:
+    """
+    Una página de deudas pendientes
+
+    Attributes:
+        role: ROLE_PAY (deudas por pagar) o ROLE_COLLECT (deudas por cobrar)
+        items: Deudas de la página, en orden de presentación
+        number: Número de página (1 = primera)
+        page_size: Deudas por página
+        has_prev: Hay deudas antes de la página
+        has_next: Hay deudas después de la página
+        count: Deudas pendientes en total
+        totals: Monto pendiente en total por moneda
+    """
+    role: str
+    items: List[Expense]
+    number: int
+    page_size: int
+    has_prev: bool
+    has_next: bool
+    count: int = 0
+    totals: Dict[str, Decimal] = field(default_factory=dict)
+
+    @property
+    def pages(self) -> int:
+        """Páginas en total (al menos 1)"""
+        return max(1, math.ceil(self.count / self.page_size))
+
+    @property
+    def start(self) -> int:
+        """Número (en la lista completa) de la primera deuda de la página"""
+        return (self.number - 1) * self.page_size + 1
+
+    def prev_callback(self) -> Optional[str]:
+        """callback_data del botón "Anterior", o None en la primera página"""
+        if not self.has_prev or not self.items:
+            return None
+        return page_callback(self.role, True, self.number - 1, PageCursor.of(self.items[0]))
+
+    def next_callback(self) -> Optional[str]:
+        """callback_data del botón "Siguiente", o None en la última página"""
+        if not self.has_next or not self.items:
+            return None
+        return page_callback(self.role, False, self.number + 1, PageCursor.of(self.items[-1]))
+
+
+def page_callback(role: str, backward: bool, number: int, cursor: PageCursor) -> str:
+    """
+    callback_data de un botón de navegación
+
+    Args:
+        role: ROLE_PAY o ROLE_COLLECT
+        backward: True para la página anterior al cursor, False para la siguiente
+        number: Número de la página destino
+        cursor: Primera (anterior) o última (siguiente) deuda de la página actual
+
+    Returns:
+        "debts:<rol><b|n>:<página>:<cursor>"
+    """
+    return f"{CALLBACK_PREFIX}{role}{'b' if backward else 'n'}:{max(1, number)}:{cursor.encode()}"
+
+
+def parse_page_callback(callback_data: str) -> Tuple[str, bool, int, PageCursor]:
+    """
+    Decodifica el callback_data de un botón de navegación
+
+    Args:
+        callback_data: Datos del callback (empieza con CALLBACK_PREFIX)
+
+    Returns:
+        Tupla (rol, backward, número de página, cursor)
+
+    Raises:
+        ValueError: Si los datos no tienen el formato esperado
+    """
+    action, number, cursor = callback_data[len(CALLBACK_PREFIX):].split(":")
+    if len(action) != 2 or action[0] not in ROLES or action[1] not in "bn":
+        raise ValueError(f"Acción de página inválida: {action}")
+    return action[0], action[1] == "b", max(1, int(number)), PageCursor.decode(cursor)
+
+
+def page_statements(role: str, user_id: int, cursor: Optional[PageCursor] = None,
+                    backward: bool = False, limit: int = 10) -> list:
+    """
+    Consultas keyset de una página, tramo por tramo
+
+    Las filas de cada consulta salen en el sentido del recorrido (hacia atrás
+    en orden inverso); hay que ejecutarlas en orden y parar cuando se junten
+    `limit` filas.
+
+    Args:
+        role: ROLE_PAY o ROLE_COLLECT
+        user_id: ID del usuario
+        cursor: Opcional, deuda límite (None = desde el principio)
+        backward: True para las deudas anteriores al cursor
+        limit: Filas máximas por consulta
+
+    Returns:
+        Lista de sentencias SELECT (una o dos)
+    """
+    # Los backrefs payer/debtor existen solo tras configurar los mappers
+    configure_mappers()
+    pending = and_(role_column(role) == user_id, Expense.is_settled == False)  # noqa: E712
+    dated, undated = Expense.due_date.isnot(None), Expense.due_date.is_(None)
+    dated_key = tuple_(Expense.due_date, Expense.created_at, Expense.id)
+    undated_key = tuple_(Expense.created_at, Expense.id)
+    dated_asc = (Expense.due_date.asc(), Expense.created_at.asc(), Expense.id.asc())
+    dated_desc = (Expense.due_date.desc(), Expense.created_at.desc(), Expense.id.desc())
+    undated_asc = (Expense.created_at.asc(), Expense.id.asc())
+    undated_desc = (Expense.created_at.desc(), Expense.id.desc())
+
+    # (filtro, orden) de cada tramo en el sentido del recorrido
+    if cursor is None:
+        segments = [(dated, dated_asc), (undated, undated_desc)]
+    elif cursor.due_date is not None:
+        key = (cursor.due_date, cursor.created_at, cursor.id)
+        if backward:
+            segments = [(and_(dated, dated_key < key), dated_desc)]
+        else:
+            segments = [(and_(dated, dated_key > key), dated_asc), (undated, undated_desc)]
+    else:
+        key = (cursor.created_at, cursor.id)
+        if backward:
+            segments = [(and_(undated, undated_key > key), undated_asc), (dated, dated_desc)]
+        else:
+            segments = [(and_(undated, undated_key < key), undated_desc)]
+
+    return [
+        select(Expense)
+        .where(pending, where)
+        .order_by(*order)
+        .limit(limit)
+        .options(selectinload(Expense.payer), selectinload(Expense.debtor))
+        for where, order in segments
+    ]
+
+
+def summary_statement(role: str, user_id: int):
+    """
+    Conteo y total por moneda de las deudas pendientes (una fila por moneda)
+
+    Args:
+        role: ROLE_PAY o ROLE_COLLECT
+        user_id: ID del usuario
+    """
+    return (
+        select(Expense.currency, func.count(Expense.id), func.sum(Expense.amount))
+        .where(role_column(role) == user_id, Expense.is_settled == False)  # noqa: E712
+        .group_by(Expense.currency)
+    )
+
+
+def build_page(role: str, rows: list, summary_rows: list, cursor: Optional[PageCursor],
+               backward: bool, number: int, page_size: int) -> DebtPage:
+    """
+    Arma la página con las filas de `page_statements` (pedidas con limit = page_size + 1)
+
+    Args:
+        role: ROLE_PAY o ROLE_COLLECT
+        rows: Filas de las consultas, en el sentido del recorrido
+        summary_rows: Filas (moneda, conteo, total) de `summary_statement`
+        cursor: Cursor usado (None = primera página)
+        backward: Sentido del recorrido
+        number: Número de la página pedida
+        page_size: Deudas por página
+
+    Returns:
+        DebtPage
+    """
+    more = len(rows) > page_size
+    items = rows[:page_size]
+    if backward:
+        items.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = cursor is not None, more
+    if not has_prev:
+        number = 1
+
+    totals = {currency: Decimal(total or 0) for currency, _, total in summary_rows}
+    count = sum(rows_count for _, rows_count, _ in summary_rows)
+    return DebtPage(role, items, number, page_size, has_prev, has_next, count, totals)
@@ -0,0 +1,215 @@
+"""
+Deduplicación de updates de Telegram por update_id
+
+Telegram reenvía un update cuando el webhook responde lento o con error. Este
+módulo descarta los reenvíos antes de cualquier consulta de autorización o
+llamada a Gemini, evitando gastos duplicados.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_dedup_lock = threading.Lock()
+
+# Cada cuántas inserciones en DB se purgan los registros vencidos
+DB_PURGE_EVERY = 500
+
+
+class UpdateDeduplicator:
+    """
+    Registro de update_id vistos con memoria acotada (LRU con TTL)
+
+    Con backend "db" además se registra cada update_id en la tabla
+    `processed_updates`, de modo que varios workers/instancias comparten el estado.
+    La caché en memoria se consulta primero para evitar el round trip a la DB
+    en los reenvíos que llegan a la misma instancia.
+
+    Attributes:
+        max_size: Máximo de update_id guardados en memoria
+        ttl_seconds: Tiempo que se recuerda un update_id
+        backend: "memory" o "db"
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: int = 3600, backend: str = "memory"):
+        if backend not in ("memory", "db"):
+            raise ValueError(f"Backend de deduplicación desconocido: {backend}")
+
+        self.max_size = max(1, max_size)
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._duplicates = 0
+        self._forgotten = 0
+        self._db_inserts = 0
+
+    def is_duplicate(self, update_id: Optional[int]) -> bool:
+        """
+        Verifica si un update ya fue recibido y lo registra si es nuevo
+
+        Args:
+            update_id: ID del update de Telegram
+
+        Returns:
+            True si el update es un reenvío y debe descartarse
+        """
+        if update_id is None:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            self._checked += 1
+            seen_at = self._seen.get(update_id)
+            if seen_at is not None and now - seen_at < self.ttl_seconds:
+                self._seen.move_to_end(update_id)
+                self._duplicates += 1
+                return True
+
+            self._seen[update_id] = now
+            self._seen.move_to_end(update_id)
+            self._evict(now)
+
+        if self.backend == "db" and self._is_duplicate_in_db(update_id):
+            with self._lock:
+                self._duplicates += 1
+            return True
+
+        return False
+
+    def forget(self, update_id: Optional[int]):
+        """
+        Olvida un update_id para que un reenvío de Telegram sí se procese
+
+        Se usa cuando el update no pudo encolarse y se respondió con error.
+
+        Args:
+            update_id: ID del update de Telegram
+        """
+        if update_id is None:
+            return
+
+        with self._lock:
+            if self._seen.pop(update_id, None) is not None:
+                self._forgotten += 1
+
+        if self.backend == "db":
+            from app import db
+            from app.models import ProcessedUpdate
+
+            try:
+                ProcessedUpdate.query.filter_by(update_id=update_id).delete()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                log_error(logger, ErrorCodes.ERR_DB_QUERY,
+                          f"Error al olvidar update_id={update_id}: {str(e)}",
+                          exception=e)
+
+    def _evict(self, now: float):
+        """Elimina entradas vencidas y las más antiguas si se supera max_size"""
+        while self._seen:
+            oldest_at = next(iter(self._seen.values()))
+            if len(self._seen) > self.max_size or now - oldest_at >= self.ttl_seconds:
+                self._seen.popitem(last=False)
+            else:
+                break
+
+    def _is_duplicate_in_db(self, update_id: int) -> bool:
+        """
+        Registra el update_id en la DB; la clave primaria detecta los duplicados
+
+        Si la DB no está disponible se deja pasar el update (fail-open) para no
+        perder mensajes.
+        """
+        from sqlalchemy.exc import IntegrityError
+        from app import db
+        from app.models import ProcessedUpdate
+
+        try:
+            db.session.add(ProcessedUpdate(update_id=update_id))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            log_error(logger, ErrorCodes.ERR_DB_QUERY,
+                      f"Error registrando update_id={update_id} para deduplicación: {str(e)}",
+                      exception=e)
+            return False
+
+        self._db_inserts += 1
+        if self._db_inserts % DB_PURGE_EVERY == 0:
+            self._purge_db()
+        return False
+
+    def _purge_db(self):
+        """Elimina de la DB los update_id más antiguos que el TTL"""
+        from app import db
+        from app.models import ProcessedUpdate
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        try:
+            deleted = ProcessedUpdate.query.filter(ProcessedUpdate.created_at < cutoff).delete()
+            db.session.commit()
+            log_operation(logger, "UPDATE_DEDUP_PURGE",
+                          f"Registros de deduplicación purgados: {deleted}",
+                          error_code=ErrorCodes.OP_SUCCESS)
+        except Exception as e:
+            db.session.rollback()
+            log_error(logger, ErrorCodes.ERR_DB_QUERY,
+                      f"Error purgando registros de deduplicación: {str(e)}",
+                      exception=e)
+
+    def stats(self) -> dict:
+        """
+        Contadores de la deduplicación
+
+        Returns:
+            Diccionario con los contadores
+        """
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "size": len(self._seen),
+                "max_size": self.max_size,
+                "checked": self._checked,
+                "duplicates_dropped": self._duplicates,
+                "forgotten": self._forgotten,
+            }
+
+
+def get_update_deduplicator(app) -> Optional[UpdateDeduplicator]:
+    """
+    Obtiene (o crea de forma lazy) el deduplicador de updates de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        UpdateDeduplicator o None si la deduplicación está desactivada
+    """
+    if not app.config.get("UPDATE_DEDUP_ENABLED", True):
+        return None
+
+    dedup = app.extensions.get("update_dedup")
+    if dedup is None:
+        with _dedup_lock:
+            dedup = app.extensions.get("update_dedup")
+            if dedup is None:
+                dedup = UpdateDeduplicator(
+                    max_size=app.config.get("UPDATE_DEDUP_MAX_SIZE", 10000),
+                    ttl_seconds=app.config.get("UPDATE_DEDUP_TTL_SECONDS", 3600),
+                    backend=app.config.get("UPDATE_DEDUP_BACKEND", "memory"),
+                )
+                app.extensions["update_dedup"] = dedup
+    return dedup
@@ -0,0 +1,199 @@
+"""
+Dispatcher de updates ordenado por chat y paralelo entre chats
+
+Cada update se asigna a un carril (lane) según su chat_id. Un carril procesa sus
+updates en orden FIFO con un único worker, así que los mensajes de un mismo chat
+nunca se reordenan ("Le debo 20000 a Carlos" seguido de "pagar"), mientras que
+chats distintos avanzan en paralelo en carriles distintos.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_key(update: dict) -> Optional[int]:
+    """
+    Obtiene la clave de orden de un update de Telegram (chat_id o telegram_id)
+
+    Args:
+        update: Diccionario con el update de Telegram
+
+    Returns:
+        chat_id del update, telegram_id del remitente o None si no se encuentra
+    """
+    if 'message' in update:
+        message = update['message']
+        return message.get('chat', {}).get('id') or message.get('from', {}).get('id')
+    if 'callback_query' in update:
+        callback_query = update['callback_query']
+        chat_id = callback_query.get('message', {}).get('chat', {}).get('id')
+        return chat_id or callback_query.get('from', {}).get('id')
+    return None
+
+
+class _Lane:
+    """Carril FIFO con un único worker"""
+
+    def __init__(self, index: int, capacity: int):
+        self.index = index
+        self.queue: "queue.Queue" = queue.Queue(maxsize=capacity)
+        self.thread: Optional[threading.Thread] = None
+        self.busy = False
+        self.busy_seconds = 0.0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_depth = 0
+
+
+_STOP = object()
+
+
+class ChatDispatcher:
+    """
+    Reparte items en carriles ordenados según una clave (chat_id)
+
+    Attributes:
+        lanes: Número de carriles (= workers en paralelo)
+        lane_capacity: Máximo de items pendientes por carril (backpressure)
+    """
+
+    def __init__(self, handler: Callable[[object], object], lanes: int = 4,
+                 lane_capacity: int = 100, name: str = "lane",
+                 on_error: Optional[Callable[[object, Exception], None]] = None):
+        self.lanes = max(1, lanes)
+        self.lane_capacity = max(1, lane_capacity)
+        self.name = name
+        self._handler = handler
+        self._on_error = on_error
+        self._lanes: List[_Lane] = [_Lane(idx, self.lane_capacity) for idx in range(self.lanes)]
+        self._lock = threading.Lock()
+        self._started_at: Optional[float] = None
+
+    def start(self):
+        """Arranca un worker por carril"""
+        self._started_at = time.monotonic()
+        for lane in self._lanes:
+            lane.thread = threading.Thread(
+                target=self._lane_loop, args=(lane,),
+                name=f"{self.name}-{lane.index}", daemon=True
+            )
+            lane.thread.start()
+
+    def lane_for(self, key: Optional[Hashable]) -> int:
+        """
+        Calcula el carril de una clave
+
+        Args:
+            key: Clave de orden (chat_id); None va siempre al carril 0
+
+        Returns:
+            Índice del carril
+        """
+        if key is None:
+            return 0
+        return hash(key) % self.lanes
+
+    def submit(self, key: Optional[Hashable], item: object, timeout: float = 0.0) -> bool:
+        """
+        Encola un item en el carril de su clave
+
+        Args:
+            key: Clave de orden (chat_id)
+            item: Item a procesar
+            timeout: Segundos a esperar si el carril está lleno (0 = no esperar)
+
+        Returns:
+            True si se encoló, False si el carril está lleno (backpressure)
+        """
+        lane = self._lanes[self.lane_for(key)]
+        try:
+            if timeout > 0:
+                lane.queue.put(item, timeout=timeout)
+            else:
+                lane.queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                lane.rejected += 1
+            return False
+
+        with self._lock:
+            lane.max_depth = max(lane.max_depth, lane.queue.qsize())
+        return True
+
+    def _lane_loop(self, lane: _Lane):
+        """Bucle del worker de un carril"""
+        while True:
+            item = lane.queue.get()
+            if item is _STOP:
+                lane.queue.task_done()
+                return
+
+            with self._lock:
+                lane.busy = True
+            started = time.monotonic()
+            failed = False
+            try:
+                self._handler(item)
+            except Exception as e:
+                failed = True
+                if self._on_error is not None:
+                    self._on_error(item, e)
+                else:
+                    logger.error(f"Error en carril {lane.index}: {e}", exc_info=True)
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    lane.busy = False
+                    lane.busy_seconds += elapsed
+                    lane.processed += 1
+                    if failed:
+                        lane.failed += 1
+                lane.queue.task_done()
+
+    def join(self):
+        """Espera a que todos los carriles vacíen su cola"""
+        for lane in self._lanes:
+            lane.queue.join()
+
+    def stats(self) -> dict:
+        """
+        Estadísticas agregadas y por carril
+
+        Returns:
+            Diccionario con profundidad de cola, utilización y contadores
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+            busy_seconds = sum(lane.busy_seconds for lane in self._lanes)
+            utilization = busy_seconds / (elapsed * self.lanes) if elapsed > 0 else 0.0
+            return {
+                "lanes": self.lanes,
+                "lane_capacity": self.lane_capacity,
+                "queue_depth": sum(lane.queue.qsize() for lane in self._lanes),
+                "busy_workers": sum(1 for lane in self._lanes if lane.busy),
+                "utilization": round(min(utilization, 1.0), 4),
+                "processed": sum(lane.processed for lane in self._lanes),
+                "failed": sum(lane.failed for lane in self._lanes),
+                "rejected": sum(lane.rejected for lane in self._lanes),
+                "lane_depths": [lane.queue.qsize() for lane in self._lanes],
+                "lane_max_depths": [lane.max_depth for lane in self._lanes],
+            }
+
+    def shutdown(self, wait: bool = True):
+        """
+        Detiene los workers de los carriles
+
+        Args:
+            wait: Si True, espera a que se procesen los items pendientes
+        """
+        for lane in self._lanes:
+            lane.queue.put(_STOP)
+        if wait:
+            for lane in self._lanes:
+                if lane.thread is not None:
+                    lane.thread.join()
@@ -0,0 +1,362 @@
+"""
+Micro-lotes de extracción con Gemini
+
+Cada extract_expense_items enviaba el system prompt completo (varios KB) para
+una frase corta del usuario. Cuando llegan varios mensajes a la vez (los
+carriles del dispatcher procesando en paralelo), el batcher junta los que
+llegan dentro de una ventana de pocos milisegundos, o hasta N mensajes, y los
+envía en una sola llamada que pide un arreglo JSON; cada handler recibe su
+propio resultado.
+
+Los errores se aíslan por mensaje: un objeto inválido solo anula su mensaje y
+los que no vuelven en la respuesta se extraen individualmente en el thread del
+handler. Si la llamada en lote falla, cada handler recibe la misma excepción
+que habría recibido con una llamada individual.
+
+Solo ahorra tiempo cuando hay más mensajes en vuelo que llamadas simultáneas
+que admite la cuota de Gemini; con concurrencia de sobra la ventana y la
+respuesta más larga hacen más lento cada mensaje (ver
+`benchmarks/bench_extraction_batch.py`). Con router de modelos solo recibe
+los mensajes del modelo rápido.
+
+Los handlers asyncio (`app.async_handlers`) esperan su resultado con
+`extract_async` sin ocupar un thread; las llamadas en lote siguen corriendo
+en el executor del batcher.
+"""
+import asyncio
+import copy
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from app.gemini_usage import ExtractionUsage, GeminiCall, OUTCOME_BATCH
+
+logger = logging.getLogger(__name__)
+
+_batcher_lock = threading.Lock()
+
+_STOP = object()
+
+
+class _PendingExtraction:
+    """Mensaje a la espera de su resultado"""
+
+    __slots__ = ("text", "expires_at", "usage", "done", "notify", "result", "error", "resolved")
+
+    def __init__(self, text: str, timeout: float, usage: Optional[ExtractionUsage] = None):
+        self.text = text
+        self.usage = usage
+        self.expires_at = time.monotonic() + timeout
+        self.done = threading.Event()
+        # Avisa al event loop de un handler asyncio que el resultado está listo
+        self.notify: Optional[Callable[[], None]] = None
+        self.result: Optional[List[Dict]] = None
+        self.error: Optional[Exception] = None
+        # False si el mensaje no vino en la respuesta del lote
+        self.resolved = False
+
+
+def _wake(waiter: "asyncio.Future"):
+    """Completa el future de un handler asyncio (si no se rindió antes)"""
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _copy_error(error: Exception) -> Exception:
+    """
+    Copia una excepción para relanzarla en varios threads
+
+    Cada handler necesita su propia instancia (el traceback se guarda en la
+    excepción); en las de requests se conservan `response` y `request` para el
+    manejo de errores HTTP de `extract_expense_items`.
+    """
+    if isinstance(error, requests.exceptions.RequestException):
+        return type(error)(*error.args, response=error.response, request=error.request)
+    return copy.copy(error)
+
+
+class ExtractionBatcher:
+    """
+    Junta extracciones concurrentes en llamadas en lote a Gemini
+
+    Attributes:
+        max_batch_size: Máximo de mensajes por llamada
+        window: Segundos que se espera a más mensajes desde que llega el primero
+        max_inflight: Llamadas en lote simultáneas
+    """
+
+    def __init__(self, send_batch: Callable[[List[str], float], Tuple[Dict[int, Optional[List[Dict]]], GeminiCall]],
+                 send_one: Callable[[str, float, Optional[ExtractionUsage]], Optional[List[Dict]]],
+                 max_batch_size: int = 8, window_ms: float = 20.0, max_inflight: int = 4):
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000
+        self.max_inflight = max(1, max_inflight)
+        self._send_batch = send_batch
+        self._send_one = send_one
+        self._queue: "queue.Queue" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_inflight,
+                                            thread_name_prefix="gemini-batch")
+        self._collector: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._messages = 0
+        self._largest_batch = 0
+        self._fallbacks = 0
+        self._failed_calls = 0
+        self._wait_timeouts = 0
+        self._prompt_tokens = 0
+
+    def _ensure_started(self):
+        """Arranca el thread colector con la primera extracción"""
+        if self._collector is None:
+            with self._lock:
+                if self._collector is None:
+                    collector = threading.Thread(target=self._collect_loop, name="gemini-batcher", daemon=True)
+                    collector.start()
+                    self._collector = collector
+
+    def extract(self, text: str, timeout: float, usage: Optional[ExtractionUsage] = None) -> Optional[List[Dict]]:
+        """
+        Extrae un mensaje dentro del próximo lote
+
+        Args:
+            text: Texto del mensaje del usuario
+            timeout: Segundos que el handler puede esperar el resultado
+            usage: Opcional, consumo del mensaje (recibe su parte de los tokens del lote)
+
+        Returns:
+            Lista con los datos de cada gasto o None si el resultado no es válido
+
+        Raises:
+            requests.exceptions.RequestException: Si la llamada falla o el
+                resultado no llega a tiempo (Timeout)
+        """
+        self._ensure_started()
+        pending = _PendingExtraction(text, timeout, usage)
+        self._queue.put(pending)
+
+        if not pending.done.wait(timeout + self.window):
+            raise self._wait_timeout(timeout)
+        remaining = self._settle(pending)
+        if remaining is None:
+            return pending.result
+        return self._send_one(text, remaining, usage)
+
+    async def extract_async(self, text: str, timeout: float,
+                            send_one: Callable[[str, float, Optional[ExtractionUsage]], Awaitable[Optional[List[Dict]]]],
+                            usage: Optional[ExtractionUsage] = None) -> Optional[List[Dict]]:
+        """
+        Igual que `extract`, pero espera el lote en el event loop
+
+        Args:
+            text: Texto del mensaje del usuario
+            timeout: Segundos que el handler puede esperar el resultado
+            send_one: Corrutina que extrae el mensaje solo si no vino en la
+                respuesta del lote (el cliente async de Gemini)
+            usage: Opcional, consumo del mensaje
+
+        Returns:
+            Lista con los datos de cada gasto o None si el resultado no es válido
+
+        Raises:
+            requests.exceptions.RequestException: Igual que `extract`
+        """
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        pending = _PendingExtraction(text, timeout, usage)
+        pending.notify = lambda: loop.call_soon_threadsafe(_wake, waiter)
+        self._queue.put(pending)
+
+        try:
+            await asyncio.wait_for(waiter, timeout + self.window)
+        except asyncio.TimeoutError:
+            raise self._wait_timeout(timeout) from None
+        remaining = self._settle(pending)
+        if remaining is None:
+            return pending.result
+        return await send_one(text, remaining, usage)
+
+    def _wait_timeout(self, timeout: float) -> requests.exceptions.Timeout:
+        """Error para el handler cuyo lote no respondió a tiempo"""
+        with self._lock:
+            self._wait_timeouts += 1
+        return requests.exceptions.Timeout(f"El lote de Gemini no respondió en {timeout:.2f}s")
+
+    def _settle(self, pending: _PendingExtraction) -> Optional[float]:
+        """
+        Revisa el resultado de un mensaje cuyo lote ya terminó
+
+        Returns:
+            None si el mensaje ya tiene resultado; si Gemini no lo devolvió,
+            los segundos que quedan para extraerlo fuera del lote
+
+        Raises:
+            requests.exceptions.RequestException: Error de la llamada en lote o
+                Timeout si ya no queda tiempo
+        """
+        if pending.error is not None:
+            raise _copy_error(pending.error)
+        if pending.resolved:
+            return None
+
+        # Gemini no devolvió este mensaje: se extrae solo con lo que quede de tiempo
+        remaining = pending.expires_at - time.monotonic()
+        if remaining <= 0:
+            with self._lock:
+                self._wait_timeouts += 1
+            raise requests.exceptions.Timeout("Sin tiempo para extraer el mensaje fuera del lote")
+        with self._lock:
+            self._fallbacks += 1
+        return remaining
+
+    def _collect_loop(self):
+        """Arma lotes por ventana de tiempo o tamaño y los envía al executor"""
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            flush_at = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[_PendingExtraction]):
+        """Envía un lote y reparte los resultados"""
+        now = time.monotonic()
+        # Los handlers que ya se rindieron no ocupan lugar en la llamada
+        live = [pending for pending in batch if pending.expires_at > now]
+        try:
+            if not live:
+                return
+            # El timeout es el del handler con más margen; los demás dejan de
+            # esperar por su cuenta cuando se les acaba el tiempo
+            timeout = max(pending.expires_at for pending in live) - now
+            if len(live) == 1:
+                live[0].result = self._send_one(live[0].text, timeout, live[0].usage)
+                live[0].resolved = True
+                tokens = 0
+            else:
+                results, call = self._send_batch([pending.text for pending in live], timeout)
+                tokens = call.prompt_tokens
+                for position, pending in enumerate(live):
+                    # Cada mensaje carga su parte de la llamada, aunque no haya vuelto en la respuesta
+                    if pending.usage is not None:
+                        pending.usage.add_call(call, OUTCOME_BATCH, position, len(live))
+                    if position in results:
+                        pending.result = results[position]
+                        pending.resolved = True
+            with self._lock:
+                self._calls += 1
+                self._messages += len(live)
+                self._largest_batch = max(self._largest_batch, len(live))
+                self._prompt_tokens += tokens
+        except Exception as e:
+            with self._lock:
+                self._failed_calls += 1
+            for pending in live:
+                pending.error = e
+        finally:
+            for pending in batch:
+                pending.done.set()
+                if pending.notify is not None:
+                    try:
+                        pending.notify()
+                    except RuntimeError:
+                        # El event loop del handler ya se cerró
+                        pass
+
+    def stats(self) -> dict:
+        """
+        Contadores del batcher
+
+        `calls_saved` son las llamadas a Gemini que se evitaron respecto a una
+        por mensaje; `prompt_tokens` suma los tokens de entrada que reportó
+        Gemini en las llamadas en lote.
+
+        Returns:
+            Diccionario con los contadores
+        """
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "window_ms": round(self.window * 1000, 3),
+                "calls": self._calls,
+                "messages": self._messages,
+                "avg_batch_size": round(self._messages / self._calls, 2) if self._calls else 0.0,
+                "largest_batch": self._largest_batch,
+                "calls_saved": self._messages - self._calls,
+                "fallbacks": self._fallbacks,
+                "failed_calls": self._failed_calls,
+                "wait_timeouts": self._wait_timeouts,
+                "prompt_tokens": self._prompt_tokens,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Detiene el colector y espera los lotes en curso"""
+        if self._collector is not None:
+            self._queue.put(_STOP)
+            if wait:
+                self._collector.join()
+        self._executor.shutdown(wait=wait)
+
+
+def get_extraction_batcher(app) -> Optional[ExtractionBatcher]:
+    """
+    Obtiene (o crea de forma lazy) el batcher de extracción de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        ExtractionBatcher o None si EXTRACTION_BATCH_ENABLED está desactivado
+    """
+    if not app.config.get("EXTRACTION_BATCH_ENABLED"):
+        return None
+
+    batcher = app.extensions.get("extraction_batcher")
+    if batcher is None:
+        with _batcher_lock:
+            batcher = app.extensions.get("extraction_batcher")
+            if batcher is None:
+                # Import diferido: ai_services usa este módulo
+                from app.ai_services import request_batch_extraction, request_extraction
+                from app.http_clients import get_http_clients, CLIENT_GEMINI
+                from app.circuit_breaker import get_gemini_breaker
+
+                from app.model_router import get_model_router
+
+                # Los threads del batcher no tienen contexto de Flask
+                session = get_http_clients(app).session(CLIENT_GEMINI)
+                breaker = get_gemini_breaker(app)
+                # Con router de modelos, los lotes son de mensajes para el modelo rápido
+                router = get_model_router(app)
+                model = router.fast_model if router is not None else None
+                batcher = ExtractionBatcher(
+                    send_batch=lambda texts, timeout: request_batch_extraction(
+                        texts, timeout, session, breaker, model, router),
+                    send_one=lambda text, timeout, usage: request_extraction(
+                        text, timeout, session, breaker, usage, model, router),
+                    max_batch_size=app.config.get("EXTRACTION_BATCH_MAX_SIZE", 8),
+                    window_ms=app.config.get("EXTRACTION_BATCH_WINDOW_MS", 20.0),
+                    max_inflight=app.config.get("EXTRACTION_BATCH_MAX_INFLIGHT", 4),
+                )
+                app.extensions["extraction_batcher"] = batcher
+    return batcher
@@ -0,0 +1,337 @@
+"""
+Caché de resultados de extracción de Gemini
+
+Los usuarios repiten los mismos mensajes ("le debo 20000 a Carlos por el
+almuerzo") y cada repetición costaba una llamada a Gemini. Aquí se guardan los
+resultados ya validados (la lista de gastos del mensaje), con el texto
+normalizado como clave. Gemini devuelve
+la expresión de fecha sin resolver (`due_date_text`) y `due_date` se calcula
+al leer (ver `app.date_resolver`), así que un mismo resultado sirve cualquier
+día y para cualquier zona horaria.
+
+La caché en memoria es un LRU con TTL acotado por número de entradas y por
+bytes. Con backend "sqlite" además se comparte entre workers del mismo host a
+través de un archivo SQLite (mismo esquema que el store del rate limiter).
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_cache_lock = threading.Lock()
+
+# Cada cuántas escrituras en SQLite se purgan vencidos y se aplica el tope de bytes
+SQLITE_PURGE_EVERY = 200
+
+
+def normalize_message(text: str) -> str:
+    """
+    Normaliza un mensaje para usarlo como clave
+
+    Minúsculas, espacios colapsados y sin puntuación final; las tildes se
+    conservan porque cambian los nombres ("María").
+
+    Args:
+        text: Texto del mensaje del usuario
+
+    Returns:
+        Texto normalizado
+    """
+    return re.sub(r"\s+", " ", text).strip().rstrip(".!¡?¿ ").casefold()
+
+
+# Versión del formato guardado: sube cuando cambia la forma del resultado para
+# que las entradas viejas del archivo SQLite no se lean con el formato nuevo
+# (v2: lista de gastos por mensaje)
+CACHE_FORMAT_VERSION = 2
+
+
+def cache_key(text: str) -> str:
+    """Clave de caché: versión del formato y texto normalizado"""
+    return f"v{CACHE_FORMAT_VERSION}:{normalize_message(text)}"
+
+
+class SQLiteExtractionStore:
+    """
+    Resultados de extracción en un archivo SQLite compartido entre procesos
+
+    Attributes:
+        path: Ruta del archivo SQLite
+        max_bytes: Tope de bytes (clave + valor) que se conservan en el archivo
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS extraction_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                "size INTEGER NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Conexión SQLite por thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        """
+        Busca una entrada vigente
+
+        Returns:
+            Tupla (valor_json, expira_en) o None
+        """
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM extraction_cache WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, key: str, value: str, expires_at: float, size: int) -> int:
+        """
+        Guarda una entrada
+
+        Returns:
+            Entradas eliminadas por la purga (0 si no tocaba purgar)
+        """
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO extraction_cache (key, value, expires_at, size) VALUES (?, ?, ?, ?)",
+            (key, value, expires_at, size),
+        )
+        self._writes += 1
+        if self._writes % SQLITE_PURGE_EVERY == 0:
+            return self.purge(time.time())
+        return 0
+
+    def purge(self, now: float) -> int:
+        """
+        Elimina las entradas vencidas y las que expiran primero si se supera max_bytes
+
+        Returns:
+            Entradas eliminadas
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = conn.execute("DELETE FROM extraction_cache WHERE expires_at <= ?", (now,)).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extraction_cache").fetchone()[0]
+            if total > self.max_bytes:
+                excess, victims = total - self.max_bytes, []
+                for key, size in conn.execute("SELECT key, size FROM extraction_cache ORDER BY expires_at"):
+                    if excess <= 0:
+                        break
+                    victims.append((key,))
+                    excess -= size
+                conn.executemany("DELETE FROM extraction_cache WHERE key = ?", victims)
+                removed += len(victims)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return removed
+
+
+class ExtractionCache:
+    """
+    LRU con TTL de resultados de extracción, acotado por entradas y bytes
+
+    Attributes:
+        max_entries: Máximo de resultados en memoria
+        max_bytes: Máximo de bytes (clave + valor JSON) en memoria y en SQLite
+        ttl_seconds: Tiempo que se reutiliza un resultado
+        backend: "memory" o "sqlite"
+    """
+
+    def __init__(self, max_entries: int = 5000, max_bytes: int = 5 * 1024 * 1024,
+                 ttl_seconds: int = 86400, backend: str = "memory",
+                 sqlite_path: Optional[str] = None):
+        if backend not in ("memory", "sqlite"):
+            raise ValueError(f"Backend de caché de extracción desconocido: {backend}")
+
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.store = SQLiteExtractionStore(sqlite_path, self.max_bytes) if backend == "sqlite" else None
+
+        # clave -> (valor_json, expira_en, bytes); expira_en en time.time()
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expired = 0
+        self._store_errors = 0
+
+    def get(self, text: str) -> Optional[List[Dict]]:
+        """
+        Busca el resultado de un mensaje
+
+        Args:
+            text: Texto del mensaje del usuario
+
+        Returns:
+            Copia de los gastos guardados o None
+        """
+        key = cache_key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return json.loads(entry[0])
+                self._remove(key)
+                self._expired += 1
+
+        stored = self._store_get(key, now)
+        with self._lock:
+            if stored is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._insert(key, stored[0], stored[1])
+        return json.loads(stored[0])
+
+    def put(self, text: str, data: List[Dict]):
+        """
+        Guarda un resultado ya validado
+
+        Args:
+            text: Texto del mensaje del usuario
+            data: Gastos extraídos del mensaje (con `due_date_text`, sin resolver)
+        """
+        key = cache_key(text)
+        value = json.dumps(data, ensure_ascii=False)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            if not self._insert(key, value, expires_at):
+                return
+
+        if self.store is not None:
+            try:
+                removed = self.store.put(key, value, expires_at, _entry_size(key, value))
+            except sqlite3.Error as e:
+                self._store_error("guardar", e)
+                return
+            if removed:
+                log_operation(logger, "EXTRACTION_CACHE_PURGE",
+                              f"Entradas de caché de extracción purgadas en SQLite: {removed}",
+                              error_code=ErrorCodes.OP_SUCCESS)
+
+    def _store_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        """Consulta el store compartido; si falla se trata como fallo de caché"""
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(key, now)
+        except sqlite3.Error as e:
+            self._store_error("leer", e)
+            return None
+
+    def _store_error(self, action: str, error: Exception):
+        """Registra un error del store SQLite sin interrumpir la extracción"""
+        with self._lock:
+            self._store_errors += 1
+        log_error(logger, ErrorCodes.ERR_DB_QUERY,
+                  f"Error al {action} en la caché de extracción: {str(error)}",
+                  exception=error)
+
+    def _insert(self, key: str, value: str, expires_at: float) -> bool:
+        """Inserta en memoria y desaloja por entradas/bytes (requiere _lock)"""
+        size = _entry_size(key, value)
+        if size > self.max_bytes:
+            return False
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._evictions += 1
+        return True
+
+    def _remove(self, key: str):
+        """Elimina una entrada de memoria (requiere _lock)"""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        """
+        Contadores de la caché
+
+        Returns:
+            Diccionario con los contadores
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "backend": self.backend,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expired": self._expired,
+                "store_errors": self._store_errors,
+            }
+
+
+def _entry_size(key: str, value: str) -> int:
+    """Bytes que ocupa una entrada (clave + valor en UTF-8)"""
+    return len(key.encode("utf-8")) + len(value.encode("utf-8"))
+
+
+def get_extraction_cache(app) -> Optional[ExtractionCache]:
+    """
+    Obtiene (o crea de forma lazy) la caché de extracción de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        ExtractionCache o None si EXTRACTION_CACHE_ENABLED está desactivado
+    """
+    if not app.config.get("EXTRACTION_CACHE_ENABLED"):
+        return None
+
+    cache = app.extensions.get("extraction_cache")
+    if cache is None:
+        with _cache_lock:
+            cache = app.extensions.get("extraction_cache")
+            if cache is None:
+                cache = ExtractionCache(
+                    max_entries=app.config.get("EXTRACTION_CACHE_MAX_ENTRIES", 5000),
+                    max_bytes=app.config.get("EXTRACTION_CACHE_MAX_BYTES", 5 * 1024 * 1024),
+                    ttl_seconds=app.config.get("EXTRACTION_CACHE_TTL_SECONDS", 86400),
+                    backend=app.config.get("EXTRACTION_CACHE_BACKEND", "memory"),
+                    sqlite_path=app.config.get("EXTRACTION_CACHE_SQLITE_PATH"),
+                )
+                app.extensions["extraction_cache"] = cache
+    return cache
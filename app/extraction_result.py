@@ -0,0 +1,317 @@
+"""
+Resultado tipado de la extracción de Gemini y parser estricto de respuestas
+
+Antes, cada respuesta se recorría a mano (candidates/content/parts), se le
+quitaban los bloques ```json con reemplazos de texto y los campos se validaban
+uno por uno en un diccionario. Aquí la respuesta se lee por el camino directo
+y el JSON se convierte en un `ExtractionResult` en una sola pasada que valida
+tipos y aplica los mismos valores por defecto (moneda COP, acción "debt").
+
+Un mensaje puede describir varios gastos ("gasté 50000 en cine con Julieth y
+20000 en taxi con Carlos"): Gemini devuelve un arreglo con un objeto por gasto
+y `ExtractionResult.list_from_json` los valida todos o ninguno.
+
+Con GEMINI_STRUCTURED_OUTPUT, generateContent recibe `responseMimeType`
+application/json y `RESPONSE_SCHEMA`, así que Gemini devuelve JSON compacto
+sin markdown y con los tipos del esquema. `parse_stats` cuenta los resultados
+válidos, los fallos por motivo y los tokens de salida que reporta Gemini.
+"""
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+ACTIONS = ("debt", "expense")
+DEFAULT_ACTION = "debt"
+DEFAULT_CURRENCY = "COP"
+
+# Motivos de fallo de parseo (claves de `failure_reasons` en /health)
+REASON_STRUCTURE = "structure"
+REASON_EMPTY = "empty"
+REASON_TRUNCATED = "truncated"
+REASON_JSON = "json"
+REASON_NOT_OBJECT = "not_object"
+REASON_MISSING_FIELD = "missing_field"
+REASON_INVALID_FIELD = "invalid_field"
+
+# Tope de gastos por mensaje (una respuesta con más se descarta completa)
+MAX_ITEMS_PER_MESSAGE = 10
+
+# Esquema de un gasto (subconjunto OpenAPI que acepta responseSchema)
+EXPENSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "amount": {"type": "NUMBER"},
+        "currency": {"type": "STRING"},
+        "description": {"type": "STRING"},
+        "category": {"type": "STRING", "nullable": True},
+        "action": {"type": "STRING", "enum": list(ACTIONS)},
+        "debtor_name": {"type": "STRING", "nullable": True},
+        "due_date_text": {"type": "STRING", "nullable": True},
+    },
+    "required": ["amount", "currency", "description", "action"],
+    "propertyOrdering": ["amount", "currency", "description", "category",
+                         "action", "debtor_name", "due_date_text"],
+}
+
+# Respuesta de un mensaje: un gasto por elemento
+RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": EXPENSE_SCHEMA,
+}
+
+# Lote: un objeto por mensaje con su número en "index" y sus gastos
+# ("expenses" vacío si el mensaje no es un gasto)
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"index": {"type": "INTEGER"}, "expenses": RESPONSE_SCHEMA},
+        "required": ["index", "expenses"],
+        "propertyOrdering": ["index", "expenses"],
+    },
+}
+
+
+class ExtractionError(ValueError):
+    """La respuesta de Gemini no se pudo convertir en un ExtractionResult"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _optional_text(data: Dict, field: str) -> Optional[str]:
+    """Campo de texto opcional: None, ausente o string"""
+    value = data.get(field)
+    if value is None or isinstance(value, str):
+        return value
+    raise ExtractionError(REASON_INVALID_FIELD, f"Campo '{field}' inválido: {value!r}")
+
+
+class ExtractionResult:
+    """
+    Gasto extraído por Gemini, ya validado
+
+    Attributes:
+        amount: Monto (> 0)
+        currency: Código de moneda
+        description: Concepto del gasto
+        category: Categoría (opcional)
+        action: "debt" o "expense"
+        debtor_name: Persona mencionada (opcional)
+        due_date_text: Expresión de fecha sin resolver (opcional)
+    """
+
+    __slots__ = ("amount", "currency", "description", "category", "action", "debtor_name", "due_date_text")
+
+    def __init__(self, amount: float, currency: str, description: str, action: str,
+                 category: Optional[str] = None, debtor_name: Optional[str] = None,
+                 due_date_text: Optional[str] = None):
+        self.amount = amount
+        self.currency = currency
+        self.description = description
+        self.category = category
+        self.action = action
+        self.debtor_name = debtor_name
+        self.due_date_text = due_date_text
+
+    @classmethod
+    def from_json(cls, data: Any) -> "ExtractionResult":
+        """
+        Valida el objeto JSON de un gasto en una sola pasada
+
+        Moneda vacía -> COP; acción desconocida -> "debt" (mismas reglas que
+        el prompt). El resto de los campos deben tener el tipo del esquema.
+
+        Args:
+            data: Objeto JSON decodificado
+
+        Returns:
+            ExtractionResult
+
+        Raises:
+            ExtractionError: Si no es un objeto, falta un campo requerido o un tipo no corresponde
+        """
+        if not isinstance(data, dict):
+            raise ExtractionError(REASON_NOT_OBJECT, "La respuesta de Gemini no es un objeto JSON")
+        try:
+            amount = data["amount"]
+            currency = data["currency"]
+            description = data["description"]
+            action = data["action"]
+        except KeyError as e:
+            raise ExtractionError(REASON_MISSING_FIELD,
+                                  f"Campo requerido '{e.args[0]}' no encontrado en la respuesta de Gemini") from None
+
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+            raise ExtractionError(REASON_INVALID_FIELD, f"Monto inválido: {amount!r}")
+        if currency is not None and not isinstance(currency, str):
+            raise ExtractionError(REASON_INVALID_FIELD, f"Moneda inválida: {currency!r}")
+        if description is not None and not isinstance(description, str):
+            raise ExtractionError(REASON_INVALID_FIELD, f"Descripción inválida: {description!r}")
+
+        return cls(
+            amount=amount,
+            currency=currency or DEFAULT_CURRENCY,
+            description=description,
+            action=action if action in ACTIONS else DEFAULT_ACTION,
+            category=_optional_text(data, "category"),
+            debtor_name=_optional_text(data, "debtor_name"),
+            due_date_text=_optional_text(data, "due_date_text"),
+        )
+
+    @classmethod
+    def list_from_json(cls, data: Any) -> List["ExtractionResult"]:
+        """
+        Valida los gastos de un mensaje
+
+        Acepta el arreglo de gastos, un objeto con la clave "expenses" (elemento
+        de un lote) o un único objeto de gasto (formato anterior, que el modo
+        texto libre todavía puede devolver). Si un gasto es inválido se
+        descarta el mensaje completo: guardar solo una parte confundiría al
+        usuario.
+
+        Args:
+            data: JSON decodificado
+
+        Returns:
+            Lista de ExtractionResult en el orden del mensaje (al menos uno)
+
+        Raises:
+            ExtractionError: Sin gastos, con más de MAX_ITEMS_PER_MESSAGE o con un gasto inválido
+        """
+        if isinstance(data, dict) and "expenses" in data:
+            data = data["expenses"]
+        if isinstance(data, dict):
+            return [cls.from_json(data)]
+        if not isinstance(data, list):
+            raise ExtractionError(REASON_NOT_OBJECT, "La respuesta de Gemini no es un arreglo de gastos")
+        if not data:
+            raise ExtractionError(REASON_EMPTY, "La respuesta de Gemini no trae gastos")
+        if len(data) > MAX_ITEMS_PER_MESSAGE:
+            raise ExtractionError(REASON_INVALID_FIELD,
+                                  f"La respuesta de Gemini trae {len(data)} gastos (máximo {MAX_ITEMS_PER_MESSAGE})")
+        return [cls.from_json(item) for item in data]
+
+    def to_dict(self) -> Dict:
+        """Diccionario con las claves que usan la caché, el resolutor de fechas y los handlers"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ExtractionResult):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"ExtractionResult({fields})"
+
+
+def response_text(response_data: Dict) -> str:
+    """
+    Texto generado de una respuesta de generateContent
+
+    Args:
+        response_data: JSON de respuesta de Gemini
+
+    Returns:
+        Texto del primer candidato
+
+    Raises:
+        ExtractionError: Sin candidato, vacío o cortado por maxOutputTokens
+    """
+    try:
+        candidate = response_data["candidates"][0]
+        text = candidate["content"]["parts"][0]["text"]
+    except (KeyError, IndexError, TypeError):
+        raise ExtractionError(REASON_STRUCTURE,
+                              "La respuesta de Gemini no trae candidates/content/parts") from None
+    if candidate.get("finishReason") == "MAX_TOKENS":
+        raise ExtractionError(REASON_TRUNCATED, "La respuesta de Gemini se cortó por maxOutputTokens")
+    if not text or text.isspace():
+        raise ExtractionError(REASON_EMPTY, "La respuesta de Gemini está vacía")
+    return text
+
+
+def decode_json(text: str) -> Any:
+    """
+    Decodifica el JSON generado
+
+    El modo estructurado devuelve JSON puro; en texto libre Gemini a veces lo
+    envuelve en un bloque ```json, que se recorta solo si está presente.
+
+    Raises:
+        ExtractionError: Si el texto no es JSON válido
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text[3:-3] if text.endswith("```") else text[3:]
+        if text.startswith("json"):
+            text = text[4:]
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise ExtractionError(REASON_JSON, f"Error al parsear JSON de Gemini: {e}") from None
+
+
+def output_tokens(response_data: Dict) -> int:
+    """Tokens de salida que reporta Gemini en usageMetadata (0 si no vienen)"""
+    return int(response_data.get("usageMetadata", {}).get("candidatesTokenCount") or 0)
+
+
+class ParseStats:
+    """Contadores thread-safe de parseo de respuestas de Gemini"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._responses = 0
+        self._parsed = 0
+        self._failures: Dict[str, int] = {}
+        self._output_tokens = 0
+
+    def record_response(self, tokens: int):
+        """Registra una respuesta recibida y sus tokens de salida"""
+        with self._lock:
+            self._responses += 1
+            self._output_tokens += tokens
+
+    def record_parsed(self, count: int = 1):
+        """Registra gastos convertidos en ExtractionResult"""
+        with self._lock:
+            self._parsed += count
+
+    def record_failure(self, reason: str):
+        """Registra un fallo de parseo (de la respuesta o de un elemento del lote)"""
+        with self._lock:
+            self._failures[reason] = self._failures.get(reason, 0) + 1
+
+    def stats(self, structured: bool) -> dict:
+        """
+        Contadores de parseo
+
+        `failure_rate` es fallos / (gastos válidos + fallos); en un lote cada
+        elemento cuenta por separado.
+
+        Args:
+            structured: Si GEMINI_STRUCTURED_OUTPUT está activo (se reporta como `mode`)
+
+        Returns:
+            Diccionario con los contadores
+        """
+        with self._lock:
+            failures = sum(self._failures.values())
+            attempts = self._parsed + failures
+            return {
+                "mode": "structured" if structured else "text",
+                "responses": self._responses,
+                "parsed": self._parsed,
+                "failures": failures,
+                "failure_rate": round(failures / attempts, 4) if attempts else 0.0,
+                "failure_reasons": dict(self._failures),
+                "output_tokens": self._output_tokens,
+                "avg_output_tokens": round(self._output_tokens / self._responses, 1) if self._responses else 0.0,
+            }
+
+
+# Contadores del proceso (los usan la ruta síncrona, el batcher y la app ASGI)
+parse_stats = ParseStats()
@@ -0,0 +1,161 @@
+"""
+Llamadas a Telegram en paralelo dentro de un update
+
+El pago de una deuda por botón encadenaba, ya confirmado el commit, la
+respuesta al callback, el comprobante y la edición del teclado: tres idas y
+vueltas a Telegram una detrás de otra, con el spinner del botón girando
+hasta la primera. FanoutPool las lanza en un pool de threads compartido
+para que viajen a la vez mientras el thread del update sigue con la consulta
+de las deudas restantes.
+
+Cada tarea corre en un contexto de aplicación propio con el deadline del
+update que la lanzó (y el HeldOutbox del lote de long polling, si lo hay), así
+que `send_message` y compañía usan el mismo presupuesto y las mismas sesiones
+HTTP que en el thread del update.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Optional
+
+from flask import g
+
+from app.deadline import current_deadline
+from app.webhook_reply import current_outbox
+from app.logger_config import log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_fanout_lock = threading.Lock()
+
+
+class FanoutPool:
+    """
+    Pool de threads para llamadas salientes de un update
+
+    Attributes:
+        app: Aplicación Flask (cada tarea corre en su contexto)
+        workers: Threads del pool
+    """
+
+    def __init__(self, app, workers: int = 8):
+        self.app = app
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="telegram-fanout")
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._inflight = 0
+        self._peak_inflight = 0
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Lanza `func(*args, **kwargs)` en el pool con el deadline del update en curso
+
+        Args:
+            func: Función a ejecutar (send_message, edit_message_text, ...)
+
+        Returns:
+            Future con el resultado de la función
+        """
+        deadline = current_deadline()
+        outbox = current_outbox()
+        with self._lock:
+            self._submitted += 1
+            self._inflight += 1
+            self._peak_inflight = max(self._peak_inflight, self._inflight)
+        return self._executor.submit(self._run, deadline, outbox, func, args, kwargs)
+
+    def _run(self, deadline, outbox, func: Callable, args: tuple, kwargs: dict):
+        """Ejecuta la tarea en un contexto de aplicación con el deadline del update"""
+        try:
+            with self.app.app_context():
+                if deadline is not None:
+                    g.deadline = deadline
+                if outbox is not None:
+                    g.held_outbox = outbox
+                return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def stats(self) -> dict:
+        """
+        Contadores del pool
+
+        Returns:
+            Diccionario con threads, tareas lanzadas y en vuelo
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "submitted": self._submitted,
+                "inflight": self._inflight,
+                "peak_inflight": self._peak_inflight,
+            }
+
+
+def get_fanout_pool(app) -> Optional[FanoutPool]:
+    """
+    Obtiene (o crea de forma lazy) el pool de llamadas en paralelo de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        FanoutPool o None si TELEGRAM_FANOUT_ENABLED está desactivado
+    """
+    if not app.config.get("TELEGRAM_FANOUT_ENABLED"):
+        return None
+
+    pool = app.extensions.get("telegram_fanout")
+    if pool is None:
+        with _fanout_lock:
+            pool = app.extensions.get("telegram_fanout")
+            if pool is None:
+                pool = FanoutPool(app, workers=app.config.get("TELEGRAM_FANOUT_WORKERS", 8))
+                app.extensions["telegram_fanout"] = pool
+    return pool
+
+
+def fan_out(app, func: Callable, *args, **kwargs) -> Future:
+    """
+    Lanza una llamada en el pool o, sin pool, la ejecuta en el thread actual
+
+    Args:
+        app: Instancia de la aplicación Flask
+        func: Función a ejecutar
+
+    Returns:
+        Future con el resultado (ya resuelto si se ejecutó en el thread actual)
+    """
+    pool = get_fanout_pool(app)
+    if pool is not None:
+        return pool.submit(func, *args, **kwargs)
+
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def wait_all(futures: Iterable[Future]):
+    """
+    Espera a que terminen las llamadas lanzadas con `fan_out`
+
+    El tope es el presupuesto del update (las funciones de Telegram ya lo
+    respetan en sus timeouts); sin deadline espera sin límite.
+
+    Args:
+        futures: Futures de `fan_out`
+    """
+    deadline = current_deadline()
+    started = time.monotonic()
+    timeout = max(0.0, deadline.remaining()) if deadline is not None else None
+    _, pending = wait(list(futures), timeout=timeout)
+    if pending:
+        log_error(logger, ErrorCodes.ERR_DEADLINE_EXCEEDED,
+                  f"{len(pending)} llamadas en paralelo siguen en curso tras "
+                  f"{time.monotonic() - started:.1f}s")
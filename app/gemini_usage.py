@@ -0,0 +1,490 @@
+"""
+Consumo de Gemini: tokens, latencia y costo por mensaje
+
+Cada mensaje que pasa por la extracción deja un ExtractionUsage con la ruta
+que siguió (extractor local, caché, Gemini, lote, respaldo local o fallo), el
+modelo, los tokens que reportó Gemini en `usageMetadata` y la latencia de la
+extracción. UsageAccounting los agrega en memoria de forma global, por
+modelo, por ruta, por usuario y por forma del mensaje (largo del texto y
+gastos extraídos), con un histograma de latencia por grupo; /health expone
+el resumen.
+
+Cada GEMINI_USAGE_FLUSH_SECONDS un thread vuelca lo acumulado desde el último
+volcado a la tabla `gemini_usage` (una fila por usuario, modelo, ruta y
+forma), que permite ver qué usuarios y qué mensajes concentran el costo.
+"""
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_usage_lock = threading.Lock()
+
+# Rutas de la extracción de un mensaje
+OUTCOME_LOCAL = "local"
+OUTCOME_CACHE = "cache"
+OUTCOME_GEMINI = "gemini"
+OUTCOME_BATCH = "batch"
+OUTCOME_FALLBACK = "fallback"
+OUTCOME_FAILED = "failed"
+
+# Límites superiores (ms) de las cubetas del histograma de latencia; la última
+# cubeta cuenta lo que supera el mayor límite
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 5000, 10000)
+
+# Cubetas de largo del mensaje para la forma (caracteres)
+TEXT_LENGTH_BUCKETS = (40, 120)
+
+# Usuarios que se listan en /health (los de más tokens)
+TOP_USERS = 10
+
+
+@dataclass(frozen=True)
+class GeminiCall:
+    """
+    Una llamada HTTP a generateContent
+
+    Attributes:
+        model: Modelo que respondió (`modelVersion`, o el configurado)
+        prompt_tokens: Tokens de entrada
+        candidate_tokens: Tokens de respuesta
+        total_tokens: Tokens totales (incluye los de razonamiento)
+        latency: Segundos de la llamada, reintentos incluidos
+    """
+    model: str
+    prompt_tokens: int = 0
+    candidate_tokens: int = 0
+    total_tokens: int = 0
+    latency: float = 0.0
+
+    @classmethod
+    def from_response(cls, response_data: Dict, latency: float, model: str) -> "GeminiCall":
+        """
+        Lee `usageMetadata` y `modelVersion` de una respuesta de generateContent
+
+        Args:
+            response_data: JSON de respuesta de Gemini
+            latency: Segundos que tardó la llamada
+            model: Modelo configurado (si la respuesta no trae `modelVersion`)
+
+        Returns:
+            GeminiCall con los tokens reportados (0 si no vienen)
+        """
+        metadata = response_data.get('usageMetadata') or {}
+        prompt = int(metadata.get('promptTokenCount') or 0)
+        candidates = int(metadata.get('candidatesTokenCount') or 0)
+        total = int(metadata.get('totalTokenCount') or 0) or (
+            prompt + candidates + int(metadata.get('thoughtsTokenCount') or 0))
+        return cls(model=response_data.get('modelVersion') or model, prompt_tokens=prompt,
+                   candidate_tokens=candidates, total_tokens=total, latency=latency)
+
+
+class ExtractionUsage:
+    """
+    Consumo de la extracción de un mensaje
+
+    Se crea al empezar la extracción (de ahí se mide la latencia) y cada capa
+    anota lo que hizo: la caché marca su acierto y las llamadas a Gemini
+    suman sus tokens.
+
+    Attributes:
+        outcome: Ruta de la extracción (OUTCOME_*) o None si aún no se sabe
+        model: Modelo de Gemini ("" si no se llamó)
+        calls: Llamadas HTTP a Gemini atribuidas al mensaje
+        gemini_latency: Segundos de esas llamadas (la de un lote, solo en la posición 0)
+    """
+
+    __slots__ = ("outcome", "model", "calls", "prompt_tokens", "candidate_tokens", "total_tokens",
+                 "gemini_latency", "started", "latency")
+
+    def __init__(self):
+        self.outcome: Optional[str] = None
+        self.model = ""
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.candidate_tokens = 0
+        self.total_tokens = 0
+        self.gemini_latency = 0.0
+        self.started = time.perf_counter()
+        self.latency: Optional[float] = None
+
+    def add_call(self, call: GeminiCall, outcome: str = OUTCOME_GEMINI, index: int = 0, count: int = 1):
+        """
+        Atribuye al mensaje una llamada a Gemini (o su parte de una en lote)
+
+        En un lote de `count` mensajes los tokens se reparten en partes
+        iguales (el resto va al primero) y la llamada cuenta solo para el
+        mensaje en la posición 0.
+
+        Args:
+            call: Llamada a Gemini
+            outcome: OUTCOME_GEMINI o OUTCOME_BATCH
+            index: Posición del mensaje en el lote
+            count: Mensajes del lote
+        """
+        count = max(1, count)
+
+        def share(tokens: int) -> int:
+            return tokens // count + (tokens % count if index == 0 else 0)
+
+        self.outcome = outcome
+        self.model = call.model
+        self.prompt_tokens += share(call.prompt_tokens)
+        self.candidate_tokens += share(call.candidate_tokens)
+        self.total_tokens += share(call.total_tokens)
+        if index == 0:
+            self.calls += 1
+            self.gemini_latency += call.latency
+
+    def finish(self) -> float:
+        """Fija y devuelve la latencia de la extracción (segundos desde que se creó)"""
+        if self.latency is None:
+            self.latency = time.perf_counter() - self.started
+        return self.latency
+
+
+def message_shape(text: str, items: int) -> str:
+    """
+    Forma del mensaje para agrupar el consumo
+
+    Args:
+        text: Texto del mensaje
+        items: Gastos extraídos
+
+    Returns:
+        Cadena "<largo>/<gastos>", ej: "<=40/1", "41-120/2", ">120/3+"
+    """
+    short, medium = TEXT_LENGTH_BUCKETS
+    length = len(text or "")
+    if length <= short:
+        size = f"<={short}"
+    elif length <= medium:
+        size = f"{short + 1}-{medium}"
+    else:
+        size = f">{medium}"
+    return f"{size}/{items if items < 3 else '3+'}"
+
+
+class UsageCounters:
+    """Contadores e histograma de latencia de un grupo de mensajes"""
+
+    __slots__ = ("messages", "calls", "prompt_tokens", "candidate_tokens", "total_tokens", "cost_usd",
+                 "gemini_ms", "latency_ms_sum", "latency_ms_max", "histogram")
+
+    def __init__(self):
+        self.messages = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.candidate_tokens = 0
+        self.total_tokens = 0
+        self.cost_usd = 0.0
+        self.gemini_ms = 0.0
+        self.latency_ms_sum = 0.0
+        self.latency_ms_max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, usage: ExtractionUsage, cost: float):
+        """Suma un mensaje"""
+        latency_ms = usage.finish() * 1000
+        self.messages += 1
+        self.calls += usage.calls
+        self.prompt_tokens += usage.prompt_tokens
+        self.candidate_tokens += usage.candidate_tokens
+        self.total_tokens += usage.total_tokens
+        self.cost_usd += cost
+        self.gemini_ms += usage.gemini_latency * 1000
+        self.latency_ms_sum += latency_ms
+        self.latency_ms_max = max(self.latency_ms_max, latency_ms)
+        bucket = len(LATENCY_BUCKETS_MS)
+        for position, limit in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= limit:
+                bucket = position
+                break
+        self.histogram[bucket] += 1
+
+    def merge(self, other: "UsageCounters"):
+        """Suma los contadores de otro grupo"""
+        for name in ("messages", "calls", "prompt_tokens", "candidate_tokens", "total_tokens",
+                     "cost_usd", "gemini_ms", "latency_ms_sum"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.latency_ms_max = max(self.latency_ms_max, other.latency_ms_max)
+        self.histogram = [mine + theirs for mine, theirs in zip(self.histogram, other.histogram)]
+
+    def _percentile_ms(self, pct: float) -> float:
+        """Percentil estimado: límite superior de la cubeta que lo contiene"""
+        if not self.messages:
+            return 0.0
+        target = pct / 100 * self.messages
+        seen = 0
+        for position, count in enumerate(self.histogram):
+            seen += count
+            if seen >= target and count:
+                if position < len(LATENCY_BUCKETS_MS):
+                    return round(min(LATENCY_BUCKETS_MS[position], self.latency_ms_max), 2)
+                break
+        return round(self.latency_ms_max, 2)
+
+    def histogram_dict(self) -> Dict[str, int]:
+        """Histograma como {"<=100": n, ..., ">10000": n}"""
+        labels = [f"<={limit}" for limit in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        return dict(zip(labels, self.histogram))
+
+    def snapshot(self) -> dict:
+        """Resumen para /health"""
+        return {
+            "messages": self.messages,
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "candidate_tokens": self.candidate_tokens,
+            "total_tokens": self.total_tokens,
+            "tokens_per_message": round(self.total_tokens / self.messages, 1) if self.messages else 0.0,
+            "cost_usd": round(self.cost_usd, 6),
+            "avg_call_ms": round(self.gemini_ms / self.calls, 2) if self.calls else 0.0,
+            "avg_latency_ms": round(self.latency_ms_sum / self.messages, 2) if self.messages else 0.0,
+            "p50_latency_ms": self._percentile_ms(50),
+            "p95_latency_ms": self._percentile_ms(95),
+            "max_latency_ms": round(self.latency_ms_max, 2),
+            "latency_histogram": self.histogram_dict(),
+        }
+
+
+class UsageAccounting:
+    """
+    Agregado en memoria del consumo de Gemini con volcado periódico a la DB
+
+    Attributes:
+        input_price: USD por millón de tokens de entrada
+        output_price: USD por millón de tokens de salida (respuesta y razonamiento)
+        flush_seconds: Segundos entre volcados (0 desactiva el volcado)
+    """
+
+    def __init__(self, input_price: float = 0.30, output_price: float = 2.50, flush_seconds: float = 60.0):
+        self.input_price = input_price
+        self.output_price = output_price
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._total = UsageCounters()
+        self._by_outcome: Dict[str, UsageCounters] = {}
+        self._by_model: Dict[str, UsageCounters] = {}
+        self._by_user: Dict[Optional[int], UsageCounters] = {}
+        self._by_shape: Dict[str, UsageCounters] = {}
+        # Lo acumulado desde el último volcado, por (usuario, modelo, ruta, forma)
+        self._pending: Dict[Tuple[Optional[int], str, str, str], UsageCounters] = {}
+        self._period_start = datetime.utcnow()
+        self._last_flush = time.monotonic()
+        self._flushes = 0
+        self._flushed_rows = 0
+        self._flush_errors = 0
+
+    def cost(self, usage: ExtractionUsage) -> float:
+        """
+        Costo estimado en USD de un mensaje
+
+        Los tokens de razonamiento no vienen en `candidatesTokenCount` pero se
+        cobran como salida: todo lo que no es entrada se cobra a precio de salida.
+        """
+        output = max(0, usage.total_tokens - usage.prompt_tokens)
+        return (usage.prompt_tokens * self.input_price + output * self.output_price) / 1_000_000
+
+    def record(self, user_id: Optional[int], text: str, usage: ExtractionUsage, items: int):
+        """
+        Agrega el consumo de un mensaje
+
+        Args:
+            user_id: ID interno del usuario
+            text: Texto del mensaje (para su forma)
+            usage: Consumo de la extracción
+            items: Gastos extraídos
+        """
+        usage.finish()
+        outcome = usage.outcome or (OUTCOME_GEMINI if usage.calls else OUTCOME_FAILED)
+        shape = message_shape(text, items)
+        cost = self.cost(usage)
+        with self._lock:
+            for groups, key in ((self._by_outcome, outcome), (self._by_model, usage.model),
+                                (self._by_user, user_id), (self._by_shape, shape),
+                                (self._pending, (user_id, usage.model, outcome, shape))):
+                counters = groups.get(key)
+                if counters is None:
+                    counters = groups[key] = UsageCounters()
+                counters.add(usage, cost)
+            self._total.add(usage, cost)
+
+    def schedule_flush(self, app):
+        """
+        Vuelca en un thread si pasó el intervalo y no hay otro volcado en curso
+
+        Args:
+            app: Instancia de la aplicación Flask
+        """
+        if self.flush_seconds <= 0 or time.monotonic() - self._last_flush < self.flush_seconds:
+            return
+        if not self._pending or not self._flush_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._flush_thread, args=(app,), name="gemini-usage-flush", daemon=True).start()
+
+    def _flush_thread(self, app):
+        """Cuerpo del thread de volcado (libera _flush_lock al terminar)"""
+        try:
+            self.flush(app)
+        finally:
+            self._flush_lock.release()
+
+    def flush(self, app) -> int:
+        """
+        Escribe en `gemini_usage` lo acumulado desde el último volcado
+
+        Un solo INSERT con una fila por (usuario, modelo, ruta, forma). Si la
+        escritura falla, los contadores vuelven a quedar pendientes para el
+        siguiente volcado.
+
+        Args:
+            app: Instancia de la aplicación Flask
+
+        Returns:
+            Filas escritas
+        """
+        # Import diferido: app.models importa la aplicación
+        from app import db
+        from app.models import GeminiUsage
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            period_start, period_end = self._period_start, datetime.utcnow()
+            self._period_start = period_end
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        rows = [{
+            'period_start': period_start,
+            'period_end': period_end,
+            'user_id': user_id,
+            'model': model,
+            'outcome': outcome,
+            'shape': shape,
+            'messages': counters.messages,
+            'calls': counters.calls,
+            'prompt_tokens': counters.prompt_tokens,
+            'candidate_tokens': counters.candidate_tokens,
+            'total_tokens': counters.total_tokens,
+            'cost_usd': round(counters.cost_usd, 6),
+            'latency_ms_sum': round(counters.latency_ms_sum, 3),
+            'latency_ms_max': round(counters.latency_ms_max, 3),
+            'latency_histogram': json.dumps(counters.histogram_dict()),
+        } for (user_id, model, outcome, shape), counters in pending.items()]
+
+        with app.app_context():
+            try:
+                db.session.execute(insert(GeminiUsage), rows)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                with self._lock:
+                    for key, counters in pending.items():
+                        merged = self._pending.get(key)
+                        if merged is None:
+                            merged = self._pending[key] = UsageCounters()
+                        merged.merge(counters)
+                    self._period_start = min(self._period_start, period_start)
+                    self._flush_errors += 1
+                log_error(logger, ErrorCodes.ERR_USAGE_FLUSH,
+                          f"Error volcando el consumo de Gemini: {str(e)}",
+                          data_dict={"rows": len(rows)},
+                          exception=e)
+                return 0
+
+        with self._lock:
+            self._flushes += 1
+            self._flushed_rows += len(rows)
+        log_operation(logger, "GEMINI_USAGE_FLUSH",
+                      f"Consumo de Gemini volcado: filas={len(rows)}, "
+                      f"mensajes={sum(counters.messages for counters in pending.values())}",
+                      error_code=ErrorCodes.OP_SUCCESS)
+        return len(rows)
+
+    def stats(self) -> dict:
+        """
+        Resumen del consumo desde que arrancó el proceso
+
+        Returns:
+            Diccionario con totales, desglose por ruta, modelo y forma, los
+            usuarios con más tokens y el estado del volcado
+        """
+        with self._lock:
+            top_users = sorted(self._by_user.items(), key=lambda item: item[1].total_tokens, reverse=True)
+            return {
+                "total": self._total.snapshot(),
+                "by_outcome": {outcome: counters.snapshot() for outcome, counters in self._by_outcome.items()},
+                "by_model": {model or "none": counters.snapshot() for model, counters in self._by_model.items()},
+                "by_shape": {shape: counters.snapshot() for shape, counters in sorted(self._by_shape.items())},
+                "top_users": [dict(user_id=user_id, **counters.snapshot())
+                              for user_id, counters in top_users[:TOP_USERS]],
+                "flush": {
+                    "interval_seconds": self.flush_seconds,
+                    "pending_rows": len(self._pending),
+                    "flushes": self._flushes,
+                    "rows_written": self._flushed_rows,
+                    "errors": self._flush_errors,
+                },
+                "prices_per_mtok": {"input": self.input_price, "output": self.output_price},
+            }
+
+
+def get_usage_accounting(app) -> Optional[UsageAccounting]:
+    """
+    Obtiene (o crea de forma lazy) el agregado de consumo de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        UsageAccounting o None si GEMINI_USAGE_ENABLED está desactivado
+    """
+    if not app.config.get("GEMINI_USAGE_ENABLED"):
+        return None
+
+    accounting = app.extensions.get("gemini_usage")
+    if accounting is None:
+        with _usage_lock:
+            accounting = app.extensions.get("gemini_usage")
+            if accounting is None:
+                accounting = UsageAccounting(
+                    input_price=app.config.get("GEMINI_INPUT_PRICE_PER_MTOK", 0.30),
+                    output_price=app.config.get("GEMINI_OUTPUT_PRICE_PER_MTOK", 2.50),
+                    flush_seconds=app.config.get("GEMINI_USAGE_FLUSH_SECONDS", 60.0),
+                )
+                app.extensions["gemini_usage"] = accounting
+    return accounting
+
+
+def record_usage(app, user_id: Optional[int], text: str, usage: ExtractionUsage, items: Optional[List]):
+    """
+    Agrega el consumo de un mensaje y programa el volcado si corresponde
+
+    Args:
+        app: Instancia de la aplicación Flask
+        user_id: ID interno del usuario
+        text: Texto del mensaje
+        usage: Consumo de la extracción
+        items: Gastos extraídos (None o vacío si falló)
+    """
+    accounting = get_usage_accounting(app)
+    if accounting is None:
+        return
+    if not items:
+        # Los tokens de una respuesta que no se pudo interpretar también cuentan
+        usage.outcome = OUTCOME_FAILED
+    accounting.record(user_id, text, usage, len(items or ()))
+    accounting.schedule_flush(app)
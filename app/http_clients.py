@@ -0,0 +1,181 @@
+"""
+Clientes HTTP compartidos con keep-alive para Telegram y Gemini
+
+Cada `requests.post` suelto abría una conexión TCP+TLS nueva; el flujo de
+pago por botón hace tres o cuatro llamadas seguidas a Telegram y pagaba el
+handshake en cada una. Aquí hay una `requests.Session` por servicio con un
+pool de conexiones por host (HTTPAdapter) que todos los threads comparten.
+
+Los reintentos solo cubren errores de conexión (la petición no llegó a
+enviarse), así que nunca duplican un sendMessage ni una llamada a Gemini.
+"""
+import threading
+from typing import Dict, Optional
+
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.config import Config
+
+_clients_lock = threading.Lock()
+_fallback_clients: Optional["HttpClients"] = None
+
+CLIENT_TELEGRAM = "telegram"
+CLIENT_GEMINI = "gemini"
+
+
+class HttpClients:
+    """
+    Sesiones HTTP con pool de conexiones por servicio
+
+    Attributes:
+        pool_connections: Hosts distintos cuyo pool se conserva por sesión
+        pool_maxsize: Conexiones keep-alive por host
+        pool_block: Si True, no se abren más de pool_maxsize conexiones por host
+            (los threads esperan una libre en lugar de abrir una descartable)
+        connect_retries: Reintentos ante errores de conexión
+    """
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 20,
+                 pool_block: bool = False, connect_retries: int = 2,
+                 retry_backoff: float = 0.1):
+        self.pool_connections = max(1, pool_connections)
+        self.pool_maxsize = max(1, pool_maxsize)
+        self.pool_block = pool_block
+        self.connect_retries = max(0, connect_retries)
+        self.retry_backoff = retry_backoff
+        self._sessions: Dict[str, requests.Session] = {
+            name: self._build_session() for name in (CLIENT_TELEGRAM, CLIENT_GEMINI)
+        }
+
+    def _build_session(self) -> requests.Session:
+        """Sesión con el adapter de pool y reintentos de conexión"""
+        retry = Retry(
+            total=self.connect_retries,
+            connect=self.connect_retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=self.retry_backoff,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def session(self, name: str) -> requests.Session:
+        """
+        Sesión de un servicio
+
+        Args:
+            name: CLIENT_TELEGRAM o CLIENT_GEMINI
+
+        Returns:
+            requests.Session compartida
+        """
+        return self._sessions[name]
+
+    def stats(self) -> dict:
+        """
+        Reutilización de conexiones por servicio
+
+        `connections` son las conexiones abiertas (cada una pagó un handshake)
+        y `requests` las peticiones enviadas; `reuse_ratio` es la fracción de
+        peticiones que viajaron por una conexión ya abierta.
+
+        Returns:
+            Diccionario {servicio: {hosts, requests, connections, reused, reuse_ratio}}
+        """
+        report = {}
+        for name, session in self._sessions.items():
+            total_requests = total_connections = hosts = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    hosts += 1
+                    total_requests += pool.num_requests
+                    total_connections += pool.num_connections
+            reused = max(0, total_requests - total_connections)
+            report[name] = {
+                "hosts": hosts,
+                "requests": total_requests,
+                "connections": total_connections,
+                "reused": reused,
+                "reuse_ratio": round(reused / total_requests, 4) if total_requests else 0.0,
+            }
+        report["pool_maxsize"] = self.pool_maxsize
+        return report
+
+    def close(self):
+        """Cierra todas las conexiones"""
+        for session in self._sessions.values():
+            session.close()
+
+
+def _from_config(config) -> HttpClients:
+    """Construye los clientes a partir de un objeto de configuración tipo dict"""
+    return HttpClients(
+        pool_connections=config.get("HTTP_POOL_CONNECTIONS", 10),
+        pool_maxsize=config.get("HTTP_POOL_MAXSIZE", 20),
+        pool_block=config.get("HTTP_POOL_BLOCK", False),
+        connect_retries=config.get("HTTP_CONNECT_RETRIES", 2),
+        retry_backoff=config.get("HTTP_RETRY_BACKOFF", 0.1),
+    )
+
+
+def get_http_clients(app) -> HttpClients:
+    """
+    Obtiene (o crea de forma lazy) los clientes HTTP de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        HttpClients
+    """
+    clients = app.extensions.get("http_clients")
+    if clients is None:
+        with _clients_lock:
+            clients = app.extensions.get("http_clients")
+            if clients is None:
+                clients = _from_config(app.config)
+                app.extensions["http_clients"] = clients
+    return clients
+
+
+def http_session(name: str) -> requests.Session:
+    """
+    Sesión compartida de un servicio
+
+    Dentro de un contexto de Flask usa los clientes de la aplicación; fuera
+    de él (scripts) usa unos clientes de proceso construidos desde Config.
+
+    Args:
+        name: CLIENT_TELEGRAM o CLIENT_GEMINI
+
+    Returns:
+        requests.Session compartida
+    """
+    global _fallback_clients
+    if has_app_context():
+        return get_http_clients(current_app).session(name)
+
+    if _fallback_clients is None:
+        with _clients_lock:
+            if _fallback_clients is None:
+                _fallback_clients = _from_config(
+                    {key: getattr(Config, key) for key in dir(Config) if key.startswith("HTTP_")}
+                )
+    return _fallback_clients.session(name)
@@ -0,0 +1,202 @@
+"""
+Router de intenciones por palabras clave
+
+Reemplaza los escaneos lineales `any(keyword in message_lower ...)` del webhook,
+que reconstruían las listas en cada request y resolvían por orden de lista, por
+una tabla compilada una sola vez: las palabras clave de todas las intenciones
+quedan ordenadas de la más larga a la más corta y el mensaje se recorre con
+`in` hasta la primera que aparece.
+
+Regla de resolución cuando varias palabras clave coinciden:
+1. Gana la palabra clave más larga ("quien me debe" sobre "pago")
+2. En empate, gana la intención registrada primero
+3. Si sigue el empate, gana la que aparece antes en el mensaje
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+INTENT_LIST_EXPENSES = "list_expenses"
+INTENT_PAY_DEBTS = "pay_debts"
+INTENT_COLLECT_DEBTS = "collect_debts"
+
+
+@dataclass(frozen=True)
+class IntentMatch:
+    """
+    Resultado de resolver la intención de un mensaje
+
+    Attributes:
+        intent: Intención resuelta
+        keyword: Palabra clave que decidió la intención
+        position: Posición de la palabra clave en el mensaje
+    """
+    intent: str
+    keyword: str
+    position: int
+
+
+class IntentRouter:
+    """
+    Tabla de intenciones con escaneo precompilado de la palabra clave más larga
+
+    Las palabras clave se comparan contra el mensaje en minúsculas, como
+    subcadenas (mismo comportamiento que los escaneos originales).
+    """
+
+    def __init__(self):
+        self._keywords: Dict[str, Tuple[str, int]] = {}
+        self._intents: List[str] = []
+        self._handlers: Dict[str, Callable] = {}
+        self._scan: Optional[Tuple[str, ...]] = None
+        self._ties: Dict[str, Tuple[str, ...]] = {}
+
+    def register(self, intent: str, keywords: Iterable[str],
+                 handler: Optional[Callable] = None) -> "IntentRouter":
+        """
+        Registra una intención con sus palabras clave y su handler
+
+        Args:
+            intent: Nombre de la intención
+            keywords: Palabras clave que activan la intención
+            handler: Opcional, función que atiende la intención
+
+        Returns:
+            El mismo router (para encadenar registros)
+        """
+        if intent not in self._intents:
+            self._intents.append(intent)
+        priority = self._intents.index(intent)
+
+        for keyword in keywords:
+            keyword = keyword.lower().strip()
+            # La primera intención que registra una palabra clave se la queda
+            if keyword and keyword not in self._keywords:
+                self._keywords[keyword] = (intent, priority)
+
+        if handler is not None:
+            self._handlers[intent] = handler
+        self._scan = None
+        return self
+
+    def set_handler(self, intent: str, handler: Callable):
+        """
+        Asocia un handler a una intención ya registrada
+
+        Args:
+            intent: Nombre de la intención
+            handler: Función que atiende la intención
+        """
+        if intent not in self._intents:
+            raise KeyError(f"Intención no registrada: {intent}")
+        self._handlers[intent] = handler
+
+    def handler_for(self, intent: str) -> Optional[Callable]:
+        """Handler registrado para una intención"""
+        return self._handlers.get(intent)
+
+    def build(self):
+        """
+        Compila la tabla de escaneo
+
+        Ordena las palabras clave de todas las intenciones de la más larga a la
+        más corta (en empate, la intención registrada primero) y anota, para
+        cada una, las que empatan con ella más adelante en la tabla.
+        """
+        ordered = sorted(self._keywords, key=lambda keyword: (-len(keyword), self._keywords[keyword][1]))
+        ties: Dict[str, Tuple[str, ...]] = {}
+        for index, keyword in enumerate(ordered):
+            rank = (len(keyword), self._keywords[keyword][1])
+            tied = tuple(other for other in ordered[index + 1:]
+                         if (len(other), self._keywords[other][1]) == rank)
+            if tied:
+                ties[keyword] = tied
+        self._scan = tuple(ordered)
+        self._ties = ties
+
+    def resolve(self, text: str) -> Optional[IntentMatch]:
+        """
+        Resuelve la intención de un mensaje
+
+        La primera palabra clave de la tabla presente en el mensaje decide; si
+        empata con otra también presente, gana la que aparece antes.
+
+        Args:
+            text: Texto del mensaje
+
+        Returns:
+            IntentMatch o None si ninguna palabra clave coincide
+        """
+        if not text:
+            return None
+        if self._scan is None:
+            self.build()
+
+        text = text.lower().strip()
+        for keyword in self._scan:
+            if keyword in text:
+                break
+        else:
+            return None
+
+        position = text.find(keyword)
+        for other in self._ties.get(keyword, ()):
+            other_position = text.find(other)
+            if 0 <= other_position < position:
+                keyword, position = other, other_position
+        return IntentMatch(intent=self._keywords[keyword][0], keyword=keyword, position=position)
+
+    def conflict_report(self) -> List[dict]:
+        """
+        Reporta palabras clave que se solapan
+
+        Tipos:
+        - "shadow": una palabra clave contiene a otra de una intención distinta;
+          la más larga gana cuando ambas aparecen
+        - "redundant": una palabra clave contiene a otra de la misma intención y
+          nunca cambia el resultado
+
+        Returns:
+            Lista de conflictos ordenada por tipo y palabra clave
+        """
+        report = []
+        for short, (short_intent, _) in self._keywords.items():
+            for long, (long_intent, _) in self._keywords.items():
+                if short == long or short not in long:
+                    continue
+                report.append({
+                    "type": "shadow" if short_intent != long_intent else "redundant",
+                    "keyword": long,
+                    "intent": long_intent,
+                    "contains": short,
+                    "contains_intent": short_intent,
+                })
+        report.sort(key=lambda item: (item["type"], item["keyword"], item["contains"]))
+        return report
+
+
+def build_default_router() -> IntentRouter:
+    """
+    Crea el router con las intenciones de consulta del bot
+
+    Returns:
+        IntentRouter compilado (sin handlers; los registra `app.routes`)
+    """
+    router = IntentRouter()
+    router.register(INTENT_LIST_EXPENSES, [
+        'ver mis gastos', 'lista de deudas', 'lista de gastos',
+        'mis gastos', 'ver gastos', 'mostrar gastos',
+        'gastos pendientes', 'deudas pendientes', 'resumen'
+    ])
+    router.register(INTENT_PAY_DEBTS, [
+        'pagar', 'pagar deuda', 'pagar deudas', 'quiero pagar',
+        'pago', 'realizar pago', 'mis deudas'
+    ])
+    router.register(INTENT_COLLECT_DEBTS, [
+        'quien me debe', 'quién me debe', 'cobrar', 'debo cobrar',
+        'me deben', 'quien me debe dinero', 'quién me debe dinero'
+    ])
+    router.build()
+    return router
+
+
+intent_router = build_default_router()
@@ -0,0 +1,357 @@
+"""
+Extractor local de gastos (ruta rápida sin Gemini)
+
+La mayoría de los mensajes siguen las formas de los ejemplos del prompt de
+`ai_services`: "Gasté 50000 con María en el supermercado", "Le debo 30000 a
+Juan por el taxi". Este módulo los interpreta con una gramática de cláusulas
+(verbo, monto, persona, concepto, fecha) y devuelve el mismo diccionario que
+cada gasto de `extract_expense_items` junto con una confianza entre 0 y 1.
+
+La gramática es deliberadamente estricta: si queda texto que no encaja en
+ninguna cláusula, si aparece una fecha que no sabe resolver ("el próximo
+lunes") o si hay dos montos o dos personas, no devuelve nada y el mensaje va a
+Gemini. Solo los resultados con confianza >= LOCAL_PARSER_MIN_CONFIDENCE se
+usan sin consultar a Gemini.
+"""
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Optional
+
+from app.date_resolver import find_date, today_in
+
+_parser_lock = threading.Lock()
+
+# Confianza de un resultado completo y penalizaciones por campo dudoso
+CONFIDENCE_FULL = 1.0
+CONFIDENCE_NO_DESCRIPTION = 0.6
+CONFIDENCE_LOWERCASE_NAME = 0.8
+
+# Concepto que Gemini pone a una deuda sin concepto ("Le debo 30000 a Juan")
+DEFAULT_DEBT_DESCRIPTION = "deuda"
+
+# Verbo inicial -> acción (mismas reglas que SYSTEM_PROMPT)
+_VERB_RE = re.compile(
+    r"(?:yo\s+)?(?:"
+    r"(?P<expense>gast[eé]|gastamos|pagu[eé]|pagamos|compr[eé]|compramos)"
+    r"|(?P<debt>(?:le\s+|les\s+)?debo(?:\s+pagar(?:le)?)?|tengo\s+que\s+pagar(?:le)?)"
+    r")(?=\s|$)",
+    re.IGNORECASE,
+)
+
+# 50000 | 50.000 | 50,000 | 12.50 | 1,5 (+ k/mil/millones) (+ moneda)
+_AMOUNT_RE = re.compile(
+    r"(?:\$\s*)?(?P<number>\d{1,3}(?:[.,]\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)"
+    r"(?:\s*(?P<multiplier>k|mil|millones|mill[oó]n|lucas?))?"
+    r"(?:\s+(?:de\s+)?(?P<currency>pesos|cop|usd|d[oó]lares?|euros?|eur))?"
+    r"(?=[\s,;]|$)",
+    re.IGNORECASE,
+)
+
+# "con María", "a Juan Pérez" (no "a la tienda")
+_PERSON_RE = re.compile(
+    r"(?i:con|a|al)\s+"
+    r"(?!(?i:el|la|los|las|un|una|mi|mis|tu|tus|su|sus|lo|pagar|cobrar)(?=\s|$))"
+    r"(?P<name>[^\W\d_]+(?:\s+[A-ZÁÉÍÓÚÑ][^\W\d_]*)?)"
+    r"(?=[\s,;]|$)"
+)
+
+# "mañana", "pasado mañana", "hoy", "en 3 días"
+_DATE_RE = re.compile(
+    r"(?P<phrase>pasado\s+ma[ñn]ana|ma[ñn]ana|hoy|en\s+(?P<days>\d+)\s+d[ií]as?)(?=[\s,;]|$)",
+    re.IGNORECASE,
+)
+
+# Cláusulas que cortan un concepto
+_CLAUSE_STOP = (
+    r"(?=\s+(?:con|a|al)\s"
+    r"|\s+(?:pasado\s+ma[ñn]ana|ma[ñn]ana|hoy|en\s+\d+\s+d[ií]as?)(?=[\s,;]|$)"
+    r"|\s*[,;]|$)"
+)
+
+# "en el supermercado", "por el taxi", "del almuerzo"
+_DESCRIPTION_RE = re.compile(
+    r"(?:en|por|para|de|del)\s+(?P<description>.+?)" + _CLAUSE_STOP,
+    re.IGNORECASE,
+)
+
+_SEPARATOR_RE = re.compile(r"[\s,;]+")
+
+_LEADING_ARTICLE_RE = re.compile(r"^(?:el|la|los|las|un|una|unos|unas)\s+", re.IGNORECASE)
+
+# Palabras de fecha que el extractor no resuelve: el mensaje va a Gemini
+_UNRESOLVED_DATE_RE = re.compile(
+    r"\b(?:ayer|anoche|lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo|"
+    r"semana|mes|a[ñn]o|pr[oó]xim[oa]|enero|febrero|marzo|abril|mayo|junio|julio|"
+    r"agosto|septiembre|octubre|noviembre|diciembre|quincena)\b|\d",
+    re.IGNORECASE,
+)
+
+_CURRENCIES = {
+    "pesos": "COP", "cop": "COP",
+    "usd": "USD", "dolar": "USD", "dolares": "USD",
+    "euro": "EUR", "euros": "EUR", "eur": "EUR",
+}
+
+_MULTIPLIERS = {
+    "k": 1000, "mil": 1000, "luca": 1000, "lucas": 1000,
+    "millon": 1000000, "millones": 1000000,
+}
+
+# Palabra clave del concepto -> categoría
+_CATEGORIES = {
+    "transporte": ("taxi", "uber", "didi", "cabify", "bus", "buseta", "metro", "transmilenio",
+                   "pasaje", "pasajes", "gasolina", "peaje", "parqueadero", "vuelo", "tiquete"),
+    "comida": ("supermercado", "mercado", "almuerzo", "comida", "cena", "desayuno", "onces",
+               "restaurante", "pizza", "hamburguesa", "cafe", "domicilio", "asado", "rappi",
+               "panaderia", "empanadas", "helado"),
+    "servicios": ("luz", "agua", "internet", "gas", "celular", "telefono", "plan", "netflix",
+                  "spotify", "factura", "recibo"),
+    "vivienda": ("arriendo", "alquiler", "administracion"),
+    "entretenimiento": ("cine", "concierto", "fiesta", "bar", "cerveza", "cervezas", "boletas",
+                        "entradas", "juego"),
+    "salud": ("farmacia", "drogueria", "medico", "medicamentos", "cita", "odontologo"),
+}
+_CATEGORY_BY_WORD = {word: category for category, words in _CATEGORIES.items() for word in words}
+DEFAULT_CATEGORY = "otros"
+
+
+@dataclass(frozen=True)
+class LocalExtraction:
+    """
+    Resultado del extractor local
+
+    Attributes:
+        data: Diccionario con los mismos campos que un gasto de `extract_expense_items`
+        confidence: Confianza entre 0 y 1
+    """
+    data: Dict
+    confidence: float
+
+
+def _strip_accents(text: str) -> str:
+    """Quita tildes (no la ñ) para comparar palabras clave"""
+    decomposed = unicodedata.normalize("NFD", text)
+    return unicodedata.normalize(
+        "NFC", "".join(char for char in decomposed if unicodedata.category(char) != "Mn" or char == "\u0303")
+    )
+
+
+def parse_amount(number: str, multiplier: Optional[str] = None) -> Optional[float]:
+    """
+    Interpreta un monto escrito como en Colombia
+
+    "50.000" y "50,000" son miles; "12.50" y "1,5" son decimales (el
+    separador seguido de tres dígitos siempre se toma como de miles).
+
+    Args:
+        number: Texto del número
+        multiplier: Opcional, "k", "mil", "millones", ...
+
+    Returns:
+        Monto o None si no es positivo
+    """
+    if re.fullmatch(r"\d{1,3}(?:[.,]\d{3})+(?:,\d{1,2})?", number):
+        integer, _, decimals = number.rpartition(",") if re.search(r",\d{1,2}$", number) else (number, "", "")
+        value = float(re.sub(r"[.,]", "", integer) + ("." + decimals if decimals else ""))
+    else:
+        value = float(number.replace(",", "."))
+
+    if multiplier:
+        value *= _MULTIPLIERS[_strip_accents(multiplier.lower())]
+    return value if value > 0 else None
+
+
+def resolve_relative_date(match: re.Match, today: date) -> date:
+    """Fecha de una cláusula de _DATE_RE (con las mismas reglas que `app.date_resolver`)"""
+    return find_date(match.group("phrase"), today).value
+
+
+def categorize(description: str) -> str:
+    """Categoría según la primera palabra clave conocida del concepto"""
+    for word in re.findall(r"[^\W\d_]+", _strip_accents(description.lower())):
+        category = _CATEGORY_BY_WORD.get(word)
+        if category:
+            return category
+    return DEFAULT_CATEGORY
+
+
+def parse_expense_text(text: str, today: Optional[date] = None) -> Optional[LocalExtraction]:
+    """
+    Interpreta un mensaje de gasto o deuda sin llamar a Gemini
+
+    Args:
+        text: Texto del mensaje del usuario
+        today: Fecha de referencia para "mañana" / "en N días" (por defecto hoy)
+
+    Returns:
+        LocalExtraction o None si el mensaje no encaja en la gramática
+    """
+    text = " ".join(text.split()).rstrip(".!?¡¿ ")
+    verb = _VERB_RE.match(text)
+    if not verb:
+        return None
+
+    action = "expense" if verb.group("expense") else "debt"
+    amount = currency = person = description = due_date = None
+    pos = verb.end()
+
+    while pos < len(text):
+        separator = _SEPARATOR_RE.match(text, pos)
+        if separator:
+            pos = separator.end()
+            if pos >= len(text):
+                break
+
+        date_match = _DATE_RE.match(text, pos)
+        amount_match = None if date_match else _AMOUNT_RE.match(text, pos)
+        person_match = None if date_match or amount_match else _PERSON_RE.match(text, pos)
+        description_match = (None if date_match or amount_match or person_match
+                             else _DESCRIPTION_RE.match(text, pos))
+
+        if date_match and due_date is None:
+            due_date = resolve_relative_date(date_match, today or today_in())
+            pos = date_match.end()
+        elif amount_match and amount is None:
+            amount = parse_amount(amount_match.group("number"), amount_match.group("multiplier"))
+            if amount is None:
+                return None
+            if amount_match.group("currency"):
+                currency = _CURRENCIES[_strip_accents(amount_match.group("currency").lower())]
+            pos = amount_match.end()
+        elif person_match and person is None:
+            person = person_match.group("name")
+            pos = person_match.end()
+        elif description_match and description is None:
+            description = _LEADING_ARTICLE_RE.sub("", description_match.group("description")).strip()
+            if not description or _UNRESOLVED_DATE_RE.search(description):
+                return None
+            pos = description_match.end()
+        else:
+            # Texto sin cláusula o cláusula repetida: que decida Gemini
+            return None
+
+    if amount is None:
+        return None
+
+    confidence = CONFIDENCE_FULL
+    if not description and action == "debt":
+        # Una deuda no necesita concepto: se guarda con el mismo que pone Gemini
+        description = DEFAULT_DEBT_DESCRIPTION
+    elif not description:
+        confidence = min(confidence, CONFIDENCE_NO_DESCRIPTION)
+    if person and not person[0].isupper():
+        # "con maria" no encuentra a "María" en la búsqueda por nombre
+        confidence = min(confidence, CONFIDENCE_LOWERCASE_NAME)
+
+    data = {
+        "amount": int(amount) if amount.is_integer() else round(amount, 2),
+        "currency": currency or "COP",
+        "description": description or "",
+        "category": categorize(description or ""),
+        "action": action,
+        "debtor_name": person,
+        "due_date": due_date.isoformat() if due_date else None,
+    }
+    return LocalExtraction(data=data, confidence=confidence)
+
+
+class LocalExpenseParser:
+    """
+    Ruta rápida de extracción con contador de aciertos
+
+    Attributes:
+        min_confidence: Confianza mínima para usar el resultado sin Gemini
+    """
+
+    def __init__(self, min_confidence: float = 0.9):
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._fallback_hits = 0
+        self._fallback_misses = 0
+
+    def extract(self, text: str, today: Optional[date] = None) -> Optional[Dict]:
+        """
+        Extrae el gasto si el resultado local es suficientemente confiable
+
+        Args:
+            text: Texto del mensaje del usuario
+            today: Fecha de referencia para fechas relativas
+
+        Returns:
+            Diccionario con los datos del gasto o None si hay que llamar a Gemini
+        """
+        result = parse_expense_text(text, today)
+        hit = result is not None and result.confidence >= self.min_confidence
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        return dict(result.data) if hit else None
+
+    def fallback(self, text: str, today: Optional[date], min_confidence: float) -> Optional[Dict]:
+        """
+        Extrae el gasto con Gemini no disponible, aceptando menos confianza
+
+        Se cuenta aparte de `extract` para no alterar la tasa de aciertos de
+        la ruta rápida.
+
+        Args:
+            text: Texto del mensaje del usuario
+            today: Fecha de referencia para fechas relativas
+            min_confidence: Confianza mínima aceptada en modo respaldo
+
+        Returns:
+            Diccionario con los datos del gasto o None si la gramática no lo interpreta
+        """
+        result = parse_expense_text(text, today)
+        hit = result is not None and result.confidence >= min_confidence
+        with self._lock:
+            if hit:
+                self._fallback_hits += 1
+            else:
+                self._fallback_misses += 1
+        return dict(result.data) if hit else None
+
+    def stats(self) -> dict:
+        """Aciertos (sin Gemini), fallos (con Gemini), tasa de aciertos y uso como respaldo"""
+        with self._lock:
+            hits, misses = self._hits, self._misses
+            fallback_hits, fallback_misses = self._fallback_hits, self._fallback_misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "min_confidence": self.min_confidence,
+            "fallback_hits": fallback_hits,
+            "fallback_misses": fallback_misses,
+        }
+
+
+def get_local_parser(app) -> Optional[LocalExpenseParser]:
+    """
+    Obtiene (o crea de forma lazy) el extractor local de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        LocalExpenseParser o None si LOCAL_PARSER_ENABLED está desactivado
+    """
+    if not app.config.get("LOCAL_PARSER_ENABLED", True):
+        return None
+
+    parser = app.extensions.get("local_parser")
+    if parser is None:
+        with _parser_lock:
+            parser = app.extensions.get("local_parser")
+            if parser is None:
+                parser = LocalExpenseParser(min_confidence=app.config.get("LOCAL_PARSER_MIN_CONFIDENCE", 0.9))
+                app.extensions["local_parser"] = parser
+    return parser
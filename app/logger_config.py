@@ -246,6 +246,8 @@ class ErrorCodes:
     # Operaciones
     OP_SUCCESS = "OP_SUCCESS"
     OP_FAILED = "OP_FAILED"
+    UPDATE_DUPLICATE = "UPDATE_DUPLICATE"
+    RATE_LIMITED = "RATE_LIMITED"
 
     # Errores específicos
     ERR_DB_CONNECTION = "ERR_DB_001"
@@ -259,3 +261,11 @@ class ErrorCodes:
     ERR_INVALID_DATA = "ERR_VAL_001"
     ERR_MISSING_REQUIRED_FIELD = "ERR_VAL_002"
     ERR_NO_OTHER_USER = "ERR_USR_003"
+    ERR_UPDATE_WORKER = "ERR_WRK_001"
+    ERR_QUEUE_FULL = "ERR_WRK_002"
+    ERR_DEADLINE_EXCEEDED = "ERR_DL_001"
+    ERR_CIRCUIT_OPEN = "ERR_CB_001"
+    ERR_PENDING_EXTRACTION = "ERR_PND_001"
+    ERR_USAGE_FLUSH = "ERR_USG_001"
+    ERR_TELEGRAM_THROTTLED = "ERR_TG_002"
+    ERR_REMINDER = "ERR_RMD_001"
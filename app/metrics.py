@@ -0,0 +1,189 @@
+"""
+Latencias por etapa del procesamiento de updates
+
+Cada etapa (update completo, autorización, Gemini, Telegram, commit de DB)
+registra sus duraciones en una ventana de las últimas N muestras; /health
+expone p50/p95/p99 por etapa cuando STAGE_METRICS_ENABLED está activo. El
+harness de `benchmarks.replay` usa estos números para desglosar la latencia
+extremo a extremo. Además, cada etapa se acumula en el deadline del update en
+curso, que la registra en el log al terminar (ver `app.deadline`).
+"""
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+from flask import current_app, has_app_context
+
+from app.deadline import current_deadline
+
+# Etapas instrumentadas
+STAGE_UPDATE = "update"
+STAGE_AUTH = "auth"
+STAGE_GEMINI = "gemini"
+STAGE_TELEGRAM = "telegram"
+STAGE_DB_COMMIT = "db_commit"
+
+_metrics_lock = threading.Lock()
+
+
+def _percentile(ordered: list, pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class StageMetrics:
+    """
+    Registro thread-safe de duraciones por etapa
+
+    Attributes:
+        max_samples: Muestras que se conservan por etapa (las más recientes)
+    """
+
+    def __init__(self, max_samples: int = 10000):
+        self.max_samples = max(1, max_samples)
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+
+    def record(self, stage: str, seconds: float, ok: bool = True):
+        """
+        Registra una duración
+
+        Args:
+            stage: Nombre de la etapa
+            seconds: Duración en segundos
+            ok: False si la etapa terminó con error
+        """
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+            if not ok:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    @contextmanager
+    def time(self, stage: str):
+        """Mide el bloque como una muestra de `stage` (con error si lanza excepción)"""
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(stage, time.perf_counter() - started, ok)
+
+    def reset(self):
+        """Descarta todas las muestras y contadores"""
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._errors.clear()
+
+    def snapshot(self) -> dict:
+        """
+        Percentiles por etapa
+
+        Returns:
+            Diccionario {etapa: {count, errors, p50_ms, p95_ms, p99_ms, max_ms}}
+        """
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            counts = dict(self._counts)
+            errors = dict(self._errors)
+
+        return {
+            stage: {
+                "count": counts.get(stage, 0),
+                "errors": errors.get(stage, 0),
+                "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(_percentile(ordered, 99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+            }
+            for stage, ordered in samples.items()
+        }
+
+
+def get_stage_metrics(app) -> Optional[StageMetrics]:
+    """
+    Obtiene (o crea de forma lazy) el registro de latencias de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        StageMetrics o None si STAGE_METRICS_ENABLED está desactivado
+    """
+    if not app.config.get("STAGE_METRICS_ENABLED"):
+        return None
+
+    metrics = app.extensions.get("stage_metrics")
+    if metrics is None:
+        with _metrics_lock:
+            metrics = app.extensions.get("stage_metrics")
+            if metrics is None:
+                metrics = StageMetrics(max_samples=app.config.get("STAGE_METRICS_MAX_SAMPLES", 10000))
+                app.extensions["stage_metrics"] = metrics
+    return metrics
+
+
+@contextmanager
+def _timed(stage: str, metrics: Optional[StageMetrics], deadline):
+    """Mide el bloque en el registro y en el deadline del update"""
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        elapsed = time.perf_counter() - started
+        if metrics is not None:
+            metrics.record(stage, elapsed, ok)
+        if deadline is not None:
+            deadline.record(stage, elapsed)
+
+
+def stage_timer(stage: str, metrics: Optional[StageMetrics] = None):
+    """
+    Context manager que mide una etapa
+
+    Sin `metrics` usa el registro de `current_app` (código síncrono de Flask);
+    si no hay contexto de aplicación o las métricas están desactivadas no mide.
+    El tiempo también se acumula en el deadline del update en curso, salvo para
+    la etapa `update`, que es el total del propio deadline.
+
+    Args:
+        stage: Nombre de la etapa
+        metrics: Registro explícito (código sin contexto de Flask)
+    """
+    if metrics is None and has_app_context():
+        metrics = get_stage_metrics(current_app)
+    deadline = current_deadline() if stage != STAGE_UPDATE else None
+    if metrics is None and deadline is None:
+        return nullcontext()
+    return _timed(stage, metrics, deadline)
+
+
+def timed_stage(stage: str):
+    """
+    Decorador que mide cada llamada a la función como una muestra de `stage`
+
+    Args:
+        stage: Nombre de la etapa
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,263 @@
+"""
+Router de modelos de Gemini por complejidad y latencia
+
+Con un solo GEMINI_MODEL, "le debo 3000 a Ana" paga la misma latencia que un
+mensaje con varios gastos, personas y fechas. El router puntúa la complejidad
+del mensaje (largo, montos, personas mencionadas, expresiones de fecha) y lo
+envía al modelo rápido (GEMINI_FAST_MODEL) o al fuerte (GEMINI_STRONG_MODEL).
+Si la respuesta del modelo rápido no pasa la validación, la extracción se
+repite con el fuerte (escalamiento, ver `ai_services.extract_expense_items`).
+
+La latencia observada por modelo retroalimenta la decisión:
+
+- Si el p95 del modelo rápido supera al del fuerte, los mensajes simples
+  también van al fuerte (el rápido está degradado)
+- Si el p95 del modelo fuerte supera GEMINI_ROUTER_STRONG_P95_BUDGET_MS, los
+  mensajes en el umbral de complejidad van al rápido
+
+Los p95 solo se usan con al menos GEMINI_ROUTER_MIN_SAMPLES llamadas. Con
+el rápido degradado, uno de cada LATENCY_PROBE_EVERY mensajes simples lo
+sigue usando para que su p95 se actualice y pueda volver a elegirse.
+"""
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Optional
+
+from app.date_resolver import find_date, fold
+
+_router_lock = threading.Lock()
+
+TIER_FAST = "fast"
+TIER_STRONG = "strong"
+
+# Motivo de la decisión
+REASON_COMPLEXITY = "complexity"
+REASON_LATENCY = "latency"
+
+# Largo (caracteres) a partir del cual un mensaje suma complejidad
+LONG_MESSAGE = 80
+VERY_LONG_MESSAGE = 160
+
+# Con el modelo rápido degradado, cada cuántos mensajes simples se le envía uno de prueba
+LATENCY_PROBE_EVERY = 10
+
+# 50000 | 50.000 | 12,50 | $ 20
+_AMOUNT_RE = re.compile(r"(?<![\w/-])\$?\s?\d[\d.,]*(?![\w/-])")
+
+# "con María", "a Juan", "al Pepe" (nombres con mayúscula inicial)
+_PERSON_RE = re.compile(r"(?i:\b(?:con|a|al|para|de)\s+)(?P<name>[A-ZÁÉÍÓÚÑ][^\W\d_]+)")
+
+
+def complexity_score(text: str, today: Optional[date] = None) -> int:
+    """
+    Puntúa la complejidad de un mensaje para elegir el modelo
+
+    - +1 si pasa de LONG_MESSAGE caracteres y +1 más si pasa de VERY_LONG_MESSAGE
+    - +2 por cada monto adicional al primero (varios gastos en un mensaje);
+      los números de la expresión de fecha no cuentan como montos
+    - +1 por cada persona mencionada adicional a la primera
+    - +1 si trae una expresión de fecha
+
+    Args:
+        text: Texto del mensaje
+        today: Opcional, fecha de referencia para buscar la fecha
+
+    Returns:
+        Puntaje (0 para "le debo 3000 a Ana")
+    """
+    score = (len(text) > LONG_MESSAGE) + (len(text) > VERY_LONG_MESSAGE)
+    score += max(0, len({match.group("name").lower() for match in _PERSON_RE.finditer(text)}) - 1)
+    folded = fold(text)
+    found = find_date(text, today or date.today())
+    if found is not None:
+        score += 1
+        folded = folded[:found.start] + " " + folded[found.start + len(found.phrase):]
+    score += 2 * max(0, len(_AMOUNT_RE.findall(folded)) - 1)
+    return score
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    """
+    Modelo elegido para un mensaje
+
+    Attributes:
+        tier: TIER_FAST o TIER_STRONG
+        model: Nombre del modelo
+        score: Puntaje de complejidad del mensaje
+        reason: REASON_COMPLEXITY o REASON_LATENCY (la latencia cambió el nivel)
+    """
+    tier: str
+    model: str
+    score: int
+    reason: str
+
+
+def _percentile(ordered: list, pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class ModelRouter:
+    """
+    Elige el modelo de Gemini de cada mensaje
+
+    Attributes:
+        fast_model: Modelo para mensajes simples
+        strong_model: Modelo para mensajes complejos y escalamientos
+        threshold: Puntaje desde el cual un mensaje va al modelo fuerte
+        strong_p95_budget_ms: p95 del modelo fuerte que se tolera antes de
+            mandar los mensajes en el umbral al rápido (0 = sin límite)
+        min_samples: Llamadas por modelo antes de usar su p95
+    """
+
+    def __init__(self, fast_model: str, strong_model: str, threshold: int = 3,
+                 strong_p95_budget_ms: float = 0.0, min_samples: int = 20, max_samples: int = 500):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.threshold = threshold
+        self.strong_p95_budget_ms = strong_p95_budget_ms
+        self.min_samples = max(1, min_samples)
+        self.max_samples = max(self.min_samples, max_samples)
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}
+        self._routed = {TIER_FAST: 0, TIER_STRONG: 0}
+        self._latency_overrides = 0
+        self._probes = 0
+        self._escalations = 0
+        self._escalations_recovered = 0
+
+    def record_latency(self, model: str, seconds: float):
+        """
+        Registra la duración de una llamada a Gemini
+
+        Args:
+            model: Modelo llamado
+            seconds: Duración de la llamada (reintentos incluidos)
+        """
+        with self._lock:
+            samples = self._latencies.get(model)
+            if samples is None:
+                samples = self._latencies[model] = deque(maxlen=self.max_samples)
+            samples.append(seconds)
+
+    def p95_ms(self, model: str) -> Optional[float]:
+        """p95 observado del modelo en milisegundos, o None con menos de `min_samples` llamadas"""
+        with self._lock:
+            samples = self._latencies.get(model)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return _percentile(ordered, 95) * 1000
+
+    def route(self, text: str, today: Optional[date] = None) -> RouteDecision:
+        """
+        Elige el modelo de un mensaje
+
+        Args:
+            text: Texto del mensaje
+            today: Opcional, fecha de hoy del usuario
+
+        Returns:
+            RouteDecision con el nivel, el modelo y el motivo
+        """
+        score = complexity_score(text, today)
+        tier, reason = (TIER_STRONG if score >= self.threshold else TIER_FAST), REASON_COMPLEXITY
+
+        if tier == TIER_FAST:
+            fast_p95, strong_p95 = self.p95_ms(self.fast_model), self.p95_ms(self.strong_model)
+            if fast_p95 is not None and strong_p95 is not None and fast_p95 > strong_p95:
+                with self._lock:
+                    self._probes += 1
+                    probe = self._probes % LATENCY_PROBE_EVERY == 0
+                if not probe:
+                    tier, reason = TIER_STRONG, REASON_LATENCY
+        elif score == self.threshold and self.strong_p95_budget_ms > 0:
+            strong_p95 = self.p95_ms(self.strong_model)
+            if strong_p95 is not None and strong_p95 > self.strong_p95_budget_ms:
+                tier, reason = TIER_FAST, REASON_LATENCY
+
+        with self._lock:
+            self._routed[tier] += 1
+            if reason == REASON_LATENCY:
+                self._latency_overrides += 1
+        return RouteDecision(tier=tier, model=self.fast_model if tier == TIER_FAST else self.strong_model,
+                             score=score, reason=reason)
+
+    def should_escalate(self, decision: RouteDecision) -> bool:
+        """True si una extracción fallida con `decision` se puede repetir con el modelo fuerte"""
+        return decision.model != self.strong_model
+
+    def record_escalation(self, recovered: bool):
+        """
+        Registra un escalamiento al modelo fuerte
+
+        Args:
+            recovered: True si el modelo fuerte devolvió gastos válidos
+        """
+        with self._lock:
+            self._escalations += 1
+            if recovered:
+                self._escalations_recovered += 1
+
+    def stats(self) -> dict:
+        """
+        Contadores del router
+
+        Returns:
+            Diccionario con los mensajes por nivel, los cambios por latencia,
+            los escalamientos y la latencia observada por modelo
+        """
+        with self._lock:
+            samples = {model: sorted(values) for model, values in self._latencies.items()}
+            stats = {
+                "fast_model": self.fast_model,
+                "strong_model": self.strong_model,
+                "threshold": self.threshold,
+                "routed": dict(self._routed),
+                "latency_overrides": self._latency_overrides,
+                "escalations": self._escalations,
+                "escalations_recovered": self._escalations_recovered,
+            }
+        stats["models"] = {
+            model: {
+                "samples": len(ordered),
+                "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+            }
+            for model, ordered in samples.items() if ordered
+        }
+        return stats
+
+
+def get_model_router(app) -> Optional[ModelRouter]:
+    """
+    Obtiene (o crea de forma lazy) el router de modelos de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        ModelRouter o None si GEMINI_ROUTER_ENABLED está desactivado
+    """
+    if not app.config.get("GEMINI_ROUTER_ENABLED"):
+        return None
+
+    router = app.extensions.get("model_router")
+    if router is None:
+        with _router_lock:
+            router = app.extensions.get("model_router")
+            if router is None:
+                router = ModelRouter(
+                    fast_model=app.config.get("GEMINI_FAST_MODEL", "gemini-2.5-flash-lite"),
+                    strong_model=app.config.get("GEMINI_STRONG_MODEL") or app.config.get("GEMINI_MODEL"),
+                    threshold=app.config.get("GEMINI_ROUTER_THRESHOLD", 3),
+                    strong_p95_budget_ms=app.config.get("GEMINI_ROUTER_STRONG_P95_BUDGET_MS", 0.0),
+                    min_samples=app.config.get("GEMINI_ROUTER_MIN_SAMPLES", 20),
+                )
+                app.extensions["model_router"] = router
+    return router
@@ -14,6 +14,8 @@ class User(db.Model):
         telegram_id: ID único de Telegram del usuario (usado para autorización)
         name: Nombre del usuario
         is_authorized: Flag para activar/desactivar acceso
+        timezone: Zona horaria IANA del usuario para resolver fechas relativas
+            (None = DEFAULT_TIMEZONE)
     """
     __tablename__ = 'users'
 
@@ -22,6 +24,7 @@ class User(db.Model):
                             nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False)
     is_authorized = db.Column(db.Boolean, default=True, nullable=False)
+    timezone = db.Column(db.String(64), nullable=True)
     created_at = db.Column(
         db.DateTime, default=datetime.utcnow, nullable=False)
 
@@ -41,6 +44,7 @@ class User(db.Model):
             'telegram_id': self.telegram_id,
             'name': self.name,
             'is_authorized': self.is_authorized,
+            'timezone': self.timezone,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
@@ -62,6 +66,14 @@ class Expense(db.Model):
         category: Categoría del gasto (opcional)
     """
     __tablename__ = 'expenses'
+    # Listas paginadas de deudas pendientes por deudor y por pagador (keyset
+    # sobre due_date, created_at, id; ver app.debt_pages) y barrido de
+    # recordatorios por deudor (ver app.reminders)
+    __table_args__ = (
+        db.Index('ix_expenses_debtor_pending', 'debtor_id', 'is_settled', 'due_date', 'created_at', 'id'),
+        db.Index('ix_expenses_payer_pending', 'payer_id', 'is_settled', 'due_date', 'created_at', 'id'),
+        db.Index('ix_expenses_reminder_pending', 'is_settled', 'debtor_id', 'due_date', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(
@@ -95,3 +107,98 @@ class Expense(db.Model):
             'category': self.category,
             'due_date': self.due_date.isoformat() if self.due_date else None
         }
+
+
+class ProcessedUpdate(db.Model):
+    """
+    Registro de updates de Telegram ya procesados (deduplicación multi-worker)
+
+    Attributes:
+        update_id: ID del update de Telegram (Primary Key)
+        created_at: Fecha y hora en que se recibió el update
+    """
+    __tablename__ = 'processed_updates'
+
+    update_id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    created_at = db.Column(
+        db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ProcessedUpdate {self.update_id}>'
+
+
+class GeminiUsage(db.Model):
+    """
+    Consumo de Gemini agregado por periodo (ver app.gemini_usage)
+
+    Cada fila suma los mensajes de un usuario con el mismo modelo, ruta de
+    extracción y forma de mensaje entre dos volcados.
+
+    Attributes:
+        id: ID interno del registro (Primary Key)
+        period_start: Inicio del periodo agregado
+        period_end: Fin del periodo agregado (momento del volcado)
+        user_id: ID del usuario (Foreign Key a users.id, nulo si no se conoce)
+        model: Modelo de Gemini (vacío si el mensaje no llamó a Gemini)
+        outcome: Ruta de la extracción (local, cache, gemini, batch, fallback, failed)
+        shape: Forma del mensaje: largo del texto y gastos extraídos (ej: "41-120/2")
+        messages: Mensajes del periodo
+        calls: Llamadas HTTP a Gemini (una llamada en lote cuenta una vez)
+        prompt_tokens: Tokens de entrada
+        candidate_tokens: Tokens de respuesta
+        total_tokens: Tokens totales (incluye los de razonamiento)
+        cost_usd: Costo estimado en USD
+        latency_ms_sum: Suma de latencias de extracción en milisegundos
+        latency_ms_max: Latencia máxima en milisegundos
+        latency_histogram: JSON con el conteo por cubeta de latencia
+    """
+    __tablename__ = 'gemini_usage'
+
+    id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.DateTime, nullable=False, index=True)
+    period_end = db.Column(db.DateTime, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
+    model = db.Column(db.String(64), nullable=False, default='')
+    outcome = db.Column(db.String(16), nullable=False)
+    shape = db.Column(db.String(16), nullable=False)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    candidate_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    total_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    cost_usd = db.Column(db.Numeric(12, 6), nullable=False, default=0)
+    latency_ms_sum = db.Column(db.Float, nullable=False, default=0)
+    latency_ms_max = db.Column(db.Float, nullable=False, default=0)
+    latency_histogram = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f'<GeminiUsage user={self.user_id} {self.outcome} {self.period_start}>'
+
+
+class ReminderRun(db.Model):
+    """
+    Avance del barrido diario de recordatorios (ver app.reminders)
+
+    Attributes:
+        run_date: Día del barrido (Primary Key)
+        started_at: Fecha y hora en que empezó el primer intento
+        finished_at: Fecha y hora en que terminó (None mientras no termina)
+        last_debtor_id: Último deudor cuyo bloque ya se envió (o se estaba enviando)
+        owner: Proceso con el lease del barrido (None si nadie lo tiene)
+        lease_until: Vencimiento del lease (otro proceso puede retomarlo después)
+        sent: Recordatorios enviados
+        failed: Recordatorios que Telegram rechazó o que no salieron
+    """
+    __tablename__ = 'reminder_runs'
+
+    run_date = db.Column(db.Date, primary_key=True, autoincrement=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    last_debtor_id = db.Column(db.Integer, nullable=False, default=0)
+    owner = db.Column(db.String(128), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ReminderRun {self.run_date} last_debtor_id={self.last_debtor_id}>'
@@ -0,0 +1,314 @@
+"""
+Cola durable de extracciones pendientes
+
+Con Gemini caído (circuito abierto o sin respuesta tras los reintentos) y un
+mensaje que el extractor local no sabe interpretar, el update se guarda en un
+archivo SQLite en lugar de responder "No pude procesar tu mensaje". Cuando el
+breaker registra de nuevo una llamada exitosa, un thread vacía la cola en
+orden de llegada: cada update se vuelve a procesar completo con
+`routes.process_update`, así que el usuario recibe la confirmación normal.
+
+La cola sobrevive a reinicios y es compartida entre workers del mismo host:
+cada worker reserva un update por un tiempo (lease) antes de procesarlo, y un
+update cuyo worker murió vuelve a estar disponible al vencer el lease. Los
+updates más viejos que PENDING_EXTRACTION_MAX_AGE_SECONDS se descartan
+avisando al usuario que lo reenvíe.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from flask import g
+
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_queue_lock = threading.Lock()
+
+# Segundos que un worker reserva un update mientras lo procesa
+CLAIM_LEASE_SECONDS = 120
+
+PENDING_REPLY = ("⏳ El servicio de análisis no está disponible en este momento. "
+                 "Guardé tu mensaje y lo registraré apenas se recupere.")
+UNAVAILABLE_REPLY = ("⚠️ El servicio de análisis no está disponible en este momento. "
+                     "Intenta de nuevo en unos minutos.")
+EXPIRED_REPLY = "❌ No pude procesar tu mensaje pendiente: \"{text}\". Por favor, envíalo de nuevo."
+
+
+def is_pending_replay() -> bool:
+    """True si el update en curso es un pendiente que se está reprocesando"""
+    return bool(g.get('pending_replay'))
+
+
+def update_sent_at(update: dict) -> Optional[datetime]:
+    """
+    Instante en que el usuario envió el mensaje (campo `date` de Telegram)
+
+    Args:
+        update: Diccionario con el update de Telegram
+
+    Returns:
+        datetime en UTC o None si el update no lo trae
+    """
+    sent = (update.get('message') or {}).get('date')
+    return datetime.fromtimestamp(sent, timezone.utc) if isinstance(sent, (int, float)) else None
+
+
+class PendingExtractionQueue:
+    """
+    Updates a la espera de que Gemini se recupere, en un archivo SQLite
+
+    Attributes:
+        path: Ruta del archivo SQLite
+        max_age: Segundos tras los cuales un pendiente se descarta
+    """
+
+    def __init__(self, path: str, max_age_seconds: float = 86400):
+        self.path = path
+        self.max_age = max_age_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._enqueued = 0
+        self._replayed = 0
+        self._expired = 0
+        self._drains = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_extractions ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER, "
+                "update_json TEXT NOT NULL, enqueued_at REAL NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, claimed_until REAL NOT NULL DEFAULT 0)"
+            )
+        # Pendientes de una ejecución anterior: se vacían con la primera llamada exitosa
+        self._maybe_pending = self.count() > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Conexión SQLite por thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, update: dict, telegram_id: Optional[int]) -> int:
+        """
+        Guarda un update para procesarlo cuando Gemini se recupere
+
+        Args:
+            update: Diccionario con el update de Telegram
+            telegram_id: ID de Telegram del remitente
+
+        Returns:
+            ID del pendiente
+        """
+        cursor = self._connect().execute(
+            "INSERT INTO pending_extractions (telegram_id, update_json, enqueued_at) VALUES (?, ?, ?)",
+            (telegram_id, json.dumps(update, ensure_ascii=False), time.time()),
+        )
+        with self._lock:
+            self._enqueued += 1
+            self._maybe_pending = True
+        return cursor.lastrowid
+
+    def claim(self, now: Optional[float] = None) -> Optional[Tuple[int, dict, float]]:
+        """
+        Reserva el pendiente más antiguo que no esté reservado por otro worker
+
+        Args:
+            now: Opcional, instante actual (time.time())
+
+        Returns:
+            Tupla (id, update, encolado_en) o None si no hay pendientes libres
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, update_json, enqueued_at FROM pending_extractions "
+                "WHERE claimed_until <= ? ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE pending_extractions SET claimed_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now + CLAIM_LEASE_SECONDS, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+
+    def complete(self, pending_id: int):
+        """Elimina un pendiente ya procesado (o descartado)"""
+        self._connect().execute("DELETE FROM pending_extractions WHERE id = ?", (pending_id,))
+
+    def release(self, pending_id: int):
+        """Libera la reserva de un pendiente para reintentarlo más tarde"""
+        self._connect().execute("UPDATE pending_extractions SET claimed_until = 0 WHERE id = ?", (pending_id,))
+
+    def count(self) -> int:
+        """Pendientes en la cola (reservados o no)"""
+        return self._connect().execute("SELECT COUNT(*) FROM pending_extractions").fetchone()[0]
+
+    def schedule_drain(self, app):
+        """
+        Vacía la cola en un thread si hay pendientes y no hay otro vaciado en curso
+
+        Se llama tras cada llamada exitosa a Gemini, así que sin pendientes
+        no toca el archivo.
+
+        Args:
+            app: Instancia de la aplicación Flask
+        """
+        if not self._maybe_pending or not self._drain_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._drain_thread, args=(app,), name="pending-drain", daemon=True).start()
+
+    def _drain_thread(self, app):
+        """Cuerpo del thread de vaciado (libera _drain_lock al terminar)"""
+        try:
+            self.drain(app)
+        except Exception as e:
+            log_error(logger, ErrorCodes.ERR_PENDING_EXTRACTION,
+                      f"Error vaciando la cola de pendientes: {str(e)}",
+                      exception=e)
+        finally:
+            self._drain_lock.release()
+
+    def drain(self, app) -> int:
+        """
+        Reprocesa los pendientes en orden hasta vaciar la cola o hasta que Gemini vuelva a fallar
+
+        Cada update corre en su propio contexto de aplicación con
+        `g.pending_replay`, que hace que `routes.process_update` use la fecha
+        del mensaje original y deje subir `GeminiUnavailable` en lugar de
+        volver a encolarlo.
+
+        Args:
+            app: Instancia de la aplicación Flask
+
+        Returns:
+            Updates reprocesados
+        """
+        # Import diferido: routes importa este módulo
+        from app.ai_services import GeminiUnavailable
+        from app.routes import process_update, get_sender_id, get_message_text_from_update
+
+        with self._lock:
+            self._drains += 1
+        replayed = 0
+        while True:
+            with self._lock:
+                enqueued = self._enqueued
+            claimed = self.claim()
+            if claimed is None:
+                with self._lock:
+                    # Un enqueue durante el claim deja la marca para el próximo vaciado
+                    if self._enqueued == enqueued:
+                        self._maybe_pending = False
+                break
+            pending_id, update, enqueued_at = claimed
+            telegram_id = get_sender_id(update)
+
+            with app.app_context():
+                if time.time() - enqueued_at > self.max_age:
+                    from app.bot_services import send_message
+                    self.complete(pending_id)
+                    with self._lock:
+                        self._expired += 1
+                    log_error(logger, ErrorCodes.ERR_PENDING_EXTRACTION,
+                              f"Pendiente descartado por antigüedad: id={pending_id}",
+                              telegram_id=telegram_id,
+                              data_dict={"age_seconds": round(time.time() - enqueued_at)})
+                    if telegram_id:
+                        text = get_message_text_from_update(update) or ""
+                        send_message(telegram_id, EXPIRED_REPLY.format(text=text[:100]))
+                    continue
+
+                g.pending_replay = True
+                try:
+                    process_update(update)
+                except GeminiUnavailable as e:
+                    self.release(pending_id)
+                    log_operation(logger, "PENDING_DRAIN_STOPPED",
+                                  f"Gemini volvió a fallar; quedan {self.count()} pendientes: {e.reason}",
+                                  telegram_id=telegram_id, error_code=ErrorCodes.OP_FAILED)
+                    break
+            self.complete(pending_id)
+            replayed += 1
+            with self._lock:
+                self._replayed += 1
+            log_operation(logger, "PENDING_REPLAYED",
+                          f"Pendiente reprocesado: id={pending_id}, espera={time.time() - enqueued_at:.1f}s",
+                          telegram_id=telegram_id, error_code=ErrorCodes.OP_SUCCESS)
+        return replayed
+
+    def stats(self) -> dict:
+        """
+        Contadores de la cola
+
+        Returns:
+            Diccionario con pendientes actuales y totales de encolados, reprocesados y descartados
+        """
+        try:
+            pending = self.count()
+        except sqlite3.Error:
+            pending = None
+        with self._lock:
+            return {
+                "pending": pending,
+                "enqueued": self._enqueued,
+                "replayed": self._replayed,
+                "expired": self._expired,
+                "drains": self._drains,
+                "draining": self._drain_lock.locked(),
+                "max_age_seconds": self.max_age,
+            }
+
+
+def get_pending_queue(app) -> Optional[PendingExtractionQueue]:
+    """
+    Obtiene (o crea de forma lazy) la cola de pendientes de la aplicación
+
+    La cola necesita el breaker de Gemini: es quien avisa cuando Gemini se
+    recupera para vaciarla.
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        PendingExtractionQueue o None si PENDING_EXTRACTION_ENABLED o el breaker están desactivados
+    """
+    if not app.config.get("PENDING_EXTRACTION_ENABLED"):
+        return None
+
+    pending_queue = app.extensions.get("pending_extractions")
+    if pending_queue is None:
+        from app.circuit_breaker import get_gemini_breaker
+
+        breaker = get_gemini_breaker(app)
+        if breaker is None:
+            return None
+        with _queue_lock:
+            pending_queue = app.extensions.get("pending_extractions")
+            if pending_queue is None:
+                pending_queue = PendingExtractionQueue(
+                    app.config.get("PENDING_EXTRACTION_PATH", "/tmp/we_owe_bot_pending.db"),
+                    max_age_seconds=app.config.get("PENDING_EXTRACTION_MAX_AGE_SECONDS", 86400),
+                )
+                breaker.add_success_listener(lambda: pending_queue.schedule_drain(app))
+                app.extensions["pending_extractions"] = pending_queue
+    return pending_queue
@@ -0,0 +1,212 @@
+"""
+Ingesta de updates por long polling (getUpdates)
+
+Alternativa al webhook para correr el bot sin endpoint público. Los updates se
+piden en lotes (offset/limit/timeout) y se procesan con el mismo `process_update`
+del webhook, usando una sola sesión de DB por lote. Con commit por lote, las
+llamadas a Telegram del lote se retienen y salen después del commit.
+"""
+import logging
+import time
+from typing import List, Optional
+
+import requests
+from flask import g
+
+from app import db
+from app.config import Config
+from app.dedup import get_update_deduplicator
+from app.webhook_reply import held_outbox
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramPoller:
+    """
+    Consume updates de Telegram con getUpdates y los procesa por lotes
+
+    Attributes:
+        app: Instancia de la aplicación Flask
+        limit: Máximo de updates por lote (1-100)
+        timeout: Segundos de long polling en getUpdates
+        batch_commit: Si True, un solo commit de DB por lote
+        offset: Próximo update_id a pedir
+    """
+
+    def __init__(self, app, limit: Optional[int] = None, timeout: Optional[int] = None,
+                 batch_commit: Optional[bool] = None):
+        self.app = app
+        self.limit = max(1, min(100, limit or app.config.get("POLLING_LIMIT", 100)))
+        self.timeout = timeout if timeout is not None else app.config.get("POLLING_TIMEOUT", 30)
+        self.batch_commit = (
+            batch_commit if batch_commit is not None
+            else app.config.get("POLLING_BATCH_COMMIT", True)
+        )
+        self.offset: Optional[int] = None
+        self.api_url = f"{Config.TELEGRAM_API_BASE_URL}/bot{Config.TELEGRAM_BOT_TOKEN}"
+        self._session = requests.Session()
+
+    def delete_webhook(self) -> bool:
+        """
+        Elimina el webhook configurado (Telegram no permite getUpdates con webhook activo)
+
+        Returns:
+            True si se eliminó correctamente
+        """
+        try:
+            response = self._session.post(f"{self.api_url}/deleteWebhook", timeout=10)
+            response.raise_for_status()
+            return True
+        except requests.exceptions.RequestException as e:
+            log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
+                      f"Error al eliminar el webhook: {str(e)}", exception=e)
+            return False
+
+    def fetch_updates(self) -> Optional[List[dict]]:
+        """
+        Pide el siguiente lote de updates a Telegram
+
+        Returns:
+            Lista de updates (vacía si no hay nuevos) o None si hubo error
+        """
+        payload = {"limit": self.limit, "timeout": self.timeout}
+        if self.offset is not None:
+            payload["offset"] = self.offset
+
+        try:
+            response = self._session.post(
+                f"{self.api_url}/getUpdates", json=payload, timeout=self.timeout + 10
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
+                      f"Error en getUpdates: {str(e)}", exception=e)
+            return None
+
+        if not data.get("ok"):
+            log_error(logger, ErrorCodes.ERR_TELEGRAM_API,
+                      "getUpdates respondió ok=false",
+                      data_dict={"description": data.get("description")})
+            return None
+
+        return data.get("result", [])
+
+    def process_batch(self, updates: List[dict]) -> bool:
+        """
+        Procesa un lote de updates dentro de un único contexto de aplicación
+
+        Con batch_commit cada update corre en un savepoint (un error solo revierte
+        ese update) y el lote se confirma con un único commit. Las llamadas a
+        Telegram del lote (confirmaciones, respuestas a callbacks, avisos) quedan
+        retenidas y se envían en orden después del commit. Si ese commit falla,
+        se descartan, el offset no avanza y Telegram vuelve a entregar el lote
+        completo: el usuario no recibe un "registrado" de algo que no se guardó
+        ni la confirmación duplicada al reprocesarlo.
+
+        Args:
+            updates: Lista de updates de Telegram
+
+        Returns:
+            True si el lote se confirmó y el offset avanzó
+        """
+        if not updates:
+            return True
+
+        from app.routes import process_update
+        from app.bot_services import send_held
+
+        started = time.monotonic()
+        with self.app.app_context():
+            dedup = get_update_deduplicator(self.app)
+            fresh = [
+                update for update in updates
+                if dedup is None or not dedup.is_duplicate(update.get("update_id"))
+            ]
+
+            g.defer_commit = self.batch_commit
+            if self.batch_commit:
+                self._begin_batch()
+            failed = 0
+            with held_outbox(self.batch_commit) as outbox:
+                for update in fresh:
+                    savepoint = db.session.begin_nested() if self.batch_commit else None
+                    _, status_code = process_update(update)
+                    if status_code >= 500:
+                        failed += 1
+                    if savepoint is not None:
+                        if status_code >= 500 or not savepoint.is_active:
+                            savepoint.rollback()
+                        else:
+                            savepoint.commit()
+
+            sent = 0
+            if self.batch_commit:
+                try:
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    if dedup is not None:
+                        for update in fresh:
+                            dedup.forget(update.get("update_id"))
+                    log_error(logger, ErrorCodes.ERR_DB_QUERY,
+                              f"Error en el commit del lote, se reintentará: {str(e)}",
+                              data_dict={"batch_size": len(updates),
+                                         "discarded_calls": len(outbox.drain())},
+                              exception=e)
+                    return False
+
+                for held in outbox.drain():
+                    sent += send_held(held)
+
+        self.offset = max(update["update_id"] for update in updates) + 1
+        log_operation(logger, "POLLING_BATCH_PROCESSED",
+                      f"Lote procesado: updates={len(updates)}, nuevos={len(fresh)}, "
+                      f"fallidos={failed}, llamadas_tras_commit={sent}, "
+                      f"duracion_ms={(time.monotonic() - started) * 1000:.1f}",
+                      error_code=ErrorCodes.OP_SUCCESS)
+        return True
+
+    @staticmethod
+    def _begin_batch():
+        """
+        Abre la transacción del lote antes del primer savepoint
+
+        pysqlite no inicia transacción con SAVEPOINT: sin un BEGIN explícito el
+        RELEASE de cada savepoint confirma ese update y un fallo del commit del
+        lote ya no lo revierte (el reenvío lo registraría dos veces).
+        """
+        connection = db.session.connection()
+        if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN")
+
+    def poll_once(self) -> Optional[int]:
+        """
+        Pide y procesa un lote
+
+        Returns:
+            Número de updates recibidos en el lote o None si getUpdates falló
+        """
+        updates = self.fetch_updates()
+        if updates is None:
+            return None
+        self.process_batch(updates)
+        return len(updates)
+
+    def run_forever(self, idle_sleep: float = 1.0):
+        """
+        Bucle principal de long polling
+
+        Args:
+            idle_sleep: Segundos de espera tras un error, o tras un lote vacío cuando
+                no se usa long polling (timeout=0)
+        """
+        log_operation(logger, "POLLING_STARTED",
+                      f"Long polling iniciado: limit={self.limit}, timeout={self.timeout}, "
+                      f"batch_commit={self.batch_commit}",
+                      error_code=ErrorCodes.OP_SUCCESS)
+        while True:
+            received = self.poll_once()
+            if received is None or (received == 0 and self.timeout == 0):
+                time.sleep(idle_sleep)
@@ -0,0 +1,309 @@
+"""
+Control de admisión con token buckets para proteger la cuota de Gemini
+
+Cada mensaje que llega a llamar a Gemini (ni el extractor local ni la caché
+lo resolvieron) consume un token del bucket del usuario (`telegram_id`) y uno
+del bucket global. El estado de los buckets vive en un
+store intercambiable: en memoria (por proceso) o SQLite (compartido entre
+workers/procesos de la misma máquina).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_limiter_lock = threading.Lock()
+
+# (clave, tokens_por_segundo, capacidad)
+BucketSpec = Tuple[str, float, float]
+
+# Buckets en memoria a partir de los cuales se purgan los que ya están llenos
+MAX_IDLE_BUCKETS = 10000
+
+
+@dataclass(frozen=True)
+class RateLimitDecision:
+    """
+    Resultado de una solicitud de admisión
+
+    Attributes:
+        allowed: True si se admite el mensaje
+        scope: "user" o "global" si se rechazó; None si se admitió
+        retry_after: Segundos hasta que haya un token disponible
+    """
+    allowed: bool
+    scope: Optional[str] = None
+    retry_after: float = 0.0
+
+
+class RateLimited(Exception):
+    """El mensaje necesita una llamada a Gemini y no hay token disponible"""
+
+    def __init__(self, telegram_id: int, decision: RateLimitDecision):
+        super().__init__(f"Mensaje limitado ({decision.scope}): reintentar en {decision.retry_after:.1f}s")
+        self.telegram_id = telegram_id
+        self.decision = decision
+
+
+def _refill(tokens: float, updated_at: float, now: float, rate: float, capacity: float) -> float:
+    """Tokens disponibles tras recargar el bucket hasta `now`"""
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+class InMemoryBucketStore:
+    """
+    Store de buckets en memoria del proceso
+
+    Un bucket recargado hasta su capacidad equivale a uno inexistente, así que
+    al superar MAX_IDLE_BUCKETS se eliminan los que ya están llenos.
+    """
+
+    def __init__(self):
+        # clave -> (tokens, updated_at, tokens_por_segundo, capacidad)
+        self._buckets: Dict[str, Tuple[float, float, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, specs: List[BucketSpec], now: Optional[float] = None) -> Tuple[Optional[str], float]:
+        """
+        Consume un token de todos los buckets o de ninguno
+
+        Args:
+            specs: Lista de (clave, tokens_por_segundo, capacidad)
+            now: Tiempo actual (time.time() por defecto)
+
+        Returns:
+            Tupla (clave_rechazada o None, segundos_para_reintentar)
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            levels = {}
+            for key, rate, capacity in specs:
+                tokens, updated_at = self._buckets.get(key, (capacity, now))[:2]
+                level = _refill(tokens, updated_at, now, rate, capacity)
+                if level < 1.0:
+                    return key, (1.0 - level) / rate if rate > 0 else float("inf")
+                levels[key] = level
+
+            for key, rate, capacity in specs:
+                self._buckets[key] = (levels[key] - 1.0, now, rate, capacity)
+            if len(self._buckets) > MAX_IDLE_BUCKETS:
+                self._prune(now)
+        return None, 0.0
+
+    def _prune(self, now: float):
+        """Elimina los buckets que ya se recargaron hasta su capacidad"""
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if _refill(bucket[0], bucket[1], now, bucket[2], bucket[3]) < bucket[3]
+        }
+
+
+class SQLiteBucketStore:
+    """
+    Store de buckets en un archivo SQLite compartido entre procesos
+
+    Cada adquisición corre en una transacción `BEGIN IMMEDIATE`, que serializa
+    a los workers que compiten por el mismo archivo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Conexión SQLite por thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, specs: List[BucketSpec], now: Optional[float] = None) -> Tuple[Optional[str], float]:
+        """
+        Consume un token de todos los buckets o de ninguno
+
+        Args:
+            specs: Lista de (clave, tokens_por_segundo, capacidad)
+            now: Tiempo actual (time.time() por defecto)
+
+        Returns:
+            Tupla (clave_rechazada o None, segundos_para_reintentar)
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = {}
+            for key, rate, capacity in specs:
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated_at = row if row else (capacity, now)
+                level = _refill(tokens, updated_at, now, rate, capacity)
+                if level < 1.0:
+                    conn.execute("ROLLBACK")
+                    return key, (1.0 - level) / rate if rate > 0 else float("inf")
+                levels[key] = level
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                [(key, level - 1.0, now) for key, level in levels.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return None, 0.0
+
+
+class RateLimiter:
+    """
+    Limitador por usuario y global
+
+    Attributes:
+        user_rate: Tokens por segundo por usuario
+        user_burst: Capacidad del bucket por usuario
+        global_rate: Tokens por segundo globales
+        global_burst: Capacidad del bucket global
+    """
+
+    def __init__(self, store, user_rate: float, user_burst: float,
+                 global_rate: float, global_burst: float):
+        self.store = store
+        self.user_rate = user_rate
+        self.user_burst = max(1.0, user_burst)
+        self.global_rate = global_rate
+        self.global_burst = max(1.0, global_burst)
+
+        self._lock = threading.Lock()
+        self._notified_until: Dict[int, float] = {}
+        self._allowed = 0
+        self._throttled = {"user": 0, "global": 0}
+        self._store_errors = 0
+
+    def check(self, telegram_id: int) -> RateLimitDecision:
+        """
+        Solicita admisión para un mensaje del usuario
+
+        La decisión se registra en los logs estructurados. Si el store SQLite
+        falla (p. ej. timeout de `BEGIN IMMEDIATE` con el archivo bloqueado) se
+        admite el mensaje (fail-open), igual que la deduplicación ante errores
+        de DB.
+
+        Args:
+            telegram_id: ID de Telegram del usuario
+
+        Returns:
+            RateLimitDecision
+        """
+        specs = [(f"user:{telegram_id}", self.user_rate, self.user_burst)]
+        if self.global_rate > 0:
+            specs.append(("global", self.global_rate, self.global_burst))
+
+        try:
+            denied_key, retry_after = self.store.acquire(specs)
+        except sqlite3.Error as e:
+            with self._lock:
+                self._store_errors += 1
+            log_error(logger, ErrorCodes.ERR_DB_QUERY,
+                      f"Error del store del limitador, se admite el mensaje: {str(e)}",
+                      telegram_id=telegram_id, exception=e)
+            return RateLimitDecision(allowed=True)
+
+        if denied_key is None:
+            with self._lock:
+                self._allowed += 1
+            return RateLimitDecision(allowed=True)
+
+        scope = "global" if denied_key == "global" else "user"
+        with self._lock:
+            self._throttled[scope] += 1
+        log_operation(logger, "RATE_LIMITED",
+                      f"Mensaje limitado: scope={scope}, retry_after={retry_after:.1f}s",
+                      telegram_id=telegram_id, error_code=ErrorCodes.RATE_LIMITED)
+        return RateLimitDecision(allowed=False, scope=scope, retry_after=retry_after)
+
+    def should_notify(self, telegram_id: int, retry_after: float) -> bool:
+        """
+        Indica si se debe enviar la respuesta de límite al usuario
+
+        Solo se notifica una vez por ventana de espera para no convertir el
+        límite en otra fuente de llamadas a Telegram.
+
+        Args:
+            telegram_id: ID de Telegram del usuario
+            retry_after: Segundos hasta el próximo token
+
+        Returns:
+            True si no se ha notificado en la ventana actual
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._notified_until.get(telegram_id, 0.0) > now:
+                return False
+            self._notified_until[telegram_id] = now + max(retry_after, 1.0)
+            if len(self._notified_until) > 10000:
+                self._notified_until = {
+                    key: until for key, until in self._notified_until.items() if until > now
+                }
+            return True
+
+    def stats(self) -> dict:
+        """Contadores de decisiones del limitador"""
+        with self._lock:
+            return {
+                "store": type(self.store).__name__,
+                "allowed": self._allowed,
+                "throttled_user": self._throttled["user"],
+                "throttled_global": self._throttled["global"],
+                "store_errors": self._store_errors,
+            }
+
+
+def get_rate_limiter(app) -> Optional[RateLimiter]:
+    """
+    Obtiene (o crea de forma lazy) el limitador de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        RateLimiter o None si RATE_LIMIT_ENABLED está desactivado
+    """
+    if not app.config.get("RATE_LIMIT_ENABLED"):
+        return None
+
+    limiter = app.extensions.get("rate_limiter")
+    if limiter is None:
+        with _limiter_lock:
+            limiter = app.extensions.get("rate_limiter")
+            if limiter is None:
+                if app.config.get("RATE_LIMIT_STORE", "memory") == "sqlite":
+                    store = SQLiteBucketStore(app.config["RATE_LIMIT_SQLITE_PATH"])
+                else:
+                    store = InMemoryBucketStore()
+                limiter = RateLimiter(
+                    store,
+                    user_rate=app.config.get("RATE_LIMIT_USER_RATE", 0.2),
+                    user_burst=app.config.get("RATE_LIMIT_USER_BURST", 5),
+                    global_rate=app.config.get("RATE_LIMIT_GLOBAL_RATE", 2.0),
+                    global_burst=app.config.get("RATE_LIMIT_GLOBAL_BURST", 20),
+                )
+                app.extensions["rate_limiter"] = limiter
+    return limiter
@@ -0,0 +1,514 @@
+"""
+Recordatorios de deudas vencidas o que vencen hoy
+
+Una vez al día, cada deudor con deudas pendientes cuya fecha límite ya pasó
+o es hoy (en su zona horaria) recibe un solo mensaje con el resumen: las
+primeras REMINDERS_MAX_ITEMS deudas, cuántas más tiene y el total por moneda.
+
+El barrido es una sola consulta indexada (`ix_expenses_reminder_pending`:
+is_settled, debtor_id, due_date, id) ordenada por deudor, leída en streaming
+con `yield_per`: las filas de un deudor llegan juntas y se agrupan al vuelo,
+así que la memoria no depende de cuántos usuarios o deudas haya. La consulta
+se corta cada REMINDERS_BATCH_SIZE deudores y se retoma desde el último
+deudor atendido (keyset sobre debtor_id), para no tener un cursor abierto
+mientras se guarda el avance.
+
+El avance vive en `reminder_runs` (una fila por día): antes de enviar un
+bloque se guarda su último deudor, así que si el proceso se cae a mitad del
+barrido la siguiente ejecución sigue después de ese bloque y nadie recibe
+dos recordatorios el mismo día (a cambio, los de un bloque interrumpido
+pueden quedarse sin el suyo). Un lease evita que dos procesos barran a la
+vez: el CLI (`python remind.py`) y el disparo en proceso
+(REMINDERS_SCHEDULE_ENABLED) pueden convivir en varios workers.
+
+Los mensajes salen por la cola de salida de Telegram con prioridad masiva
+(después de las respuestas a los updates, dentro de los límites por chat y
+global) y se espera a que salga cada bloque antes de leer el siguiente.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, wait
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+from app.date_resolver import get_timezone, today_in
+from app.logger_config import log_error, log_operation, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_reminders_lock = threading.Lock()
+
+# Adelanto máximo de una zona horaria sobre UTC (UTC+14): tope de la consulta
+MAX_UTC_OFFSET = timedelta(hours=14)
+
+# Reintento del disparo en proceso si otro proceso tiene el barrido o falló
+RETRY_SECONDS = 60
+
+
+@dataclass
+class DebtorDigest:
+    """
+    Resumen de las deudas vencidas de un deudor
+
+    Attributes:
+        debtor_id: ID del deudor
+        telegram_id: Chat del deudor
+        today: Fecha de hoy del deudor (vencida = due_date anterior)
+        items: Primeras deudas (monto, moneda, descripción, due_date, nombre del pagador)
+        count: Deudas vencidas o que vencen hoy en total
+        totals: Total por moneda
+    """
+    debtor_id: int
+    telegram_id: int
+    today: date
+    items: List[tuple] = field(default_factory=list)
+    count: int = 0
+    totals: Dict[str, Decimal] = field(default_factory=dict)
+
+
+def due_debts_statement(latest_due: date, after_debtor_id: int = 0, stream_rows: int = 1000):
+    """
+    Deudas pendientes con due_date <= latest_due de los deudores después de `after_debtor_id`
+
+    Args:
+        latest_due: Fecha límite máxima (la de hoy en la zona más adelantada)
+        after_debtor_id: Último deudor ya atendido (0 = desde el principio)
+        stream_rows: Filas por lote del streaming (`yield_per`)
+
+    Returns:
+        SELECT ordenado por (debtor_id, due_date, id)
+    """
+    # Import diferido: app.models importa la aplicación
+    from app.models import Expense, User
+
+    debtor, payer = aliased(User), aliased(User)
+    return (
+        select(Expense.debtor_id, debtor.telegram_id, debtor.timezone, Expense.amount,
+               Expense.currency, Expense.description, Expense.due_date, payer.name)
+        .select_from(Expense)
+        .join(debtor, debtor.id == Expense.debtor_id)
+        .join(payer, payer.id == Expense.payer_id)
+        .where(Expense.is_settled == False,  # noqa: E712
+               Expense.debtor_id > after_debtor_id,
+               Expense.due_date <= latest_due,
+               debtor.is_authorized == True)  # noqa: E712
+        .order_by(Expense.debtor_id, Expense.due_date, Expense.id)
+        .execution_options(yield_per=stream_rows)
+    )
+
+
+def iter_digests(rows: Iterable, max_items: int, now: Optional[datetime] = None,
+                 run_date: Optional[date] = None) -> Iterator[DebtorDigest]:
+    """
+    Agrupa las filas de `due_debts_statement` en un resumen por deudor
+
+    Args:
+        rows: Filas ordenadas por deudor
+        max_items: Deudas que se detallan en cada resumen
+        now: Opcional, instante de referencia con zona (por defecto ahora)
+        run_date: Opcional, fecha fija de hoy para todos (por defecto la de cada deudor)
+
+    Yields:
+        DebtorDigest de cada deudor con al menos una deuda vencida o que vence hoy
+    """
+    now = now or datetime.now(timezone.utc)
+    for debtor_id, debtor_rows in groupby(rows, key=lambda row: row[0]):
+        digest = None
+        for _, telegram_id, timezone_name, amount, currency, description, due_date, payer_name in debtor_rows:
+            if digest is None:
+                digest = DebtorDigest(debtor_id, telegram_id, run_date or today_in(timezone_name, now))
+            if due_date > digest.today:
+                continue
+            digest.count += 1
+            digest.totals[currency] = digest.totals.get(currency, Decimal(0)) + amount
+            if len(digest.items) < max_items:
+                digest.items.append((amount, currency, description, due_date, payer_name))
+        if digest is not None and digest.count:
+            yield digest
+
+
+def format_reminder(digest: DebtorDigest) -> str:
+    """
+    Formatea el recordatorio de un deudor
+
+    Args:
+        digest: Resumen de sus deudas vencidas
+
+    Returns:
+        Mensaje HTML
+    """
+    # Import diferido: bot_services importa requests (arranque en frío)
+    from app.bot_services import preview_description
+
+    noun = "deuda vencida o que vence" if digest.count == 1 else "deudas vencidas o que vencen"
+    message = (
+        "⏰ <b>Recordatorio de deudas</b>\n\n"
+        f"Tienes {digest.count} {noun} hoy:\n\n"
+    )
+    for idx, (amount, currency, description, due_date, payer_name) in enumerate(digest.items, 1):
+        status = "🔴 Vence hoy" if due_date == digest.today else f"⚠️ Vencida ({due_date.strftime('%d/%m/%Y')})"
+        message += (
+            f"<b>{idx}.</b> {amount} {currency} - {preview_description(description)}\n"
+            f"   👤 A: {payer_name or 'Usuario'} {status}\n\n"
+        )
+    if digest.count > len(digest.items):
+        message += f"… y {digest.count - len(digest.items)} más\n\n"
+
+    message += "<b>💰 Total:</b>\n"
+    for currency, total in digest.totals.items():
+        message += f"• {float(total):,.2f} {currency}\n"
+    message += "\nEscribe \"pagar deudas\" para saldarlas."
+    return message
+
+
+class ReminderBroadcaster:
+    """
+    Barrido diario de recordatorios con avance reanudable
+
+    Attributes:
+        app: Aplicación Flask
+        batch_size: Deudores por bloque (cada bloque guarda el avance y espera su envío)
+        stream_rows: Filas por lote del streaming de la consulta
+        max_items: Deudas detalladas por recordatorio
+        lease_seconds: Duración del lease del barrido (se renueva en cada bloque)
+        daily_at: Hora local (DEFAULT_TIMEZONE) del disparo en proceso, "HH:MM"
+    """
+
+    def __init__(self, app, batch_size: int = 200, stream_rows: int = 1000, max_items: int = 10,
+                 lease_seconds: float = 300.0, daily_at: str = "09:00"):
+        self.app = app
+        self.batch_size = max(1, batch_size)
+        self.stream_rows = max(1, stream_rows)
+        self.max_items = max(1, max_items)
+        self.lease_seconds = lease_seconds
+        hour, minute = daily_at.split(":")
+        self.daily_at = (int(hour), int(minute))
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._done_date: Optional[date] = None
+        self._retry_at = 0.0
+        self._runs = 0
+        self._last_run: Optional[dict] = None
+
+    def run(self, run_date: Optional[date] = None, now: Optional[datetime] = None,
+            dry_run: bool = False) -> dict:
+        """
+        Barre las deudas vencidas del día y envía un recordatorio por deudor
+
+        Args:
+            run_date: Opcional, día del barrido y fecha de hoy para todos los
+                deudores (por defecto hoy en DEFAULT_TIMEZONE, y cada deudor
+                con la fecha de su zona horaria)
+            now: Opcional, instante de referencia con zona (por defecto ahora)
+            dry_run: Solo cuenta los recordatorios: no envía ni guarda avance
+
+        Returns:
+            Diccionario con el resultado: status ("done", "already_done",
+            "busy", "lease_lost"), deudores, deudas, fallidos y segundos
+        """
+        # Import diferido: app.models importa la aplicación
+        from app import db
+
+        started = time.monotonic()
+        now = now or datetime.now(timezone.utc)
+        fixed_date = run_date
+        run_date = run_date or today_in(None, now)
+        latest_due = fixed_date or (now.astimezone(timezone.utc) + MAX_UTC_OFFSET).date()
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        result = {"run_date": run_date.isoformat(), "status": "done", "debtors": 0, "debts": 0,
+                  "failed": 0, "blocks": 0}
+
+        with self.app.app_context():
+            after = 0
+            if not dry_run:
+                claimed = self._claim(run_date, owner, now)
+                if claimed is None:
+                    result["status"] = self._unclaimed_status(run_date)
+                    return self._finish_result(result, started)
+                after = claimed
+
+            while True:
+                digests = self._read_block(latest_due, after, now, fixed_date)
+                if not digests:
+                    break
+                after = digests[-1].debtor_id
+                result["blocks"] += 1
+                result["debtors"] += len(digests)
+                result["debts"] += sum(digest.count for digest in digests)
+                if dry_run:
+                    continue
+
+                # El avance se guarda antes de enviar: una caída a mitad del
+                # bloque no repite sus recordatorios en la siguiente ejecución
+                if not self._checkpoint(run_date, owner, after):
+                    result["status"] = "lease_lost"
+                    break
+                failed = self._send_block(digests)
+                result["failed"] += failed
+                self._record_sent(run_date, owner, len(digests) - failed, failed)
+
+            if not dry_run and result["status"] == "done":
+                self._complete(run_date, owner)
+            db.session.remove()
+
+        return self._finish_result(result, started)
+
+    def _finish_result(self, result: dict, started: float) -> dict:
+        """Completa el resultado con la duración, lo guarda para /health y lo registra"""
+        result["seconds"] = round(time.monotonic() - started, 3)
+        with self._lock:
+            self._runs += 1
+            self._last_run = result
+        log_operation(logger, "REMINDERS_RUN",
+                      f"Recordatorios {result['run_date']}: status={result['status']}, "
+                      f"deudores={result['debtors']}, deudas={result['debts']}, fallidos={result['failed']}",
+                      error_code=ErrorCodes.OP_SUCCESS)
+        return result
+
+    def _read_block(self, latest_due: date, after: int, now: datetime,
+                    fixed_date: Optional[date]) -> List[DebtorDigest]:
+        """
+        Lee los resúmenes del siguiente bloque de deudores (streaming)
+
+        La consulta se cierra al completar el bloque: las filas ya leídas del
+        deudor siguiente se vuelven a leer en el próximo bloque.
+        """
+        from app import db
+
+        digests = []
+        result = db.session.execute(due_debts_statement(latest_due, after, self.stream_rows))
+        try:
+            for digest in iter_digests(result, self.max_items, now, fixed_date):
+                digests.append(digest)
+                if len(digests) >= self.batch_size:
+                    break
+        finally:
+            result.close()
+        db.session.commit()
+        return digests
+
+    def _claim(self, run_date: date, owner: str, now: datetime) -> Optional[int]:
+        """
+        Toma el lease del barrido del día
+
+        Returns:
+            Último deudor ya atendido (0 si el barrido empieza), o None si el
+            barrido ya terminó o lo tiene otro proceso
+        """
+        from app import db
+        from app.models import ReminderRun
+
+        now_utc = now.astimezone(timezone.utc).replace(tzinfo=None)
+        try:
+            db.session.add(ReminderRun(run_date=run_date, started_at=now_utc))
+            db.session.commit()
+        except IntegrityError:
+            # Otro proceso (o una ejecución anterior) ya creó la fila del día
+            db.session.rollback()
+
+        claimed = db.session.execute(
+            update(ReminderRun)
+            .where(ReminderRun.run_date == run_date,
+                   ReminderRun.finished_at.is_(None),
+                   or_(ReminderRun.owner.is_(None), ReminderRun.lease_until < now_utc))
+            .values(owner=owner, lease_until=now_utc + timedelta(seconds=self.lease_seconds))
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return None
+        return db.session.get(ReminderRun, run_date).last_debtor_id
+
+    def _unclaimed_status(self, run_date: date) -> str:
+        """"already_done" si el barrido del día terminó, "busy" si lo tiene otro proceso"""
+        from app import db
+        from app.models import ReminderRun
+
+        run = db.session.get(ReminderRun, run_date)
+        db.session.commit()
+        return "already_done" if run is not None and run.finished_at is not None else "busy"
+
+    def _owned(self, run_date: date, owner: str):
+        """Filtro de la fila del día con el lease de este barrido"""
+        from app.models import ReminderRun
+        return and_(ReminderRun.run_date == run_date, ReminderRun.owner == owner)
+
+    def _checkpoint(self, run_date: date, owner: str, last_debtor_id: int) -> bool:
+        """Guarda el último deudor del bloque y renueva el lease; False si se perdió el lease"""
+        from app import db
+        from app.models import ReminderRun
+
+        lease_until = datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+        updated = db.session.execute(
+            update(ReminderRun)
+            .where(self._owned(run_date, owner))
+            .values(last_debtor_id=last_debtor_id, lease_until=lease_until)
+        ).rowcount
+        db.session.commit()
+        if not updated:
+            log_error(logger, ErrorCodes.ERR_REMINDER,
+                      f"Lease de recordatorios perdido: run_date={run_date}, last_debtor_id={last_debtor_id}")
+        return bool(updated)
+
+    def _record_sent(self, run_date: date, owner: str, sent: int, failed: int):
+        """Suma los enviados y fallidos del bloque a la fila del día"""
+        from app import db
+        from app.models import ReminderRun
+
+        db.session.execute(
+            update(ReminderRun)
+            .where(self._owned(run_date, owner))
+            .values(sent=ReminderRun.sent + sent, failed=ReminderRun.failed + failed)
+        )
+        db.session.commit()
+
+    def _complete(self, run_date: date, owner: str):
+        """Marca el barrido del día como terminado y libera el lease"""
+        from app import db
+        from app.models import ReminderRun
+
+        db.session.execute(
+            update(ReminderRun)
+            .where(self._owned(run_date, owner))
+            .values(finished_at=datetime.utcnow(), owner=None, lease_until=None)
+        )
+        db.session.commit()
+
+    def _send_block(self, digests: List[DebtorDigest]) -> int:
+        """
+        Envía los recordatorios de un bloque y espera a que salgan
+
+        Con la cola de salida activa se encolan con prioridad masiva (la cola
+        respeta los límites de Telegram y los 429); sin ella se envían uno por
+        uno a TELEGRAM_GLOBAL_PER_SECOND como máximo.
+
+        Returns:
+            Recordatorios que no se pudieron enviar
+        """
+        from app.bot_services import send_message, telegram_scheduler, TELEGRAM_TIMEOUT
+        from app.telegram_scheduler import PRIORITY_BULK
+
+        scheduler = telegram_scheduler()
+        if scheduler is None:
+            interval = 1.0 / max(self.app.config.get("TELEGRAM_GLOBAL_PER_SECOND", 30.0), 0.001)
+            failed = 0
+            for digest in digests:
+                started = time.monotonic()
+                failed += not send_message(digest.telegram_id, format_reminder(digest))
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+            return failed
+
+        futures: Dict[Future, DebtorDigest] = {}
+        for digest in digests:
+            payload = {'chat_id': digest.telegram_id, 'text': format_reminder(digest), 'parse_mode': 'HTML'}
+            futures[scheduler.submit("sendMessage", payload, digest.telegram_id, PRIORITY_BULK)] = digest
+
+        # La cola descarta lo que pasa de max_age en espera: todos terminan
+        done, pending = wait(futures, timeout=scheduler.max_age + TELEGRAM_TIMEOUT)
+        failed = len(pending)
+        for future in done:
+            if future.exception() is not None:
+                failed += 1
+                log_error(logger, ErrorCodes.ERR_REMINDER,
+                          f"Recordatorio no enviado: {future.exception()}",
+                          telegram_id=futures[future].telegram_id, user_id=futures[future].debtor_id)
+        return failed
+
+    def schedule(self, now: Optional[datetime] = None):
+        """
+        Lanza el barrido del día en un thread si ya pasó la hora y no se hizo
+
+        Se llama en cada update (costo: una comparación); el barrido usa el
+        lease de `reminder_runs`, así que varios workers pueden llamarlo.
+
+        Args:
+            now: Opcional, instante de referencia con zona (por defecto ahora)
+        """
+        if time.monotonic() < self._retry_at:
+            return
+        local_now = (now or datetime.now(timezone.utc)).astimezone(get_timezone(None))
+        if self._done_date == local_now.date() or (local_now.hour, local_now.minute) < self.daily_at:
+            return
+        if not self._run_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._run_thread, args=(local_now.date(),),
+                         name="reminders", daemon=True).start()
+
+    def _run_thread(self, run_date: date):
+        """Cuerpo del thread del disparo en proceso (libera _run_lock al terminar)"""
+        try:
+            result = self.run()
+            if result["status"] in ("done", "already_done"):
+                self._done_date = run_date
+            else:
+                self._retry_at = time.monotonic() + RETRY_SECONDS
+        except Exception as e:
+            self._retry_at = time.monotonic() + RETRY_SECONDS
+            log_error(logger, ErrorCodes.ERR_REMINDER,
+                      f"Error en el barrido de recordatorios: {str(e)}", exception=e)
+        finally:
+            self._run_lock.release()
+
+    def stats(self) -> dict:
+        """
+        Estado del barrido en este proceso
+
+        Returns:
+            Diccionario con la configuración, barridos y el resultado del último
+        """
+        with self._lock:
+            return {
+                "daily_at": f"{self.daily_at[0]:02d}:{self.daily_at[1]:02d}",
+                "batch_size": self.batch_size,
+                "runs": self._runs,
+                "done_date": self._done_date.isoformat() if self._done_date else None,
+                "last_run": self._last_run,
+            }
+
+
+def get_reminder_broadcaster(app) -> ReminderBroadcaster:
+    """
+    Obtiene (o crea de forma lazy) el barrido de recordatorios de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        ReminderBroadcaster
+    """
+    broadcaster = app.extensions.get("reminders")
+    if broadcaster is None:
+        with _reminders_lock:
+            broadcaster = app.extensions.get("reminders")
+            if broadcaster is None:
+                broadcaster = ReminderBroadcaster(
+                    app,
+                    batch_size=app.config.get("REMINDERS_BATCH_SIZE", 200),
+                    stream_rows=app.config.get("REMINDERS_STREAM_ROWS", 1000),
+                    max_items=app.config.get("REMINDERS_MAX_ITEMS", 10),
+                    lease_seconds=app.config.get("REMINDERS_LEASE_SECONDS", 300.0),
+                    daily_at=app.config.get("REMINDERS_DAILY_AT", "09:00"),
+                )
+                app.extensions["reminders"] = broadcaster
+    return broadcaster
+
+
+def schedule_reminders(app):
+    """
+    Disparo en proceso del barrido diario (REMINDERS_SCHEDULE_ENABLED)
+
+    Args:
+        app: Instancia de la aplicación Flask
+    """
+    if app.config.get("REMINDERS_SCHEDULE_ENABLED"):
+        get_reminder_broadcaster(app).schedule()
@@ -2,30 +2,33 @@
 Rutas de la aplicación Flask
 """
 import logging
-from typing import Optional
-from flask import Blueprint, request, jsonify
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import select
 from app import db
 from app.models import User, Expense
-from app.bot_services import (
-    send_message,
-    is_user_authorized,
-    create_user,
-    create_expense,
-    format_expense_confirmation,
-    format_payment_receipt,
-    get_user_by_telegram_id,
-    get_user_expenses,
-    format_expenses_summary,
-    get_user_debts_to_pay,
-    get_user_debts_to_collect,
-    format_debts_list_for_payment,
-    format_debts_to_collect,
-    mark_expense_as_paid,
-    answer_callback_query,
-    edit_message_text,
-    validate_message_content
+# app.bot_services y app.ai_services (y con ellos `requests`) se importan dentro
+# de cada handler: el arranque en frío no paga su carga hasta el primer update
+from app.update_queue import get_update_pool
+from app.dedup import get_update_deduplicator
+from app.rate_limiter import RateLimited, get_rate_limiter
+from app.local_parser import get_local_parser
+from app.gemini_usage import ExtractionUsage, record_usage, OUTCOME_LOCAL, OUTCOME_FALLBACK
+from app.extraction_result import parse_stats
+from app.date_resolver import user_today, is_valid_timezone
+from app.metrics import timed_stage, STAGE_UPDATE
+from app.deadline import Deadline, DeadlineExceeded, update_deadline
+from app.webhook_reply import WebhookReply, webhook_reply
+from app.fanout import fan_out, wait_all
+from app.reminders import schedule_reminders
+from app.debt_pages import CALLBACK_PREFIX as DEBTS_PAGE_PREFIX, ROLE_PAY, ROLE_COLLECT, parse_page_callback
+from app.pending_extractions import (
+    get_pending_queue, is_pending_replay, update_sent_at, PENDING_REPLY, UNAVAILABLE_REPLY
+)
+from app.intent_router import (
+    intent_router, INTENT_LIST_EXPENSES, INTENT_PAY_DEBTS, INTENT_COLLECT_DEBTS
 )
-from app.ai_services import extract_expense_data
 from app.logger_config import (
     log_request, log_response, log_error, log_operation, ErrorCodes
 )
@@ -34,6 +37,20 @@ logger = logging.getLogger(__name__)
 
 bp = Blueprint('main', __name__)
 
+# Prefijo del callback_data de los botones para pagar una deuda
+PAY_DEBT_PREFIX = 'pay_debt_'
+
+# Respuestas compartidas con los handlers asyncio (app.async_handlers)
+NOT_AUTHORIZED_REPLY = "❌ No estás autorizado para usar este bot."
+NOT_REGISTERED_REPLY = "❌ No estás registrado. Usa /start para registrarte."
+REJECTED_REPLY = "🚫 Tu mensaje no cumple con las politicas de seguridad"
+UNPARSED_REPLY = ("❌ No pude procesar tu mensaje. Por favor, intenta de nuevo con un formato claro.\n\n"
+                  "Ejemplo: 'Gasté 50000 en el supermercado'")
+PARTIES_ERROR_REPLY = "❌ Error al procesar el gasto. No se pudo determinar quién pagó o quién debe."
+DEADLINE_REPLY = "⏳ No alcancé a procesar tu mensaje a tiempo. Intenta de nuevo en unos segundos."
+ONLY_USER_REPLY = "⚠️ Solo hay un usuario registrado. Necesitas registrar otro usuario primero."
+CALLBACK_ERROR_REPLY = "❌ Error al procesar la solicitud."
+
 
 def get_telegram_id_from_update(update: dict) -> Optional[int]:
     """
@@ -52,6 +69,20 @@ def get_telegram_id_from_update(update: dict) -> Optional[int]:
     return None
 
 
+def get_sender_id(update: dict) -> Optional[int]:
+    """
+    Variante tolerante de get_telegram_id_from_update para logs
+
+    Args:
+        update: Diccionario con el update de Telegram
+
+    Returns:
+        telegram_id del remitente o None si el update no lo trae
+    """
+    source = update.get('message') or update.get('callback_query') or {}
+    return source.get('from', {}).get('id')
+
+
 def get_message_text_from_update(update: dict) -> Optional[str]:
     """
     Extrae el texto del mensaje del update de Telegram
@@ -73,15 +104,18 @@ def webhook():
     Endpoint principal para recibir updates de Telegram
 
     Flujo:
-    1. Recibe el update de Telegram
-    2. Verifica autorización del usuario
-    3. Procesa el mensaje con Gemini
-    4. Guarda el gasto en la base de datos
-    5. Envía confirmación al usuario
+    1. Recibe y valida el update de Telegram
+    2. Descarta reenvíos de Telegram (mismo update_id)
+    3. Si WEBHOOK_ASYNC_MODE está activo, encola el update y responde 200 de inmediato
+    4. Si no, procesa el update en línea con process_update bajo un deadline
+       de UPDATE_DEADLINE_SECONDS; con WEBHOOK_INLINE_REPLY, la primera llamada
+       a Telegram del update va en el cuerpo de la respuesta. Si termina en
+       5xx (o con una excepción) se olvida el update_id para que el reintento
+       de Telegram sí se procese
     """
     try:
         update = request.get_json()
-        
+
         log_request(logger, "IN", "/webhook", data_dict={"has_update": update is not None})
 
         if not update:
@@ -89,6 +123,289 @@ def webhook():
             log_response(logger, "OUT", "/webhook", 400, error_code=ErrorCodes.RESP_ERROR)
             return jsonify({'status': 'error', 'message': 'Empty update'}), 400
 
+    except Exception as e:
+        log_error(logger, ErrorCodes.ERR_INVALID_DATA,
+                  f"Error al leer el update: {str(e)}", exception=e)
+        log_response(logger, "OUT", "/webhook", 400, error_code=ErrorCodes.RESP_ERROR)
+        return jsonify({'status': 'error', 'message': 'Invalid update'}), 400
+
+    flask_app = current_app._get_current_object()
+    update_id = update.get('update_id')
+
+    # Descartar reenvíos de Telegram antes de cualquier consulta o llamada a Gemini
+    dedup = get_update_deduplicator(flask_app)
+    if dedup is not None and dedup.is_duplicate(update_id):
+        log_operation(logger, "UPDATE_DUPLICATE_DROPPED",
+                      f"Update duplicado descartado: update_id={update_id}",
+                      error_code=ErrorCodes.UPDATE_DUPLICATE)
+        log_response(logger, "OUT", "/webhook", 200,
+                     message="Update duplicado", error_code=ErrorCodes.RESP_OK)
+        return jsonify({'status': 'ok'}), 200
+
+    pool = get_update_pool(flask_app)
+    if pool is None:
+        try:
+            response = process_inline_update(update)
+        except Exception:
+            # Flask responde 500 y Telegram reintenta: el reintento no es un duplicado
+            if dedup is not None:
+                dedup.forget(update_id)
+            raise
+        if dedup is not None and response_status(response) >= 500:
+            dedup.forget(update_id)
+        return response
+
+    if not pool.submit(update):
+        # Pool lleno: responder 503 para que Telegram reintente más tarde
+        if dedup is not None:
+            dedup.forget(update_id)
+        log_error(logger, ErrorCodes.ERR_QUEUE_FULL,
+                  "Cola de updates llena, update rechazado",
+                  data_dict={"update_id": update_id, **pool.stats()})
+        log_response(logger, "OUT", "/webhook", 503, error_code=ErrorCodes.RESP_ERROR)
+        return jsonify({'status': 'error', 'message': 'Queue full'}), 503
+
+    log_response(logger, "OUT", "/webhook", 200,
+                 message=f"Update encolado: update_id={update_id}",
+                 error_code=ErrorCodes.RESP_OK)
+    return jsonify({'status': 'ok'}), 200
+
+
+def process_inline_update(update: dict, deadline: Optional[Deadline] = None):
+    """
+    Procesa un update dentro del request del webhook
+
+    La usan `webhook()` y la app ASGI nativa (`app.asgi`), que la ejecuta en
+    su pool de workers para los updates sin handler asyncio. El deadline del update se crea aquí (o se activa el
+    que recibe) y process_update lo reutiliza; con WEBHOOK_INLINE_REPLY, la
+    primera llamada a Telegram del update va en el cuerpo de la respuesta.
+    Requiere un contexto de aplicación.
+
+    Args:
+        update: Diccionario con el update de Telegram ya deduplicado
+        deadline: Deadline creado al recibir el update (app ASGI nativa), para
+            que la espera por un worker o por el turno del chat cuente
+
+    Returns:
+        Respuesta Flask (json, status_code)
+    """
+    flask_app = current_app._get_current_object()
+    with update_deadline(flask_app.config.get('UPDATE_DEADLINE_SECONDS', 0),
+                         flask_app.config.get('UPDATE_DEADLINE_REPLY_RESERVE', 0),
+                         deadline=deadline, telegram_id=get_sender_id(update)):
+        with webhook_reply(flask_app.config.get('WEBHOOK_INLINE_REPLY', False)) as inline:
+            return inline_reply_response(process_update(update), inline)
+
+
+def response_status(response) -> int:
+    """Status HTTP de una respuesta Flask (objeto Response o tupla (json, status_code))"""
+    return response[1] if isinstance(response, tuple) else response.status_code
+
+
+def inline_reply_response(response, inline: Optional[WebhookReply]):
+    """
+    Pone en la respuesta del webhook la llamada a Telegram retenida, si la hay
+
+    Con un status distinto de 200 Telegram ignora el cuerpo (y reintenta el
+    update), así que la llamada retenida se envía por HTTP.
+
+    Args:
+        response: Respuesta Flask (json, status_code) de process_update
+        inline: WebhookReply del request o None
+
+    Returns:
+        Respuesta Flask (json, status_code)
+    """
+    held = inline.release() if inline is not None else None
+    if held is None:
+        return response
+
+    if response_status(response) != 200:
+        from app.bot_services import send_held
+        send_held(held)
+        return response
+    return held_reply_response(held)
+
+
+def held_reply_response(held):
+    """Respuesta 200 del webhook con la llamada retenida en el cuerpo"""
+    log_response(logger, "OUT", "/webhook", 200, telegram_id=held.chat_id,
+                 message=f"{held.method} en la respuesta del webhook",
+                 error_code=ErrorCodes.RESP_OK)
+    return jsonify(held.body()), 200
+
+
+@timed_stage(STAGE_UPDATE)
+def process_update(update: dict):
+    """
+    Procesa un update de Telegram dentro de su presupuesto de tiempo
+
+    Reutiliza el deadline del webhook si existe; en los workers del pool y en
+    long polling crea uno propio por update. Si el presupuesto se agota antes
+    de terminar, responde al usuario con un mensaje de reintento en lugar de
+    dejar el update colgado. Si Gemini no está disponible y el extractor local
+    no alcanza, el update queda en la cola de pendientes.
+
+    Args:
+        update: Diccionario con el update de Telegram
+
+    Returns:
+        Respuesta Flask (json, status_code)
+
+    Raises:
+        GeminiUnavailable: Solo al reprocesar un pendiente (`g.pending_replay`),
+            para que la cola lo conserve
+    """
+    from app.ai_services import GeminiUnavailable
+    flask_app = current_app._get_current_object()
+    schedule_reminders(flask_app)
+    with update_deadline(flask_app.config.get('UPDATE_DEADLINE_SECONDS', 0),
+                         flask_app.config.get('UPDATE_DEADLINE_REPLY_RESERVE', 0),
+                         telegram_id=get_sender_id(update)):
+        try:
+            return _process_update(update)
+        except DeadlineExceeded as e:
+            return reply_deadline_exceeded(update, e)
+        except GeminiUnavailable as e:
+            if is_pending_replay():
+                raise
+            return defer_update(update, e)
+
+
+def reply_deadline_exceeded(update: dict, error: DeadlineExceeded):
+    """
+    Respuesta degradada cuando se agota el presupuesto del update
+
+    Args:
+        update: Diccionario con el update de Telegram
+        error: Excepción con la etapa que no alcanzó a ejecutarse
+
+    Returns:
+        Respuesta Flask (json, status_code)
+    """
+    from app.bot_services import send_message, answer_callback_query
+    telegram_id = log_deadline_exceeded(update, error)
+    if 'callback_query' in update:
+        callback_query = update['callback_query']
+        answer_callback_query(callback_query.get('id', ''), DEADLINE_REPLY, show_alert=True,
+                              chat_id=callback_query.get('message', {}).get('chat', {}).get('id'))
+    elif telegram_id:
+        send_message(telegram_id, DEADLINE_REPLY)
+    return deadline_response(telegram_id)
+
+
+def log_deadline_exceeded(update: dict, error: DeadlineExceeded) -> Optional[int]:
+    """Registra el presupuesto agotado de un update y devuelve su telegram_id"""
+    telegram_id = get_sender_id(update)
+    log_error(logger, ErrorCodes.ERR_DEADLINE_EXCEEDED,
+              f"Presupuesto del update agotado en la etapa {error.stage}",
+              telegram_id=telegram_id,
+              data_dict={"update_id": update.get('update_id'),
+                         "remaining_ms": round(error.remaining * 1000)})
+    return telegram_id
+
+
+def deadline_response(telegram_id: Optional[int]):
+    """Respuesta del webhook tras responder `DEADLINE_REPLY` al usuario"""
+    log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id,
+                 message="Respuesta degradada por deadline",
+                 error_code=ErrorCodes.ERR_DEADLINE_EXCEEDED)
+    return jsonify({'status': 'ok'}), 200
+
+
+def defer_update(update: dict, error):
+    """
+    Respuesta cuando Gemini no está disponible: guarda el update para después
+
+    Con la cola de pendientes activa el update se procesa completo cuando
+    Gemini se recupera; sin ella solo se pide al usuario que reintente.
+
+    Args:
+        update: Diccionario con el update de Telegram
+        error: GeminiUnavailable con el motivo
+
+    Returns:
+        Respuesta Flask (json, status_code)
+    """
+    from app.bot_services import send_message
+    telegram_id = get_sender_id(update)
+    pending_id = enqueue_pending(update, error)
+    if telegram_id:
+        send_message(telegram_id, pending_reply(pending_id))
+    return deferred_response(telegram_id, pending_id)
+
+
+def enqueue_pending(update: dict, error) -> Optional[int]:
+    """
+    Guarda en la cola de pendientes un update que no se pudo extraer
+
+    Corre SQLite síncrono: los handlers asyncio la llaman con `asyncio.to_thread`.
+
+    Args:
+        update: Diccionario con el update de Telegram
+        error: GeminiUnavailable con el motivo
+
+    Returns:
+        ID del pendiente o None si la cola está desactivada o falló
+    """
+    telegram_id = get_sender_id(update)
+    pending_queue = get_pending_queue(current_app._get_current_object())
+    pending_id = None
+    if pending_queue is not None:
+        try:
+            pending_id = pending_queue.enqueue(update, telegram_id)
+        except sqlite3.Error as e:
+            log_error(logger, ErrorCodes.ERR_PENDING_EXTRACTION,
+                      f"No se pudo guardar el update pendiente: {str(e)}",
+                      telegram_id=telegram_id, exception=e)
+
+    log_error(logger, ErrorCodes.ERR_GEMINI_API,
+              f"Gemini no disponible: {error.reason}",
+              telegram_id=telegram_id,
+              data_dict={"update_id": update.get('update_id'),
+                         "retry_after": round(error.retry_after, 1),
+                         "pending_id": pending_id})
+    return pending_id
+
+
+def pending_reply(pending_id: Optional[int]) -> str:
+    """Respuesta al usuario de un update que no se pudo extraer"""
+    return PENDING_REPLY if pending_id is not None else UNAVAILABLE_REPLY
+
+
+def deferred_response(telegram_id: Optional[int], pending_id: Optional[int]):
+    """Respuesta del webhook de un update que no se pudo extraer"""
+    log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id,
+                 message="Update pendiente por Gemini no disponible" if pending_id is not None
+                 else "Gemini no disponible",
+                 error_code=ErrorCodes.ERR_GEMINI_API)
+    return jsonify({'status': 'ok'}), 200
+
+
+def _process_update(update: dict):
+    """
+    Procesa un update de Telegram ya validado
+
+    Flujo:
+    1. Verifica autorización del usuario
+    2. Procesa el mensaje con Gemini (uno o varios gastos)
+    3. Guarda los gastos en la base de datos en una sola transacción
+    4. Envía una confirmación al usuario
+
+    Se ejecuta dentro del request del webhook (modo síncrono) o en un worker del
+    pool de updates (modo asíncrono). Requiere un contexto de aplicación activo.
+
+    Args:
+        update: Diccionario con el update de Telegram
+
+    Returns:
+        Respuesta Flask (json, status_code)
+    """
+    from app.ai_services import extract_expense_items, GeminiUnavailable
+    from app.bot_services import (
+        send_message, is_user_authorized, create_expenses, format_expenses_confirmation
+    )
+    try:
         # Manejar callback queries (botones inline) primero - DEBE ser lo primero
         # Esto previene que los clicks en botones se procesen como mensajes de texto
         if 'callback_query' in update:
@@ -123,86 +440,29 @@ def webhook():
                 return handle_start_command(telegram_id, update)
             elif message_text.startswith('/admin'):
                 return handle_admin_command(telegram_id, message_text)
-            elif any(keyword in message_lower for keyword in [
-                'ver mis gastos', 'lista de deudas', 'lista de gastos',
-                'mis gastos', 'ver gastos', 'mostrar gastos',
-                'gastos pendientes', 'deudas pendientes', 'resumen'
-            ]):
-                # Verificar autorización antes de mostrar gastos
-                authorized, user = is_user_authorized(telegram_id)
-                if not authorized:
-                    if user:
-                        send_message(
-                            telegram_id, "❌ No estás autorizado para usar este bot.")
-                    else:
-                        send_message(
-                            telegram_id,
-                            "❌ No estás registrado. Usa /start para registrarte."
-                        )
-                    return jsonify({'status': 'ok'}), 200
-                
-                if not user:
-                    logger.error("Usuario autorizado pero user es None")
-                    return jsonify({'status': 'error', 'message': 'Internal error'}), 500
-                
-                return handle_list_expenses(telegram_id, user)
-            elif any(keyword in message_lower for keyword in [
-                'pagar', 'pagar deuda', 'pagar deudas', 'quiero pagar',
-                'pago', 'realizar pago', 'mis deudas'
-            ]):
-                # Verificar autorización antes de mostrar deudas para pagar
-                authorized, user = is_user_authorized(telegram_id)
-                if not authorized:
-                    if user:
-                        send_message(
-                            telegram_id, "❌ No estás autorizado para usar este bot.")
-                    else:
-                        send_message(
-                            telegram_id,
-                            "❌ No estás registrado. Usa /start para registrarte."
-                        )
-                    return jsonify({'status': 'ok'}), 200
-                
-                if not user:
-                    logger.error("Usuario autorizado pero user es None")
-                    return jsonify({'status': 'error', 'message': 'Internal error'}), 500
-                
-                return handle_pay_debts(telegram_id, user)
-            elif any(keyword in message_lower for keyword in [
-                'quien me debe', 'quién me debe', 'cobrar', 'debo cobrar',
-                'me deben', 'quien me debe dinero', 'quién me debe dinero'
-            ]):
-                # Verificar autorización antes de mostrar deudas a cobrar
-                authorized, user = is_user_authorized(telegram_id)
-                if not authorized:
-                    if user:
-                        send_message(
-                            telegram_id, "❌ No estás autorizado para usar este bot.")
-                    else:
-                        send_message(
-                            telegram_id,
-                            "❌ No estás registrado. Usa /start para registrarte."
-                        )
-                    return jsonify({'status': 'ok'}), 200
-                
-                if not user:
-                    logger.error("Usuario autorizado pero user es None")
-                    return jsonify({'status': 'error', 'message': 'Internal error'}), 500
-                
-                return handle_collect_debts(telegram_id, user)
+            else:
+                intent = intent_router.resolve(message_lower)
+                if intent is not None:
+                    # Verificar autorización antes de atender consultas
+                    authorized, user = is_user_authorized(telegram_id)
+                    if not authorized:
+                        send_message(telegram_id, unauthorized_reply(user))
+                        return jsonify({'status': 'ok'}), 200
+
+                    if not user:
+                        logger.error("Usuario autorizado pero user es None")
+                        return jsonify({'status': 'error', 'message': 'Internal error'}), 500
+
+                    log_operation(logger, "INTENT_RESOLVED",
+                                  f"Intención resuelta: {intent.intent} (keyword='{intent.keyword}')",
+                                  telegram_id=telegram_id, user_id=user.id)
+                    return intent_router.handler_for(intent.intent)(telegram_id, user)
 
         # Verificar autorización
         authorized, user = is_user_authorized(telegram_id)
 
         if not authorized:
-            if user:
-                send_message(
-                    telegram_id, "❌ No estás autorizado para usar este bot.")
-            else:
-                send_message(
-                    telegram_id,
-                    "❌ No estás registrado. Usa /start para registrarte."
-                )
+            send_message(telegram_id, unauthorized_reply(user))
             return jsonify({'status': 'ok'}), 200
 
         # En este punto, si authorized es True, user no puede ser None
@@ -215,214 +475,383 @@ def webhook():
             return jsonify({'status': 'ok'}), 200
 
         # Validar contenido del mensaje por seguridad
-        if not validate_message_content(message_text):
-            log_error(logger, ErrorCodes.ERR_INVALID_DATA, 
-                     "Mensaje rechazado por políticas de seguridad: caracteres no permitidos",
-                     telegram_id=telegram_id, user_id=user.id,
-                     data_dict={"message_preview": message_text[:20]})
-            send_message(
-                telegram_id,
-                "🚫 Tu mensaje no cumple con las politicas de seguridad"
-            )
-            log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id,
-                        message="Mensaje rechazado por seguridad")
-            return jsonify({'status': 'ok'}), 200
+        if rejected_message(telegram_id, user, message_text):
+            send_message(telegram_id, REJECTED_REPLY)
+            return rejected_response(telegram_id, user)
 
-        # Extraer datos con Gemini
-        log_operation(logger, "GEMINI_EXTRACTION", f"Extrayendo datos del mensaje: {message_text[:50]}...",
-                     telegram_id=telegram_id, user_id=user.id)
-        expense_data = extract_expense_data(message_text)
+        # Extraer datos: primero el extractor local, Gemini solo si no es confiable.
+        # Las fechas relativas se resuelven con el "hoy" de la zona del usuario
+        # (un pendiente reprocesado usa la fecha en que se envió el mensaje)
+        today = user_today(user, update_sent_at(update) if is_pending_replay() else None)
+        usage = ExtractionUsage()
+        expense_items = local_extraction(telegram_id, user, message_text, today, usage)
+        if expense_items is None:
+            try:
+                # El limitador se consulta dentro, solo si el mensaje no está en caché
+                expense_items = extract_expense_items(message_text, today=today, usage=usage,
+                                                      telegram_id=telegram_id)
+            except RateLimited as e:
+                reply = rate_limited_reply(telegram_id, e)
+                if reply is not None:
+                    send_message(telegram_id, reply)
+                return rate_limited_response(telegram_id, user, e)
+            except GeminiUnavailable as e:
+                # Gemini caído: el extractor local con confianza relajada, o a la cola
+                expense_items = local_fallback(telegram_id, user, message_text, today, usage, e)
+                if expense_items is None:
+                    raise
+        # Un mensaje que se va a la cola de pendientes se cuenta cuando se reprocese
+        record_usage(current_app._get_current_object(), user.id, message_text, usage, expense_items)
 
-        if not expense_data:
-            log_error(logger, ErrorCodes.ERR_GEMINI_API,
-                     "No se pudieron extraer datos del mensaje con Gemini",
-                     telegram_id=telegram_id, user_id=user.id)
-            send_message(
-                telegram_id,
-                "❌ No pude procesar tu mensaje. Por favor, intenta de nuevo con un formato claro.\n\n"
-                "Ejemplo: 'Gasté 50000 en el supermercado'"
-            )
+        if not expense_items:
+            send_message(telegram_id, unparsed_reply(telegram_id, user))
             log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id)
             return jsonify({'status': 'ok'}), 200
 
-        # Determinar payer_id y debtor_id basándose en la acción
-        action = expense_data.get('action', 'debt')
-        mentioned_name = expense_data.get('debtor_name')  # Nombre de la persona mencionada
-        
-        # REGLA 1: Si dice "gasté" (action == "expense"):
-        #   - Quien envía el mensaje es el cobrador (payer)
-        #   - La persona mencionada es el deudor (debtor)
-        # REGLA 2: Si dice "debo" (action == "debt"):
-        #   - Quien envía el mensaje es el deudor (debtor)
-        #   - La persona mencionada es el cobrador (payer)
-        
-        if action == 'expense':
-            # Caso "gasté": el usuario es quien pagó (cobrador)
-            payer_id = user.id
-            debtor_id = None
-            
-            # Buscar quién debe (debtor) basándose en el nombre mencionado
-            if mentioned_name:
-                # Buscar usuario por nombre (búsqueda flexible, case-insensitive)
-                debtor_user = User.query.filter(
-                    db.func.lower(User.name).like(f"%{mentioned_name.lower()}%")
-                ).filter(User.id != user.id).first()
-                
-                if debtor_user:
-                    debtor_id = debtor_user.id
-                    log_operation(logger, "USER_SEARCH", 
-                                f"Usuario deudor encontrado por nombre '{mentioned_name}': {debtor_user.name}",
-                                telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
-                else:
-                    # Si no se encuentra, listar usuarios disponibles
-                    all_users = User.query.filter(User.id != user.id).all()
-                    if all_users:
-                        user_list = ", ".join([u.name for u in all_users])
-                        send_message(
-                            telegram_id,
-                            f"❌ No encontré un usuario llamado '{mentioned_name}'.\n\n"
-                            f"Usuarios disponibles: {user_list}\n\n"
-                            f"Por favor, verifica el nombre e intenta de nuevo.\n"
-                            f"Ejemplo: 'Gasté 50000 con {all_users[0].name} en el supermercado'"
-                        )
-                        log_error(logger, ErrorCodes.ERR_USER_NOT_FOUND,
-                                 f"Usuario '{mentioned_name}' no encontrado. Usuarios disponibles: {user_list}",
-                                 telegram_id=telegram_id, user_id=user.id)
-                    else:
-                        send_message(
-                            telegram_id,
-                            "⚠️ Solo hay un usuario registrado. Necesitas registrar otro usuario primero."
-                        )
-                        log_error(logger, ErrorCodes.ERR_USER_NOT_FOUND,
-                                 f"Usuario '{mentioned_name}' no encontrado y solo hay un usuario registrado",
-                                 telegram_id=telegram_id, user_id=user.id)
-                    return jsonify({'status': 'ok'}), 200
-            else:
-                # Si no se menciona a nadie en "gasté", no se puede determinar el deudor
-                send_message(
-                    telegram_id,
-                    "❌ Para registrar un gasto compartido, debes mencionar con quién gastaste.\n\n"
-                    "Ejemplo: 'Gasté 50000 con María en el supermercado'"
-                )
-                log_error(logger, ErrorCodes.ERR_NO_OTHER_USER,
-                         "Gasto compartido sin mencionar a otra persona",
-                         telegram_id=telegram_id, user_id=user.id)
+        # Determinar payer_id y debtor_id de cada gasto; si uno falla no se guarda ninguno
+        rows = []
+        for expense_data in expense_items:
+            parties = resolve_parties(telegram_id, user, expense_data)
+            if parties is None:
                 return jsonify({'status': 'ok'}), 200
-        else:
-            # Caso "debo": el usuario es quien debe (deudor)
-            debtor_id = user.id
-            payer_id = None
-            
-            # Buscar quién va a recibir el pago (payer) basándose en el nombre mencionado
-            if mentioned_name:
-                # Buscar usuario por nombre (búsqueda flexible, case-insensitive)
-                payer_user = User.query.filter(
-                    db.func.lower(User.name).like(f"%{mentioned_name.lower()}%")
-                ).filter(User.id != user.id).first()
-                
-                if payer_user:
-                    payer_id = payer_user.id
-                    log_operation(logger, "USER_SEARCH", 
-                                f"Usuario pagador encontrado por nombre '{mentioned_name}': {payer_user.name}",
-                                telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
-                else:
-                    # Si no se encuentra, listar usuarios disponibles
-                    all_users = User.query.filter(User.id != user.id).all()
-                    if all_users:
-                        user_list = ", ".join([u.name for u in all_users])
-                        send_message(
-                            telegram_id,
-                            f"❌ No encontré un usuario llamado '{mentioned_name}'.\n\n"
-                            f"Usuarios disponibles: {user_list}\n\n"
-                            f"Por favor, verifica el nombre e intenta de nuevo.\n"
-                            f"Ejemplo: 'Le debo 50000 a {all_users[0].name}'"
-                        )
-                        log_error(logger, ErrorCodes.ERR_USER_NOT_FOUND,
-                                 f"Usuario '{mentioned_name}' no encontrado. Usuarios disponibles: {user_list}",
-                                 telegram_id=telegram_id, user_id=user.id)
-                    else:
-                        send_message(
-                            telegram_id,
-                            "⚠️ Solo hay un usuario registrado. Necesitas registrar otro usuario primero."
-                        )
-                        log_error(logger, ErrorCodes.ERR_USER_NOT_FOUND,
-                                 f"Usuario '{mentioned_name}' no encontrado y solo hay un usuario registrado",
-                                 telegram_id=telegram_id, user_id=user.id)
-                    return jsonify({'status': 'ok'}), 200
-            else:
-                # Si no se especifica nombre, usar la lógica por defecto
-                # Buscar el otro usuario (asumiendo solo 2 usuarios)
-                other_user = User.query.filter(User.id != user.id).first()
-                
-                if not other_user:
-                    send_message(
-                        telegram_id,
-                        "⚠️ Solo hay un usuario registrado. Necesitas registrar otro usuario primero.\n\n"
-                        "💡 Tip: Puedes especificar a quién le debes en tu mensaje.\n"
-                        "Ejemplo: 'Le debo 50000 a María'"
-                    )
-                    log_error(logger, ErrorCodes.ERR_USER_NOT_FOUND,
-                              "Solo hay un usuario registrado. No se puede determinar el pagador.",
-                              telegram_id=telegram_id, user_id=user.id)
-                    return jsonify({'status': 'ok'}), 200
-                
-                payer_id = other_user.id
-                log_operation(logger, "DEFAULT_PAYER",
-                             f"No se especificó nombre de pagador, usando usuario por defecto: {other_user.name}",
-                             telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
-        
-        # Validar que tenemos ambos IDs
-        if not payer_id or not debtor_id:
-            log_error(logger, ErrorCodes.ERR_EXPENSE_CREATION,
-                     f"No se pudo determinar payer_id o debtor_id. payer_id={payer_id}, debtor_id={debtor_id}",
-                     telegram_id=telegram_id, user_id=user.id)
-            send_message(
-                telegram_id,
-                "❌ Error al procesar el gasto. No se pudo determinar quién pagó o quién debe."
-            )
-            return jsonify({'status': 'error', 'message': 'Could not determine payer or debtor'}), 500
 
-        # Si la acción es "expense", ambos comparten el gasto (50/50)
-        # Por ahora, lo tratamos igual que una deuda
+            # Validar que tenemos ambos IDs
+            if not complete_parties(telegram_id, user, *parties):
+                send_message(telegram_id, PARTIES_ERROR_REPLY)
+                return parties_error_response()
+            rows.append(expense_row(expense_data, *parties))
 
-        # Crear el gasto
-        log_operation(logger, "EXPENSE_CREATION",
-                     f"Creando gasto: payer_id={payer_id}, debtor_id={debtor_id}, amount={expense_data['amount']}, currency={expense_data['currency']}",
-                     telegram_id=telegram_id, user_id=user.id)
-        expense = create_expense(
-            payer_id=payer_id,
-            debtor_id=debtor_id,
-            amount=float(expense_data['amount']),
-            currency=expense_data['currency'],
-            description=expense_data['description'],
-            raw_text=message_text,
-            category=expense_data.get('category'),
-            due_date=expense_data.get('due_date')
-        )
+        # Crear los gastos en una sola transacción
+        log_expense_creation(telegram_id, user, rows)
+        expenses = create_expenses(rows, raw_text=message_text)
+        log_expenses_created(telegram_id, user, expenses)
+
+        # Enviar una sola confirmación
+        confirmation_message = format_expenses_confirmation(expenses)
+        send_message(telegram_id, confirmation_message)
+        return expenses_created_response(telegram_id, user)
+
+    except (DeadlineExceeded, GeminiUnavailable):
+        raise
+    except Exception as e:
+        return update_error_response(e, locals().get('telegram_id'), locals().get('user'))
+
+
+def unauthorized_reply(user: Optional[User]) -> str:
+    """Respuesta a un usuario sin autorización (o sin registro, si `user` es None)"""
+    return NOT_AUTHORIZED_REPLY if user else NOT_REGISTERED_REPLY
+
+
+def rejected_message(telegram_id: int, user: User, message_text: str) -> bool:
+    """
+    Valida el contenido de un mensaje de gasto
+
+    Returns:
+        True si el mensaje se rechaza por las políticas de seguridad (ya registrado en el log)
+    """
+    from app.bot_services import validate_message_content
+    if validate_message_content(message_text):
+        return False
+    log_error(logger, ErrorCodes.ERR_INVALID_DATA, 
+             "Mensaje rechazado por políticas de seguridad: caracteres no permitidos",
+             telegram_id=telegram_id, user_id=user.id,
+             data_dict={"message_preview": message_text[:20]})
+    return True
+
+
+def rejected_response(telegram_id: int, user: User):
+    """Respuesta del webhook tras responder `REJECTED_REPLY`"""
+    log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id,
+                message="Mensaje rechazado por seguridad")
+    return jsonify({'status': 'ok'}), 200
+
+
+def local_extraction(telegram_id: int, user: User, message_text: str, today,
+                     usage: ExtractionUsage) -> Optional[List[Dict]]:
+    """
+    Extrae el gasto con el extractor local si es confiable
+
+    Un mensaje puede traer varios gastos; el extractor local solo reconoce uno.
+
+    Args:
+        telegram_id: ID de Telegram del usuario
+        user: Usuario que envió el mensaje
+        message_text: Texto del mensaje
+        today: Fecha de hoy en la zona del usuario
+        usage: Consumo del mensaje (se marca OUTCOME_LOCAL)
 
-        log_operation(logger, "EXPENSE_CREATED",
-                     f"Gasto creado exitosamente: expense_id={expense.id}",
+    Returns:
+        Lista con el gasto o None si el mensaje necesita Gemini
+    """
+    local_parser = get_local_parser(current_app._get_current_object())
+    expense_data = local_parser.extract(message_text, today) if local_parser is not None else None
+    if expense_data is not None:
+        usage.outcome = OUTCOME_LOCAL
+        log_operation(logger, "LOCAL_EXTRACTION", f"Datos extraídos sin Gemini: {message_text[:50]}...",
                      telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
+        return [expense_data]
+    log_operation(logger, "GEMINI_EXTRACTION", f"Extrayendo datos del mensaje: {message_text[:50]}...",
+                 telegram_id=telegram_id, user_id=user.id)
+    return None
 
-        # Enviar confirmación
-        confirmation_message = format_expense_confirmation(expense)
-        send_message(telegram_id, confirmation_message)
 
-        log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id,
-                    message="Gasto creado exitosamente", error_code=ErrorCodes.RESP_OK)
-        return jsonify({'status': 'ok'}), 200
+def local_fallback(telegram_id: int, user: User, message_text: str, today,
+                   usage: ExtractionUsage, error) -> Optional[List[Dict]]:
+    """
+    Extractor local con confianza relajada cuando Gemini no está disponible
 
-    except Exception as e:
-        user_id_val = user.id if 'user' in locals() and user else None
-        log_error(logger, ErrorCodes.ERR_EXPENSE_CREATION,
-                 f"Error en webhook: {str(e)}",
-                 telegram_id=telegram_id if 'telegram_id' in locals() else None,
-                 user_id=user_id_val,
-                 exception=e)
-        log_response(logger, "OUT", "/webhook", 500, 
-                    telegram_id=telegram_id if 'telegram_id' in locals() else None,
-                    error_code=ErrorCodes.RESP_ERROR)
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+    Args:
+        telegram_id: ID de Telegram del usuario
+        user: Usuario que envió el mensaje
+        message_text: Texto del mensaje
+        today: Fecha de hoy en la zona del usuario
+        usage: Consumo del mensaje (se marca OUTCOME_FALLBACK)
+        error: GeminiUnavailable con el motivo
+
+    Returns:
+        Lista con el gasto o None si el update debe ir a la cola de pendientes
+    """
+    local_parser = get_local_parser(current_app._get_current_object())
+    expense_data = local_parser.fallback(
+        message_text, today, current_app.config.get('GEMINI_FALLBACK_MIN_CONFIDENCE', 0.6)
+    ) if local_parser is not None else None
+    if expense_data is None:
+        return None
+    usage.outcome = OUTCOME_FALLBACK
+    log_operation(logger, "LOCAL_FALLBACK",
+                 f"Gemini no disponible ({error.reason}); datos extraídos localmente: {message_text[:50]}...",
+                 telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
+    return [expense_data]
+
+
+def rate_limited_reply(telegram_id: int, error: RateLimited) -> Optional[str]:
+    """Aviso de límite al usuario, o None si ya se le avisó en esta ventana"""
+    decision = error.decision
+    limiter = get_rate_limiter(current_app._get_current_object())
+    if limiter is None or not limiter.should_notify(telegram_id, decision.retry_after):
+        return None
+    return ("⏳ Estás enviando muchos mensajes. "
+            f"Intenta de nuevo en {max(1, int(decision.retry_after + 0.5))} segundos.")
+
+
+def rate_limited_response(telegram_id: int, user: User, error: RateLimited):
+    """Respuesta del webhook de un mensaje limitado"""
+    log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id,
+                 message=f"Mensaje limitado ({error.decision.scope})",
+                 error_code=ErrorCodes.RATE_LIMITED)
+    return jsonify({'status': 'ok'}), 200
+
+
+def unparsed_reply(telegram_id: int, user: User) -> str:
+    """Registra un mensaje del que no se extrajo ningún gasto y devuelve la respuesta"""
+    log_error(logger, ErrorCodes.ERR_GEMINI_API,
+             "No se pudieron extraer datos del mensaje con Gemini",
+             telegram_id=telegram_id, user_id=user.id)
+    return UNPARSED_REPLY
+
+
+def complete_parties(telegram_id: int, user: User, payer_id: Optional[int], debtor_id: Optional[int]) -> bool:
+    """True si el gasto tiene pagador y deudor (si no, se registra el error)"""
+    if payer_id and debtor_id:
+        return True
+    log_error(logger, ErrorCodes.ERR_EXPENSE_CREATION,
+             f"No se pudo determinar payer_id o debtor_id. payer_id={payer_id}, debtor_id={debtor_id}",
+             telegram_id=telegram_id, user_id=user.id)
+    return False
+
+
+def parties_error_response():
+    """Respuesta del webhook tras responder `PARTIES_ERROR_REPLY`"""
+    return jsonify({'status': 'error', 'message': 'Could not determine payer or debtor'}), 500
+
+
+def expense_row(expense_data: dict, payer_id: int, debtor_id: int) -> dict:
+    """
+    Gasto listo para `create_expenses` a partir de los datos extraídos
+
+    Si la acción es "expense", ambos comparten el gasto (50/50); por ahora se
+    trata igual que una deuda.
+    """
+    return {
+        'payer_id': payer_id,
+        'debtor_id': debtor_id,
+        'amount': float(expense_data['amount']),
+        'currency': expense_data['currency'],
+        'description': expense_data['description'],
+        'category': expense_data.get('category'),
+        'due_date': expense_data.get('due_date'),
+    }
+
+
+def log_expense_creation(telegram_id: int, user: User, rows: List[dict]):
+    """Registra los gastos de un mensaje antes de guardarlos"""
+    log_operation(logger, "EXPENSE_CREATION",
+                 f"Creando {len(rows)} gastos: "
+                 + ", ".join(f"payer_id={row['payer_id']}, debtor_id={row['debtor_id']}, "
+                             f"amount={row['amount']}, currency={row['currency']}" for row in rows),
+                 telegram_id=telegram_id, user_id=user.id)
+
+
+def log_expenses_created(telegram_id: int, user: User, expenses: list):
+    """Registra los gastos ya guardados de un mensaje"""
+    log_operation(logger, "EXPENSE_CREATED",
+                 f"Gastos creados exitosamente: expense_ids={[expense.id for expense in expenses]}",
+                 telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
+
+
+def expenses_created_response(telegram_id: int, user: User):
+    """Respuesta del webhook tras confirmar los gastos al usuario"""
+    log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id,
+                message="Gasto creado exitosamente", error_code=ErrorCodes.RESP_OK)
+    return jsonify({'status': 'ok'}), 200
+
+
+def update_error_response(error: Exception, telegram_id: Optional[int] = None, user: Optional[User] = None):
+    """Respuesta 500 de un error inesperado al procesar un update"""
+    log_error(logger, ErrorCodes.ERR_EXPENSE_CREATION,
+             f"Error procesando update: {str(error)}",
+             telegram_id=telegram_id,
+             user_id=user.id if user else None,
+             exception=error)
+    log_response(logger, "OUT", "/webhook", 500, 
+                telegram_id=telegram_id,
+                error_code=ErrorCodes.RESP_ERROR)
+    return jsonify({'status': 'error', 'message': str(error)}), 500
+
+
+def resolve_parties(telegram_id: int, user: User, expense_data: dict) -> Optional[Tuple[int, int]]:
+    """
+    Determina quién pagó y quién debe en un gasto extraído
+
+    Si no se puede determinar (nombre desconocido, gasto compartido sin otra
+    persona o un solo usuario registrado) se avisa al usuario.
+
+    Args:
+        telegram_id: ID de Telegram del usuario
+        user: Usuario que envió el mensaje
+        expense_data: Datos de un gasto extraído
+
+    Returns:
+        Tupla (payer_id, debtor_id) o None si no se pudo determinar (ya se avisó al usuario)
+    """
+    from app.bot_services import send_message
+
+    statement = counterpart_statement(user, expense_data)
+    counterpart = db.session.scalars(statement).first() if statement is not None else None
+    others = []
+    if needs_user_list(expense_data, counterpart):
+        others = db.session.scalars(other_users_statement(user)).all()
+
+    parties, reply = assign_parties(telegram_id, user, expense_data, counterpart, others)
+    if reply is not None:
+        send_message(telegram_id, reply)
+    return parties
+
+
+def other_users_statement(user: User):
+    """SELECT de los usuarios registrados distintos de `user`"""
+    return select(User).where(User.id != user.id)
+
+
+def counterpart_statement(user: User, expense_data: dict):
+    """
+    SELECT de la otra persona de un gasto extraído
+
+    Con nombre mencionado se busca por nombre (búsqueda flexible,
+    case-insensitive); una deuda sin nombre usa el otro usuario (asumiendo
+    solo 2 usuarios). La comparten `resolve_parties` y la ruta async de la DB.
+
+    Args:
+        user: Usuario que envió el mensaje
+        expense_data: Datos de un gasto extraído
+
+    Returns:
+        Sentencia SELECT o None si no hay a quién buscar (gasto sin nombre)
+    """
+    mentioned_name = expense_data.get('debtor_name')
+    if mentioned_name:
+        return other_users_statement(user).where(
+            db.func.lower(User.name).like(f"%{mentioned_name.lower()}%")
+        ).limit(1)
+    if expense_data.get('action', 'debt') == 'expense':
+        return None
+    return other_users_statement(user).limit(1)
+
+
+def needs_user_list(expense_data: dict, counterpart: Optional[User]) -> bool:
+    """True si el nombre mencionado no se encontró y hay que listar los usuarios"""
+    return bool(expense_data.get('debtor_name')) and counterpart is None
+
+
+def assign_parties(telegram_id: int, user: User, expense_data: dict, counterpart: Optional[User],
+                   others: List[User]) -> Tuple[Optional[Tuple[int, int]], Optional[str]]:
+    """
+    Asigna pagador y deudor con los usuarios ya consultados
+
+    REGLA 1: Si dice "gasté" (action == "expense"), quien envía el mensaje es
+    el cobrador (payer) y la persona mencionada es el deudor (debtor).
+    REGLA 2: Si dice "debo" (action == "debt"), quien envía el mensaje es el
+    deudor y la persona mencionada es el cobrador.
+
+    Args:
+        telegram_id: ID de Telegram del usuario
+        user: Usuario que envió el mensaje
+        expense_data: Datos de un gasto extraído
+        counterpart: Resultado de `counterpart_statement` (o None)
+        others: Usuarios distintos de `user` si `needs_user_list`
+
+    Returns:
+        Tupla ((payer_id, debtor_id), None) o (None, respuesta para el usuario)
+    """
+    action = expense_data.get('action', 'debt')
+    mentioned_name = expense_data.get('debtor_name')  # Nombre de la persona mencionada
+    role = "deudor" if action == 'expense' else "pagador"
+
+    if counterpart is not None:
+        if mentioned_name:
+            log_operation(logger, "USER_SEARCH", 
+                        f"Usuario {role} encontrado por nombre '{mentioned_name}': {counterpart.name}",
+                        telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
+        else:
+            log_operation(logger, "DEFAULT_PAYER",
+                         f"No se especificó nombre de pagador, usando usuario por defecto: {counterpart.name}",
+                         telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
+        if action == 'expense':
+            return (user.id, counterpart.id), None
+        return (counterpart.id, user.id), None
+
+    if mentioned_name:
+        # Si no se encuentra, listar usuarios disponibles
+        if not others:
+            log_error(logger, ErrorCodes.ERR_USER_NOT_FOUND,
+                     f"Usuario '{mentioned_name}' no encontrado y solo hay un usuario registrado",
+                     telegram_id=telegram_id, user_id=user.id)
+            return None, ONLY_USER_REPLY
+        user_list = ", ".join([u.name for u in others])
+        log_error(logger, ErrorCodes.ERR_USER_NOT_FOUND,
+                 f"Usuario '{mentioned_name}' no encontrado. Usuarios disponibles: {user_list}",
+                 telegram_id=telegram_id, user_id=user.id)
+        example = (f"Gasté 50000 con {others[0].name} en el supermercado" if action == 'expense'
+                   else f"Le debo 50000 a {others[0].name}")
+        return None, (f"❌ No encontré un usuario llamado '{mentioned_name}'.\n\n"
+                      f"Usuarios disponibles: {user_list}\n\n"
+                      f"Por favor, verifica el nombre e intenta de nuevo.\n"
+                      f"Ejemplo: '{example}'")
+
+    if action == 'expense':
+        # Si no se menciona a nadie en "gasté", no se puede determinar el deudor
+        log_error(logger, ErrorCodes.ERR_NO_OTHER_USER,
+                 "Gasto compartido sin mencionar a otra persona",
+                 telegram_id=telegram_id, user_id=user.id)
+        return None, ("❌ Para registrar un gasto compartido, debes mencionar con quién gastaste.\n\n"
+                      "Ejemplo: 'Gasté 50000 con María en el supermercado'")
+
+    log_error(logger, ErrorCodes.ERR_USER_NOT_FOUND,
+              "Solo hay un usuario registrado. No se puede determinar el pagador.",
+              telegram_id=telegram_id, user_id=user.id)
+    return None, (ONLY_USER_REPLY + "\n\n"
+                  "💡 Tip: Puedes especificar a quién le debes en tu mensaje.\n"
+                  "Ejemplo: 'Le debo 50000 a María'")
 
 
 def handle_start_command(telegram_id: int, update: dict):
@@ -433,6 +862,7 @@ def handle_start_command(telegram_id: int, update: dict):
         telegram_id: ID de Telegram del usuario
         update: Update completo de Telegram
     """
+    from app.bot_services import send_message, get_user_by_telegram_id, create_user
     try:
         # Obtener información del usuario desde Telegram
         if update and 'message' in update:
@@ -478,11 +908,15 @@ def handle_admin_command(telegram_id: int, message_text: str):
     /admin list - Lista todos los usuarios
     /admin authorize <telegram_id> - Autoriza un usuario
     /admin deauthorize <telegram_id> - Desautoriza un usuario
+    /admin timezone <telegram_id> <zona> - Zona horaria IANA del usuario (ej: America/Mexico_City)
 
     Args:
         telegram_id: ID de Telegram del usuario que ejecuta el comando
         message_text: Texto completo del mensaje con el comando
     """
+    from app.bot_services import (
+        send_message, get_user_by_telegram_id, create_user, commit_session
+    )
     try:
 
         parts = message_text.split()
@@ -495,7 +929,8 @@ def handle_admin_command(telegram_id: int, message_text: str):
                 "/admin add <telegram_id> <nombre>\n"
                 "/admin list\n"
                 "/admin authorize <telegram_id>\n"
-                "/admin deauthorize <telegram_id>"
+                "/admin deauthorize <telegram_id>\n"
+                "/admin timezone <telegram_id> <zona>"
             )
             return jsonify({'status': 'ok'}), 200
 
@@ -539,7 +974,7 @@ def handle_admin_command(telegram_id: int, message_text: str):
                 user = get_user_by_telegram_id(target_telegram_id)
                 if user:
                     user.is_authorized = True
-                    db.session.commit()
+                    commit_session()
                     send_message(
                         telegram_id, f"✅ Usuario {user.name} autorizado.")
                 else:
@@ -556,7 +991,7 @@ def handle_admin_command(telegram_id: int, message_text: str):
                 user = get_user_by_telegram_id(target_telegram_id)
                 if user:
                     user.is_authorized = False
-                    db.session.commit()
+                    commit_session()
                     send_message(
                         telegram_id, f"❌ Usuario {user.name} desautorizado.")
                 else:
@@ -566,6 +1001,27 @@ def handle_admin_command(telegram_id: int, message_text: str):
                 send_message(
                     telegram_id, "❌ El telegram_id debe ser un número.")
 
+        elif command == 'timezone' and len(parts) >= 4:
+            # /admin timezone <telegram_id> <zona>
+            try:
+                target_telegram_id = int(parts[2])
+                timezone_name = parts[3]
+                user = get_user_by_telegram_id(target_telegram_id)
+                if not user:
+                    send_message(
+                        telegram_id, f"❌ Usuario con telegram_id {target_telegram_id} no encontrado.")
+                elif not is_valid_timezone(timezone_name):
+                    send_message(
+                        telegram_id, f"❌ Zona horaria desconocida: {timezone_name}. Ejemplo: America/Bogota")
+                else:
+                    user.timezone = timezone_name
+                    commit_session()
+                    send_message(
+                        telegram_id, f"🕒 Zona horaria de {user.name}: {timezone_name}")
+            except ValueError:
+                send_message(
+                    telegram_id, "❌ El telegram_id debe ser un número.")
+
         else:
             send_message(
                 telegram_id, "❌ Comando no reconocido. Usa /admin list para ver ayuda.")
@@ -585,6 +1041,7 @@ def handle_list_expenses(telegram_id: int, user: User):
         telegram_id: ID de Telegram del usuario
         user: Objeto User
     """
+    from app.bot_services import send_message, get_user_expenses, format_expenses_summary
     try:
         # Obtener gastos del usuario
         expenses_to_pay, expenses_to_collect = get_user_expenses(user.id)
@@ -606,19 +1063,20 @@ def handle_list_expenses(telegram_id: int, user: User):
 
 def handle_pay_debts(telegram_id: int, user: User):
     """
-    Maneja la solicitud de pagar deudas - muestra lista numerada con botones
+    Maneja la solicitud de pagar deudas - muestra la primera página con botones
     
     Args:
         telegram_id: ID de Telegram del usuario
         user: Objeto User
     """
+    from app.bot_services import send_message, get_debts_page, format_debts_page
     try:
-        # Obtener solo las deudas que el usuario debe pagar
-        debts = get_user_debts_to_pay(user.id)
+        # Primera página de las deudas que el usuario debe pagar
+        page = get_debts_page(user.id, ROLE_PAY)
         
-        # Formatear mensaje con botones inline
-        message, reply_markup = format_debts_list_for_payment(debts)
-        send_message(telegram_id, message, reply_markup)
+        # Formatear mensaje con botones de pago y de navegación
+        message, reply_markup = format_debts_page(page)
+        send_message(telegram_id, message, reply_markup or None)
         
         return jsonify({'status': 'ok'}), 200
         
@@ -633,23 +1091,20 @@ def handle_pay_debts(telegram_id: int, user: User):
 
 def handle_collect_debts(telegram_id: int, user: User):
     """
-    Maneja la solicitud de ver quién le debe - muestra lista de deudas a cobrar
+    Maneja la solicitud de ver quién le debe - muestra la primera página de deudas a cobrar
     
     Args:
         telegram_id: ID de Telegram del usuario
         user: Objeto User
     """
+    from app.bot_services import send_message, get_debts_page, format_debts_page
     try:
-        # Obtener solo las deudas que el usuario debe cobrar (donde es pagador)
-        debts_to_collect = get_user_debts_to_collect(user.id)
-        
-        if not debts_to_collect:
-            send_message(telegram_id, "✅ No tienes deudas pendientes por cobrar.")
-            return jsonify({'status': 'ok'}), 200
+        # Primera página de las deudas que el usuario debe cobrar (donde es pagador)
+        page = get_debts_page(user.id, ROLE_COLLECT)
         
-        # Formatear mensaje con la lista de deudas a cobrar
-        message = format_debts_to_collect(debts_to_collect)
-        send_message(telegram_id, message)
+        # Formatear mensaje con la página (y botones de navegación si hay más)
+        message, reply_markup = format_debts_page(page)
+        send_message(telegram_id, message, reply_markup or None)
         
         return jsonify({'status': 'ok'}), 200
         
@@ -662,6 +1117,12 @@ def handle_collect_debts(telegram_id: int, user: User):
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+# Tabla de handlers de las intenciones de consulta
+intent_router.set_handler(INTENT_LIST_EXPENSES, handle_list_expenses)
+intent_router.set_handler(INTENT_PAY_DEBTS, handle_pay_debts)
+intent_router.set_handler(INTENT_COLLECT_DEBTS, handle_collect_debts)
+
+
 def handle_callback_query(update: dict):
     """
     Maneja los callback queries (clicks en botones inline)
@@ -669,14 +1130,13 @@ def handle_callback_query(update: dict):
     Args:
         update: Update de Telegram con callback_query
     """
+    from app.bot_services import (
+        send_message, is_user_authorized, answer_callback_query, edit_message_text,
+        mark_expense_as_paid, format_payment_receipt, get_debts_page, format_debts_page,
+        format_remaining_debts, flush_webhook_reply
+    )
     try:
-        callback_query = update.get('callback_query', {})
-        callback_data = callback_query.get('data', '')
-        callback_query_id = callback_query.get('id', '')
-        telegram_id = callback_query.get('from', {}).get('id')
-        message = callback_query.get('message', {})
-        message_id = message.get('message_id')
-        chat_id = message.get('chat', {}).get('id')
+        callback_query_id, callback_data, telegram_id, message_id, chat_id = callback_fields(update)
         
         if not telegram_id:
             logger.warning("No se pudo obtener telegram_id del callback_query")
@@ -684,12 +1144,9 @@ def handle_callback_query(update: dict):
         
         # Verificar autorización
         authorized, user = is_user_authorized(telegram_id)
-        if not authorized:
-            answer_callback_query(callback_query_id, "❌ No estás autorizado.", show_alert=True)
-            return jsonify({'status': 'ok'}), 200
-        
-        if not user:
-            answer_callback_query(callback_query_id, "❌ Error interno.", show_alert=True)
+        reply = callback_auth_reply(authorized, user)
+        if reply is not None:
+            answer_callback_query(callback_query_id, reply, show_alert=True, chat_id=chat_id)
             return jsonify({'status': 'ok'}), 200
         
         # Manejar diferentes tipos de callbacks
@@ -697,125 +1154,263 @@ def handle_callback_query(update: dict):
             log_error(logger, ErrorCodes.ERR_INVALID_DATA,
                      "Callback query sin data recibido",
                      telegram_id=telegram_id)
-            answer_callback_query(callback_query_id, "❌ Error: callback sin datos.", show_alert=True)
+            answer_callback_query(callback_query_id, "❌ Error: callback sin datos.", show_alert=True,
+                                  chat_id=chat_id)
             return jsonify({'status': 'ok'}), 200
         
-        if callback_data.startswith('pay_debt_'):
+        if callback_data.startswith(PAY_DEBT_PREFIX):
             # Extraer ID de la deuda
-            try:
-                debt_id = int(callback_data.replace('pay_debt_', ''))
-                log_operation(logger, "DEBT_PAYMENT_INITIATED",
-                             f"Iniciando pago de deuda: debt_id={debt_id}",
-                             telegram_id=telegram_id, user_id=user.id)
-            except ValueError:
-                log_error(logger, ErrorCodes.ERR_INVALID_DATA,
-                         f"ID de deuda inválido en callback: {callback_data}",
-                         telegram_id=telegram_id, user_id=user.id)
-                answer_callback_query(callback_query_id, "❌ ID de deuda inválido.", show_alert=True)
+            debt_id = parse_debt_id(telegram_id, user, callback_data)
+            if debt_id is None:
+                answer_callback_query(callback_query_id, "❌ ID de deuda inválido.", show_alert=True,
+                                      chat_id=chat_id)
                 return jsonify({'status': 'ok'}), 200
             
             # Verificar que la deuda pertenece al usuario
-            expense = Expense.query.get(debt_id)
-            if not expense:
-                log_error(logger, ErrorCodes.ERR_EXPENSE_NOT_FOUND,
-                         f"Deuda no encontrada: debt_id={debt_id}",
-                         telegram_id=telegram_id, user_id=user.id)
-                answer_callback_query(callback_query_id, "❌ Deuda no encontrada.", show_alert=True)
-                return jsonify({'status': 'ok'}), 200
-            
-            if expense.debtor_id != user.id:
-                log_error(logger, ErrorCodes.ERR_USER_NOT_AUTHORIZED,
-                         f"Usuario intentando pagar deuda que no le pertenece: debt_id={debt_id}, user_id={user.id}, debtor_id={expense.debtor_id}",
-                         telegram_id=telegram_id, user_id=user.id)
-                answer_callback_query(callback_query_id, "❌ Esta deuda no te pertenece.", show_alert=True)
-                return jsonify({'status': 'ok'}), 200
-            
-            if expense.is_settled:
-                log_operation(logger, "DEBT_ALREADY_PAID",
-                             f"Intento de pagar deuda ya pagada: debt_id={debt_id}",
-                             telegram_id=telegram_id, user_id=user.id)
-                answer_callback_query(callback_query_id, "✅ Esta deuda ya está pagada.", show_alert=True)
+            reply = debt_payment_error(telegram_id, user, debt_id, Expense.query.get(debt_id))
+            if reply is not None:
+                answer_callback_query(callback_query_id, reply, show_alert=True, chat_id=chat_id)
                 return jsonify({'status': 'ok'}), 200
             
             # Marcar como pagada
             updated_expense = mark_expense_as_paid(debt_id)
             if updated_expense:
-                # Responder al callback primero
-                answer_callback_query(callback_query_id, f"✅ Deuda pagada: {updated_expense.amount} {updated_expense.currency}")
-                
-                log_operation(logger, "DEBT_PAYMENT_SUCCESS",
-                             f"Deuda pagada exitosamente: debt_id={debt_id}, amount={updated_expense.amount} {updated_expense.currency}",
-                             telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
+                # Ya confirmado el commit, la respuesta al callback (que detiene el
+                # spinner), el comprobante y la edición viajan en paralelo mientras
+                # se consultan las deudas restantes. La respuesta no puede esperar
+                # a la del webhook: sale por HTTP
+                flask_app = current_app._get_current_object()
+                flush_webhook_reply()
+                answered = fan_out(flask_app, answer_callback_query, callback_query_id,
+                                   debt_paid_answer(telegram_id, user, updated_expense), chat_id=chat_id)
                 
                 # Enviar comprobante de pago como mensaje nuevo
                 receipt_message = format_payment_receipt(updated_expense)
-                send_message(chat_id, receipt_message)
-                
-                # Obtener deudas restantes y actualizar el mensaje original
-                remaining_debts = get_user_debts_to_pay(user.id)
+                receipt_sent = fan_out(flask_app, send_message, chat_id, receipt_message)
                 
-                if remaining_debts:
-                    # Calcular totales por moneda
-                    from collections import defaultdict
-                    totals_by_currency = defaultdict(float)
-                    for debt in remaining_debts:
-                        totals_by_currency[debt.currency] += float(debt.amount)
-                    
-                    # Crear mensaje con resumen y lista de deudas restantes
-                    remaining_message = (
-                        f"💳 <b>Deudas Pendientes Restantes</b>\n\n"
-                        f"📊 Total de deudas: {len(remaining_debts)}\n\n"
-                    )
-                    
-                    # Agregar totales por moneda
-                    if totals_by_currency:
-                        remaining_message += "<b>💰 Total a pagar:</b>\n"
-                        for currency, total in totals_by_currency.items():
-                            remaining_message += f"• {total:,.2f} {currency}\n"
-                        remaining_message += "\n"
-                    
-                    # Agregar lista de deudas con botones
-                    debts_list, reply_markup = format_debts_list_for_payment(remaining_debts)
-                    # Extraer solo la lista de deudas (sin el encabezado duplicado)
-                    if "💳 <b>Deudas Pendientes - Selecciona una para pagar:</b>\n\n" in debts_list:
-                        debts_only = debts_list.split("💳 <b>Deudas Pendientes - Selecciona una para pagar:</b>\n\n", 1)[1]
-                        remaining_message += debts_only
-                    else:
-                        remaining_message += debts_list
-                    
-                    edit_message_text(chat_id, message_id, remaining_message, reply_markup)
-                else:
-                    # No quedan deudas pendientes
-                    final_message = (
-                        "✅ <b>¡Felicidades!</b>\n\n"
-                        "🎉 No tienes más deudas pendientes.\n"
-                        "Todas tus deudas han sido saldadas."
-                    )
-                    edit_message_text(chat_id, message_id, final_message)
+                # Primera página de las deudas restantes para actualizar el mensaje original
+                remaining_page = get_debts_page(user.id, ROLE_PAY)
+                remaining_message, reply_markup = format_remaining_debts(remaining_page)
+                edited = fan_out(flask_app, edit_message_text, chat_id, message_id,
+                                 remaining_message, reply_markup or None)
+                wait_all([answered, receipt_sent, edited])
             else:
                 log_error(logger, ErrorCodes.ERR_EXPENSE_CREATION,
                          f"Error al marcar deuda como pagada: debt_id={debt_id}",
                          telegram_id=telegram_id, user_id=user.id)
-                answer_callback_query(callback_query_id, "❌ Error al marcar la deuda como pagada.", show_alert=True)
+                answer_callback_query(callback_query_id, "❌ Error al marcar la deuda como pagada.", show_alert=True,
+                                      chat_id=chat_id)
+        elif callback_data.startswith(DEBTS_PAGE_PREFIX):
+            # Botones Anterior/Siguiente: la página sale del cursor del botón
+            page_request = parse_page(telegram_id, user, callback_data)
+            if page_request is None:
+                answer_callback_query(callback_query_id, "❌ Página inválida.", show_alert=True,
+                                      chat_id=chat_id)
+                return jsonify({'status': 'ok'}), 200
+            
+            page = get_debts_page(user.id, *page_request)
+            page_message, reply_markup = format_debts_page(page)
+            
+            # La respuesta al callback y la edición viajan en paralelo
+            flask_app = current_app._get_current_object()
+            flush_webhook_reply()
+            answered = fan_out(flask_app, answer_callback_query, callback_query_id)
+            edited = fan_out(flask_app, edit_message_text, chat_id, message_id,
+                             page_message, reply_markup or None)
+            wait_all([answered, edited])
         else:
             # Callback desconocido
             log_error(logger, ErrorCodes.ERR_INVALID_DATA,
                      f"Tipo de callback desconocido: {callback_data}",
                      telegram_id=telegram_id, user_id=user.id)
-            answer_callback_query(callback_query_id, "❌ Tipo de callback desconocido.", show_alert=True)
+            answer_callback_query(callback_query_id, "❌ Tipo de callback desconocido.", show_alert=True,
+                                  chat_id=chat_id)
         
-        log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id,
-                    message="Callback query procesado", error_code=ErrorCodes.RESP_OK)
-        return jsonify({'status': 'ok'}), 200
+        return callback_response(telegram_id, user)
         
     except Exception as e:
         logger.error(f"Error en handle_callback_query: {e}", exc_info=True)
         if 'callback_query_id' in locals():
-            answer_callback_query(callback_query_id, "❌ Error al procesar la solicitud.", show_alert=True)
+            answer_callback_query(callback_query_id, CALLBACK_ERROR_REPLY, show_alert=True,
+                                  chat_id=locals().get('chat_id'))
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+def callback_fields(update: dict) -> Tuple[str, str, Optional[int], Optional[int], Optional[int]]:
+    """
+    Campos de un callback query
+
+    Returns:
+        Tupla (callback_query_id, callback_data, telegram_id, message_id, chat_id)
+    """
+    callback_query = update.get('callback_query', {})
+    message = callback_query.get('message', {})
+    return (callback_query.get('id', ''), callback_query.get('data', ''),
+            callback_query.get('from', {}).get('id'), message.get('message_id'),
+            message.get('chat', {}).get('id'))
+
+
+def callback_auth_reply(authorized: bool, user: Optional[User]) -> Optional[str]:
+    """Alerta para un callback de un usuario sin autorización, o None si está autorizado"""
+    if not authorized:
+        return "❌ No estás autorizado."
+    if not user:
+        return "❌ Error interno."
+    return None
+
+
+def parse_debt_id(telegram_id: int, user: User, callback_data: str) -> Optional[int]:
+    """ID de la deuda de un botón pay_debt_, o None si es inválido (ya registrado en el log)"""
+    try:
+        debt_id = int(callback_data.replace(PAY_DEBT_PREFIX, ''))
+    except ValueError:
+        log_error(logger, ErrorCodes.ERR_INVALID_DATA,
+                 f"ID de deuda inválido en callback: {callback_data}",
+                 telegram_id=telegram_id, user_id=user.id)
+        return None
+    log_operation(logger, "DEBT_PAYMENT_INITIATED",
+                 f"Iniciando pago de deuda: debt_id={debt_id}",
+                 telegram_id=telegram_id, user_id=user.id)
+    return debt_id
+
+
+def debt_payment_error(telegram_id: int, user: User, debt_id: int, expense: Optional[Expense]) -> Optional[str]:
+    """
+    Verifica que el usuario pueda pagar la deuda
+
+    Args:
+        telegram_id: ID de Telegram del usuario
+        user: Usuario que pulsó el botón
+        debt_id: ID de la deuda del botón
+        expense: Deuda consultada o None si no existe
+
+    Returns:
+        Alerta para el usuario o None si la deuda se puede pagar
+    """
+    if not expense:
+        log_error(logger, ErrorCodes.ERR_EXPENSE_NOT_FOUND,
+                 f"Deuda no encontrada: debt_id={debt_id}",
+                 telegram_id=telegram_id, user_id=user.id)
+        return "❌ Deuda no encontrada."
+    
+    if expense.debtor_id != user.id:
+        log_error(logger, ErrorCodes.ERR_USER_NOT_AUTHORIZED,
+                 f"Usuario intentando pagar deuda que no le pertenece: debt_id={debt_id}, user_id={user.id}, debtor_id={expense.debtor_id}",
+                 telegram_id=telegram_id, user_id=user.id)
+        return "❌ Esta deuda no te pertenece."
+    
+    if expense.is_settled:
+        log_operation(logger, "DEBT_ALREADY_PAID",
+                     f"Intento de pagar deuda ya pagada: debt_id={debt_id}",
+                     telegram_id=telegram_id, user_id=user.id)
+        return "✅ Esta deuda ya está pagada."
+    return None
+
+
+def debt_paid_answer(telegram_id: int, user: User, expense: Expense) -> str:
+    """Registra el pago de una deuda y devuelve la respuesta al callback"""
+    log_operation(logger, "DEBT_PAYMENT_SUCCESS",
+                 f"Deuda pagada exitosamente: debt_id={expense.id}, amount={expense.amount} {expense.currency}",
+                 telegram_id=telegram_id, user_id=user.id, error_code=ErrorCodes.OP_SUCCESS)
+    return f"✅ Deuda pagada: {expense.amount} {expense.currency}"
+
+
+def parse_page(telegram_id: int, user: User, callback_data: str) -> Optional[tuple]:
+    """
+    Página pedida por un botón Anterior/Siguiente
+
+    Returns:
+        Tupla (role, cursor, backward, number) para `get_debts_page`, o None
+        si el cursor es inválido (ya registrado en el log)
+    """
+    try:
+        role, backward, number, cursor = parse_page_callback(callback_data)
+    except ValueError:
+        log_error(logger, ErrorCodes.ERR_INVALID_DATA,
+                 f"Cursor de página inválido en callback: {callback_data}",
+                 telegram_id=telegram_id, user_id=user.id)
+        return None
+    return role, cursor, backward, number
+
+
+def callback_response(telegram_id: int, user: User):
+    """Respuesta del webhook de un callback query procesado"""
+    log_response(logger, "OUT", "/webhook", 200, telegram_id=telegram_id, user_id=user.id,
+                message="Callback query procesado", error_code=ErrorCodes.RESP_OK)
+    return jsonify({'status': 'ok'}), 200
+
+
 @bp.route('/health', methods=['GET'])
 def health_check():
     """Endpoint de health check"""
-    return jsonify({'status': 'ok', 'message': 'Bot is running'}), 200
+    return jsonify(health_payload(current_app._get_current_object())), 200
+
+
+def health_payload(app) -> dict:
+    """
+    Payload de /health (también lo sirve la app ASGI nativa)
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        Diccionario con el estado y las estadísticas de cada extensión activa
+    """
+    payload = {'status': 'ok', 'message': 'Bot is running'}
+    extensions = app.extensions
+
+    pool = extensions.get('update_pool')
+    if pool is not None:
+        payload['workers'] = pool.stats()
+
+    dedup = extensions.get('update_dedup')
+    if dedup is not None:
+        payload['dedup'] = dedup.stats()
+
+    limiter = extensions.get('rate_limiter')
+    if limiter is not None:
+        payload['rate_limiter'] = limiter.stats()
+
+    local_parser = extensions.get('local_parser')
+    if local_parser is not None:
+        payload['local_parser'] = local_parser.stats()
+
+    extraction_cache = extensions.get('extraction_cache')
+    if extraction_cache is not None:
+        payload['extraction_cache'] = extraction_cache.stats()
+    extraction_batcher = extensions.get('extraction_batcher')
+    if extraction_batcher is not None:
+        payload['extraction_batcher'] = extraction_batcher.stats()
+    payload['extraction_parser'] = parse_stats.stats(app.config.get('GEMINI_STRUCTURED_OUTPUT', False))
+
+    gemini_breaker = extensions.get('gemini_breaker')
+    if gemini_breaker is not None:
+        payload['gemini_breaker'] = gemini_breaker.stats()
+    pending_queue = extensions.get('pending_extractions')
+    if pending_queue is not None:
+        payload['pending_extractions'] = pending_queue.stats()
+    gemini_usage = extensions.get('gemini_usage')
+    if gemini_usage is not None:
+        payload['gemini_usage'] = gemini_usage.stats()
+    model_router = extensions.get('model_router')
+    if model_router is not None:
+        payload['model_router'] = model_router.stats()
+    telegram_scheduler = extensions.get('telegram_scheduler')
+    if telegram_scheduler is not None:
+        payload['telegram_scheduler'] = telegram_scheduler.stats()
+    telegram_fanout = extensions.get('telegram_fanout')
+    if telegram_fanout is not None:
+        payload['telegram_fanout'] = telegram_fanout.stats()
+    reminders = extensions.get('reminders')
+    if reminders is not None:
+        payload['reminders'] = reminders.stats()
+
+    http_clients = extensions.get('http_clients')
+    if http_clients is not None:
+        payload['http_clients'] = http_clients.stats()
+
+    metrics = extensions.get('stage_metrics')
+    if metrics is not None:
+        payload['stages'] = metrics.snapshot()
+
+    return payload
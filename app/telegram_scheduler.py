@@ -0,0 +1,450 @@
+"""
+Cola de salida hacia la Bot API de Telegram
+
+Telegram acepta unos 30 mensajes por segundo por bot, alrededor de 1 por
+segundo en un mismo chat y 20 por minuto en un grupo; lo que se pase recibe
+un 429 con `parameters.retry_after`. Sin esta cola, `send_message`,
+`edit_message_text` y `answer_callback_query` salían de inmediato y un 429
+solo quedaba en el log: el mensaje se perdía.
+
+TelegramScheduler encola cada llamada y decide cuál sale:
+
+- Un token bucket global y uno por chat (`rate_limiter.InMemoryBucketStore`)
+- Un 429 pausa el chat (o toda la cola, si no tiene chat) durante
+  `retry_after` y la llamada vuelve a la cabeza de su chat
+- Prioridad: respuestas a callbacks, luego mensajes de un update y al final
+  los envíos masivos (recordatorios, avisos)
+- Los mensajes de un chat salen en orden y de a uno; una edición que llega
+  mientras la anterior del mismo `message_id` sigue en cola la reemplaza
+- Las respuestas a callbacks van en la cola del chat del mensaje del botón,
+  delante de sus mensajes: no esperan a que el chat quede libre ni consumen
+  su bucket (el límite por chat de Telegram es de mensajes)
+- Lo que lleva más de `max_age` segundos en cola se descarta
+
+La cola no hace I/O: la atienden threads (`start`) que envían con la sesión
+HTTP de `bot_services`. Quien encola recibe un Future que se resuelve con
+True, con la excepción del envío o con OutboundExpired.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.logger_config import log_operation, log_error, ErrorCodes
+from app.rate_limiter import InMemoryBucketStore
+
+logger = logging.getLogger(__name__)
+
+_scheduler_lock = threading.Lock()
+
+# Prioridades (menor sale primero)
+PRIORITY_CALLBACK = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BULK = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_CALLBACK: "callback",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BULK: "bulk",
+}
+
+# Clave del bucket y de la pausa globales
+GLOBAL_KEY = "global"
+
+CALLBACK_METHOD = "answerCallbackQuery"
+
+# retry_after por defecto si un 429 no lo trae
+DEFAULT_RETRY_AFTER = 1.0
+
+# Espera máxima de un worker sin nada listo (revisa vencimientos)
+IDLE_WAIT = 1.0
+
+# Muestras de espera en cola que se conservan por prioridad
+MAX_WAIT_SAMPLES = 1000
+
+
+class OutboundExpired(Exception):
+    """La llamada pasó más de `max_age` segundos en la cola y se descartó"""
+
+
+@dataclass
+class OutboundMessage:
+    """
+    Una llamada en la cola de salida
+
+    Attributes:
+        method: Método de la Bot API (sendMessage, editMessageText, ...)
+        payload: Cuerpo JSON
+        chat_id: Chat destino (en answerCallbackQuery, el del mensaje del botón)
+        priority: PRIORITY_CALLBACK, PRIORITY_INTERACTIVE o PRIORITY_BULK
+        seq: Orden de llegada
+        enqueued_at: time.monotonic() al encolar
+        future: Se resuelve con True o con la excepción del envío
+        attempts: Envíos hechos (cuenta los 429)
+        dispatched_at: time.monotonic() del último envío
+    """
+    method: str
+    payload: dict
+    chat_id: Optional[int]
+    priority: int
+    seq: int
+    enqueued_at: float
+    future: Future = field(default_factory=Future)
+    attempts: int = 0
+    dispatched_at: float = 0.0
+
+
+def _percentile(ordered: list, pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def retry_after_seconds(body) -> float:
+    """
+    Segundos de espera que pide un 429 de Telegram
+
+    Args:
+        body: Cuerpo JSON de la respuesta (`{"parameters": {"retry_after": 3}}`)
+
+    Returns:
+        retry_after, o DEFAULT_RETRY_AFTER si no viene
+    """
+    try:
+        return max(0.0, float(body["parameters"]["retry_after"]))
+    except (KeyError, TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class TelegramScheduler:
+    """
+    Cola de salida con token buckets, prioridades y pausas por 429
+
+    Attributes:
+        global_per_second: Mensajes por segundo de todo el bot
+        global_burst: Capacidad del bucket global
+        chat_per_second: Mensajes por segundo en un chat privado
+        chat_burst: Capacidad del bucket de cada chat
+        group_per_minute: Mensajes por minuto en un grupo (chat_id negativo)
+        max_age: Segundos que una llamada puede esperar en cola
+    """
+
+    def __init__(self, global_per_second: float = 30.0, global_burst: int = 30,
+                 chat_per_second: float = 1.0, chat_burst: int = 3,
+                 group_per_minute: float = 20.0, max_age: float = 60.0):
+        self.global_per_second = global_per_second
+        self.global_burst = max(1, global_burst)
+        self.chat_per_second = chat_per_second
+        self.chat_burst = max(1, chat_burst)
+        self.group_per_minute = group_per_minute
+        self.max_age = max_age
+        self._buckets = InMemoryBucketStore()
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        # Cola FIFO por chat (None: llamadas sin chat conocido)
+        self._queues: Dict[Optional[int], deque] = {}
+        # Chats con una llamada en vuelo (sus mensajes salen de a uno)
+        self._busy: set = set()
+        # Clave (chat o GLOBAL_KEY) -> time.monotonic() hasta el que está pausada
+        self._paused_until: Dict[object, float] = {}
+        self._workers: List[threading.Thread] = []
+        self._waits: Dict[int, deque] = {
+            priority: deque(maxlen=MAX_WAIT_SAMPLES) for priority in PRIORITY_NAMES
+        }
+        self._queued = 0
+        self._inflight = 0
+        self._sent = 0
+        self._failed = 0
+        self._coalesced = 0
+        self._throttled = 0
+        self._expired = 0
+
+    def _notify(self):
+        """Despierta a los workers (se llama con el lock tomado)"""
+        self._cond.notify_all()
+
+    def submit(self, method: str, payload: dict, chat_id: Optional[int] = None,
+               priority: int = PRIORITY_INTERACTIVE) -> Future:
+        """
+        Encola una llamada a la Bot API
+
+        Si la última llamada en cola del chat es una edición del mismo
+        `message_id`, se reemplaza su payload y se devuelve su Future. Una
+        respuesta a callback se pone detrás de las otras respuestas en cola
+        del chat y delante de sus mensajes.
+
+        Args:
+            method: Método de la Bot API
+            payload: Cuerpo JSON
+            chat_id: Chat destino (en answerCallbackQuery, el del mensaje del botón)
+            priority: Prioridad de la llamada
+
+        Returns:
+            Future que se resuelve con True o con la excepción del envío
+        """
+        with self._cond:
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+            if method == "editMessageText" and queue:
+                tail = queue[-1]
+                if tail.method == method and tail.payload.get("message_id") == payload.get("message_id"):
+                    tail.payload = payload
+                    tail.priority = min(tail.priority, priority)
+                    self._coalesced += 1
+                    return tail.future
+
+            message = OutboundMessage(method=method, payload=payload, chat_id=chat_id, priority=priority,
+                                      seq=next(self._seq), enqueued_at=time.monotonic())
+            if method == CALLBACK_METHOD:
+                position = next((index for index, queued in enumerate(queue)
+                                 if queued.method != CALLBACK_METHOD), len(queue))
+                queue.insert(position, message)
+            else:
+                queue.append(message)
+            self._queued += 1
+            self._notify()
+        return message.future
+
+    def _specs(self, message: OutboundMessage) -> list:
+        """Buckets que consume la llamada"""
+        specs = [(GLOBAL_KEY, self.global_per_second, self.global_burst)]
+        chat_id = message.chat_id
+        if chat_id is None or message.method == CALLBACK_METHOD:
+            return specs
+        if chat_id < 0:
+            specs.append((f"chat:{chat_id}", self.group_per_minute / 60, self.chat_burst))
+        else:
+            specs.append((f"chat:{chat_id}", self.chat_per_second, self.chat_burst))
+        return specs
+
+    def _expire(self, now: float):
+        """Descarta las llamadas que pasaron `max_age` en cola (se llama con el lock tomado)"""
+        emptied = []
+        for chat_id, queue in self._queues.items():
+            while queue and now - queue[0].enqueued_at > self.max_age:
+                message = queue.popleft()
+                self._queued -= 1
+                self._expired += 1
+                log_error(logger, ErrorCodes.ERR_TELEGRAM_THROTTLED,
+                          f"{message.method} descartado tras {now - message.enqueued_at:.1f}s en cola "
+                          f"({message.attempts} intentos)",
+                          telegram_id=chat_id)
+                message.future.set_exception(OutboundExpired(
+                    f"{message.method} pasó más de {self.max_age:.0f}s en la cola de salida"))
+            if not queue:
+                emptied.append(chat_id)
+        for chat_id in emptied:
+            del self._queues[chat_id]
+
+    def next_ready(self) -> Tuple[Optional[OutboundMessage], Optional[float]]:
+        """
+        Saca la próxima llamada que puede salir ya
+
+        Entre las cabezas de cada chat que no está pausado ni tiene un
+        mensaje en vuelo (una respuesta a callback no espera), elige por prioridad y orden de llegada la primera
+        cuyos buckets tienen token.
+
+        Returns:
+            Tupla (llamada o None, segundos hasta que otra pueda estar lista o None)
+        """
+        with self._cond:
+            now = time.monotonic()
+            self._expire(now)
+            wait = None
+            for key, until in list(self._paused_until.items()):
+                if until <= now:
+                    del self._paused_until[key]
+            global_pause = self._paused_until.get(GLOBAL_KEY, 0.0) - now
+            if global_pause > 0:
+                return None, global_pause
+
+            heads = []
+            for chat_id, queue in self._queues.items():
+                if not queue or (chat_id in self._busy and queue[0].method != CALLBACK_METHOD):
+                    continue
+                pause = self._paused_until.get(chat_id, 0.0) - now
+                if pause > 0:
+                    wait = pause if wait is None else min(wait, pause)
+                    continue
+                heads.append(queue[0])
+            heads.sort(key=lambda message: (message.priority, message.seq))
+
+            for message in heads:
+                rejected, retry_in = self._buckets.acquire(self._specs(message), now)
+                if rejected is None:
+                    queue = self._queues[message.chat_id]
+                    queue.popleft()
+                    if not queue:
+                        del self._queues[message.chat_id]
+                    if message.chat_id is not None and message.method != CALLBACK_METHOD:
+                        self._busy.add(message.chat_id)
+                    self._queued -= 1
+                    self._inflight += 1
+                    message.attempts += 1
+                    message.dispatched_at = now
+                    return message, 0.0
+                wait = retry_in if wait is None else min(wait, retry_in)
+                if rejected == GLOBAL_KEY:
+                    break
+            if self._queued:
+                wait = IDLE_WAIT if wait is None else min(wait, IDLE_WAIT)
+            return None, wait
+
+    def finish(self, message: OutboundMessage, response=None, error: Optional[BaseException] = None):
+        """
+        Registra el resultado del envío de una llamada
+
+        Con un 429 la llamada vuelve a la cabeza de su chat y el chat (o toda
+        la cola, si no tiene chat) queda pausado `retry_after` segundos.
+
+        Args:
+            message: Llamada entregada por `next_ready`
+            response: Respuesta HTTP (requests o httpx) si la hubo
+            error: Excepción del envío si no hubo respuesta
+        """
+        retry_after = None
+        if error is None and response is not None and response.status_code == 429:
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+            retry_after = retry_after_seconds(body)
+        elif error is None and response is not None:
+            try:
+                response.raise_for_status()
+            except Exception as e:
+                error = e
+
+        with self._cond:
+            self._inflight -= 1
+            if message.method != CALLBACK_METHOD:
+                self._busy.discard(message.chat_id)
+            if retry_after is not None:
+                self._throttled += 1
+                pause_key = GLOBAL_KEY if message.chat_id is None else message.chat_id
+                self._paused_until[pause_key] = max(self._paused_until.get(pause_key, 0.0),
+                                                    time.monotonic() + retry_after)
+                # Una edición que llegó mientras volaba no la pisa: la vieja sale primero
+                self._queues.setdefault(message.chat_id, deque()).appendleft(message)
+                self._queued += 1
+            else:
+                # Espera en cola hasta el envío que resolvió la llamada (incluye las pausas por 429)
+                self._waits[message.priority].append(message.dispatched_at - message.enqueued_at)
+                if error is not None:
+                    self._failed += 1
+                else:
+                    self._sent += 1
+            self._notify()
+
+        if retry_after is not None:
+            log_operation(logger, "TELEGRAM_THROTTLED",
+                          f"429 en {message.method}, reintento en {retry_after:.1f}s "
+                          f"(intento {message.attempts})",
+                          telegram_id=message.chat_id, error_code=ErrorCodes.RATE_LIMITED)
+        elif error is not None:
+            message.future.set_exception(error)
+        else:
+            message.future.set_result(True)
+
+    def start(self, post: Callable[[str, dict], object], workers: int = 8):
+        """
+        Arranca (una sola vez) los threads que atienden la cola
+
+        Args:
+            post: Función (método, payload) -> respuesta HTTP
+            workers: Threads de envío (envíos simultáneos a chats distintos)
+        """
+        with self._cond:
+            if self._workers:
+                return
+            for index in range(max(1, workers)):
+                thread = threading.Thread(target=self._work, args=(post,),
+                                          name=f"telegram-outbound-{index}", daemon=True)
+                self._workers.append(thread)
+                thread.start()
+
+    def _work(self, post: Callable[[str, dict], object]):
+        """Bucle de un worker: toma la próxima llamada lista y la envía"""
+        while True:
+            with self._cond:
+                # Condition usa un RLock: next_ready toma el mismo lock y no se pierde un notify
+                message, wait = self.next_ready()
+                if message is None:
+                    self._cond.wait(wait)
+                    continue
+            try:
+                response = post(message.method, message.payload)
+            except Exception as e:
+                self.finish(message, error=e)
+                continue
+            self.finish(message, response=response)
+
+    def stats(self) -> dict:
+        """
+        Contadores de la cola
+
+        Returns:
+            Diccionario con llamadas en cola y en vuelo, enviadas, fallidas,
+            fusionadas, 429 recibidos, descartadas y la espera en cola
+            (p50/p95/p99) por prioridad
+        """
+        with self._cond:
+            now = time.monotonic()
+            waits = {priority: sorted(values) for priority, values in self._waits.items()}
+            stats = {
+                "queued": self._queued,
+                "inflight": self._inflight,
+                "sent": self._sent,
+                "failed": self._failed,
+                "coalesced": self._coalesced,
+                "throttled": self._throttled,
+                "expired": self._expired,
+                "paused_chats": sum(1 for key, until in self._paused_until.items()
+                                    if key != GLOBAL_KEY and until > now),
+                "global_paused": self._paused_until.get(GLOBAL_KEY, 0.0) > now,
+            }
+        stats["queue_wait"] = {
+            PRIORITY_NAMES[priority]: {
+                "samples": len(ordered),
+                "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(_percentile(ordered, 99) * 1000, 2),
+            }
+            for priority, ordered in waits.items() if ordered
+        }
+        return stats
+
+
+def get_telegram_scheduler(app) -> Optional[TelegramScheduler]:
+    """
+    Obtiene (o crea de forma lazy) la cola de salida de Telegram de la aplicación
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        TelegramScheduler o None si TELEGRAM_SCHEDULER_ENABLED está desactivado
+    """
+    if not app.config.get("TELEGRAM_SCHEDULER_ENABLED"):
+        return None
+
+    scheduler = app.extensions.get("telegram_scheduler")
+    if scheduler is None:
+        with _scheduler_lock:
+            scheduler = app.extensions.get("telegram_scheduler")
+            if scheduler is None:
+                scheduler = TelegramScheduler(
+                    global_per_second=app.config.get("TELEGRAM_GLOBAL_PER_SECOND", 30.0),
+                    global_burst=app.config.get("TELEGRAM_GLOBAL_BURST", 30),
+                    chat_per_second=app.config.get("TELEGRAM_CHAT_PER_SECOND", 1.0),
+                    chat_burst=app.config.get("TELEGRAM_CHAT_BURST", 3),
+                    group_per_minute=app.config.get("TELEGRAM_GROUP_PER_MINUTE", 20.0),
+                    max_age=app.config.get("TELEGRAM_SCHEDULER_MAX_AGE_SECONDS", 60.0),
+                )
+                app.extensions["telegram_scheduler"] = scheduler
+    return scheduler
@@ -0,0 +1,212 @@
+"""
+Pool de workers para procesar updates de Telegram en segundo plano
+
+El webhook valida y encola el update crudo, responde 200 de inmediato y un pool
+de threads o procesos ejecuta la lógica de `process_update`.
+
+Los updates se reparten con `ChatDispatcher`: los de un mismo chat se procesan en
+orden y los de chats distintos en paralelo.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from app.dispatcher import ChatDispatcher, update_chat_key
+from app.logger_config import log_operation, log_error, ErrorCodes
+
+logger = logging.getLogger(__name__)
+
+_pool_lock = threading.Lock()
+
+# App propia de cada proceso worker (solo se usa en modo "process")
+_worker_app = None
+
+
+def _init_worker_process(config_name: str):
+    """
+    Inicializa un proceso worker creando su propia aplicación Flask
+
+    Args:
+        config_name: Nombre del entorno de configuración
+    """
+    global _worker_app
+    from app import create_app
+
+    _worker_app = create_app(config_name)
+
+
+def _run_in_worker_process(update: dict) -> float:
+    """
+    Procesa un update dentro de un proceso worker
+
+    Args:
+        update: Update de Telegram
+
+    Returns:
+        Segundos que el worker estuvo ocupado procesando el update
+    """
+    from app.routes import process_update
+
+    started = time.monotonic()
+    with _worker_app.app_context():
+        process_update(update)
+    return time.monotonic() - started
+
+
+class UpdateWorkerPool:
+    """
+    Pool de workers que procesa updates de Telegram fuera del request del webhook
+
+    Cada worker es un carril del dispatcher. En modo "process" cada carril delega
+    en su propio proceso (un ProcessPoolExecutor de un solo worker), lo que
+    mantiene el orden por chat también entre procesos.
+
+    Attributes:
+        kind: Tipo de pool ("thread" o "process")
+        workers: Número de workers (carriles)
+        queue_size: Máximo total de updates pendientes antes de rechazar nuevos
+    """
+
+    def __init__(self, app, handler: Optional[Callable[[dict], object]] = None,
+                 workers: int = 4, queue_size: int = 1000, kind: str = "thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Tipo de pool desconocido: {kind}")
+
+        self.app = app
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self._handler = handler
+        self._executors: List[ProcessPoolExecutor] = []
+
+        # La capacidad total se reparte entre carriles (backpressure por carril)
+        lane_capacity = max(1, -(-self.queue_size // self.workers))
+        self._dispatcher = ChatDispatcher(
+            self._handle,
+            lanes=self.workers,
+            lane_capacity=lane_capacity,
+            name="update-worker",
+            on_error=self._on_error,
+        )
+
+    def start(self):
+        """Arranca los workers del pool"""
+        if self.kind == "process":
+            config_name = self.app.config.get("CONFIG_NAME", "default")
+            self._executors = [
+                ProcessPoolExecutor(
+                    max_workers=1,
+                    initializer=_init_worker_process,
+                    initargs=(config_name,),
+                )
+                for _ in range(self.workers)
+            ]
+        self._dispatcher.start()
+
+        log_operation(logger, "UPDATE_POOL_STARTED",
+                      f"Pool de workers iniciado: kind={self.kind}, workers={self.workers}, "
+                      f"queue_size={self.queue_size}",
+                      error_code=ErrorCodes.OP_SUCCESS)
+
+    def submit(self, update: dict) -> bool:
+        """
+        Encola un update en el carril de su chat
+
+        Args:
+            update: Update de Telegram
+
+        Returns:
+            True si se encoló, False si el carril del chat está lleno
+        """
+        key = update_chat_key(update)
+        return self._dispatcher.submit(key, (self._dispatcher.lane_for(key), update))
+
+    def _handle(self, item: Tuple[int, dict]):
+        """Procesa un update en el worker de su carril"""
+        lane, update = item
+        if self.kind == "process":
+            self._executors[lane].submit(_run_in_worker_process, update).result()
+            return
+
+        with self.app.app_context():
+            self._get_handler()(update)
+
+    def _on_error(self, item: Tuple[int, dict], error: Exception):
+        """Registra un error de procesamiento sin detener el carril"""
+        _, update = item
+        log_error(logger, ErrorCodes.ERR_UPDATE_WORKER,
+                  f"Error procesando update en worker: {str(error)}",
+                  data_dict={"update_id": update.get("update_id")},
+                  exception=error)
+
+    def _get_handler(self) -> Callable[[dict], object]:
+        """Obtiene el handler de updates (import diferido para evitar circular)"""
+        if self._handler is None:
+            from app.routes import process_update
+
+            self._handler = process_update
+        return self._handler
+
+    def stats(self) -> dict:
+        """
+        Estadísticas del pool: profundidad de la cola y utilización de workers
+
+        Returns:
+            Diccionario con las métricas del pool
+        """
+        dispatcher_stats = self._dispatcher.stats()
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            **{key: value for key, value in dispatcher_stats.items() if key != "lanes"},
+        }
+
+    def join(self):
+        """Espera a que se procesen todos los updates encolados"""
+        self._dispatcher.join()
+
+    def shutdown(self, wait: bool = True):
+        """
+        Detiene el pool de workers
+
+        Args:
+            wait: Si True, espera a que se procesen los updates pendientes
+        """
+        self._dispatcher.shutdown(wait=wait)
+        for executor in self._executors:
+            executor.shutdown(wait=wait)
+
+
+def get_update_pool(app) -> Optional[UpdateWorkerPool]:
+    """
+    Obtiene (o crea de forma lazy) el pool de workers de la aplicación
+
+    El pool solo existe si WEBHOOK_ASYNC_MODE está activo. Se crea en el primer
+    update recibido para no arrancar workers en instancias que nunca reciben tráfico.
+
+    Args:
+        app: Instancia de la aplicación Flask
+
+    Returns:
+        UpdateWorkerPool o None si el modo asíncrono está desactivado
+    """
+    if not app.config.get("WEBHOOK_ASYNC_MODE"):
+        return None
+
+    pool = app.extensions.get("update_pool")
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get("update_pool")
+            if pool is None:
+                pool = UpdateWorkerPool(
+                    app,
+                    workers=app.config.get("WEBHOOK_WORKERS", 4),
+                    queue_size=app.config.get("WEBHOOK_QUEUE_SIZE", 1000),
+                    kind=app.config.get("WEBHOOK_WORKER_KIND", "thread"),
+                )
+                pool.start()
+                app.extensions["update_pool"] = pool
+    return pool
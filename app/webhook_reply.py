@@ -0,0 +1,199 @@
+"""
+Respuesta en línea del webhook
+
+Telegram acepta que la respuesta HTTP del webhook sea una llamada a la Bot
+API (`{"method": "sendMessage", "chat_id": ..., "text": ...}`). La mayoría de
+los updates producen un solo mensaje (la confirmación del gasto, el aviso de
+no autorizado, el rechazo por validación): enviarlo en la respuesta ahorra
+la ida y vuelta de un `sendMessage` aparte.
+
+Mientras se procesa un update, WebhookReply retiene la primera llamada
+saliente en lugar de enviarla. Si llega una segunda, la retenida sale antes
+por HTTP (para conservar el orden) y el resto sigue por el cliente HTTP; al
+terminar, la que siga retenida va en el cuerpo de la respuesta. Telegram no
+informa el resultado de una llamada en línea: se da por enviada.
+
+El WebhookReply activo vive en `flask.g` (lo crea `process_inline_update`
+solo cuando el update se procesa en el request, con Flask o con la app ASGI
+nativa).
+
+En long polling con commit por lote el problema es el inverso: nada puede
+salir antes del commit. HeldOutbox retiene todas las llamadas del lote y el
+poller las envía solo si el commit se confirmó; si falla, Telegram vuelve a
+entregar el lote y las respuestas se descartan (saldrán al reprocesarlo).
+"""
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional
+
+from flask import g, has_app_context
+
+
+@dataclass(frozen=True)
+class HeldCall:
+    """
+    Llamada a la Bot API retenida para la respuesta del webhook
+
+    Attributes:
+        method: Método de la Bot API
+        payload: Cuerpo JSON
+        chat_id: Chat destino (None en answerCallbackQuery)
+        priority: Prioridad en la cola de salida si termina saliendo por HTTP
+    """
+    method: str
+    payload: dict
+    chat_id: Optional[int]
+    priority: int
+
+    def body(self) -> dict:
+        """Cuerpo de la respuesta del webhook que ejecuta la llamada"""
+        return {"method": self.method, **self.payload}
+
+
+class WebhookReply:
+    """
+    Retiene la primera llamada saliente de un update
+
+    Una vez liberada (por una segunda llamada o al responder) ya no retiene
+    más: todo lo que sigue sale por HTTP.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held: Optional[HeldCall] = None
+        self._closed = False
+
+    def hold(self, method: str, payload: dict, chat_id: Optional[int] = None, priority: int = 0) -> bool:
+        """
+        Retiene la llamada si es la primera del update
+
+        Args:
+            method: Método de la Bot API
+            payload: Cuerpo JSON
+            chat_id: Opcional, chat destino
+            priority: Opcional, prioridad en la cola de salida
+
+        Returns:
+            True si quedó retenida (no hay que enviarla)
+        """
+        with self._lock:
+            if self._closed or self._held is not None:
+                return False
+            self._held = HeldCall(method, payload, chat_id, priority)
+            return True
+
+    def release(self) -> Optional[HeldCall]:
+        """
+        Deja de retener llamadas
+
+        Returns:
+            La llamada retenida (que ahora debe enviarse) o None
+        """
+        with self._lock:
+            held, self._held, self._closed = self._held, None, True
+            return held
+
+
+def current_webhook_reply() -> Optional[WebhookReply]:
+    """WebhookReply del update en curso, o None"""
+    if not has_app_context():
+        return None
+    return g.get('webhook_reply')
+
+
+@contextmanager
+def webhook_reply(enabled: bool):
+    """
+    Activa un WebhookReply en `flask.g` mientras se procesa un update
+
+    Args:
+        enabled: WEBHOOK_INLINE_REPLY
+
+    Yields:
+        WebhookReply activo o None si está desactivado
+    """
+    if not enabled:
+        yield None
+        return
+
+    reply = WebhookReply()
+    g.webhook_reply = reply
+    try:
+        yield reply
+    finally:
+        g.pop('webhook_reply', None)
+
+
+class HeldOutbox:
+    """
+    Retiene todas las llamadas salientes hasta que se confirme la DB
+
+    Attributes:
+        held: Llamadas retenidas, en el orden en que se hicieron
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.held: List[HeldCall] = []
+
+    def hold(self, method: str, payload: dict, chat_id: Optional[int] = None, priority: int = 0) -> bool:
+        """
+        Retiene la llamada
+
+        Args:
+            method: Método de la Bot API
+            payload: Cuerpo JSON
+            chat_id: Opcional, chat destino
+            priority: Opcional, prioridad en la cola de salida
+
+        Returns:
+            True (la llamada quedó retenida)
+        """
+        with self._lock:
+            self.held.append(HeldCall(method, payload, chat_id, priority))
+        return True
+
+    def drain(self) -> List[HeldCall]:
+        """
+        Entrega y olvida las llamadas retenidas
+
+        Returns:
+            Lista de llamadas retenidas
+        """
+        with self._lock:
+            held, self.held = self.held, []
+            return held
+
+
+def current_outbox() -> Optional[HeldOutbox]:
+    """HeldOutbox del lote en curso, o None"""
+    if not has_app_context():
+        return None
+    return g.get('held_outbox')
+
+
+@contextmanager
+def held_outbox(enabled: bool):
+    """
+    Activa un HeldOutbox en `flask.g` mientras se procesa un lote
+
+    Al salir las llamadas siguen en el HeldOutbox: quien lo activó decide si
+    enviarlas (`bot_services.send_held`) o descartarlas.
+
+    Args:
+        enabled: POLLING_BATCH_COMMIT
+
+    Yields:
+        HeldOutbox activo o None si está desactivado
+    """
+    if not enabled:
+        yield None
+        return
+
+    outbox = HeldOutbox()
+    g.held_outbox = outbox
+    try:
+        yield outbox
+    finally:
+        g.pop('held_outbox', None)
@@ -0,0 +1,4 @@
+"""
+Benchmarks y herramientas de carga del bot
+Ejecutar desde la raíz del repositorio: python -m benchmarks.<nombre>
+"""
@@ -0,0 +1,199 @@
+"""
+Benchmark: aplicación ASGI nativa vs Flask envuelto en WsgiToAsgi
+Ejecutar: python -m benchmarks.bench_asgi [--updates 200] [--concurrency 200] [--latency-ms 100]
+
+Levanta Telegram y Gemini locales con latencia artificial, registra dos
+usuarios y envía mensajes de gasto concurrentes a /webhook de cada aplicación
+(llamando al callable ASGI en el mismo proceso, sin servidor HTTP delante).
+Los servidores falsos corren en un proceso aparte para no competir por el GIL
+con la aplicación medida.
+Mide updates por segundo y latencia p50/p95/p99 por request, y verifica que
+cada update terminó en un sendMessage de confirmación.
+
+WsgiToAsgi ejecuta la app Flask en un único thread (sync_to_async con
+thread_sensitive), así que sus requests se atienden uno a la vez. La app
+nativa procesa los mensajes de gasto en el event loop con clientes httpx y la
+sesión async de la base de datos; `--workers` solo dimensiona el pool de los
+updates sin handler asyncio.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import FakeServersProcess, bootstrap_env, percentile
+
+PAYER_ID = 1001
+FIRST_DEBTOR_ID = 2000
+
+
+def make_update(update_id: int, chats: int) -> bytes:
+    """Update de mensaje de deuda de uno de los `chats` deudores hacia el usuario 'Ana'"""
+    debtor_id = FIRST_DEBTOR_ID + update_id % chats
+    return json.dumps({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "from": {"id": debtor_id, "first_name": f"Deudor{debtor_id}"},
+            "chat": {"id": debtor_id, "type": "private"},
+            "date": int(time.time()),
+            "text": f"Le debo {1000 + update_id} a Ana por el almuerzo",
+        },
+    }).encode("utf-8")
+
+
+async def post_webhook(asgi_app, body: bytes) -> int:
+    """
+    Llama al callable ASGI con un POST /webhook
+
+    Returns:
+        Status HTTP de la respuesta
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/webhook",
+        "raw_path": b"/webhook",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+    request_sent = False
+    status = 0
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Sin desconexión del cliente: esperar hasta que la app termine
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await asyncio.wait_for(asgi_app(scope, receive, send), timeout=600)
+    return status
+
+
+async def run_load(asgi_app, first_update_id: int, updates: int, concurrency: int,
+                   chats: int) -> dict:
+    """
+    Envía `updates` requests de `chats` chats distintos con a lo sumo `concurrency` en vuelo
+
+    Los workers de la app nativa se detienen en el mismo event loop que los usó.
+
+    Returns:
+        Diccionario con duración, latencias, status recibidos y pico en vuelo
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def one(update_id: int):
+        async with semaphore:
+            started = time.perf_counter()
+            status = await post_webhook(asgi_app, make_update(update_id, chats))
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(first_update_id + i) for i in range(updates)))
+    elapsed = time.perf_counter() - started
+
+    peak = "-"
+    if hasattr(asgi_app, "aclose"):
+        peak = str(asgi_app.health()["asgi"]["peak_inflight"])
+        await asgi_app.aclose()
+    return {"elapsed": elapsed, "latencies": latencies, "statuses": statuses, "peak": peak}
+
+
+def seed_users(flask_app, chats: int):
+    """Registra a 'Ana' y a los deudores del benchmark si no existen"""
+    from app import db
+    from app.models import User
+
+    users = [(PAYER_ID, "Ana")] + [
+        (FIRST_DEBTOR_ID + i, f"Deudor{FIRST_DEBTOR_ID + i}") for i in range(chats)
+    ]
+    with flask_app.app_context():
+        db.create_all()
+        for telegram_id, name in users:
+            if not User.query.filter_by(telegram_id=telegram_id).first():
+                db.session.add(User(telegram_id=telegram_id, name=name, is_authorized=True))
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ASGI nativo vs WsgiToAsgi")
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=100,
+                        help="Chats distintos (los updates de un chat se procesan en orden)")
+    parser.add_argument("--workers", type=int, default=16, help="ASGI_WORKERS de la app nativa")
+    parser.add_argument("--latency-ms", type=float, default=100.0,
+                        help="Latencia artificial de Telegram y Gemini")
+    parser.add_argument("--modes", default="wsgi,native")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    fakes = FakeServersProcess(latency=args.latency_ms / 1000).start()
+
+    os.environ["DATABASE_URL"] = args.database_url or (
+        f"sqlite:///{tempfile.mkstemp(prefix='we_owe_bot_asgi_', suffix='.db')[1]}"
+    )
+    os.environ["TELEGRAM_API_BASE_URL"] = fakes.telegram_url
+    os.environ["GEMINI_API_URL"] = fakes.gemini_url
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["ASGI_MAX_INFLIGHT"] = str(max(args.concurrency, 1))
+    os.environ["ASGI_WORKERS"] = str(max(args.workers, 1))
+    bootstrap_env()
+
+    from asgiref.wsgi import WsgiToAsgi
+    from app import create_app
+    from app.asgi import AsyncBotApp
+
+    flask_app = create_app()
+    seed_users(flask_app, args.chats)
+
+    print(f"Updates: {args.updates}, chats: {args.chats}, concurrencia: {args.concurrency}, "
+          f"latencia Telegram/Gemini: {args.latency_ms:.0f} ms")
+    print(f"{'modo':<8} {'updates/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'pico en vuelo':>14} {'confirmaciones':>15} {'status'}")
+
+    next_update_id = 1
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        if mode == "native":
+            asgi_app = AsyncBotApp(flask_app)
+        elif mode == "wsgi":
+            asgi_app = WsgiToAsgi(flask_app)
+        else:
+            raise SystemExit(f"Modo desconocido: {mode}")
+
+        sent_before = fakes.count("sendMessage")
+        result = asyncio.run(run_load(asgi_app, next_update_id, args.updates,
+                                    args.concurrency, args.chats))
+        next_update_id += args.updates
+        confirmations = fakes.count("sendMessage") - sent_before
+
+        latencies = result["latencies"]
+        print(f"{mode:<8} {args.updates / result['elapsed']:>10.1f} "
+              f"{percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 95) * 1000:>9.1f} "
+              f"{percentile(latencies, 99) * 1000:>9.1f} {result['peak']:>14} {confirmations:>15} "
+              f"{result['statuses']}")
+
+    fakes.stop()
+
+
+if __name__ == "__main__":
+    main()
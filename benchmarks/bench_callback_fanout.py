@@ -0,0 +1,96 @@
+"""
+Benchmark: pago por botón en serie vs con las llamadas a Telegram en paralelo
+Ejecutar: python -m benchmarks.bench_callback_fanout [--clicks 50] [--debts 20] [--latency-ms 50]
+
+Cada click es un callback `pay_debt_<id>` procesado por el webhook síncrono
+(cliente de pruebas de Flask) contra un Telegram local que tarda
+`--latency-ms` por llamada. El deudor empieza con `--debts` + `--clicks`
+deudas en una base SQLite en archivo.
+
+- en serie: TELEGRAM_FANOUT_ENABLED=false; respuesta al callback, comprobante,
+  consulta de deudas restantes y edición, una tras otra
+- en paralelo: las tres llamadas a Telegram salen a la vez tras el commit y
+  la consulta corre mientras viajan
+
+Reporta el tiempo hasta que Telegram recibe la respuesta al callback (lo que
+gira el spinner) y el tiempo de click a mensaje actualizado (fin del webhook).
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import bootstrap_env, percentile
+from benchmarks.fake_telegram import FakeTelegramServer
+
+DEBTOR_ID = 2
+MESSAGE_ID = 10
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pago por botón: en serie vs en paralelo")
+    parser.add_argument("--clicks", type=int, default=50, help="Clicks por modo")
+    parser.add_argument("--debts", type=int, default=20, help="Deudas que quedan tras los clicks")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(latency=args.latency_ms / 1000).start()
+    # bot_services arma la URL de Telegram al importarse
+    os.environ.update(TELEGRAM_API_BASE_URL=server.base_url,
+                      DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'callback_fanout.db')}")
+    bootstrap_env()
+
+    from app import create_app, db
+    from app.models import User, Expense
+
+    app = create_app()
+    app.config.update(WEBHOOK_ASYNC_MODE=False, UPDATE_DEDUP_ENABLED=False, WEBHOOK_INLINE_REPLY=False)
+    with app.app_context():
+        db.create_all()
+        payer, debtor = User(telegram_id=1, name="Luis"), User(telegram_id=DEBTOR_ID, name="Julieth")
+        db.session.add_all([payer, debtor])
+        db.session.flush()
+        expenses = [Expense(payer_id=payer.id, debtor_id=debtor.id, amount=1000 + idx, currency="COP",
+                            description=f"gasto {idx}", raw_text=f"gasto {idx}")
+                    for idx in range(2 * args.clicks + args.debts)]
+        db.session.add_all(expenses)
+        db.session.commit()
+        expense_ids = [expense.id for expense in expenses]
+    client = app.test_client()
+
+    results = {}
+    try:
+        for offset, (mode, enabled) in enumerate((("en serie", False), ("en paralelo", True))):
+            app.config["TELEGRAM_FANOUT_ENABLED"] = enabled
+            spinner, click_to_update = [], []
+            for click in range(args.clicks):
+                callback_id = f"{mode}-{click}"
+                update = {"update_id": offset * args.clicks + click, "callback_query": {
+                    "id": callback_id, "from": {"id": DEBTOR_ID}, "data": f"pay_debt_{expense_ids[offset * args.clicks + click]}",
+                    "message": {"message_id": MESSAGE_ID, "chat": {"id": DEBTOR_ID}},
+                }}
+                started = time.perf_counter()
+                client.post("/webhook", json=update)
+                click_to_update.append(time.perf_counter() - started)
+                answered = next(at for method, payload, at in reversed(server.replied)
+                                if method == "answerCallbackQuery" and payload.get("callback_query_id") == callback_id)
+                spinner.append(answered - started)
+            results[mode] = {"spinner": spinner, "click_to_update": click_to_update}
+    finally:
+        server.stop()
+
+    print(f"{args.clicks} clicks por modo, {args.debts}+ deudas restantes; Telegram local de {args.latency_ms:.0f} ms\n")
+    print(f"{'modo':<12} {'spinner p50':>12} {'spinner p95':>12} {'click->msg p50':>15} {'click->msg p95':>15}")
+    for mode, result in results.items():
+        print(f"{mode:<12} {percentile(result['spinner'], 50) * 1000:>12.1f} "
+              f"{percentile(result['spinner'], 95) * 1000:>12.1f} "
+              f"{percentile(result['click_to_update'], 50) * 1000:>15.1f} "
+              f"{percentile(result['click_to_update'], 95) * 1000:>15.1f}")
+
+    serial, parallel = results["en serie"], results["en paralelo"]
+    print(f"\nClick a mensaje actualizado p50: {percentile(serial['click_to_update'], 50) * 1000:.1f} ms -> "
+          f"{percentile(parallel['click_to_update'], 50) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark: lista completa de deudas vs páginas keyset
+Ejecutar: python -m benchmarks.bench_debt_pages [--debts 5000] [--repeat 50]
+
+Un deudor con `--debts` deudas pendientes (un tercio con fecha límite) en una
+base SQLite en archivo, con los índices de app.debt_pages.
+
+- lista completa: get_user_debts_to_pay + format_debts_list_for_payment (antes)
+- primera página: get_debts_page + format_debts_page
+- página del medio: la misma consulta con el cursor de un botón "Siguiente"
+
+Reporta latencia (p50/p95), filas cargadas y largo del mensaje (Telegram
+rechaza más de 4096 caracteres).
+"""
+import argparse
+import datetime as dt
+import os
+import tempfile
+import time
+
+from benchmarks.common import bootstrap_env, percentile
+
+TELEGRAM_MAX_CHARS = 4096
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lista completa de deudas vs páginas keyset")
+    parser.add_argument("--debts", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'debt_pages.db')}")
+    bootstrap_env()
+
+    from app import create_app, db
+    from app.models import User, Expense
+    from app.bot_services import (get_user_debts_to_pay, format_debts_list_for_payment,
+                                  get_debts_page, format_debts_page)
+    from app.debt_pages import ROLE_PAY, parse_page_callback
+
+    app = create_app()
+    base = dt.datetime(2024, 1, 1)
+    with app.app_context():
+        db.create_all()
+        payer, debtor = User(telegram_id=1, name="Luis"), User(telegram_id=2, name="Julieth")
+        db.session.add_all([payer, debtor])
+        db.session.flush()
+        db.session.add_all([
+            Expense(payer_id=payer.id, debtor_id=debtor.id, amount=1000 + idx, currency="COP",
+                    description=f"gasto {idx} en el supermercado del barrio", raw_text=f"gasto {idx}",
+                    created_at=base + dt.timedelta(minutes=idx),
+                    due_date=(base + dt.timedelta(days=idx % 90)).date() if idx % 3 == 0 else None)
+            for idx in range(args.debts)
+        ])
+        db.session.commit()
+        debtor_id = debtor.id
+
+        # Cursor del botón "Siguiente" a mitad de la lista
+        page = get_debts_page(debtor_id, ROLE_PAY)
+        for _ in range(args.debts // page.page_size // 2):
+            page = get_debts_page(debtor_id, *_page_args(parse_page_callback(page.next_callback())))
+        middle = parse_page_callback(page.next_callback())
+
+        def full_list():
+            debts = get_user_debts_to_pay(debtor_id)
+            return len(debts), format_debts_list_for_payment(debts)[0]
+
+        def first_page():
+            page = get_debts_page(debtor_id, ROLE_PAY)
+            return len(page.items), format_debts_page(page)[0]
+
+        def middle_page():
+            page = get_debts_page(debtor_id, *_page_args(middle))
+            return len(page.items), format_debts_page(page)[0]
+
+        results = {}
+        for mode, func in (("lista completa", full_list), ("primera página", first_page),
+                           ("página del medio", middle_page)):
+            latencies = []
+            for _ in range(args.repeat):
+                db.session.expunge_all()
+                started = time.perf_counter()
+                rows, message = func()
+                latencies.append(time.perf_counter() - started)
+            results[mode] = (latencies, rows, len(message))
+
+    print(f"{args.debts} deudas pendientes, {args.repeat} repeticiones por modo\n")
+    print(f"{'modo':<18} {'p50 ms':>8} {'p95 ms':>8} {'filas':>6} {'caracteres':>11}")
+    for mode, (latencies, rows, chars) in results.items():
+        flag = " (pasa el límite)" if chars > TELEGRAM_MAX_CHARS else ""
+        print(f"{mode:<18} {percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+              f"{rows:>6} {chars:>11}{flag}")
+
+
+def _page_args(parsed: tuple) -> tuple:
+    """(rol, backward, número, cursor) de parse_page_callback -> argumentos de get_debts_page"""
+    role, backward, number, cursor = parsed
+    return role, cursor, backward, number
+
+
+if __name__ == "__main__":
+    main()
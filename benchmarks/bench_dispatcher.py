@@ -0,0 +1,100 @@
+"""
+Benchmark del dispatcher ordenado por chat
+Ejecutar: python -m benchmarks.bench_dispatcher [--chats 200] [--messages 10] [--latency-ms 20]
+
+Simula una carga multi-chat donde cada update tarda `latency-ms` (I/O de Gemini,
+DB y Telegram) y mide el throughput con distintos números de workers. También
+verifica que los mensajes de cada chat se procesen en orden.
+"""
+import argparse
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks.common import bootstrap_env
+
+bootstrap_env()
+
+from app.dispatcher import ChatDispatcher, update_chat_key  # noqa: E402
+
+
+def build_workload(chats: int, messages: int) -> list:
+    """Genera updates sintéticos intercalados entre chats"""
+    updates = []
+    update_id = 1
+    for seq in range(messages):
+        for chat_id in range(1, chats + 1):
+            updates.append({
+                "update_id": update_id,
+                "message": {
+                    "chat": {"id": chat_id},
+                    "from": {"id": chat_id},
+                    "text": f"mensaje {seq}",
+                    "seq": seq,
+                },
+            })
+            update_id += 1
+    return updates
+
+
+def run(workers: int, updates: list, latency: float) -> tuple:
+    """
+    Procesa la carga con un número de workers
+
+    Returns:
+        Tupla (segundos, updates_por_segundo, chats_desordenados)
+    """
+    seen = defaultdict(list)
+    seen_lock = threading.Lock()
+
+    def handler(update):
+        time.sleep(latency)
+        with seen_lock:
+            seen[update["message"]["chat"]["id"]].append(update["message"]["seq"])
+
+    dispatcher = ChatDispatcher(handler, lanes=workers, lane_capacity=len(updates))
+    dispatcher.start()
+
+    started = time.perf_counter()
+    for update in updates:
+        dispatcher.submit(update_chat_key(update), update, timeout=5)
+    dispatcher.join()
+    elapsed = time.perf_counter() - started
+    dispatcher.shutdown()
+
+    out_of_order = sum(1 for seqs in seen.values() if seqs != sorted(seqs))
+    return elapsed, len(updates) / elapsed, out_of_order
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del dispatcher por chat")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--workers", type=str, default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    updates = build_workload(args.chats, args.messages)
+    latency = args.latency_ms / 1000
+
+    print(f"Carga: {args.chats} chats x {args.messages} mensajes, "
+          f"{args.latency_ms} ms por update")
+    print(f"{'workers':>8} {'segundos':>10} {'updates/s':>10} {'speedup':>8} {'desorden':>9}")
+
+    baseline = None
+    failed = False
+    for workers in [int(w) for w in args.workers.split(",")]:
+        elapsed, throughput, out_of_order = run(workers, updates, latency)
+        baseline = baseline or throughput
+        failed = failed or out_of_order > 0
+        print(f"{workers:>8} {elapsed:>10.2f} {throughput:>10.1f} "
+              f"{throughput / baseline:>7.1f}x {out_of_order:>9}")
+
+    if failed:
+        print("❌ Se detectaron chats con mensajes desordenados")
+        raise SystemExit(1)
+    print("✅ Orden por chat preservado en todas las ejecuciones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark: extracción con Gemini una llamada por mensaje vs micro-lotes
+Ejecutar: python -m benchmarks.bench_extraction_batch [--messages 64] [--threads 16] [--batch-size 8]
+          [--window-ms 20] [--latency-ms 300] [--item-latency-ms 20] [--max-concurrency 4]
+
+Simula una ráfaga: `--threads` handlers (los carriles del dispatcher) extraen
+`--messages` mensajes contra un Gemini local con latencia base, latencia por
+mensaje de la respuesta y un límite de llamadas simultáneas (la cuota de la
+API). Compara:
+
+- individual: `request_extraction`, una llamada por mensaje (comportamiento anterior)
+- lotes: `ExtractionBatcher` con la ventana y el tamaño de lote indicados
+
+Reporta mensajes por segundo, latencia por mensaje (p50/p95), llamadas a
+Gemini y tokens de entrada (caracteres del prompt / 4, como los cuenta el
+servidor local).
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import bootstrap_env, percentile
+from benchmarks.fake_gemini import FakeGeminiServer
+
+TEXTS = (
+    "Le debo {n} a Ana por el almuerzo",
+    "Gasté {n} con Carlos en el supermercado",
+    "Pagamos {n} del taxi con María",
+    "Tengo que pagar {n} a Juan por la boleta",
+)
+
+
+def run_burst(extract, messages: int, threads: int) -> dict:
+    """
+    Extrae `messages` mensajes distintos con `threads` handlers en paralelo
+
+    Returns:
+        Diccionario con el tiempo total, latencias por mensaje y resultados válidos
+    """
+    texts = [TEXTS[idx % len(TEXTS)].format(n=1000 + idx) for idx in range(messages)]
+
+    def timed(text):
+        started = time.perf_counter()
+        data = extract(text)
+        return time.perf_counter() - started, data is not None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        samples = list(executor.map(timed, texts))
+    return {
+        "wall": time.perf_counter() - started,
+        "latencies": [seconds for seconds, _ in samples],
+        "valid": sum(1 for _, ok in samples if ok),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-lotes de extracción con Gemini")
+    parser.add_argument("--messages", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--window-ms", type=float, default=20.0)
+    parser.add_argument("--latency-ms", type=float, default=300.0,
+                        help="Latencia base de cada llamada al Gemini local")
+    parser.add_argument("--item-latency-ms", type=float, default=20.0,
+                        help="Latencia extra por mensaje de la respuesta")
+    parser.add_argument("--max-concurrency", type=int, default=4,
+                        help="Llamadas que el Gemini local atiende a la vez")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(latency=args.latency_ms / 1000, item_latency=args.item_latency_ms / 1000,
+                              max_concurrency=args.max_concurrency).start()
+    # ai_services arma la URL de Gemini al importarse
+    os.environ["GEMINI_API_URL"] = server.base_url
+    bootstrap_env()
+
+    import requests
+    from app.ai_services import request_batch_extraction, request_extraction
+    from app.extraction_batcher import ExtractionBatcher
+
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(1, args.threads)))
+    results = {}
+    try:
+        for mode in ("individual", "lotes"):
+            calls_before, tokens_before = len(server.calls), server.prompt_tokens
+            if mode == "individual":
+                burst = run_burst(lambda text: request_extraction(text, 30, session),
+                                  args.messages, args.threads)
+            else:
+                batcher = ExtractionBatcher(
+                    send_batch=lambda texts, timeout: request_batch_extraction(texts, timeout, session),
+                    send_one=lambda text, timeout, usage: request_extraction(text, timeout, session, usage=usage),
+                    max_batch_size=args.batch_size, window_ms=args.window_ms,
+                    max_inflight=max(1, args.threads),
+                )
+                burst = run_burst(lambda text: batcher.extract(text, 30), args.messages, args.threads)
+                burst["batcher"] = batcher.stats()
+                batcher.shutdown()
+            burst["calls"] = len(server.calls) - calls_before
+            burst["tokens"] = server.prompt_tokens - tokens_before
+            results[mode] = burst
+    finally:
+        server.stop()
+
+    print(f"Ráfaga: {args.messages} mensajes, {args.threads} handlers, Gemini local con "
+          f"{args.latency_ms:.0f} ms + {args.item_latency_ms:.0f} ms/mensaje, "
+          f"{args.max_concurrency or 'sin límite de'} llamadas simultáneas")
+    print(f"Lotes: hasta {args.batch_size} mensajes, ventana {args.window_ms:.0f} ms\n")
+    print(f"{'modo':<11} {'msg/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'media ms':>9} "
+          f"{'llamadas':>8} {'tokens':>8} {'tok/msg':>8} {'válidos':>8}")
+    for mode, burst in results.items():
+        latencies = burst["latencies"]
+        print(f"{mode:<11} {args.messages / burst['wall']:>7.1f} {percentile(latencies, 50) * 1000:>8.0f} "
+              f"{percentile(latencies, 95) * 1000:>8.0f} {statistics.mean(latencies) * 1000:>9.0f} "
+              f"{burst['calls']:>8} {burst['tokens']:>8} {burst['tokens'] / args.messages:>8.0f} "
+              f"{burst['valid']:>8}")
+
+    single, batched = results["individual"], results["lotes"]
+    print(f"\nThroughput: {single['wall'] / batched['wall']:.1f}x, "
+          f"tokens de entrada: -{1 - batched['tokens'] / single['tokens']:.0%}, "
+          f"tamaño medio de lote: {batched['batcher']['avg_batch_size']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: mensajes durante una caída de Gemini, sin breaker vs con breaker
+Ejecutar: python -m benchmarks.bench_gemini_outage [--messages 40] [--latency-ms 500]
+          [--threshold 5] [--reset-seconds 2]
+
+Un Gemini local responde 500 a todo (con `--latency-ms` por llamada) y se
+extraen `--messages` mensajes seguidos con `request_extraction`:
+
+- sin breaker: cada mensaje paga la latencia y los reintentos con backoff
+- con breaker: tras `--threshold` mensajes fallidos el circuito se abre y el
+  resto se rechaza al instante (el webhook los manda al extractor local o a la
+  cola de pendientes)
+
+Después Gemini se recupera y se mide cuánto tarda el breaker en cerrarse.
+Reporta latencia por mensaje (p50/p95/máx), llamadas a Gemini y las
+transiciones del breaker.
+"""
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.common import bootstrap_env, percentile
+from benchmarks.fake_gemini import FakeGeminiServer
+
+
+def run_outage(extract, messages: int) -> dict:
+    """
+    Extrae `messages` mensajes seguidos con Gemini caído
+
+    Returns:
+        Diccionario con latencias por mensaje y cuántos terminaron en GeminiUnavailable
+    """
+    from app.ai_services import GeminiUnavailable
+
+    latencies, unavailable = [], 0
+    for idx in range(messages):
+        started = time.perf_counter()
+        try:
+            extract(f"Le debo {1000 + idx} a Ana por el almuerzo")
+        except GeminiUnavailable:
+            unavailable += 1
+        latencies.append(time.perf_counter() - started)
+    return {"latencies": latencies, "unavailable": unavailable}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caída de Gemini con y sin circuit breaker")
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=500.0,
+                        help="Latencia de cada respuesta 500 del Gemini local")
+    parser.add_argument("--threshold", type=int, default=5, help="Fallos consecutivos que abren el circuito")
+    parser.add_argument("--reset-seconds", type=float, default=2.0, help="Tiempo abierto antes de probar")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(latency=args.latency_ms / 1000, error_rate=1.0).start()
+    # ai_services arma la URL de Gemini al importarse
+    os.environ["GEMINI_API_URL"] = server.base_url
+    bootstrap_env()
+
+    import requests
+    from app.ai_services import GEMINI_TIMEOUT, request_extraction
+    from app.circuit_breaker import CircuitBreaker
+
+    session = requests.Session()
+    breaker = CircuitBreaker("gemini", failure_threshold=args.threshold, reset_timeout=args.reset_seconds)
+    results = {}
+    try:
+        for mode, mode_breaker in (("sin breaker", None), ("con breaker", breaker)):
+            calls_before = len(server.calls)
+            outage = run_outage(lambda text: request_extraction(text, GEMINI_TIMEOUT, session, mode_breaker),
+                                args.messages)
+            outage["calls"] = len(server.calls) - calls_before
+            results[mode] = outage
+
+        # Recuperación: el primer mensaje tras reset_timeout es la llamada de prueba
+        server.error_rate = 0.0
+        server.latency = 0.0
+        recovery_started = time.perf_counter()
+        while breaker.stats()["state"] != "closed":
+            try:
+                request_extraction("Le debo 500 a Ana", GEMINI_TIMEOUT, session, breaker)
+            except Exception:
+                time.sleep(0.05)
+        recovery = time.perf_counter() - recovery_started
+    finally:
+        server.stop()
+
+    print(f"Caída: {args.messages} mensajes, Gemini local responde 500 en {args.latency_ms:.0f} ms; "
+          f"breaker abre tras {args.threshold} fallos, {args.reset_seconds:g}s abierto\n")
+    print(f"{'modo':<12} {'p50 ms':>8} {'p95 ms':>8} {'máx ms':>8} {'total s':>8} {'llamadas':>9} {'no disp.':>9}")
+    for mode, outage in results.items():
+        latencies = outage["latencies"]
+        print(f"{mode:<12} {percentile(latencies, 50) * 1000:>8.0f} {percentile(latencies, 95) * 1000:>8.0f} "
+              f"{max(latencies) * 1000:>8.0f} {sum(latencies):>8.1f} {outage['calls']:>9} "
+              f"{outage['unavailable']:>9}")
+
+    stats = breaker.stats()
+    without, with_breaker = results["sin breaker"], results["con breaker"]
+    print(f"\nLatencia media: {statistics.mean(without['latencies']) * 1000:.0f} ms -> "
+          f"{statistics.mean(with_breaker['latencies']) * 1000:.0f} ms; "
+          f"llamadas a Gemini: {without['calls']} -> {with_breaker['calls']}")
+    print(f"Breaker cerrado {recovery:.1f}s después de que Gemini se recuperó; "
+          f"transiciones: {stats['transitions']}, rechazadas: {stats['rejected']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark: sesiones HTTP con keep-alive vs un requests.post por llamada
+Ejecutar: python -m benchmarks.bench_http_pool [--flows 100] [--threads 1] [--latency-ms 0]
+
+Levanta Telegram y Gemini locales sobre HTTPS (certificado autofirmado, en un
+proceso aparte) y repite el flujo de pago por botón (answerCallbackQuery,
+sendMessage, editMessageText) más una extracción con generateContent:
+
+- requests.post: conexión TCP+TLS nueva en cada llamada (comportamiento anterior)
+- sesión pooled: las sesiones compartidas de `app.http_clients`
+
+Reporta la latencia por llamada (p50/p95/media) de cada servicio y la
+reutilización de conexiones del modo pooled. Con --threads > 1 los flujos
+corren en paralelo y se ve el efecto de HTTP_POOL_MAXSIZE.
+
+Requiere el CLI de openssl para generar el certificado.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import FakeServersProcess, bootstrap_env, make_self_signed_cert, percentile
+
+MODES = ("requests.post", "sesión pooled")
+
+
+def build_calls(telegram_url: str, gemini_url: str, token: str) -> list:
+    """Llamadas de un flujo: (servicio, url, payload)"""
+    from app.ai_services import build_extraction_payload
+
+    bot_url = f"{telegram_url}/bot{token}"
+    return [
+        ("telegram", f"{bot_url}/answerCallbackQuery",
+         {"callback_query_id": "1", "text": "✅ Deuda pagada"}),
+        ("telegram", f"{bot_url}/sendMessage",
+         {"chat_id": 1001, "text": "🧾 Comprobante de pago", "parse_mode": "HTML"}),
+        ("telegram", f"{bot_url}/editMessageText",
+         {"chat_id": 1001, "message_id": 1, "text": "No tienes deudas pendientes", "parse_mode": "HTML"}),
+        ("gemini", f"{gemini_url}gemini-2.5-flash:generateContent?key=benchmark",
+         build_extraction_payload("Le debo 30000 a Ana por el almuerzo")),
+    ]
+
+
+def run_flow(calls: list, post_for) -> list:
+    """
+    Ejecuta un flujo
+
+    Returns:
+        Lista de (servicio, segundos) por llamada
+    """
+    samples = []
+    for service, url, payload in calls:
+        started = time.perf_counter()
+        response = post_for(service)(url, json=payload, timeout=10)
+        response.raise_for_status()
+        samples.append((service, time.perf_counter() - started))
+    return samples
+
+
+def run_mode(calls: list, post_for, flows: int, threads: int) -> dict:
+    """
+    Repite el flujo `flows` veces con `threads` en paralelo
+
+    Returns:
+        Diccionario {servicio: [segundos por llamada]} y "wall" con el tiempo total
+    """
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        results = list(executor.map(lambda _: run_flow(calls, post_for), range(flows)))
+    by_service = {"wall": time.perf_counter() - started}
+    for samples in results:
+        for service, seconds in samples:
+            by_service.setdefault(service, []).append(seconds)
+    return by_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep-alive HTTP vs una conexión por llamada")
+    parser.add_argument("--flows", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="Latencia artificial de los servidores locales")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="we_owe_bot_tls_")
+    certfile, keyfile = make_self_signed_cert(workdir)
+    # requests (y las sesiones) validan contra el certificado autofirmado
+    os.environ["REQUESTS_CA_BUNDLE"] = certfile
+    bootstrap_env()
+
+    import requests
+    from app.http_clients import HttpClients
+
+    fakes = FakeServersProcess(latency=args.latency_ms / 1000, certfile=certfile, keyfile=keyfile).start()
+    try:
+        calls = build_calls(fakes.telegram_url, fakes.gemini_url, "000000:benchmark-token")
+        clients = HttpClients(pool_maxsize=max(1, args.threads))
+
+        results = {
+            "requests.post": run_mode(calls, lambda service: requests.post, args.flows, args.threads),
+            "sesión pooled": run_mode(calls, lambda service: clients.session(service).post,
+                                      args.flows, args.threads),
+        }
+    finally:
+        fakes.stop()
+
+    print(f"Flujos: {args.flows} x {len(calls)} llamadas HTTPS, threads={args.threads}, "
+          f"latencia del servidor={args.latency_ms:.0f} ms")
+    print(f"\n{'modo':<15} {'servicio':<9} {'llamadas':>8} {'p50 ms':>8} {'p95 ms':>8} {'media ms':>9}")
+    for mode in MODES:
+        for service in ("telegram", "gemini"):
+            values = results[mode][service]
+            print(f"{mode:<15} {service:<9} {len(values):>8} {percentile(values, 50) * 1000:>8.2f} "
+                  f"{percentile(values, 95) * 1000:>8.2f} {statistics.mean(values) * 1000:>9.2f}")
+
+    before = results["requests.post"]["wall"]
+    after = results["sesión pooled"]["wall"]
+    print(f"\nTiempo total: {before:.2f}s -> {after:.2f}s ({before / after:.1f}x)")
+
+    print("\nReutilización de conexiones (sesión pooled)")
+    stats = clients.stats()
+    for service in ("telegram", "gemini"):
+        service_stats = stats[service]
+        print(f"  {service:<9} peticiones={service_stats['requests']} conexiones={service_stats['connections']} "
+              f"reuse_ratio={service_stats['reuse_ratio']:.1%}")
+    clients.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Micro-benchmark del router de intenciones y reporte de conflictos de palabras clave
+Ejecutar: python -m benchmarks.bench_intent_router [--iterations 20000]
+
+Compara los escaneos lineales originales del webhook (listas literales
+reconstruidas en cada request) contra la tabla precompilada de
+`app.intent_router` (palabras clave de la más larga a la más corta). Con `--extra-keywords` agrega palabras clave sintéticas
+para ver cómo escala cada método al crecer la tabla. Al final imprime las
+palabras clave que se solapan.
+"""
+import argparse
+import random
+import string
+import timeit
+
+from benchmarks.common import bootstrap_env
+
+bootstrap_env()
+
+from app.intent_router import (  # noqa: E402
+    IntentRouter, intent_router, INTENT_LIST_EXPENSES, INTENT_PAY_DEBTS, INTENT_COLLECT_DEBTS
+)
+
+MESSAGES = [
+    "Gasté 50000 con María en el supermercado",
+    "Le debo 30000 a Juan por el taxi",
+    "ver mis gastos",
+    "pagar",
+    "quién me debe dinero",
+    "Debo 100000 pesos a Juan mañana",
+    "quiero ver el resumen de este mes por favor",
+    "Tengo que pagar 50 USD el próximo lunes",
+    "gastamos 120000 en el asado del domingo con Pedro y Carlos",
+    "quien me debe el pago del arriendo",
+]
+
+
+def linear_scan(message_text: str):
+    """Réplica de los escaneos secuenciales originales de webhook()"""
+    message_lower = message_text.lower().strip()
+    if any(keyword in message_lower for keyword in [
+        'ver mis gastos', 'lista de deudas', 'lista de gastos',
+        'mis gastos', 'ver gastos', 'mostrar gastos',
+        'gastos pendientes', 'deudas pendientes', 'resumen'
+    ]):
+        return INTENT_LIST_EXPENSES
+    elif any(keyword in message_lower for keyword in [
+        'pagar', 'pagar deuda', 'pagar deudas', 'quiero pagar',
+        'pago', 'realizar pago', 'mis deudas'
+    ]):
+        return INTENT_PAY_DEBTS
+    elif any(keyword in message_lower for keyword in [
+        'quien me debe', 'quién me debe', 'cobrar', 'debo cobrar',
+        'me deben', 'quien me debe dinero', 'quién me debe dinero'
+    ]):
+        return INTENT_COLLECT_DEBTS
+    return None
+
+
+def router_resolve(message_text: str):
+    """Resolución con la tabla precompilada"""
+    match = intent_router.resolve(message_text)
+    return match.intent if match else None
+
+
+def scaled_comparison(extra: int, iterations: int):
+    """Compara escaneo lineal y tabla precompilada con más palabras clave"""
+    rng = random.Random(42)
+    keyword_table = {
+        intent: list(keywords) for intent, keywords in [
+            (INTENT_LIST_EXPENSES, [k for k, (i, _) in intent_router._keywords.items()
+                                    if i == INTENT_LIST_EXPENSES]),
+            (INTENT_PAY_DEBTS, [k for k, (i, _) in intent_router._keywords.items()
+                                if i == INTENT_PAY_DEBTS]),
+            (INTENT_COLLECT_DEBTS, [k for k, (i, _) in intent_router._keywords.items()
+                                    if i == INTENT_COLLECT_DEBTS]),
+        ]
+    }
+    for idx in range(extra):
+        word = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(6, 14)))
+        keyword_table[f"synthetic_{idx % 10}"] = keyword_table.get(f"synthetic_{idx % 10}", []) + [word]
+
+    router = IntentRouter()
+    for intent, keywords in keyword_table.items():
+        router.register(intent, keywords)
+    router.build()
+    tables = list(keyword_table.items())
+
+    def linear(message_text):
+        message_lower = message_text.lower().strip()
+        for intent, keywords in tables:
+            if any(keyword in message_lower for keyword in keywords):
+                return intent
+        return None
+
+    total = iterations * len(MESSAGES)
+    linear_time = timeit.timeit(lambda: [linear(m) for m in MESSAGES], number=iterations)
+    table_time = timeit.timeit(lambda: [router.resolve(m) for m in MESSAGES], number=iterations)
+    keywords = sum(len(k) for k in keyword_table.values())
+    print(f"{keywords:>10} {linear_time / total * 1e6:>14.2f} {table_time / total * 1e6:>12.2f} "
+          f"{linear_time / table_time:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark del router de intenciones")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--extra-keywords", type=str, default="0,100,500")
+    args = parser.parse_args()
+
+    total = args.iterations * len(MESSAGES)
+    linear = timeit.timeit(lambda: [linear_scan(m) for m in MESSAGES], number=args.iterations)
+    router = timeit.timeit(lambda: [router_resolve(m) for m in MESSAGES], number=args.iterations)
+
+    print(f"Mensajes evaluados: {total}")
+    print(f"{'método':<22} {'µs/mensaje':>12}")
+    print(f"{'escaneo lineal':<22} {linear / total * 1e6:>12.2f}")
+    print(f"{'tabla precompilada':<22} {router / total * 1e6:>12.2f}")
+    print(f"speedup: {linear / router:.2f}x")
+
+    print(f"\n{'keywords':>10} {'lineal µs/msg':>14} {'tabla µs/msg':>12} {'speedup':>9}")
+    for extra in [int(n) for n in args.extra_keywords.split(",")]:
+        scaled_comparison(extra, max(1, args.iterations // 10))
+
+    print("\nDiferencias de resolución (lineal -> router):")
+    differences = 0
+    for message in MESSAGES:
+        before, after = linear_scan(message), router_resolve(message)
+        if before != after:
+            differences += 1
+            print(f"  '{message}': {before} -> {after}")
+    if not differences:
+        print("  (ninguna)")
+
+    print("\nReporte de conflictos de palabras clave:")
+    for conflict in intent_router.conflict_report():
+        print(f"  [{conflict['type']}] '{conflict['keyword']}' ({conflict['intent']}) "
+              f"contiene '{conflict['contains']}' ({conflict['contains_intent']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark: extracción con un solo modelo vs router de modelos por complejidad
+Ejecutar: python -m benchmarks.bench_model_router [--messages 100] [--complex-share 0.4]
+          [--fast-ms 100] [--strong-ms 400] [--fast-invalid-rate 0.2]
+
+Extrae `--messages` mensajes con `extract_expense_items` contra un Gemini local
+con dos modelos: el rápido responde en `--fast-ms` y se equivoca en
+`--fast-invalid-rate` de los mensajes con varios gastos; el fuerte responde
+en `--strong-ms`. Una fracción `--complex-share` de los mensajes trae dos
+gastos: la mitad con dos personas y una fecha (van al fuerte) y la otra
+mitad sin ellas (quedan bajo el umbral, van al rápido y pueden escalar). El
+resto es "le debo N a Ana".
+
+- un modelo: todo va a GEMINI_MODEL (el fuerte)
+- router: los mensajes simples van al rápido, los complejos al fuerte y los
+  inválidos del rápido se repiten con el fuerte
+
+Reporta latencia por mensaje (p50/p95), llamadas por modelo, escalamientos y
+extracciones válidas.
+"""
+import argparse
+import os
+import random
+import time
+
+from benchmarks.common import bootstrap_env, percentile
+from benchmarks.fake_gemini import FakeGeminiServer
+from benchmarks.fake_telegram import FakeTelegramServer
+
+FAST_MODEL = "gemini-2.5-flash-lite"
+STRONG_MODEL = "gemini-2.5-flash"
+
+SIMPLE = "Le debo {n} a Ana"
+COMPLEX = "Gasté {n} en cine con Julieth y {m} en taxi con Carlos mañana"
+TWO_ITEMS = "Gasté {n} en pan y {m} en leche"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Router de modelos de Gemini")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--complex-share", type=float, default=0.4)
+    parser.add_argument("--fast-ms", type=float, default=100.0)
+    parser.add_argument("--strong-ms", type=float, default=400.0)
+    parser.add_argument("--fast-invalid-rate", type=float, default=0.2,
+                        help="Probabilidad de que el modelo rápido falle un mensaje con varios gastos")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(
+        model_latency={FAST_MODEL: args.fast_ms / 1000, STRONG_MODEL: args.strong_ms / 1000},
+        model_invalid_rate={FAST_MODEL: args.fast_invalid_rate},
+    ).start()
+    telegram = FakeTelegramServer().start()
+    # ai_services y bot_services arman las URLs de Gemini y Telegram al importarse
+    os.environ.update(GEMINI_API_URL=server.base_url, TELEGRAM_API_BASE_URL=telegram.base_url,
+                      GEMINI_MODEL=STRONG_MODEL, GEMINI_FAST_MODEL=FAST_MODEL, GEMINI_STRONG_MODEL=STRONG_MODEL)
+    bootstrap_env()
+
+    from app import create_app
+    from app.ai_services import extract_expense_items
+
+    app = create_app()
+    # Solo Gemini: sin extractor local ni caché, cada mensaje es una llamada
+    app.config.update(LOCAL_PARSER_ENABLED=False, EXTRACTION_CACHE_ENABLED=False,
+                      EXTRACTION_BATCH_ENABLED=False, GEMINI_USAGE_ENABLED=False)
+
+    rng = random.Random(7)
+    texts = []
+    for idx in range(args.messages):
+        draw = rng.random()
+        template = SIMPLE if draw >= args.complex_share else COMPLEX if draw < args.complex_share / 2 else TWO_ITEMS
+        texts.append(template.format(n=1000 + idx, m=500 + idx))
+    results = {}
+    try:
+        for mode, routed in (("un modelo", False), ("router", True)):
+            app.config["GEMINI_ROUTER_ENABLED"] = routed
+            app.extensions.pop("model_router", None)
+            calls_before = len(server.calls)
+            latencies, valid = [], 0
+            with app.app_context():
+                for text in texts:
+                    started = time.perf_counter()
+                    items = extract_expense_items(text)
+                    latencies.append(time.perf_counter() - started)
+                    valid += items is not None
+            calls = server.calls[calls_before:]
+            router = app.extensions.get("model_router")
+            results[mode] = {
+                "latencies": latencies,
+                "valid": valid,
+                "fast_calls": sum(1 for model, _ in calls if model == FAST_MODEL),
+                "strong_calls": sum(1 for model, _ in calls if model == STRONG_MODEL),
+                "escalations": router.stats()["escalations"] if router is not None else 0,
+            }
+    finally:
+        server.stop()
+        telegram.stop()
+
+    print(f"{args.messages} mensajes ({args.complex_share:.0%} complejos); rápido {args.fast_ms:.0f} ms "
+          f"({args.fast_invalid_rate:.0%} inválidos en complejos), fuerte {args.strong_ms:.0f} ms\n")
+    print(f"{'modo':<10} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8} {'rápido':>7} {'fuerte':>7} "
+          f"{'escal.':>7} {'válidos':>8}")
+    for mode, result in results.items():
+        latencies = result["latencies"]
+        print(f"{mode:<10} {percentile(latencies, 50) * 1000:>8.0f} {percentile(latencies, 95) * 1000:>8.0f} "
+              f"{sum(latencies):>8.1f} {result['fast_calls']:>7} {result['strong_calls']:>7} "
+              f"{result['escalations']:>7} {result['valid']:>8}")
+
+    single, routed = results["un modelo"], results["router"]
+    print(f"\nLatencia p50: {percentile(single['latencies'], 50) * 1000:.0f} ms -> "
+          f"{percentile(routed['latencies'], 50) * 1000:.0f} ms; "
+          f"llamadas al modelo fuerte: {single['strong_calls']} -> {routed['strong_calls']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: guardar los gastos de un mensaje uno por uno vs en bloque
+Ejecutar: python -m benchmarks.bench_multi_expense [--messages 200] [--items 3]
+
+Cada mensaje trae `--items` gastos ("gasté 50000 en cine con Julieth y 20000
+en taxi con Carlos"). Se guardan en una base SQLite en archivo de dos formas:
+
+- uno por uno: `create_expense` por gasto, cada uno con su commit
+- en bloque: `create_expenses`, un solo INSERT y un solo commit por mensaje
+
+Reporta la latencia por mensaje (p50/p95), las sentencias INSERT y los commits.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import bootstrap_env, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gastos de un mensaje: uno por uno vs en bloque")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--items", type=int, default=3, help="Gastos por mensaje")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "multi_expense.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    bootstrap_env()
+
+    from sqlalchemy import event
+    from app import create_app, db
+    from app.models import User
+    from app.bot_services import create_expense, create_expenses
+
+    app = create_app()
+    counters = {"inserts": 0, "commits": 0}
+    with app.app_context():
+        db.create_all()
+        users = [User(telegram_id=idx, name=name) for idx, name in enumerate(("Luis", "Julieth", "Carlos"), 1)]
+        db.session.add_all(users)
+        db.session.commit()
+        payer_id, debtor_ids = users[0].id, [user.id for user in users[1:]]
+
+        def count_insert(conn, cursor, statement, *rest):
+            if statement.startswith("INSERT"):
+                counters["inserts"] += 1
+
+        def count_commit(conn):
+            counters["commits"] += 1
+
+        event.listen(db.engine, "before_cursor_execute", count_insert)
+        event.listen(db.engine, "commit", count_commit)
+
+        def items_for(message: int) -> list:
+            return [{
+                "payer_id": payer_id,
+                "debtor_id": debtor_ids[item % len(debtor_ids)],
+                "amount": float(1000 * (item + 1) + message),
+                "currency": "COP",
+                "description": f"gasto {item + 1} del mensaje {message}",
+                "category": "otros",
+                # Un gasto con fecha y otro sin ella no parte el INSERT en bloque
+                "due_date": "2026-12-31" if item % 2 else None,
+            } for item in range(args.items)]
+
+        def one_by_one(message: int):
+            for item in items_for(message):
+                create_expense(raw_text=f"mensaje {message}", **item)
+
+        def bulk(message: int):
+            create_expenses(items_for(message), raw_text=f"mensaje {message}")
+
+        results = {}
+        for mode, save in (("uno por uno", one_by_one), ("en bloque", bulk)):
+            counters.update(inserts=0, commits=0)
+            latencies = []
+            for message in range(args.messages):
+                started = time.perf_counter()
+                save(message)
+                latencies.append(time.perf_counter() - started)
+            results[mode] = dict(counters, latencies=latencies)
+
+    print(f"{args.messages} mensajes con {args.items} gastos cada uno, SQLite en archivo\n")
+    print(f"{'modo':<12} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8} {'INSERT':>8} {'commits':>8}")
+    for mode, result in results.items():
+        latencies = result["latencies"]
+        print(f"{mode:<12} {percentile(latencies, 50) * 1000:>8.2f} {percentile(latencies, 95) * 1000:>8.2f} "
+              f"{sum(latencies):>8.2f} {result['inserts']:>8} {result['commits']:>8}")
+
+    single, bulk_result = results["uno por uno"], results["en bloque"]
+    print(f"\nTiempo total: {sum(single['latencies']) / sum(bulk_result['latencies']):.1f}x más rápido en bloque")
+
+
+if __name__ == "__main__":
+    main()
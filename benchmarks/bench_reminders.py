@@ -0,0 +1,133 @@
+"""
+Benchmark: barrido de recordatorios cargando todo vs en streaming por bloques
+Ejecutar: python -m benchmarks.bench_reminders [--debtors 20000] [--debts 3] [--send 500]
+
+Crea `--debtors` deudores con hasta `--debts` deudas vencidas cada uno en una
+base SQLite en archivo y arma un recordatorio por deudor:
+
+- todo en memoria: la misma consulta con `.all()` y los resúmenes en una lista
+- streaming: ReminderBroadcaster.run(dry_run=True), bloques de
+  REMINDERS_BATCH_SIZE deudores leídos con `yield_per`
+
+Reporta tiempo y pico de memoria (tracemalloc). Luego envía de verdad los
+recordatorios de los primeros `--send` deudores por la cola de salida contra
+un Telegram local con los límites de Telegram (30/s global, 429 al pasarse)
+y reporta enviados, 429 recibidos y duplicados tras un reintento del barrido.
+"""
+import argparse
+import datetime as dt
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from benchmarks.common import bootstrap_env
+from benchmarks.fake_telegram import FakeTelegramServer
+
+RUN_DATE = dt.date(2024, 3, 15)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Barrido de recordatorios: todo en memoria vs streaming")
+    parser.add_argument("--debtors", type=int, default=20000)
+    parser.add_argument("--debts", type=int, default=3, help="Deudas vencidas máximas por deudor")
+    parser.add_argument("--send", type=int, default=500, help="Deudores del envío real")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(latency=0.02, global_limit=30).start()
+    # bot_services arma la URL de Telegram al importarse
+    os.environ.update(TELEGRAM_API_BASE_URL=server.base_url,
+                      DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'reminders.db')}")
+    bootstrap_env()
+
+    from app import create_app, db
+    from app.models import User, Expense
+    from app.reminders import ReminderBroadcaster, due_debts_statement, iter_digests
+    from sqlalchemy import insert
+
+    app = create_app()
+    app.config.update(TELEGRAM_SCHEDULER_ENABLED=True)
+    with app.app_context():
+        db.create_all()
+        payer = User(telegram_id=1, name="Luis")
+        db.session.add(payer)
+        db.session.flush()
+        db.session.execute(insert(User), [{"telegram_id": 1000 + idx, "name": f"Deudor {idx}"}
+                                          for idx in range(args.debtors)])
+        debtor_ids = [row.id for row in db.session.execute(db.select(User.id).where(User.id != payer.id))]
+        db.session.execute(insert(Expense), [
+            {"payer_id": payer.id, "debtor_id": debtor_id, "amount": 1000 + k, "currency": "COP",
+             "description": f"gasto {k} del deudor {debtor_id}", "raw_text": "x",
+             "due_date": RUN_DATE - dt.timedelta(days=k)}
+            for debtor_id in debtor_ids for k in range(1 + debtor_id % args.debts)
+        ])
+        db.session.commit()
+
+    def load_all():
+        with app.app_context():
+            rows = db.session.execute(due_debts_statement(RUN_DATE)).all()
+            digests = list(iter_digests(rows, 10, run_date=RUN_DATE))
+            db.session.remove()
+            return len(digests)
+
+    broadcaster = ReminderBroadcaster(app, batch_size=200, stream_rows=1000)
+
+    def stream():
+        return broadcaster.run(run_date=RUN_DATE, dry_run=True)["debtors"]
+
+    results = {}
+    for mode, func in (("todo en memoria", load_all), ("streaming", stream)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        debtors = func()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[mode] = (elapsed, peak, debtors)
+
+    print(f"{args.debtors} deudores con deudas vencidas\n")
+    print(f"{'modo':<16} {'segundos':>9} {'pico MB':>8} {'recordatorios':>14}")
+    for mode, (elapsed, peak, debtors) in results.items():
+        print(f"{mode:<16} {elapsed:>9.2f} {peak / 2**20:>8.1f} {debtors:>14}")
+
+    # Envío real de los primeros --send deudores, interrumpido y reanudado
+    with app.app_context():
+        db.session.execute(db.update(User).where(User.id > debtor_ids[min(args.send, len(debtor_ids)) - 1])
+                           .values(is_authorized=False))
+        db.session.commit()
+    sender = ReminderBroadcaster(app, batch_size=100)
+    original, blocks = sender._send_block, []
+
+    def crash_on_third_block(digests):
+        blocks.append(len(digests))
+        if len(blocks) == 3:
+            raise RuntimeError("caída simulada")
+        return original(digests)
+
+    sender._send_block = crash_on_third_block
+    started = time.perf_counter()
+    try:
+        sender.run(run_date=RUN_DATE)
+    except RuntimeError:
+        pass
+    with app.app_context():
+        from app.models import ReminderRun
+        db.session.execute(db.update(ReminderRun).values(lease_until=dt.datetime(2000, 1, 1)))
+        db.session.commit()
+    sender._send_block = original
+    resumed = sender.run(run_date=RUN_DATE)
+    elapsed = time.perf_counter() - started
+    server.stop()
+
+    sent = Counter(payload["chat_id"] for method, payload, _ in server.replied if method == "sendMessage")
+    print(f"\nEnvío de {args.send} recordatorios con caída en el tercer bloque y reanudación: "
+          f"{sum(sent.values())} enviados en {elapsed:.1f}s ({sum(sent.values()) / elapsed:.1f}/s), "
+          f"{len(server.throttled)} respuestas 429, "
+          f"{sum(1 for count in sent.values() if count > 1)} duplicados, "
+          f"{blocks[2] if len(blocks) > 2 else 0} perdidos en el bloque interrumpido; "
+          f"reanudación: {resumed['status']}")
+
+
+if __name__ == "__main__":
+    main()
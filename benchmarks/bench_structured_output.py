@@ -0,0 +1,91 @@
+"""
+Benchmark: extracción con Gemini en texto libre vs salida estructurada
+Ejecutar: python -m benchmarks.bench_structured_output [--messages 200] [--malformed-rate 0.05]
+
+Extrae `--messages` mensajes contra un Gemini local en los dos modos:
+
+- texto: el prompt pide JSON y Gemini lo devuelve indentado dentro de un
+  bloque ```json; con `--malformed-rate` a veces antepone una frase, y esa
+  respuesta se pierde
+- estructurado: generationConfig con responseMimeType/responseSchema y
+  maxOutputTokens según el largo del mensaje; Gemini devuelve JSON compacto
+
+Reporta fallos de parseo, tokens de salida por mensaje (los que cuenta el
+servidor local, caracteres / 4) y el costo de parsear cada respuesta.
+"""
+import argparse
+import os
+import time
+
+from benchmarks.common import bootstrap_env
+from benchmarks.fake_gemini import FakeGeminiServer
+
+TEXTS = (
+    "Le debo {n} a Ana por el almuerzo",
+    "Gasté {n} con Carlos en el supermercado mañana",
+    "Pagamos {n} del taxi con María",
+    "Tengo que pagar {n} USD a Juan el próximo lunes",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Salida estructurada de Gemini")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--malformed-rate", type=float, default=0.05,
+                        help="Probabilidad de texto extra antes del JSON en modo texto libre")
+    parser.add_argument("--parse-iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(malformed_rate=args.malformed_rate).start()
+    # ai_services arma la URL de Gemini al importarse
+    os.environ["GEMINI_API_URL"] = server.base_url
+    bootstrap_env()
+
+    import requests
+    from app import ai_services
+    from app.extraction_result import ExtractionResult, ParseStats, decode_json, response_text
+
+    session = requests.Session()
+    texts = [TEXTS[idx % len(TEXTS)].format(n=1000 + idx) for idx in range(args.messages)]
+    results = {}
+    try:
+        for mode, structured in (("texto", False), ("estructurado", True)):
+            ai_services.GEMINI_STRUCTURED_OUTPUT = structured
+            ai_services.parse_stats = stats = ParseStats()
+            tokens_before = server.output_tokens
+            valid = sum(1 for text in texts if ai_services.request_extraction(text, 30, session) is not None)
+            results[mode] = {
+                "valid": valid,
+                "stats": stats.stats(structured),
+                "tokens": server.output_tokens - tokens_before,
+            }
+
+            # Costo del parseo: texto del candidato -> JSON -> ExtractionResult
+            server.malformed_rate = 0.0
+            payload = ai_services.build_extraction_payload(texts[0])
+            response = session.post(ai_services.gemini_request_url(), json=payload, timeout=30).json()
+            server.malformed_rate = args.malformed_rate
+            started = time.perf_counter()
+            for _ in range(args.parse_iterations):
+                ExtractionResult.list_from_json(decode_json(response_text(response)))
+            results[mode].update({
+                "max_output": payload["generationConfig"]["maxOutputTokens"],
+                "parse_us": (time.perf_counter() - started) / args.parse_iterations * 1e6,
+            })
+    finally:
+        server.stop()
+
+    print(f"{args.messages} mensajes, texto libre con {args.malformed_rate:.0%} de respuestas con texto extra\n")
+    print(f"{'modo':<13} {'válidos':>8} {'fallos':>7} {'tasa':>7} {'tok/msg':>8} {'maxOutput':>10} {'parseo µs':>10}")
+    for mode, result in results.items():
+        stats = result["stats"]
+        print(f"{mode:<13} {result['valid']:>8} {stats['failures']:>7} {stats['failure_rate']:>7.1%} "
+              f"{result['tokens'] / args.messages:>8.1f} {result['max_output']:>10} {result['parse_us']:>10.1f}")
+
+    text, structured = results["texto"], results["estructurado"]
+    print(f"\nTokens de salida: -{1 - structured['tokens'] / text['tokens']:.0%}; "
+          f"motivos de fallo en texto libre: {text['stats']['failure_reasons']}")
+
+
+if __name__ == "__main__":
+    main()
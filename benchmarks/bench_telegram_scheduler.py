@@ -0,0 +1,131 @@
+"""
+Benchmark: envíos directos a Telegram vs cola de salida con rate limit
+Ejecutar: python -m benchmarks.bench_telegram_scheduler [--chats 20] [--bulk 60]
+          [--chat-limit 1] [--global-limit 30] [--latency-ms 20]
+
+Una ráfaga contra un Telegram local que responde 429 (con retry_after) a lo
+que pasa de `--chat-limit` envíos por segundo en un chat o `--global-limit`
+en total. En cada uno de `--chats` chats llegan a la vez una respuesta a un
+callback, tres ediciones del mismo mensaje y dos mensajes; además salen
+`--bulk` recordatorios masivos a otros chats.
+
+- directo: cada llamada sale de inmediato; un 429 es un mensaje perdido
+- cola: TELEGRAM_SCHEDULER_ENABLED, con buckets, prioridades, reintento
+  tras retry_after y fusión de ediciones
+
+Reporta llamadas perdidas, 429 recibidos, ediciones fusionadas, latencia de
+las respuestas a callbacks y la espera en cola por prioridad.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import bootstrap_env, percentile
+from benchmarks.fake_telegram import FakeTelegramServer
+
+EDITS_PER_CHAT = 3
+SENDS_PER_CHAT = 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cola de salida de Telegram")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--bulk", type=int, default=60, help="Recordatorios masivos a otros chats")
+    parser.add_argument("--chat-limit", type=int, default=1)
+    parser.add_argument("--global-limit", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(latency=args.latency_ms / 1000, chat_limit=args.chat_limit,
+                                global_limit=args.global_limit).start()
+    # bot_services arma la URL de Telegram al importarse
+    os.environ["TELEGRAM_API_BASE_URL"] = server.base_url
+    bootstrap_env()
+
+    from app import create_app
+    from app.bot_services import send_message, edit_message_text, answer_callback_query
+
+    app = create_app()
+    app.config.update(TELEGRAM_GLOBAL_PER_SECOND=float(args.global_limit), TELEGRAM_GLOBAL_BURST=args.global_limit,
+                      TELEGRAM_CHAT_PER_SECOND=float(args.chat_limit), TELEGRAM_CHAT_BURST=args.chat_limit)
+
+    def callback(chat_id: int):
+        with app.app_context():
+            started = time.perf_counter()
+            ok = answer_callback_query(f"cb-{chat_id}", "Listo", chat_id=chat_id)
+            return "callback", ok, time.perf_counter() - started
+
+    def edit(chat_id: int, step: int):
+        with app.app_context():
+            return "edit", edit_message_text(chat_id, 1, f"Procesando {step + 1}/{EDITS_PER_CHAT}"), 0.0
+
+    def send(chat_id: int, step: int):
+        with app.app_context():
+            return "send", send_message(chat_id, f"Mensaje {step + 1}"), 0.0
+
+    def bulk(chat_id: int):
+        with app.app_context():
+            return "bulk", send_message(chat_id, "Recordatorio: tienes deudas por pagar", bulk=True), 0.0
+
+    results = {}
+    try:
+        for mode, enabled in (("directo", False), ("cola", True)):
+            app.config["TELEGRAM_SCHEDULER_ENABLED"] = enabled
+            app.extensions.pop("telegram_scheduler", None)
+            server.calls.clear()
+            server.throttled.clear()
+            # Deja vaciar las ventanas de rate limit del modo anterior
+            time.sleep(1.1)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=64) as pool:
+                futures = []
+                for chat in range(1, args.chats + 1):
+                    futures.append(pool.submit(callback, chat))
+                    futures.extend(pool.submit(edit, chat, step) for step in range(EDITS_PER_CHAT))
+                    futures.extend(pool.submit(send, chat, step) for step in range(SENDS_PER_CHAT))
+                futures.extend(pool.submit(bulk, 10_000 + idx) for idx in range(args.bulk))
+                outcomes = [future.result() for future in futures]
+
+            scheduler = app.extensions.get("telegram_scheduler")
+            if scheduler is not None:
+                # Los masivos no se esperan al encolar: se espera a que la cola se vacíe
+                while scheduler.stats()["queued"] or scheduler.stats()["inflight"]:
+                    time.sleep(0.05)
+            elapsed = time.perf_counter() - started
+
+            delivered_bulk = sum(1 for method, payload in server.calls
+                                 if method == "sendMessage" and payload.get("chat_id", 0) >= 10_000) \
+                - sum(1 for method, payload in server.throttled
+                      if method == "sendMessage" and payload.get("chat_id", 0) >= 10_000)
+            results[mode] = {
+                "elapsed": elapsed,
+                "lost": sum(1 for kind, ok, _ in outcomes if not ok and kind != "bulk")
+                + (args.bulk - delivered_bulk),
+                "throttled": len(server.throttled),
+                "callback_latencies": [latency for kind, _, latency in outcomes if kind == "callback"],
+                "stats": scheduler.stats() if scheduler is not None else None,
+            }
+    finally:
+        server.stop()
+
+    print(f"{args.chats} chats (1 callback, {EDITS_PER_CHAT} ediciones y {SENDS_PER_CHAT} mensajes cada uno) "
+          f"+ {args.bulk} masivos; límite {args.chat_limit}/s por chat y {args.global_limit}/s global\n")
+    print(f"{'modo':<8} {'total s':>8} {'perdidos':>9} {'429':>6} {'fusiones':>9} "
+          f"{'callback p50 ms':>16} {'callback p95 ms':>16}")
+    for mode, result in results.items():
+        callbacks = result["callback_latencies"]
+        coalesced = result["stats"]["coalesced"] if result["stats"] else 0
+        print(f"{mode:<8} {result['elapsed']:>8.2f} {result['lost']:>9} {result['throttled']:>6} {coalesced:>9} "
+              f"{percentile(callbacks, 50) * 1000:>16.1f} {percentile(callbacks, 95) * 1000:>16.1f}")
+
+    stats = results["cola"]["stats"]
+    print("\nEspera en cola (ms):")
+    for priority, wait in stats["queue_wait"].items():
+        print(f"  {priority:<12} n={wait['samples']:<5} p50={wait['p50_ms']:>8.1f} "
+              f"p95={wait['p95_ms']:>8.1f} p99={wait['p99_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
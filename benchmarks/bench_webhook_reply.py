@@ -0,0 +1,99 @@
+"""
+Benchmark: respuesta por sendMessage aparte vs en el cuerpo del webhook
+Ejecutar: python -m benchmarks.bench_webhook_reply [--updates 200] [--latency-ms 50]
+
+Procesa `--updates` updates con el webhook síncrono (cliente de pruebas de
+Flask) contra un Telegram local que tarda `--latency-ms` por llamada. Los
+updates se reparten entre los casos de una sola respuesta: un gasto que
+resuelve el extractor local, un usuario no registrado y un mensaje rechazado
+por validación. Gemini apunta a un servidor local y se reportan sus
+llamadas: deben ser 0.
+
+- sendMessage: WEBHOOK_INLINE_REPLY=false, la confirmación es otra llamada HTTP
+- en línea: WEBHOOK_INLINE_REPLY=true, la confirmación va en la respuesta
+
+Reporta la latencia del webhook (p50/p95) y las llamadas HTTP a Telegram.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import bootstrap_env, percentile
+from benchmarks.fake_gemini import FakeGeminiServer
+from benchmarks.fake_telegram import FakeTelegramServer
+
+CASES = (
+    (1, "Le debo {n} a Julieth por el almuerzo"),
+    (999, "hola"),
+    (1, "<b>{n}</b>"),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Respuesta en línea del webhook")
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(latency=args.latency_ms / 1000).start()
+    gemini = FakeGeminiServer().start()
+    # bot_services y ai_services arman las URLs de Telegram y Gemini al importarse
+    os.environ.update(TELEGRAM_API_BASE_URL=server.base_url, GEMINI_API_URL=gemini.base_url,
+                      DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'webhook_reply.db')}")
+    bootstrap_env()
+
+    from app import create_app, db
+    from app.models import User
+
+    app = create_app()
+    app.config.update(RATE_LIMIT_ENABLED=False, WEBHOOK_ASYNC_MODE=False, UPDATE_DEDUP_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(telegram_id=1, name="Luis"), User(telegram_id=2, name="Julieth")])
+        db.session.commit()
+    client = app.test_client()
+
+    results = {}
+    try:
+        for mode, inline in (("sendMessage", False), ("en línea", True)):
+            app.config["WEBHOOK_INLINE_REPLY"] = inline
+            calls_before = len(server.calls)
+            gemini_before = len(gemini.calls)
+            latencies, inline_bodies = [], 0
+            for idx in range(args.updates):
+                telegram_id, template = CASES[idx % len(CASES)]
+                update = {"update_id": idx, "message": {
+                    "message_id": idx, "from": {"id": telegram_id}, "chat": {"id": telegram_id},
+                    "date": int(time.time()), "text": template.format(n=1000 + idx),
+                }}
+                started = time.perf_counter()
+                response = client.post("/webhook", json=update)
+                latencies.append(time.perf_counter() - started)
+                inline_bodies += "method" in (response.get_json() or {})
+            results[mode] = {
+                "latencies": latencies,
+                "http_calls": len(server.calls) - calls_before,
+                "inline": inline_bodies,
+                "gemini_calls": len(gemini.calls) - gemini_before,
+            }
+    finally:
+        server.stop()
+        gemini.stop()
+
+    print(f"{args.updates} updates de una sola respuesta; Telegram local de {args.latency_ms:.0f} ms\n")
+    print(f"{'modo':<12} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8} {'HTTP':>6} {'en línea':>9} {'Gemini':>7}")
+    for mode, result in results.items():
+        latencies = result["latencies"]
+        print(f"{mode:<12} {percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+              f"{sum(latencies):>8.2f} {result['http_calls']:>6} {result['inline']:>9} "
+              f"{result['gemini_calls']:>7}")
+
+    separate, inline = results["sendMessage"], results["en línea"]
+    print(f"\nLatencia p50: {percentile(separate['latencies'], 50) * 1000:.1f} ms -> "
+          f"{percentile(inline['latencies'], 50) * 1000:.1f} ms; "
+          f"llamadas a Telegram: {separate['http_calls']} -> {inline['http_calls']}")
+
+
+if __name__ == "__main__":
+    main()
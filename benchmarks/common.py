@@ -0,0 +1,136 @@
+"""
+Utilidades compartidas por los benchmarks
+"""
+import multiprocessing
+import os
+import subprocess
+import tempfile
+
+
+def bootstrap_env():
+    """
+    Define variables de entorno de prueba antes de importar el paquete `app`
+
+    `app.config` lee TELEGRAM_BOT_TOKEN, GOOGLE_API_KEY y DATABASE_URL al
+    importarse y create_app exige que estén definidas; los benchmarks usan
+    valores ficticios y una base SQLite temporal salvo que el entorno ya los
+    defina.
+    """
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "000000:benchmark-token")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-key")
+    os.environ.setdefault(
+        "DATABASE_URL",
+        f"sqlite:///{os.path.join(tempfile.gettempdir(), 'we_owe_bot_bench.db')}",
+    )
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_FILE", "")
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Percentil por el método del rango más cercano
+
+    Args:
+        values: Lista de valores
+        pct: Percentil entre 0 y 100
+
+    Returns:
+        Valor del percentil o 0.0 si la lista está vacía
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def make_self_signed_cert(directory: str) -> tuple:
+    """
+    Genera un certificado autofirmado para 127.0.0.1 con el CLI de openssl
+
+    Args:
+        directory: Carpeta donde se escriben cert.pem y key.pem
+
+    Returns:
+        Tupla (certfile, keyfile)
+    """
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+         "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def _serve_fakes(conn, latency: float, jitter: float, telegram_error_rate: float,
+                 gemini_error_rate: float, certfile=None, keyfile=None):
+    """
+    Proceso hijo: Telegram y Gemini locales
+
+    Envía por `conn` las URLs base y luego responde cada ("count", método) con
+    el número de llamadas recibidas (método "gemini" = generateContent), hasta
+    recibir "stop".
+    """
+    from benchmarks.fake_gemini import FakeGeminiServer
+    from benchmarks.fake_telegram import FakeTelegramServer
+
+    telegram = FakeTelegramServer(latency=latency, error_rate=telegram_error_rate,
+                                  jitter=jitter, certfile=certfile, keyfile=keyfile).start()
+    gemini = FakeGeminiServer(latency=latency, error_rate=gemini_error_rate,
+                              jitter=jitter, certfile=certfile, keyfile=keyfile).start()
+    conn.send((telegram.base_url, gemini.base_url))
+    while True:
+        command = conn.recv()
+        if command == "stop":
+            break
+        method = command[1]
+        conn.send(len(gemini.calls) if method == "gemini" else len(telegram.calls_for(method)))
+    telegram.stop()
+    gemini.stop()
+
+
+class FakeServersProcess:
+    """
+    Telegram y Gemini locales en un proceso aparte
+
+    Corren fuera del proceso medido para no competir por el GIL con la
+    aplicación.
+
+    Con certfile/keyfile sirven HTTPS (ver make_self_signed_cert).
+
+    Attributes:
+        telegram_url: Valor para TELEGRAM_API_BASE_URL
+        gemini_url: Valor para GEMINI_API_URL
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 telegram_error_rate: float = 0.0, gemini_error_rate: float = 0.0,
+                 certfile: str = None, keyfile: str = None):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve_fakes,
+            args=(child_conn, latency, jitter, telegram_error_rate, gemini_error_rate,
+                  certfile, keyfile),
+            daemon=True,
+        )
+        self.telegram_url = None
+        self.gemini_url = None
+
+    def start(self):
+        """Arranca el proceso y espera las URLs de los servidores"""
+        self._process.start()
+        self.telegram_url, self.gemini_url = self._conn.recv()
+        return self
+
+    def count(self, method: str) -> int:
+        """Llamadas recibidas por un método de Telegram (o por Gemini, con "gemini")"""
+        self._conn.send(("count", method))
+        return self._conn.recv()
+
+    def stop(self):
+        """Detiene los servidores y el proceso"""
+        self._conn.send("stop")
+        self._process.join(timeout=5)
@@ -0,0 +1,152 @@
+"""
+Tabla de casos del resolutor de fechas relativas
+Ejecutar: python -m benchmarks.date_resolver_cases [--verbose]
+
+Cada caso es (texto, hoy, fecha esperada o None); además se verifican el "hoy"
+por zona horaria y la resolución de `due_date_text`. Sale con código 1 si
+algún caso falla, para usarlo como gate al tocar `app/date_resolver.py`.
+"""
+import argparse
+import sys
+from datetime import date, datetime, timezone
+
+from benchmarks.common import bootstrap_env
+
+bootstrap_env()
+
+from app.date_resolver import find_date, resolve_due_date, today_in  # noqa: E402
+
+MONDAY = date(2024, 1, 15)
+WEDNESDAY = date(2024, 1, 17)
+SATURDAY = date(2024, 1, 20)
+JAN_31 = date(2024, 1, 31)
+DEC_30 = date(2024, 12, 30)
+
+# (texto, hoy, esperado)
+CASES = [
+    # Días cercanos
+    ("Debo 100000 pesos a Juan mañana", MONDAY, date(2024, 1, 16)),
+    ("Le pago MAÑANA", MONDAY, date(2024, 1, 16)),
+    ("le pago manana", MONDAY, date(2024, 1, 16)),
+    ("pasado mañana te pago", MONDAY, date(2024, 1, 17)),
+    ("Gasté 20000 hoy en el almuerzo", MONDAY, MONDAY),
+    ("Debo 20 dólares ayer", MONDAY, date(2024, 1, 14)),
+    ("anoche pagué la cena", MONDAY, date(2024, 1, 14)),
+    ("anteayer compramos el mercado", MONDAY, date(2024, 1, 13)),
+    ("antier", MONDAY, date(2024, 1, 13)),
+    ("antes de ayer", MONDAY, date(2024, 1, 13)),
+    ("Gasté 8000 en café esta mañana", MONDAY, MONDAY),
+    ("pagué el taxi por la mañana", MONDAY, MONDAY),
+    # Plazos
+    ("en 3 días", MONDAY, date(2024, 1, 18)),
+    ("en 1 día", MONDAY, date(2024, 1, 16)),
+    ("dentro de 10 días", MONDAY, date(2024, 1, 25)),
+    ("en dos días", MONDAY, date(2024, 1, 17)),
+    ("en una semana", MONDAY, date(2024, 1, 22)),
+    ("en 2 semanas", MONDAY, date(2024, 1, 29)),
+    ("en un mes", MONDAY, date(2024, 2, 15)),
+    ("en un mes", JAN_31, date(2024, 2, 29)),
+    ("dentro de 3 meses", DEC_30, date(2025, 3, 30)),
+    # Días de la semana
+    ("Tengo que pagar 50 USD el próximo lunes", MONDAY, date(2024, 1, 22)),
+    ("el lunes", MONDAY, date(2024, 1, 22)),
+    ("el viernes", MONDAY, date(2024, 1, 19)),
+    ("este viernes", WEDNESDAY, date(2024, 1, 19)),
+    ("el miércoles que viene", MONDAY, date(2024, 1, 17)),
+    ("el sábado próximo", SATURDAY, date(2024, 1, 27)),
+    ("el domingo", SATURDAY, date(2024, 1, 21)),
+    ("el lunes pasado", WEDNESDAY, date(2024, 1, 15)),
+    ("el viernes pasado", MONDAY, date(2024, 1, 12)),
+    # Semanas, meses y fechas de pago
+    ("la próxima semana", WEDNESDAY, date(2024, 1, 22)),
+    ("la semana que viene", MONDAY, date(2024, 1, 22)),
+    ("el próximo mes", MONDAY, date(2024, 2, 1)),
+    ("el mes que viene", DEC_30, date(2025, 1, 1)),
+    ("fin de mes", MONDAY, date(2024, 1, 31)),
+    ("a fin de mes", date(2024, 2, 3), date(2024, 2, 29)),
+    ("para finales de mes", MONDAY, date(2024, 1, 31)),
+    ("fin de semana", WEDNESDAY, date(2024, 1, 20)),
+    ("este fin de semana", SATURDAY, SATURDAY),
+    ("en la quincena", date(2024, 1, 10), date(2024, 1, 15)),
+    ("en la quincena", date(2024, 1, 16), date(2024, 1, 31)),
+    # Fechas explícitas
+    ("el día 20", MONDAY, date(2024, 1, 20)),
+    ("el día 10", MONDAY, date(2024, 2, 10)),
+    ("el día 31", date(2024, 2, 5), date(2024, 2, 29)),
+    ("el 20 de marzo", MONDAY, date(2024, 3, 20)),
+    ("el 3 de diciembre", MONDAY, date(2023, 12, 3)),
+    ("el 2 de enero de 2025", MONDAY, date(2025, 1, 2)),
+    ("el 5 de febrero", DEC_30, date(2025, 2, 5)),
+    ("20/03", MONDAY, date(2024, 3, 20)),
+    ("20/03/2025", MONDAY, date(2025, 3, 20)),
+    ("1/2/25", MONDAY, date(2025, 2, 1)),
+    ("2024-02-29", MONDAY, date(2024, 2, 29)),
+    # Sin fecha o no reconocible
+    ("Gasté 50000 con María en el supermercado", MONDAY, None),
+    ("Le debo 30000 a María por el taxi", MONDAY, None),
+    ("Gasté 15000 en el bus de la ruta 20", MONDAY, None),
+    ("los hoyos del parque", MONDAY, None),
+    ("31/02", MONDAY, None),
+    ("2024-13-01", MONDAY, None),
+    ("el día 40", MONDAY, None),
+]
+
+# (instante UTC, zona, hoy esperado)
+TIMEZONE_CASES = [
+    (datetime(2024, 1, 16, 3, 0, tzinfo=timezone.utc), "America/Bogota", date(2024, 1, 15)),
+    (datetime(2024, 1, 16, 3, 0, tzinfo=timezone.utc), "Europe/Madrid", date(2024, 1, 16)),
+    (datetime(2024, 1, 15, 23, 0, tzinfo=timezone.utc), "Asia/Tokyo", date(2024, 1, 16)),
+    (datetime(2024, 1, 16, 3, 0, tzinfo=timezone.utc), "Zona/Inexistente", date(2024, 1, 15)),
+    (datetime(2024, 1, 16, 3, 0, tzinfo=timezone.utc), None, date(2024, 1, 15)),
+]
+
+# (due_date_text de Gemini, texto del mensaje, hoy, due_date esperado)
+DUE_DATE_CASES = [
+    ("mañana", "Debo 100000 pesos a Juan mañana", MONDAY, "2024-01-16"),
+    ("el próximo lunes", "Tengo que pagar 50 USD el próximo lunes", MONDAY, "2024-01-22"),
+    (None, "Le debo 30000 a María por el taxi", MONDAY, None),
+    # Gemini omitió la expresión: se busca en el mensaje
+    (None, "Le pago a Juan pasado mañana", MONDAY, "2024-01-17"),
+    # Expresión irreconocible: sin fecha
+    ("cuando me paguen", "Le debo 5000 a Ana cuando me paguen", MONDAY, None),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Casos del resolutor de fechas relativas")
+    parser.add_argument("--verbose", action="store_true", help="Muestra también los casos correctos")
+    args = parser.parse_args()
+
+    failures = 0
+
+    def report(ok: bool, description: str):
+        nonlocal failures
+        if not ok:
+            failures += 1
+        if args.verbose or not ok:
+            print(f"  {'✅' if ok else '❌'} {description}")
+
+    print(f"Expresiones ({len(CASES)} casos)")
+    for text, today, expected in CASES:
+        match = find_date(text, today)
+        got = match.value if match else None
+        report(got == expected, f"{text!r} (hoy {today}): {got} (esperado {expected})")
+
+    print(f"Zonas horarias ({len(TIMEZONE_CASES)} casos)")
+    for now, zone, expected in TIMEZONE_CASES:
+        got = today_in(zone, now)
+        report(got == expected, f"{now.isoformat()} en {zone}: {got} (esperado {expected})")
+
+    print(f"Resolución de due_date ({len(DUE_DATE_CASES)} casos)")
+    for phrase, text, today, expected in DUE_DATE_CASES:
+        got = resolve_due_date({"due_date_text": phrase}, text, today)["due_date"]
+        report(got == expected, f"{phrase!r} / {text!r}: {got} (esperado {expected})")
+
+    total = len(CASES) + len(TIMEZONE_CASES) + len(DUE_DATE_CASES)
+    print(f"\n{total - failures}/{total} casos correctos")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Servidor local que imita generateContent de Gemini para pruebas y benchmarks
+Ejecutar: python -m benchmarks.fake_gemini [--port 8082] [--latency-ms 0] [--jitter-ms 0] [--error-rate 0]
+          [--item-latency-ms 0] [--max-concurrency 0] [--malformed-rate 0]
+
+Apunta el bot al servidor con GEMINI_API_URL=http://127.0.0.1:8082/v1beta/models/
+
+La respuesta se arma con heurísticas simples sobre el texto del usuario (primer
+número = monto, "debo" = deuda, nombre tras "con"/"a" = persona mencionada,
+expresión de fecha tal cual en `due_date_text`),
+suficientes para recorrer el flujo completo de registro de gastos. Cada mensaje
+recibe un arreglo con un gasto por cláusula ("... y 20000 en taxi con Carlos"
+es un segundo gasto); los prompts en lote ("Mensajes:" numerados) reciben un
+objeto por mensaje con su "index" y sus "expenses".
+
+Como el modelo real, en texto libre devuelve el JSON indentado dentro de un
+bloque ```json (y con `malformed_rate` a veces con una frase antes); con
+`responseMimeType` application/json devuelve JSON compacto. La salida que no
+cabe en `maxOutputTokens` se corta con finishReason MAX_TOKENS.
+"""
+import argparse
+import json
+import random
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+_PATH_RE = re.compile(r"^/v1beta/models/(?P<model>[^/:]+):generateContent$")
+_USER_TEXT_RE = re.compile(r"Texto del usuario: (?P<text>.*)\n\nJSON:", re.S)
+_BATCH_RE = re.compile(r"Mensajes:\n(?P<items>.*)\n\nJSON:", re.S)
+_BATCH_ITEM_RE = re.compile(r"^(?P<index>\d+)\. (?P<text>\".*\")$", re.M)
+_AMOUNT_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_CLAUSE_SPLIT_RE = re.compile(r"\s+y\s+(?=\d)")
+_NAME_RE = re.compile(r"\b(?:con|a)\s+([A-ZÁÉÍÓÚÑ][\wáéíóúñ]+)")
+_DATE_TEXT_RE = re.compile(
+    r"\b(?:pasado mañana|mañana|hoy|ayer|en \d+ días?|fin de mes|"
+    r"(?:el )?(?:próximo )?(?:lunes|martes|miércoles|jueves|viernes|sábado|domingo))\b",
+    re.IGNORECASE,
+)
+
+
+class _Server(ThreadingHTTPServer):
+    """ThreadingHTTPServer con backlog amplio para ráfagas de conexiones concurrentes"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def fake_extraction(text: str) -> dict:
+    """
+    Extracción heurística con la misma estructura que devuelve Gemini
+
+    Args:
+        text: Texto del usuario
+
+    Returns:
+        Diccionario del gasto (amount, currency, description, ...)
+    """
+    lower = text.lower()
+    amount_match = _AMOUNT_RE.search(text)
+    name_match = _NAME_RE.search(text)
+    date_match = _DATE_TEXT_RE.search(text)
+    return {
+        "amount": float(amount_match.group().replace(",", ".")) if amount_match else 0,
+        "currency": "USD" if ("usd" in lower or "dólar" in lower) else "COP",
+        "description": text[:60],
+        "category": "otros",
+        "action": "debt" if "debo" in lower or "pagar" in lower else "expense",
+        "debtor_name": name_match.group(1) if name_match else None,
+        "due_date_text": date_match.group() if date_match else None,
+    }
+
+
+def fake_extractions(text: str) -> List[dict]:
+    """
+    Gastos de un mensaje: uno por cláusula "... y <monto> ..."
+
+    Las cláusulas siguientes heredan la acción de la primera ("gasté 50000 en
+    cine con Julieth y 20000 en taxi con Carlos" son dos gastos compartidos).
+
+    Args:
+        text: Texto del usuario
+
+    Returns:
+        Lista de diccionarios de gasto
+    """
+    items = [fake_extraction(clause) for clause in _CLAUSE_SPLIT_RE.split(text)]
+    for item in items[1:]:
+        item["action"] = items[0]["action"]
+    return items
+
+
+class FakeGeminiServer:
+    """
+    Servidor HTTP que responde como generativelanguage.googleapis.com
+
+    Attributes:
+        host: Host donde escucha
+        port: Puerto donde escucha (0 = puerto libre aleatorio)
+        latency: Segundos de latencia añadidos a cada respuesta
+        jitter: Segundos extra aleatorios (uniforme entre 0 y jitter) por respuesta
+        error_rate: Probabilidad (0-1) de responder 500
+        item_latency: Segundos extra por mensaje de la respuesta (la salida de un
+            lote tarda más en generarse)
+        max_concurrency: Llamadas atendidas a la vez (0 = sin límite); las demás
+            esperan turno, como con la cuota de concurrencia de la API
+        calls: Lista de (modelo, texto_del_usuario) recibidos; en las llamadas
+            en lote el texto es la lista de mensajes
+        prompt_tokens: Tokens de entrada acumulados (estimados como caracteres / 4)
+        output_tokens: Tokens de salida acumulados (misma estimación)
+        malformed_rate: Probabilidad (0-1) de anteponer texto al JSON en modo texto libre
+        model_latency: {modelo: segundos} que reemplaza a `latency` para ese modelo
+        model_invalid_rate: {modelo: probabilidad (0-1)} de devolver un gasto sin
+            monto en los mensajes con varios gastos (un modelo más débil que se
+            equivoca en los mensajes complejos)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, error_rate: float = 0.0, jitter: float = 0.0,
+                 certfile: Optional[str] = None, keyfile: Optional[str] = None,
+                 item_latency: float = 0.0, max_concurrency: int = 0, malformed_rate: float = 0.0,
+                 model_latency: Optional[Dict[str, float]] = None,
+                 model_invalid_rate: Optional[Dict[str, float]] = None):
+        self.host = host
+        self.latency = latency
+        self.model_latency = dict(model_latency or {})
+        self.model_invalid_rate = dict(model_invalid_rate or {})
+        self.item_latency = item_latency
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.calls: List[tuple] = []
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self._tokens_lock = threading.Lock()
+        self._server = _Server((host, port), self._make_handler())
+        self.port = self._server.server_address[1]
+        self.tls = certfile is not None
+        if self.tls:
+            # El handshake se hace en el thread de cada conexión, no en el accept
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(
+                self._server.socket, server_side=True, do_handshake_on_connect=False)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """URL para GEMINI_API_URL (el bot concatena `{modelo}:generateContent`)"""
+        return f"{'https' if self.tls else 'http'}://{self.host}:{self.port}/v1beta/models/"
+
+    def start(self):
+        """Arranca el servidor en un thread en segundo plano"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Detiene el servidor"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, model: str, payload: dict):
+        """
+        Resuelve una llamada a generateContent
+
+        Returns:
+            Tupla (status_code, cuerpo_json)
+        """
+        prompt = payload.get("contents", [{}])[0].get("parts", [{}])[0].get("text", "")
+        batch = _BATCH_RE.search(prompt)
+        if batch:
+            texts = [json.loads(item.group("text")) for item in _BATCH_ITEM_RE.finditer(batch.group("items"))]
+            self.calls.append((model, texts))
+        else:
+            match = _USER_TEXT_RE.search(prompt)
+            text = match.group("text") if match else prompt
+            self.calls.append((model, text))
+        prompt_tokens = len(prompt) // 4
+        with self._tokens_lock:
+            self.prompt_tokens += prompt_tokens
+
+        delay = self.model_latency.get(model, self.latency) + self.item_latency * (len(texts) if batch else 1)
+        if delay or self.jitter:
+            if self._slots is not None:
+                with self._slots:
+                    time.sleep(delay + random.uniform(0, self.jitter))
+            else:
+                time.sleep(delay + random.uniform(0, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {"error": {"code": 500, "message": "Internal error", "status": "INTERNAL"}}
+
+        if batch:
+            result = [{"index": index, "expenses": fake_extractions(text)}
+                      for index, text in enumerate(texts, start=1)]
+        else:
+            result = fake_extractions(text)
+            invalid_rate = self.model_invalid_rate.get(model, 0.0)
+            if len(result) > 1 and invalid_rate and random.random() < invalid_rate:
+                result[-1] = dict(result[-1], amount=None)
+        generation = payload.get("generationConfig", {})
+        if generation.get("responseMimeType") == "application/json":
+            output = json.dumps(result, ensure_ascii=False, separators=(",", ":"))
+        else:
+            output = f"```json\n{json.dumps(result, ensure_ascii=False, indent=4)}\n```"
+            if self.malformed_rate and random.random() < self.malformed_rate:
+                output = "Aquí está el JSON solicitado:\n" + output
+        output_tokens = len(output) // 4
+        finish_reason = "STOP"
+        max_tokens = generation.get("maxOutputTokens")
+        if max_tokens and output_tokens > max_tokens:
+            output, output_tokens, finish_reason = output[:max_tokens * 4], max_tokens, "MAX_TOKENS"
+        with self._tokens_lock:
+            self.output_tokens += output_tokens
+        return 200, {
+            "candidates": [{
+                "content": {"parts": [{"text": output}],
+                            "role": "model"},
+                "finishReason": finish_reason,
+            }],
+            "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens},
+            "modelVersion": model,
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Encabezados y cuerpo salen en escrituras separadas: sin TCP_NODELAY el
+            # algoritmo de Nagle y el ACK retardado suman ~40 ms por respuesta
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                match = _PATH_RE.match(self.path.split("?", 1)[0])
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if not match:
+                    self._reply(404, {"error": {"code": 404, "message": "Not Found"}})
+                    return
+                try:
+                    payload = json.loads(body) if body else {}
+                except ValueError:
+                    payload = {}
+                self._reply(*server._handle(match.group("model"), payload))
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local de generateContent de Gemini")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--item-latency-ms", type=float, default=0.0,
+                        help="Latencia extra por mensaje de cada respuesta")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="Llamadas atendidas a la vez (0 = sin límite)")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Probabilidad de anteponer texto al JSON en modo texto libre")
+    parser.add_argument("--certfile", default=None, help="Certificado PEM para servir HTTPS")
+    parser.add_argument("--keyfile", default=None, help="Llave privada PEM del certificado")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(args.host, args.port, args.latency_ms / 1000, args.error_rate,
+                              args.jitter_ms / 1000, args.certfile, args.keyfile,
+                              args.item_latency_ms / 1000, args.max_concurrency, args.malformed_rate)
+    print(f"🤖 Fake Gemini escuchando en {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
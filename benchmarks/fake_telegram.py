@@ -0,0 +1,258 @@
+"""
+Servidor local que imita la Bot API de Telegram para pruebas y benchmarks
+Ejecutar: python -m benchmarks.fake_telegram [--port 8081] [--latency-ms 0] [--jitter-ms 0] [--error-rate 0]
+          [--chat-limit 0] [--global-limit 0]
+
+Apunta el bot al servidor con TELEGRAM_API_BASE_URL=http://127.0.0.1:8081.
+
+Métodos soportados: getUpdates (con offset/limit/timeout), sendMessage,
+editMessageText, answerCallbackQuery, deleteWebhook y setWebhook. Todas las
+llamadas quedan registradas en `calls`. Con `chat_limit` / `global_limit`
+responde 429 con `retry_after`, como la API real, a los envíos que pasan de
+ese número por segundo en un chat o en total (quedan en `throttled`).
+"""
+import argparse
+import json
+import random
+import re
+import ssl
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+_PATH_RE = re.compile(r"^/bot(?P<token>[^/]+)/(?P<method>\w+)$")
+
+
+class _Server(ThreadingHTTPServer):
+    """ThreadingHTTPServer con backlog amplio para ráfagas de conexiones concurrentes"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+class FakeTelegramServer:
+    """
+    Servidor HTTP que responde como api.telegram.org
+
+    Attributes:
+        host: Host donde escucha
+        port: Puerto donde escucha (0 = puerto libre aleatorio)
+        latency: Segundos de latencia añadidos a cada respuesta
+        jitter: Segundos extra aleatorios (uniforme entre 0 y jitter) por respuesta
+        error_rate: Probabilidad (0-1) de responder 500 en métodos de envío
+        chat_limit: Envíos por segundo a un chat antes de responder 429 (0 = sin límite)
+        global_limit: Envíos por segundo en total antes de responder 429 (0 = sin límite)
+        calls: Lista de (método, payload) recibidos
+        replied: Lista de (método, payload, time.perf_counter()) al responder 2xx
+        throttled: Lista de (método, payload) respondidos con 429
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, error_rate: float = 0.0, jitter: float = 0.0,
+                 certfile: Optional[str] = None, keyfile: Optional[str] = None,
+                 chat_limit: int = 0, global_limit: int = 0):
+        self.host = host
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.calls: List[tuple] = []
+        self.replied: List[tuple] = []
+        self.throttled: List[tuple] = []
+        self._sent_at: Dict[object, deque] = {}
+        self._updates: List[dict] = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._cond = threading.Condition()
+        self._server = _Server((host, port), self._make_handler())
+        self.port = self._server.server_address[1]
+        self.tls = certfile is not None
+        if self.tls:
+            # El handshake se hace en el thread de cada conexión, no en el accept
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(
+                self._server.socket, server_side=True, do_handshake_on_connect=False)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """URL base para TELEGRAM_API_BASE_URL"""
+        return f"{'https' if self.tls else 'http'}://{self.host}:{self.port}"
+
+    def start(self):
+        """Arranca el servidor en un thread en segundo plano"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Detiene el servidor"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def enqueue_update(self, update: dict) -> dict:
+        """
+        Agrega un update para que lo entregue getUpdates
+
+        Args:
+            update: Update de Telegram (se le asigna update_id si no lo tiene)
+
+        Returns:
+            El update encolado
+        """
+        with self._cond:
+            if "update_id" not in update:
+                update["update_id"] = self._next_update_id
+            self._next_update_id = max(self._next_update_id, update["update_id"] + 1)
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update
+
+    def calls_for(self, method: str) -> List[dict]:
+        """Payloads recibidos para un método"""
+        return [payload for name, payload in list(self.calls) if name == method]
+
+    def _get_updates(self, payload: dict) -> list:
+        """Implementa getUpdates: confirma los updates < offset y espera hasta timeout"""
+        offset = payload.get("offset")
+        limit = int(payload.get("limit", 100))
+        timeout = float(payload.get("timeout", 0))
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            if offset is not None:
+                self._updates = [u for u in self._updates if u["update_id"] >= int(offset)]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(timeout=deadline - time.monotonic())
+            return self._updates[:limit]
+
+    def _retry_after(self, payload: dict) -> int:
+        """Segundos de espera si el envío pasa el límite por chat o global, 0 si puede salir"""
+        now = time.monotonic()
+        limits = [("global", self.global_limit)]
+        if payload.get("chat_id") is not None:
+            limits.append((payload["chat_id"], self.chat_limit))
+        with self._cond:
+            windows = []
+            for key, limit in limits:
+                if not limit:
+                    continue
+                window = self._sent_at.setdefault(key, deque())
+                while window and now - window[0] >= 1.0:
+                    window.popleft()
+                if len(window) >= limit:
+                    return max(1, int(1.0 - (now - window[0]) + 0.999))
+                windows.append(window)
+            for window in windows:
+                window.append(now)
+        return 0
+
+    def _handle(self, method: str, payload: dict):
+        """
+        Resuelve una llamada a la API
+
+        Returns:
+            Tupla (status_code, cuerpo_json)
+        """
+        self.calls.append((method, payload))
+
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self._get_updates(payload)}
+
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+        if method in ("sendMessage", "editMessageText"):
+            retry_after = self._retry_after(payload)
+            if retry_after:
+                self.throttled.append((method, payload))
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {retry_after}",
+                             "parameters": {"retry_after": retry_after}}
+
+        if method in ("sendMessage", "editMessageText"):
+            with self._cond:
+                message_id = payload.get("message_id") or self._next_message_id
+                self._next_message_id += 1
+            return 200, {"ok": True, "result": {
+                "message_id": message_id,
+                "chat": {"id": payload.get("chat_id")},
+                "date": int(time.time()),
+                "text": payload.get("text", ""),
+            }}
+        if method in ("answerCallbackQuery", "deleteWebhook", "setWebhook"):
+            return 200, {"ok": True, "result": True}
+
+        return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, como la API real
+            protocol_version = "HTTP/1.1"
+            # Encabezados y cuerpo salen en escrituras separadas: sin TCP_NODELAY el
+            # algoritmo de Nagle y el ACK retardado suman ~40 ms por respuesta
+            disable_nagle_algorithm = True
+
+            def _dispatch(self):
+                match = _PATH_RE.match(self.path.split("?", 1)[0])
+                if not match:
+                    self._reply(404, {"ok": False, "description": "Not Found"})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                try:
+                    payload = json.loads(body) if body else {}
+                except ValueError:
+                    payload = {}
+                status, body = server._handle(match.group("method"), payload)
+                if status == 200:
+                    server.replied.append((match.group("method"), payload, time.perf_counter()))
+                self._reply(status, body)
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local de la Bot API de Telegram")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--chat-limit", type=int, default=0, help="Envíos por segundo por chat antes del 429")
+    parser.add_argument("--global-limit", type=int, default=0, help="Envíos por segundo en total antes del 429")
+    parser.add_argument("--certfile", default=None, help="Certificado PEM para servir HTTPS")
+    parser.add_argument("--keyfile", default=None, help="Llave privada PEM del certificado")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(args.host, args.port, args.latency_ms / 1000, args.error_rate,
+                                args.jitter_ms / 1000, args.certfile, args.keyfile,
+                                args.chat_limit, args.global_limit)
+    print(f"🤖 Fake Telegram escuchando en {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Exactitud y cobertura del extractor local contra un corpus etiquetado
+Ejecutar: python -m benchmarks.local_parser_accuracy [--corpus benchmarks/expense_corpus.jsonl] [--min-accuracy 1.0]
+
+Cada línea del corpus es {"text": ..., "expected": {...}} con los campos que
+devolvería una extracción correcta (las fechas relativas se resuelven contra
+--today). Reporta:
+
+- cobertura: mensajes que el extractor resuelve sin Gemini (tasa de aciertos)
+- exactitud: de esos, cuántos tienen bien todos los campos que usa el bot
+  (amount, currency, action, debtor_name, due_date, description)
+- exactitud por campo, incluida la categoría (solo informativa)
+- barrido de umbrales de confianza y costo por mensaje
+
+Con --min-accuracy sale con código 1 si la exactitud queda por debajo, para
+usarlo como gate al tocar la gramática.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import date
+
+from benchmarks.common import bootstrap_env
+
+bootstrap_env()
+
+from app.local_parser import parse_expense_text  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "expense_corpus.jsonl")
+
+# Campos que deciden el gasto que se guarda; la categoría solo se muestra
+CORE_FIELDS = ("amount", "currency", "action", "debtor_name", "due_date", "description")
+FIELDS = CORE_FIELDS + ("category",)
+
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+def load_corpus(path: str) -> list:
+    """Lee el corpus JSONL (ignora líneas vacías)"""
+    with open(path, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def field_matches(field: str, got, expected) -> bool:
+    """Compara un campo extraído con la etiqueta"""
+    if field == "amount":
+        return got is not None and expected is not None and abs(float(got) - float(expected)) < 0.005
+    if field in ("description", "category") and got is not None and expected is not None:
+        return str(got).casefold() == str(expected).casefold()
+    return got == expected
+
+
+def evaluate(corpus: list, today: date, threshold: float) -> dict:
+    """
+    Evalúa el extractor con un umbral de confianza
+
+    Returns:
+        Diccionario con cobertura, exactitud, aciertos por campo y errores
+    """
+    accepted = correct = 0
+    per_field = {field: 0 for field in FIELDS}
+    mistakes = []
+
+    for entry in corpus:
+        result = parse_expense_text(entry["text"], today)
+        if result is None or result.confidence < threshold:
+            continue
+        accepted += 1
+        expected = entry["expected"]
+        wrong = []
+        for field in FIELDS:
+            if field_matches(field, result.data.get(field), expected.get(field)):
+                per_field[field] += 1
+            elif field in CORE_FIELDS:
+                wrong.append((field, result.data.get(field), expected.get(field)))
+        if wrong:
+            mistakes.append((entry["text"], result.confidence, wrong))
+        else:
+            correct += 1
+
+    return {
+        "threshold": threshold,
+        "total": len(corpus),
+        "accepted": accepted,
+        "coverage": accepted / len(corpus) if corpus else 0.0,
+        "accuracy": correct / accepted if accepted else 1.0,
+        "per_field": {field: (hits / accepted if accepted else 1.0) for field, hits in per_field.items()},
+        "mistakes": mistakes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exactitud del extractor local de gastos")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--today", default="2024-01-15",
+                        help="Fecha de referencia de las etiquetas (YYYY-MM-DD)")
+    parser.add_argument("--threshold", type=float, default=0.9,
+                        help="Confianza mínima (LOCAL_PARSER_MIN_CONFIDENCE)")
+    parser.add_argument("--min-accuracy", type=float, default=None,
+                        help="Exactitud mínima aceptada; por debajo sale con código 1")
+    parser.add_argument("--iterations", type=int, default=200,
+                        help="Repeticiones del corpus para medir el costo por mensaje")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    today = date.fromisoformat(args.today)
+    report = evaluate(corpus, today, args.threshold)
+
+    print(f"Corpus: {report['total']} mensajes, umbral de confianza {args.threshold}")
+    print(f"  cobertura (sin Gemini): {report['accepted']}/{report['total']} = {report['coverage']:.1%}")
+    print(f"  exactitud (campos del gasto): {report['accuracy']:.1%}")
+    print("\nExactitud por campo (mensajes aceptados)")
+    for field, value in report["per_field"].items():
+        print(f"  {field:<12} {value:>7.1%}")
+
+    if report["mistakes"]:
+        print("\nErrores")
+        for text, confidence, wrong in report["mistakes"]:
+            details = ", ".join(f"{field}={got!r} (esperado {expected!r})" for field, got, expected in wrong)
+            print(f"  [{confidence:.2f}] {text}: {details}")
+
+    print("\nBarrido de umbrales")
+    print(f"  {'umbral':>6} {'cobertura':>10} {'exactitud':>10}")
+    for threshold in THRESHOLDS:
+        sweep = evaluate(corpus, today, threshold)
+        print(f"  {threshold:>6.1f} {sweep['coverage']:>10.1%} {sweep['accuracy']:>10.1%}")
+
+    texts = [entry["text"] for entry in corpus]
+    seconds = timeit.timeit(lambda: [parse_expense_text(text, today) for text in texts],
+                            number=max(1, args.iterations))
+    per_message_us = seconds / (max(1, args.iterations) * len(texts)) * 1e6
+    print(f"\nCosto: {per_message_us:.1f} µs por mensaje")
+
+    if args.min_accuracy is not None and report["accuracy"] < args.min_accuracy:
+        print(f"\nExactitud {report['accuracy']:.1%} por debajo del mínimo {args.min_accuracy:.1%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
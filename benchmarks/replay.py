@@ -0,0 +1,447 @@
+"""
+Replay y prueba de carga del webhook con Telegram y Gemini locales
+Ejecutar: python -m benchmarks.replay [--updates-file updates.jsonl] [--updates 500] [--rate 50]
+          [--concurrency 32] [--latency-ms 100] [--baseline base.json] [--save-baseline base.json]
+
+Reproduce updates de Telegram contra POST /webhook a un ritmo y concurrencia
+configurables y reporta throughput, latencia extremo a extremo (p50/p95/p99)
+y el desglose por etapa (update, auth, gemini, telegram, db_commit) que expone
+/health con STAGE_METRICS_ENABLED=true.
+
+Updates:
+- `--updates-file`: updates grabados, uno por línea (JSONL), un arreglo JSON o
+  la respuesta de getUpdates ({"ok": true, "result": [...]}). Los update_id se
+  renumeran para que la deduplicación no descarte reenvíos entre corridas.
+- Sin archivo: `--updates` mensajes sintéticos de `--chats` usuarios que le
+  deben a 'Ana', con una fracción `--query-ratio` de consultas ("resumen",
+  "pagar", "quién me debe"). De las deudas, una fracción `--gemini-ratio`
+  trae una fecha que el extractor local no resuelve ("del próximo lunes")
+  y pasa por Gemini; el resto lo resuelve el extractor local.
+
+Destino:
+- Por defecto levanta la app Flask en este proceso (servidor WSGI con threads)
+  sobre una base SQLite temporal, con Telegram y Gemini locales en un proceso
+  aparte (`--latency-ms`, `--jitter-ms`, `--telegram-error-rate`,
+  `--gemini-error-rate`), y registra a los remitentes de los updates.
+- `--target-url`: un bot ya corriendo (p. ej. `uvicorn app:app`) apuntado a
+  `benchmarks.fake_telegram` / `benchmarks.fake_gemini`. Sus etapas acumulan
+  desde que arrancó el bot.
+
+Con `--rate` la carga es de lazo abierto: la latencia se mide desde el
+instante programado de cada envío, así que incluye la espera cuando el
+harness no consigue slot libre (no oculta las colas).
+
+Gate de regresión: `--save-baseline` guarda el resultado y `--baseline`
+compara contra él; sale con código 1 si el throughput baja, o la latencia
+p95/p99 extremo a extremo sube, más de `--max-regression` por ciento, o si la
+tasa de errores HTTP supera `--max-error-rate`. Con `--gate-stages` también
+compara el p95 de cada etapa y falla si una etapa de la línea base (p. ej.
+gemini) no aparece en la corrida.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import FakeServersProcess, bootstrap_env, percentile
+
+PAYER_ID = 1001
+PAYER_NAME = "Ana"
+FIRST_DEBTOR_ID = 2000
+
+_QUERIES = ("resumen", "pagar", "quién me debe")
+
+# Deuda que el extractor local resuelve y otra que rechaza (fecha "próximo lunes")
+_LOCAL_DEBT = "Le debo {amount} a {payer} por el almuerzo"
+_GEMINI_DEBT = "Le debo {amount} a {payer} por el almuerzo del próximo lunes"
+
+
+def load_updates(path: str) -> list:
+    """
+    Lee updates grabados (JSONL, arreglo JSON o respuesta de getUpdates)
+
+    Args:
+        path: Ruta del archivo
+
+    Returns:
+        Lista de updates
+    """
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    if not content:
+        return []
+    if content[0] in "[{":
+        try:
+            data = json.loads(content)
+        except ValueError:
+            data = None
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            return data.get("result", [data])
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def synthetic_updates(count: int, chats: int, query_ratio: float, gemini_ratio: float = 0.5) -> list:
+    """
+    Genera updates de deudores hacia 'Ana' intercalados entre chats
+
+    Cada `1 / query_ratio` mensajes de un chat uno es una consulta en lugar de
+    una deuda (no pasa por Gemini). De las deudas, una fracción `gemini_ratio`
+    usa una forma que el extractor local rechaza, así que llega a Gemini.
+    """
+    query_every = int(round(1 / query_ratio)) if query_ratio > 0 else 0
+    gemini_ratio = min(1.0, max(0.0, gemini_ratio))
+    updates = []
+    debts = 0
+    for i in range(count):
+        debtor_id = FIRST_DEBTOR_ID + i % max(1, chats)
+        seq = i // max(1, chats)
+        if query_every and seq % query_every == query_every - 1:
+            text = _QUERIES[seq % len(_QUERIES)]
+        else:
+            # Reparte las deudas de Gemini de forma uniforme en la carga
+            to_gemini = int((debts + 1) * gemini_ratio) > int(debts * gemini_ratio)
+            template = _GEMINI_DEBT if to_gemini else _LOCAL_DEBT
+            text = template.format(amount=1000 + i, payer=PAYER_NAME)
+            debts += 1
+        updates.append({
+            "message": {
+                "message_id": i + 1,
+                "from": {"id": debtor_id, "first_name": f"Deudor{debtor_id}"},
+                "chat": {"id": debtor_id, "type": "private"},
+                "date": int(time.time()),
+                "text": text,
+            },
+        })
+    return updates
+
+
+def renumber(updates: list, first_update_id: int) -> list:
+    """Asigna update_id consecutivos a partir de `first_update_id`"""
+    return [dict(update, update_id=first_update_id + i) for i, update in enumerate(updates)]
+
+
+def update_senders(updates: list) -> dict:
+    """Remitentes de los updates: {telegram_id: nombre}"""
+    senders = {PAYER_ID: PAYER_NAME}
+    for update in updates:
+        source = update.get("message") or update.get("callback_query") or {}
+        sender = source.get("from") or {}
+        if sender.get("id") is not None:
+            senders.setdefault(sender["id"], sender.get("first_name") or sender.get("username") or "Usuario")
+    return senders
+
+
+def start_local_app(updates: list, args):
+    """
+    Crea la app Flask, registra a los remitentes y la sirve en un thread
+
+    Returns:
+        Tupla (url_base, flask_app, servidor)
+    """
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app, db
+    from app.models import User
+
+    flask_app = create_app()
+    with flask_app.app_context():
+        db.create_all()
+        for telegram_id, name in update_senders(updates).items():
+            if not User.query.filter_by(telegram_id=telegram_id).first():
+                db.session.add(User(telegram_id=telegram_id, name=name, is_authorized=True))
+        db.session.commit()
+
+    # Sin una línea de log por request del servidor de desarrollo
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", flask_app, server
+
+
+def fetch_stages(http, base_url: str) -> dict:
+    """Latencias por etapa publicadas en /health ({} si están desactivadas)"""
+    try:
+        return http.get(f"{base_url}/health", timeout=10).json().get("stages", {})
+    except (ValueError, OSError):
+        return {}
+
+
+def replay(base_url: str, updates: list, rate: float, concurrency: int) -> dict:
+    """
+    Envía los updates a /webhook
+
+    Args:
+        base_url: URL base del bot
+        updates: Updates a enviar, en orden
+        rate: Updates por segundo (0 = tan rápido como permita la concurrencia)
+        concurrency: Máximo de requests en vuelo
+
+    Returns:
+        Diccionario con duración, latencias y status recibidos
+    """
+    import requests
+
+    local = threading.local()
+    slots = threading.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+    results_lock = threading.Lock()
+
+    def session():
+        if not hasattr(local, "http"):
+            local.http = requests.Session()
+        return local.http
+
+    def send(body: bytes, scheduled_at: float):
+        try:
+            response = session().post(f"{base_url}/webhook", data=body, timeout=120,
+                                      headers={"Content-Type": "application/json"})
+            status = response.status_code
+        except requests.exceptions.RequestException:
+            status = 0
+        finally:
+            slots.release()
+        elapsed = time.perf_counter() - scheduled_at
+        with results_lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, update in enumerate(updates):
+            scheduled_at = started + i / rate if rate else None
+            if scheduled_at is not None:
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            slots.acquire()
+            executor.submit(send, json.dumps(update).encode("utf-8"),
+                            scheduled_at or time.perf_counter())
+    return {"elapsed": time.perf_counter() - started, "latencies": latencies, "statuses": statuses}
+
+
+def wait_processed(http, base_url: str, expected: int, timeout: float) -> bool:
+    """
+    Espera a que la etapa "update" registre `expected` updates
+
+    Con WEBHOOK_ASYNC_MODE el webhook responde antes de procesar; el
+    throughput se mide hasta que el pool termina.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if fetch_stages(http, base_url).get("update", {}).get("count", 0) >= expected:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def summarize(run: dict, processed_elapsed: float, stages: dict) -> dict:
+    """Resultado comparable entre corridas (lo que guarda --save-baseline)"""
+    latencies = run["latencies"]
+    total = len(latencies)
+    failed = sum(count for status, count in run["statuses"].items() if not 200 <= status < 300)
+    return {
+        "updates": total,
+        "throughput": total / processed_elapsed if processed_elapsed else 0.0,
+        "error_rate": failed / total if total else 0.0,
+        "statuses": {str(status): count for status, count in sorted(run["statuses"].items())},
+        "e2e": {
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        },
+        "stages": stages,
+    }
+
+
+def print_report(result: dict):
+    """Imprime throughput, latencia extremo a extremo y desglose por etapa"""
+    print(f"\nUpdates: {result['updates']}  throughput: {result['throughput']:.1f} updates/s  "
+          f"errores HTTP: {result['error_rate'] * 100:.1f}%  status: {result['statuses']}")
+    print(f"{'etapa':<12} {'count':>7} {'errores':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    e2e = result["e2e"]
+    print(f"{'e2e':<12} {result['updates']:>7} {'-':>8} {e2e['p50_ms']:>9.1f} {e2e['p95_ms']:>9.1f} "
+          f"{e2e['p99_ms']:>9.1f} {e2e['max_ms']:>9.1f}")
+    for stage, values in result["stages"].items():
+        print(f"{stage:<12} {values['count']:>7} {values['errors']:>8} {values['p50_ms']:>9.1f} "
+              f"{values['p95_ms']:>9.1f} {values['p99_ms']:>9.1f} {values['max_ms']:>9.1f}")
+
+
+def check_regression(result: dict, baseline: dict, max_regression: float,
+                     max_error_rate: float = None, gate_stages: bool = False) -> list:
+    """
+    Compara el resultado con la línea base
+
+    Args:
+        result: Resultado de esta corrida
+        baseline: Resultado guardado con --save-baseline
+        max_regression: Porcentaje máximo de empeoramiento permitido
+        max_error_rate: Tasa máxima de errores HTTP (0-1), o None para no verificarla
+        gate_stages: Si True, también compara el p95 de cada etapa y exige que
+            estén todas las etapas de la línea base
+
+    Returns:
+        Lista de violaciones (vacía si pasa)
+    """
+    violations = []
+    limit = max_regression / 100
+
+    if baseline.get("throughput") and result["throughput"] < baseline["throughput"] * (1 - limit):
+        violations.append(f"throughput {result['throughput']:.1f}/s < línea base "
+                          f"{baseline['throughput']:.1f}/s - {max_regression:.0f}%")
+
+    checks = [("e2e p95", result["e2e"]["p95_ms"], baseline.get("e2e", {}).get("p95_ms")),
+              ("e2e p99", result["e2e"]["p99_ms"], baseline.get("e2e", {}).get("p99_ms"))]
+    if gate_stages:
+        for stage in baseline.get("stages", {}):
+            if stage not in result["stages"]:
+                violations.append(f"etapa {stage} ausente (está en la línea base)")
+        for stage, values in result["stages"].items():
+            checks.append((f"{stage} p95", values["p95_ms"],
+                           baseline.get("stages", {}).get(stage, {}).get("p95_ms")))
+    for name, current, reference in checks:
+        if reference and current > reference * (1 + limit):
+            violations.append(f"{name} {current:.1f} ms > línea base {reference:.1f} ms + {max_regression:.0f}%")
+
+    if max_error_rate is not None and result["error_rate"] > max_error_rate:
+        violations.append(f"errores HTTP {result['error_rate'] * 100:.1f}% > {max_error_rate * 100:.1f}%")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay y prueba de carga del webhook")
+    parser.add_argument("--updates-file", default=None, help="Updates grabados (JSONL o JSON)")
+    parser.add_argument("--updates", type=int, default=500, help="Updates sintéticos")
+    parser.add_argument("--chats", type=int, default=50, help="Chats de los updates sintéticos")
+    parser.add_argument("--query-ratio", type=float, default=0.2,
+                        help="Fracción de consultas en los updates sintéticos")
+    parser.add_argument("--gemini-ratio", type=float, default=0.5,
+                        help="Fracción de deudas sintéticas que el extractor local rechaza (van a Gemini)")
+    parser.add_argument("--repeat", type=int, default=1, help="Veces que se reproduce la carga")
+    parser.add_argument("--warmup", type=int, default=20, help="Updates iniciales que no se miden")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Updates por segundo (0 = lazo cerrado, limitado por --concurrency)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--target-url", default=None, help="Bot ya corriendo (por defecto, app local)")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--latency-ms", type=float, default=100.0,
+                        help="Latencia de Telegram y Gemini locales")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--drain-timeout", type=float, default=120.0,
+                        help="Segundos a esperar a que se procesen los updates encolados")
+    parser.add_argument("--json-output", default=None, help="Guardar el resultado en JSON")
+    parser.add_argument("--save-baseline", default=None, help="Guardar el resultado como línea base")
+    parser.add_argument("--baseline", default=None, help="Línea base contra la que comparar")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="Porcentaje máximo de empeoramiento frente a la línea base")
+    parser.add_argument("--max-error-rate", type=float, default=None,
+                        help="Tasa máxima de respuestas no 2xx (0-1)")
+    parser.add_argument("--gate-stages", action="store_true",
+                        help="Comparar también el p95 de cada etapa con la línea base")
+    args = parser.parse_args()
+
+    updates = (load_updates(args.updates_file) if args.updates_file
+               else synthetic_updates(args.updates, args.chats, args.query_ratio, args.gemini_ratio))
+    updates = updates * max(1, args.repeat)
+    updates = renumber(updates, int(time.time() * 1000))
+    warmup, measured = updates[:args.warmup], updates[args.warmup:]
+    if not measured:
+        raise SystemExit("No hay updates para medir (revisa --updates/--warmup)")
+
+    fakes = flask_app = server = None
+    if args.target_url:
+        base_url = args.target_url.rstrip("/")
+    else:
+        fakes = FakeServersProcess(
+            latency=args.latency_ms / 1000,
+            jitter=args.jitter_ms / 1000,
+            telegram_error_rate=args.telegram_error_rate,
+            gemini_error_rate=args.gemini_error_rate,
+        ).start()
+        os.environ["DATABASE_URL"] = args.database_url or (
+            f"sqlite:///{tempfile.mkstemp(prefix='we_owe_bot_replay_', suffix='.db')[1]}"
+        )
+        os.environ["TELEGRAM_API_BASE_URL"] = fakes.telegram_url
+        os.environ["GEMINI_API_URL"] = fakes.gemini_url
+        os.environ["STAGE_METRICS_ENABLED"] = "true"
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+        bootstrap_env()
+        base_url, flask_app, server = start_local_app(updates, args)
+
+    import requests
+
+    http = requests.Session()
+    print(f"Destino: {base_url}  updates: {len(measured)} (+{len(warmup)} de calentamiento)  "
+          f"ritmo: {args.rate or 'máximo'}  concurrencia: {args.concurrency}")
+    if fakes:
+        print(f"Telegram/Gemini locales: latencia {args.latency_ms:.0f} ms "
+              f"(+0-{args.jitter_ms:.0f} ms), errores Telegram {args.telegram_error_rate:.0%}, "
+              f"Gemini {args.gemini_error_rate:.0%}")
+
+    if warmup:
+        replay(base_url, warmup, 0, args.concurrency)
+    stages_before = fetch_stages(http, base_url).get("update", {}).get("count", 0)
+    if flask_app is not None:
+        wait_processed(http, base_url, stages_before, args.drain_timeout)
+        metrics = flask_app.extensions.get("stage_metrics")
+        if metrics is not None:
+            metrics.reset()
+        stages_before = 0
+    sent_before = fakes.count("sendMessage") if fakes else 0
+
+    run = replay(base_url, measured, args.rate, args.concurrency)
+    accepted = sum(count for status, count in run["statuses"].items() if 200 <= status < 300)
+    processed_elapsed = run["elapsed"]
+    if fetch_stages(http, base_url):
+        started = time.perf_counter()
+        if not wait_processed(http, base_url, stages_before + accepted, args.drain_timeout):
+            print("⚠️ No se procesaron todos los updates antes de --drain-timeout")
+        processed_elapsed += time.perf_counter() - started
+
+    result = summarize(run, processed_elapsed, fetch_stages(http, base_url))
+    print_report(result)
+    if fakes:
+        print(f"Llamadas a Gemini: {fakes.count('gemini')}  "
+              f"sendMessage: {fakes.count('sendMessage') - sent_before}")
+        if args.gemini_error_rate and not fakes.count("gemini"):
+            print("⚠️ Ningún update llegó a Gemini: --gemini-error-rate no tuvo efecto "
+                  "(revisa --gemini-ratio o LOCAL_PARSER_ENABLED)")
+
+    if server is not None:
+        server.shutdown()
+    if fakes:
+        fakes.stop()
+
+    for path in (args.json_output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+            print(f"Resultado guardado en {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        violations = check_regression(result, baseline, args.max_regression,
+                                      args.max_error_rate, args.gate_stages)
+    else:
+        violations = check_regression(result, {}, args.max_regression, args.max_error_rate)
+
+    if violations:
+        print("\n❌ Regresión detectada:")
+        for violation in violations:
+            print(f"  - {violation}")
+        raise SystemExit(1)
+    if args.baseline or args.max_error_rate is not None:
+        print("\n✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
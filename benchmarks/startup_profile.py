@@ -0,0 +1,146 @@
+"""
+Perfil del arranque en frío: costo de imports por módulo y de cada fase de create_app
+Ejecutar: python -m benchmarks.startup_profile [--runs 3] [--schema-init startup] [--asgi] [--top 15]
+
+Cada corrida es un intérprete nuevo (`python -X importtime`), como una instancia
+serverless recién levantada: importa el paquete `app`, llama a get_app (y,
+con --asgi, construye `app:app` como lo haría uvicorn) y reporta:
+
+- tiempo total hasta tener la aplicación lista
+- costo de import agrupado por paquete de primer nivel (tiempo propio sumado)
+- costo acumulado de cada módulo `app.*`
+- duración de cada fase de create_app (app.extensions["startup_timings"])
+
+Con varias corridas se reporta la mediana.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import bootstrap_env
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+# Código que corre el intérprete hijo; imprime una línea JSON con los tiempos
+_CHILD_CODE = """
+import json, time
+started = time.perf_counter()
+import app as package
+imported = time.perf_counter()
+flask_app = package.get_app()
+created = time.perf_counter()
+if {asgi}:
+    package.app
+ready = time.perf_counter()
+print("STARTUP_PROFILE " + json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "asgi_ms": (ready - created) * 1000,
+    "total_ms": (ready - started) * 1000,
+    "phases": flask_app.extensions.get("startup_timings", {{}}),
+}}))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    """
+    Interpreta la salida de `python -X importtime`
+
+    Args:
+        stderr: Salida de error del intérprete hijo
+
+    Returns:
+        Lista de (módulo, tiempo_propio_us, tiempo_acumulado_us)
+    """
+    modules = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            modules.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return modules
+
+
+def run_once(asgi: bool) -> tuple:
+    """
+    Arranca la aplicación en un intérprete nuevo
+
+    Returns:
+        Tupla (tiempos_reportados, módulos_importados)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD_CODE.format(asgi=asgi)],
+        capture_output=True, text=True, env=os.environ.copy(),
+    )
+    report = None
+    for line in result.stdout.splitlines():
+        if line.startswith("STARTUP_PROFILE "):
+            report = json.loads(line[len("STARTUP_PROFILE "):])
+    if result.returncode != 0 or report is None:
+        raise SystemExit(f"El arranque falló:\n{result.stderr[-2000:]}")
+    return report, parse_importtime(result.stderr)
+
+
+def median_by_key(rows: list) -> dict:
+    """Mediana por clave de una lista de diccionarios {clave: valor}"""
+    keys = {key for row in rows for key in row}
+    return {key: statistics.median(row.get(key, 0) for row in rows) for key in keys}
+
+
+def print_table(title: str, values: dict, top: int = 0):
+    """Imprime un diccionario {nombre: ms} ordenado de mayor a menor"""
+    print(f"\n{title}")
+    ordered = sorted(values.items(), key=lambda item: item[1], reverse=True)
+    for name, ms in ordered[:top] if top else ordered:
+        print(f"  {name:<40} {ms:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfil del arranque en frío")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--schema-init", default=None, choices=["startup", "deploy"],
+                        help="Valor de SCHEMA_INIT para las corridas")
+    parser.add_argument("--asgi", action="store_true",
+                        help="Incluir la construcción de la app ASGI (uvicorn app:app)")
+    parser.add_argument("--top", type=int, default=15,
+                        help="Paquetes a mostrar en el desglose de imports")
+    args = parser.parse_args()
+
+    bootstrap_env()
+    if args.schema_init:
+        os.environ["SCHEMA_INIT"] = args.schema_init
+
+    reports, packages, app_modules = [], [], []
+    for _ in range(max(1, args.runs)):
+        report, modules = run_once(args.asgi)
+        reports.append(report)
+
+        by_package = {}
+        by_app_module = {}
+        for name, self_us, cumulative_us in modules:
+            top_level = name.split(".", 1)[0]
+            by_package[top_level] = by_package.get(top_level, 0) + self_us / 1000
+            if top_level == "app":
+                by_app_module[name] = cumulative_us / 1000
+        packages.append(by_package)
+        app_modules.append(by_app_module)
+
+    totals = median_by_key([{k: v for k, v in r.items() if k != "phases"} for r in reports])
+    print(f"Corridas: {len(reports)} (mediana), SCHEMA_INIT={os.environ.get('SCHEMA_INIT', 'startup')}, "
+          f"DATABASE_URL={os.environ['DATABASE_URL'].split('://', 1)[0]}://...")
+    print(f"  import del paquete app                   {totals['import_ms']:>9.1f} ms")
+    print(f"  create_app                               {totals['create_app_ms']:>9.1f} ms")
+    if args.asgi:
+        print(f"  app ASGI (app:app)                       {totals['asgi_ms']:>9.1f} ms")
+    print(f"  total                                    {totals['total_ms']:>9.1f} ms")
+
+    print_table("Imports por paquete (tiempo propio)", median_by_key(packages), args.top)
+    print_table("Módulos app.* (tiempo acumulado, incluye sus imports)", median_by_key(app_modules))
+    print_table("Fases de create_app", median_by_key([r["phases"] for r in reports]))
+
+
+if __name__ == "__main__":
+    main()
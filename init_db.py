@@ -1,6 +1,9 @@
 """
 Script para inicializar la base de datos
 Ejecutar: python init_db.py
+
+Con SCHEMA_INIT=deploy las instancias no crean tablas al arrancar: este script
+se corre una vez por despliegue (por ejemplo, como paso de build o de CI).
 """
 from app import create_app, db
 from app.models import User, Expense
@@ -11,5 +14,5 @@ with app.app_context():
     # Crear todas las tablas
     db.create_all()
     print("✅ Base de datos inicializada correctamente")
-    print("📋 Tablas creadas: users, expenses")
+    print(f"📋 Tablas creadas: {', '.join(db.metadata.tables)}")
 
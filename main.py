@@ -1,3 +1,4 @@
-from app import create_app
+from app import get_app
 
-app = create_app()
+# Reutiliza la instancia singleton: importar el paquete no crea otra app
+app = get_app()
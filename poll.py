@@ -0,0 +1,43 @@
+"""
+Script para correr el bot por long polling (sin webhook público)
+Ejecutar: python poll.py [--delete-webhook] [--once] [--limit 100] [--timeout 30]
+"""
+import argparse
+
+from app import create_app
+from app.polling import TelegramPoller
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta de updates por getUpdates")
+    parser.add_argument("--config", default="development", help="Entorno de configuración")
+    parser.add_argument("--limit", type=int, default=None, help="Updates por lote (1-100)")
+    parser.add_argument("--timeout", type=int, default=None, help="Segundos de long polling")
+    parser.add_argument("--no-batch-commit", action="store_true",
+                        help="Hacer commit por update en lugar de por lote")
+    parser.add_argument("--delete-webhook", action="store_true",
+                        help="Eliminar el webhook antes de empezar (requerido por getUpdates)")
+    parser.add_argument("--once", action="store_true", help="Procesar un solo lote y salir")
+    args = parser.parse_args()
+
+    app = create_app(args.config)
+    poller = TelegramPoller(
+        app,
+        limit=args.limit,
+        timeout=args.timeout,
+        batch_commit=False if args.no_batch_commit else None,
+    )
+
+    if args.delete_webhook:
+        poller.delete_webhook()
+
+    if args.once:
+        received = poller.poll_once()
+        print(f"✅ Lote procesado: {received or 0} updates")
+        return
+
+    poller.run_forever()
+
+
+if __name__ == "__main__":
+    main()
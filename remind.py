@@ -0,0 +1,46 @@
+"""
+Script para enviar los recordatorios de deudas vencidas o que vencen hoy
+Ejecutar: python remind.py [--date 2024-01-15] [--dry-run] [--batch-size 200]
+
+Pensado para un cron diario. Si se interrumpe, correrlo de nuevo retoma el
+barrido del día donde quedó; si el barrido del día ya terminó no envía nada.
+"""
+import argparse
+from datetime import date
+
+from app import create_app
+from app.reminders import get_reminder_broadcaster
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recordatorios de deudas vencidas")
+    parser.add_argument("--config", default="development", help="Entorno de configuración")
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="Día del barrido (por defecto hoy en la zona horaria de cada deudor)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Deudores por bloque")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Contar los recordatorios sin enviarlos ni guardar avance")
+    args = parser.parse_args()
+
+    app = create_app(args.config)
+    # El envío masivo siempre pasa por la cola de salida (límites de Telegram y 429)
+    app.config["TELEGRAM_SCHEDULER_ENABLED"] = True
+    if args.batch_size:
+        app.config["REMINDERS_BATCH_SIZE"] = args.batch_size
+
+    result = get_reminder_broadcaster(app).run(run_date=args.date, dry_run=args.dry_run)
+    if result["status"] == "already_done":
+        print(f"✅ Los recordatorios del {result['run_date']} ya se enviaron")
+    elif result["status"] == "busy":
+        print(f"⏳ Otro proceso está enviando los recordatorios del {result['run_date']}")
+    elif result["status"] == "lease_lost":
+        print(f"⚠️ Otro proceso tomó el barrido del {result['run_date']}: "
+              f"{result['debtors']} recordatorios enviados hasta entonces")
+    else:
+        action = "por enviar" if args.dry_run else "enviados"
+        print(f"✅ Recordatorios del {result['run_date']}: {result['debtors']} {action} "
+              f"({result['debts']} deudas, {result['failed']} fallidos) en {result['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()